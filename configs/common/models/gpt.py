@@ -22,6 +22,8 @@ cfg = dict(
     apply_query_key_layer_scaling=True,
     apply_residual_post_layernorm=False,
     amp_enabled=False,
+    # compute the LM head + loss in chunks of this many tokens to save memory, None to disable
+    lm_loss_chunk_size=None,
 )
 
 cfg = DictConfig(cfg)
@@ -66,6 +66,17 @@ train = dict(
         stage=1,
     ),
 
+    # Keep an exponential moving average of the model weights with `momentum`
+    # following `schedule` ("constant", "cosine" or "warmup"), it is saved with the checkpoints.
+    # Set `eval_with_ema` to run the evaluation with the averaged weights.
+    model_ema=dict(
+        enabled=False,
+        momentum=0.9999,
+        schedule="warmup",
+        update_period=1,
+        eval_with_ema=True,
+    ),
+
     # Save a model checkpoint after every this number of iterations,
     # and maximum number of checkpoint will be kept.
     checkpointer=dict(period=5000, max_to_keep=100, save_model_after_n_epoch=None),
@@ -14,19 +14,38 @@
 # limitations under the License.
 
 
+import importlib
+
+# Submodules are imported on first attribute access (PEP 562), so that light entry points
+# such as ``from libai.config import LazyConfig`` don't pay for every model and dataset.
+_SUBMODULES = (
+    "data",
+    "evaluation",
+    "layers",
+    "models",
+    "optim",
+    "scheduler",
+    "tokenizer",
+    "engine",
+    "utils",
+)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        module = importlib.import_module(f".{name}", __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
+
+
 # This line will be programatically read/write by setup.py.
 # Leave them at the bottom of this file and don't touch them.
 
-from libai import data
-from libai import evaluation
-from libai import layers
-from libai import models
-from libai import optim
-from libai import scheduler
-from libai import tokenizer
-from libai import engine
-from libai import utils
-
 try:
     from .version import __version__  # noqa: F401
 except ImportError:
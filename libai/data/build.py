@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+
+import oneflow as flow
 from omegaconf import OmegaConf
 from oneflow.utils.data import DataLoader
 from oneflow.utils.data.dataset import ConcatDataset
@@ -21,8 +24,10 @@ from libai.config import LazyCall, instantiate
 from libai.utils import distributed as dist
 
 from .data_utils import get_train_valid_test_split_
-from .samplers import CyclicSampler, SingleRoundSampler
-from .structures import Instance
+from .datasets.packed_dataset import PackedDataset
+from .samplers import CyclicSampler, LengthBucketSampler, SingleRoundSampler
+from .samplers.samplers import get_bucket_index, get_sequence_length
+from .structures import DistTensorData, Instance
 
 
 def build_nlp_train_val_test_loader(
@@ -67,7 +72,8 @@ def build_nlp_train_val_test_loader(
         seed: random seed, used for reproducing experiments (default: ``0``).
         collate_fn: merges a list of samples to form a
             mini-batch of Tensor(s).  Used when using batched loading from a
-            map-style dataset.
+            map-style dataset. If None, datasets with a ``get_batch`` method build
+            every micro-batch at once with it, see :class:`BatchFetchDataset`.
         dataset_mixer: function for concating list dataset.
     """
 
@@ -114,8 +120,6 @@ def build_nlp_train_val_test_loader(
     val_dataset = dataset_mixer(val_datasets)
     test_dataset = dataset_mixer(test_datasets)
 
-    collate_fn = trivial_batch_collator if collate_fn is None else collate_fn
-
     train_loader, _, _ = build_nlp_train_loader(
         dataset=train_dataset,
         train_batch_size=train_batch_size,
@@ -158,6 +162,8 @@ def build_nlp_train_loader(
     seed=0,
     collate_fn=None,
     dataset_mixer=ConcatDataset,
+    sequence_packing=None,
+    length_bucketing=None,
     **kwargs
 ):
     """
@@ -182,11 +188,23 @@ def build_nlp_train_loader(
             (default: ``4``).
         consumed_samples: the number of samples that have been trained at the current time,
             used for resuming training (default: ``0``).
-        seed: random seed, used for reproducing experiments (default: ``0``).
+        seed: random seed, used for reproducing experiments, set to the sampler and to
+            ``collate_fn`` if it has a ``seed`` attribute (default: ``0``).
         collate_fn: merges a list of samples to form a
             mini-batch of Tensor(s).  Used when using batched loading from a
-            map-style dataset.
+            map-style dataset. If None, datasets with a ``get_batch`` method build
+            every micro-batch at once with it, see :class:`BatchFetchDataset`.
         dataset_mixer: function for concating list dataset.
+        sequence_packing: options of :class:`libai.data.datasets.PackedDataset` to pack
+            several examples into every sample of the dataset, used when its ``enabled``
+            key is True, e.g. ``dict(enabled=True, max_seq_length=512,
+            pad_values={"input_ids": 0, "labels": -1}, strip_padding=True)``
+            (default: ``None``, meaning no packing).
+        length_bucketing: options to batch samples of similar length together and trim
+            their padding, used when its ``enabled`` key is True. ``trim_fields`` goes to
+            :class:`BucketPaddingCollator` and the other options, e.g. ``bucket_boundaries``,
+            to both of it and :class:`libai.data.samplers.LengthBucketSampler`, which replace
+            ``collate_fn`` and ``sampler`` (default: ``None``, meaning no bucketing).
     """
     dataset = instantiate(dataset)
     if OmegaConf.is_list(dataset):
@@ -199,6 +217,16 @@ def build_nlp_train_loader(
     else:
         dataset = dataset[0]
 
+    if sequence_packing is not None and sequence_packing.get("enabled", False):
+        options = {key: value for key, value in sequence_packing.items() if key != "enabled"}
+        dataset = PackedDataset(dataset, **options)
+
+    if length_bucketing is not None and length_bucketing.get("enabled", False):
+        options = {key: value for key, value in length_bucketing.items() if key != "enabled"}
+        trim_fields = options.pop("trim_fields")
+        sampler = LazyCall(LengthBucketSampler)(**options)
+        collate_fn = BucketPaddingCollator(trim_fields, **options)
+
     sampler.dataset = dataset
     sampler.micro_batch_size = train_batch_size
     sampler.consumed_samples = consumed_samples
@@ -206,15 +234,12 @@ def build_nlp_train_loader(
     sampler.data_parallel_size = dist.get_data_parallel_size()
     sampler.seed = seed
     sampler = instantiate(sampler)
+    collate_fn = instantiate(collate_fn)
+    # collators drawing random numbers, e.g. the span corruption of T5, follow the seed too
+    if hasattr(collate_fn, "seed"):
+        collate_fn.seed = seed
 
-    dataloader = DataLoader(
-        dataset,
-        batch_sampler=sampler,
-        num_workers=num_workers,
-        persistent_workers=True if num_workers > 0 else False,
-        collate_fn=trivial_batch_collator if collate_fn is None else collate_fn,
-        **kwargs,
-    )
+    dataloader = build_nlp_data_loader(dataset, sampler, num_workers, collate_fn, **kwargs)
 
     return dataloader, None, None
 
@@ -247,10 +272,10 @@ def build_nlp_test_loader(
         seed: random seed, used for reproducing experiments (default: ``0``).
         collate_fn: merges a list of samples to form a
             mini-batch of Tensor(s).  Used when using batched loading from a
-            map-style dataset.
+            map-style dataset. If None, datasets with a ``get_batch`` method build
+            every micro-batch at once with it, see :class:`BatchFetchDataset`.
     """
     dataset = instantiate(dataset)
-    collate_fn = trivial_batch_collator if collate_fn is None else collate_fn
 
     sampler.dataset = dataset
     sampler.micro_batch_size = test_batch_size
@@ -259,14 +284,37 @@ def build_nlp_test_loader(
     sampler.seed = seed
     sampler = instantiate(sampler)
 
-    test_loader = DataLoader(
+    test_loader = build_nlp_data_loader(dataset, sampler, num_workers, collate_fn)
+    return test_loader
+
+
+def build_nlp_data_loader(dataset, sampler, num_workers=4, collate_fn=None, **kwargs):
+    """
+    Build the dataloader of the micro-batches of indices drawn by ``sampler``.
+
+    Without ``collate_fn``, a dataset that has a ``get_batch`` method builds every
+    micro-batch at once with it instead of stacking the samples of ``__getitem__``
+    with :func:`trivial_batch_collator`.
+    """
+    if collate_fn is None and BatchFetchDataset.supported(dataset):
+        # The sampler yields the indices of a micro-batch, which the dataset fetches at once.
+        return DataLoader(
+            BatchFetchDataset(dataset),
+            sampler=sampler,
+            batch_size=None,
+            num_workers=num_workers,
+            persistent_workers=True if num_workers > 0 else False,
+            collate_fn=fetched_batch_collator,
+            **kwargs,
+        )
+    return DataLoader(
         dataset,
         batch_sampler=sampler,
         num_workers=num_workers,
         persistent_workers=True if num_workers > 0 else False,
-        collate_fn=collate_fn,
+        collate_fn=trivial_batch_collator if collate_fn is None else collate_fn,
+        **kwargs,
     )
-    return test_loader
 
 
 def build_image_train_loader(
@@ -399,3 +447,95 @@ def trivial_batch_collator(batch):
     assert isinstance(batch[0], Instance), "batch[0] must be `instance` for trivial batch collator"
     batch = Instance.stack(batch)
     return batch
+
+
+def fetched_batch_collator(batch):
+    """Returns the micro-batch already built by :class:`BatchFetchDataset` as it is."""
+    return batch
+
+
+class BatchFetchDataset(flow.utils.data.Dataset):
+    """Indexes ``dataset`` with the indices of a whole micro-batch and builds it with
+    ``dataset.get_batch(indices)``, e.g. :meth:`libai.data.datasets.BertDataset.get_batch`.
+
+    A :class:`ConcatDataset` is supported when all of its datasets have ``get_batch``.
+    The micro-batches that mix samples of several of them are stacked from ``__getitem__``
+    instead.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    @staticmethod
+    def supported(dataset):
+        if isinstance(dataset, ConcatDataset):
+            return all(hasattr(d, "get_batch") for d in dataset.datasets)
+        return hasattr(dataset, "get_batch")
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, indices):
+        if not isinstance(self.dataset, ConcatDataset):
+            return self.dataset.get_batch(indices)
+        cumulative_sizes = self.dataset.cumulative_sizes
+        dataset_idxs = {bisect.bisect_right(cumulative_sizes, idx) for idx in indices}
+        if len(dataset_idxs) > 1:
+            return trivial_batch_collator([self.dataset[idx] for idx in indices])
+        dataset_idx = dataset_idxs.pop()
+        offset = cumulative_sizes[dataset_idx - 1] if dataset_idx > 0 else 0
+        return self.dataset.datasets[dataset_idx].get_batch([idx - offset for idx in indices])
+
+
+class BucketPaddingCollator:
+    """Stacks a batch like :func:`trivial_batch_collator` and trims the padding of the
+    batch to the boundary of the bucket of its longest sample.
+
+    Use it with :class:`libai.data.samplers.LengthBucketSampler` and the same
+    ``bucket_boundaries``, ``length_keys`` and ``pad_value``, so that the micro batches
+    of all data parallel ranks are trimmed to the same length, e.g. through the
+    ``length_bucketing`` option of :func:`build_nlp_train_loader`. Only the dims listed in
+    ``trim_fields`` are trimmed, each to the bucket boundary or its own size if smaller,
+    so fields padded to different lengths, e.g. the encoder and decoder inputs of a
+    seq2seq model, are trimmed consistently.
+
+    Arguments:
+        trim_fields: dims of the stacked tensor of every field to trim, e.g.
+            ``{"input_ids": [1], "attention_mask": [1, 2]}`` for a (seq_length,
+            seq_length) mask. Dim 0 is the batch dim.
+        bucket_boundaries: ascending upper bounds of the sample lengths of each bucket.
+        length_keys: fields to compute the lengths from (default: ``("attention_mask",)``).
+        pad_value: padding value of the ``length_keys`` fields (default: ``0``).
+    """
+
+    def __init__(
+        self,
+        trim_fields,
+        bucket_boundaries=(16, 32, 64, 128, 256),
+        length_keys=("attention_mask",),
+        pad_value=0,
+    ):
+        self.trim_fields = {key: tuple(dims) for key, dims in trim_fields.items()}
+        self.bucket_boundaries = tuple(sorted(bucket_boundaries))
+        self.length_keys = tuple(length_keys)
+        self.pad_value = pad_value
+
+    def __call__(self, batch):
+        batch = trivial_batch_collator(batch)
+        length = get_sequence_length(batch, self.length_keys, self.pad_value)
+        bucket = get_bucket_index(length, self.bucket_boundaries)
+        if bucket == len(self.bucket_boundaries):
+            return batch
+        length = self.bucket_boundaries[bucket]
+
+        for key, dims in self.trim_fields.items():
+            value = batch.get(key)
+            tensor = value.tensor if isinstance(value, DistTensorData) else value
+            index = [slice(None)] * tensor.ndim
+            for dim in dims:
+                index[dim] = slice(0, min(length, tensor.shape[dim]))
+            if isinstance(value, DistTensorData):
+                value.tensor = tensor[tuple(index)]
+            else:
+                batch.set(key, tensor[tuple(index)])
+        return batch
@@ -16,6 +16,8 @@
 from .dataset_utils import (
     compile_helper,
     is_shared_folder,
+    build_cn_wwm_id_array,
+    build_start_piece_array,
     create_masked_lm_predictions,
     get_samples_mapping,
     get_train_valid_test_split_,
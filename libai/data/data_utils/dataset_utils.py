@@ -76,6 +76,45 @@ def is_start_piece(piece):
     return not piece.startswith("##")
 
 
+def build_start_piece_array(vocab_id_to_token_dict):
+    """Build a boolean array indexed by vocab id which marks the starting word pieces,
+    so that whole word boundaries of a sample are found with a single lookup."""
+    start_piece_array = np.zeros(max(vocab_id_to_token_dict) + 1, dtype=bool)
+    for token_id, token in vocab_id_to_token_dict.items():
+        start_piece_array[token_id] = is_start_piece(token)
+    return start_piece_array
+
+
+def build_cn_wwm_id_array(tokenizer, vocab_id_to_token_dict):
+    """Build an array indexed by vocab id which maps every chinese word piece prefixed
+    with ## to the id of the same piece without ##, as done by the bert-cn-wwm masking."""
+    cn_wwm_id_array = np.arange(max(vocab_id_to_token_dict) + 1, dtype=np.int64)
+    for token_id, token in vocab_id_to_token_dict.items():
+        if len(re.findall("##[\u4E00-\u9FA5]", token)) > 0:
+            cn_wwm_id_array[token_id] = tokenizer.convert_tokens_to_ids([token[2:]])[0]
+    return cn_wwm_id_array
+
+
+def _strip_cn_wwm(tokenizer, token_ids, cn_wwm_id_array=None):
+    """Remove the ## of the chinese word pieces in `token_ids`."""
+    if cn_wwm_id_array is not None:
+        return cn_wwm_id_array[token_ids]
+    new_token_ids = []
+    for token_id in token_ids:
+        token = tokenizer.convert_ids_to_tokens([int(token_id)])[0]
+        if len(re.findall("##[\u4E00-\u9FA5]", token)) > 0:
+            token = token[2:]
+        new_token_ids.append(tokenizer.convert_tokens_to_ids([token])[0])
+    return np.array(new_token_ids, dtype=np.int64)
+
+
+def _start_piece_mask(tokens, vocab_id_to_token_dict, start_piece_array=None):
+    """Boolean array marking the starting word pieces of `tokens`."""
+    if start_piece_array is not None:
+        return start_piece_array[np.asarray(tokens, dtype=np.int64)]
+    return np.array([is_start_piece(vocab_id_to_token_dict[token]) for token in tokens], dtype=bool)
+
+
 def create_masked_lm_predictions(
     tokenizer,
     tokens,
@@ -93,15 +132,50 @@ def create_masked_lm_predictions(
     do_permutation=False,
     geometric_dist=False,
     masking_style="bert",
+    start_piece_array=None,
+    cn_wwm_id_array=None,
+    legacy_masking=False,
 ):
     """Creates the predictions for the masked LM objective.
-    Note: Tokens here are vocab ids and not text tokens."""
+    Note: Tokens here are vocab ids and not text tokens.
+
+    By default the masking runs on whole token arrays with numpy, see
+    `create_masked_lm_predictions_vectorized`. Set `legacy_masking=True` to run
+    the original per-token loop, which reproduces the random streams (and thus
+    the samples) of previous releases. `do_permutation` always uses the original loop.
+
+    `start_piece_array` and `cn_wwm_id_array` are the per-vocab lookup tables built by
+    `build_start_piece_array` and `build_cn_wwm_id_array`, they avoid looking up
+    every token in `vocab_id_to_token_dict` or the tokenizer.
+    """
+
+    if not legacy_masking and not do_permutation:
+        return create_masked_lm_predictions_vectorized(
+            tokenizer,
+            tokens,
+            vocab_id_list,
+            vocab_id_to_token_dict,
+            masked_lm_prob,
+            cls_id,
+            sep_id,
+            mask_id,
+            max_predictions_per_seq,
+            np_rng,
+            max_ngrams=max_ngrams,
+            do_whole_word_mask=do_whole_word_mask,
+            favor_longer_ngram=favor_longer_ngram,
+            geometric_dist=geometric_dist,
+            masking_style=masking_style,
+            start_piece_array=start_piece_array,
+            cn_wwm_id_array=cn_wwm_id_array,
+        )
 
     cand_indexes = []
     # Note(mingdachen): We create a list for recording if the piece is
     # the starting piece of current token, where 1 means true, so that
     # on-the-fly whole word masking is possible.
     token_boundary = [0] * len(tokens)
+    start_pieces = _start_piece_mask(tokens, vocab_id_to_token_dict, start_piece_array)
 
     for (i, token) in enumerate(tokens):
         if token == cls_id or token == sep_id:
@@ -113,15 +187,11 @@ def create_masked_lm_predictions(
         # Note that Whole Word Masking does *not* change the training code
         # at all -- we still predict each WordPiece independently, softmaxed
         # over the entire vocabulary.
-        if (
-            do_whole_word_mask
-            and len(cand_indexes) >= 1
-            and not is_start_piece(vocab_id_to_token_dict[token])
-        ):
+        if do_whole_word_mask and len(cand_indexes) >= 1 and not start_pieces[i]:
             cand_indexes[-1].append(i)
         else:
             cand_indexes.append([i])
-            if is_start_piece(vocab_id_to_token_dict[token]):
+            if start_pieces[i]:
                 token_boundary[i] = 1
 
     output_tokens = list(tokens)
@@ -129,14 +199,7 @@ def create_masked_lm_predictions(
     if masking_style == "bert-cn-wwm":
         # if non chinese is False, that means it is chinese,
         # then try to remove "##" which is added previously
-        new_token_ids = []
-        for token_id in output_tokens:
-            token = tokenizer.convert_ids_to_tokens([token_id])[0]
-            if len(re.findall("##[\u4E00-\u9FA5]", token)) > 0:
-                token = token[2:]
-            new_token_id = tokenizer.convert_tokens_to_ids([token])[0]
-            new_token_ids.append(new_token_id)
-        output_tokens = new_token_ids
+        output_tokens = _strip_cn_wwm(tokenizer, output_tokens, cn_wwm_id_array).tolist()
 
     masked_lm_positions = []
     masked_lm_labels = []
@@ -232,12 +295,9 @@ def create_masked_lm_predictions(
                     # 10% of the time, keep original
                     if np_rng.random() < 0.5:
                         # if it's chinese wwm, remove ## in toknes
-                        token_id = tokens[index]
-                        token = tokenizer.convert_ids_to_tokens([token_id])[0]
-                        if len(re.findall("##[\u4E00-\u9FA5]", token)) > 0:
-                            token = token[2:]
-                        new_token_id = tokenizer.convert_tokens_to_ids([token])[0]
-                        masked_token = new_token_id
+                        masked_token = int(
+                            _strip_cn_wwm(tokenizer, [tokens[index]], cn_wwm_id_array)[0]
+                        )
                     # 10% of the time, replace with random word
                     else:
                         masked_token = vocab_id_list[np_rng.randint(0, len(vocab_id_list))]
@@ -322,6 +382,133 @@ def create_masked_lm_predictions(
     )
 
 
+def create_masked_lm_predictions_vectorized(
+    tokenizer,
+    tokens,
+    vocab_id_list,
+    vocab_id_to_token_dict,
+    masked_lm_prob,
+    cls_id,
+    sep_id,
+    mask_id,
+    max_predictions_per_seq,
+    np_rng,
+    max_ngrams=3,
+    do_whole_word_mask=True,
+    favor_longer_ngram=False,
+    geometric_dist=False,
+    masking_style="bert",
+    start_piece_array=None,
+    cn_wwm_id_array=None,
+):
+    """Numpy implementation of `create_masked_lm_predictions` working on whole token
+    arrays. Word boundaries, n-gram lengths, span order and replacement tokens are
+    drawn at once for the whole sample, only the greedy span selection iterates,
+    and it stops as soon as enough tokens are masked.
+
+    The masking follows the same rules as the original loop, but consumes the random
+    generator differently, so the produced samples differ for the same seed.
+    """
+    tokens = np.asarray(tokens, dtype=np.int64)
+    num_tokens = len(tokens)
+
+    special = (tokens == cls_id) | (tokens == sep_id)
+    start_pieces = _start_piece_mask(tokens, vocab_id_to_token_dict, start_piece_array)
+    token_boundary = (special | start_pieces).astype(np.int64)
+
+    # Every non special token either starts a new word or continues the previous one.
+    word_starts = ~special & (start_pieces | (not do_whole_word_mask))
+    word_positions = np.flatnonzero(~special)
+    if len(word_positions) > 0:
+        word_starts[word_positions[0]] = True
+    word_ids = np.cumsum(word_starts) - 1  # word id of every token
+    num_words = int(word_starts.sum())
+    # `word_positions[word_offsets[w] : word_offsets[w + 1]]` are the tokens of word w
+    word_offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(word_ids[word_positions], minlength=num_words))]
+    ).astype(np.int64)
+
+    output_tokens = tokens
+    if masking_style == "bert-cn-wwm":
+        output_tokens = _strip_cn_wwm(tokenizer, tokens, cn_wwm_id_array)
+    output_tokens = output_tokens.copy()
+
+    if masked_lm_prob == 0:
+        return (output_tokens.tolist(), [], [], token_boundary.tolist())
+
+    num_to_predict = min(max_predictions_per_seq, max(1, int(round(num_tokens * masked_lm_prob))))
+
+    # Draw the n-gram length starting at every word, then visit the words in random order.
+    if not geometric_dist:
+        pvals = 1.0 / np.arange(1, max_ngrams + 1)
+        pvals /= pvals.sum(keepdims=True)
+        if favor_longer_ngram:
+            pvals = pvals[::-1]
+        ngram_lens = np_rng.choice(np.arange(1, max_ngrams + 1), size=num_words, p=pvals)
+    else:
+        ngram_lens = np.minimum(np_rng.geometric(0.2, size=num_words), max_ngrams)
+    # An n-gram cannot go past the last word.
+    ngram_lens = np.minimum(ngram_lens, num_words - np.arange(num_words))
+    order = np_rng.permutation(num_words)
+
+    covered = np.zeros(num_words, dtype=bool)
+    masked_spans_words = []
+    num_masked = 0
+    for w in order:
+        if num_masked >= num_to_predict:
+            break
+        n = ngram_lens[w]
+        # Try shorter n-grams until the span fits the number of predictions.
+        while n > 1 and num_masked + word_offsets[w + n] - word_offsets[w] > num_to_predict:
+            n -= 1
+        span_len = word_offsets[w + n] - word_offsets[w]
+        if num_masked + span_len > num_to_predict or covered[w : w + n].any():
+            continue
+        covered[w : w + n] = True
+        num_masked += span_len
+        masked_spans_words.append((w, n))
+
+    masked_lm_positions = word_positions[covered[word_ids[word_positions]]]
+    masked_lm_labels = tokens[masked_lm_positions]
+    num_masked = len(masked_lm_positions)
+
+    if masking_style in ["bert", "bert-cn-wwm"]:
+        # 80% of the time, replace with [MASK], 10% keep original, 10% random word
+        replace_with_mask = np_rng.random_sample(num_masked) < 0.8
+        keep_original = np_rng.random_sample(num_masked) < 0.5
+        random_words = np.array(
+            [vocab_id_list[i] for i in np_rng.randint(0, len(vocab_id_list), size=num_masked)],
+            dtype=np.int64,
+        )
+        original = masked_lm_labels
+        if masking_style == "bert-cn-wwm":
+            original = _strip_cn_wwm(tokenizer, masked_lm_labels, cn_wwm_id_array)
+        masked_tokens = np.where(
+            replace_with_mask, mask_id, np.where(keep_original, original, random_words)
+        )
+    elif masking_style == "t5":
+        masked_tokens = mask_id
+    else:
+        raise ValueError("invalid value of masking style")
+    output_tokens[masked_lm_positions] = masked_tokens
+
+    # Sort the spans by the index of the first span
+    masked_spans = []
+    for w, n in sorted(masked_spans_words):
+        index_set = word_positions[word_offsets[w] : word_offsets[w + n]]
+        masked_spans.append(
+            MaskedLmInstance(index=index_set.tolist(), label=tokens[index_set].tolist())
+        )
+
+    return (
+        output_tokens.tolist(),
+        masked_lm_positions.tolist(),
+        masked_lm_labels.tolist(),
+        token_boundary.tolist(),
+        masked_spans,
+    )
+
+
 def get_samples_mapping(
     indexed_dataset,
     data_prefix,
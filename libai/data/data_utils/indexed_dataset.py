@@ -17,7 +17,6 @@ import shutil
 import struct
 import time
 from functools import lru_cache
-from itertools import accumulate
 
 import numpy as np
 import oneflow as flow
@@ -190,14 +189,22 @@ class IndexedDataset(flow.utils.data.Dataset):
             start, stop, step = idx.indices(len(self))
             if step != 1:
                 raise ValueError("Slices into indexed_dataset must be contiguous")
-            sizes = self.sizes[self.dim_offsets[start] : self.dim_offsets[stop]]
-            size = sum(sizes)
-            a = np.empty(size, dtype=self.dtype)
-            self.data_file.seek(self.data_offsets[start] * self.element_size)
-            self.data_file.readinto(a)
-            offsets = list(accumulate(sizes))
-            sents = np.split(a, offsets[:-1])
-            return sents
+            a, sizes = self.get_contiguous(start, stop)
+            return np.split(a, np.cumsum(sizes)[:-1])
+
+    def get_contiguous(self, start, stop):
+        """Reads the items in ``[start, stop)`` with a single read.
+
+        Returns the concatenated items as one flat array together with the size of
+        every item, so callers can work on the whole span without splitting it.
+        """
+        if not self.data_file:
+            self.read_data(self.path)
+        sizes = np.asarray(self.sizes[self.dim_offsets[start] : self.dim_offsets[stop]])
+        a = np.empty(int(sizes.sum()), dtype=self.dtype)
+        self.data_file.seek(self.data_offsets[start] * self.element_size)
+        self.data_file.readinto(a)
+        return a, sizes
 
     def __len__(self):
         return self._len
@@ -268,6 +275,13 @@ class IndexedCachedDataset(IndexedDataset):
                 sents.append(self[i])
             return sents
 
+    def get_contiguous(self, start, stop):
+        sents = self[start:stop]
+        sizes = np.array([len(sent) for sent in sents], dtype=np.int64)
+        if len(sents) == 0:
+            return np.empty(0, dtype=self.dtype), sizes
+        return np.concatenate(sents), sizes
+
 
 class IndexedDatasetBuilder(object):
     element_sizes = {
@@ -469,7 +483,8 @@ class MMapIndexedDataset(flow.utils.data.Dataset):
         return self._path
 
     def __setstate__(self, state):
-        self._do_init(state)
+        # workers of a data loader map the same files instead of receiving a copy of the data
+        self._do_init(state, skip_warmup=True)
 
     def _do_init(self, path, skip_warmup):
         self._path = path
@@ -503,15 +518,21 @@ class MMapIndexedDataset(flow.utils.data.Dataset):
             start, stop, step = idx.indices(len(self))
             if step != 1:
                 raise ValueError("Slices into indexed_dataset must be contiguous")
-            ptr = self._index._pointers[start]
-            sizes = self._index._sizes[idx]
-            offsets = list(accumulate(sizes))
-            total_size = sum(sizes)
-            np_array = np.frombuffer(
-                self._bin_buffer, dtype=self._index.dtype, count=total_size, offset=ptr
-            )
-            sents = np.split(np_array, offsets[:-1])
-            return sents
+            np_array, sizes = self.get_contiguous(start, stop)
+            return np.split(np_array, np.cumsum(sizes)[:-1])
+
+    def get_contiguous(self, start, stop):
+        """Returns the items in ``[start, stop)`` as one flat array viewing the mmap
+        buffer, together with the size of every item. Nothing is copied.
+        """
+        sizes = self._index._sizes[start:stop]
+        if len(sizes) == 0:
+            return np.empty(0, dtype=self._index.dtype), sizes
+        ptr = self._index._pointers[start]
+        np_array = np.frombuffer(
+            self._bin_buffer, dtype=self._index.dtype, count=int(sizes.sum()), offset=ptr
+        )
+        return np_array, sizes
 
     def get(self, idx, offset=0, length=None):
         """Retrieves a single item from the dataset with the option to only
@@ -559,7 +580,9 @@ class MMapIndexedDatasetBuilder(object):
         self._doc_idx = [0]
 
     def add_item(self, tensor):
-        np_array = np.array(tensor.numpy(), dtype=self._dtype)
+        if isinstance(tensor, flow.Tensor):
+            tensor = tensor.numpy()
+        np_array = np.array(tensor, dtype=self._dtype)
         self._data_file.write(np_array.tobytes(order="C"))
         self._sizes.append(np_array.size)
 
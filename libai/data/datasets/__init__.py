@@ -13,10 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .cifar import CIFAR10Dataset, CIFAR100Dataset
-from .imagenet import ImageNetDataset
-from .mnist import MNISTDataset
-from .bert_dataset import BertDataset
-from .roberta_dataset import RobertaDataset
-from .gpt_dataset import GPT2Dataset
-from .t5_dataset import T5Dataset
+import importlib
+
+# Datasets are imported on first access (PEP 562): the vision datasets pull in flowvision
+# and the NLP ones the indexed dataset helpers, which most entry points never need.
+_LAZY_ATTRS = {
+    "CIFAR10Dataset": ".cifar",
+    "CIFAR100Dataset": ".cifar",
+    "ImageNetDataset": ".imagenet",
+    "MNISTDataset": ".mnist",
+    "BertDataset": ".bert_dataset",
+    "RobertaDataset": ".roberta_dataset",
+    "GPT2Dataset": ".gpt_dataset",
+    "T5Dataset": ".t5_dataset",
+    "PackedDataset": ".packed_dataset",
+    "TokenizedDataset": ".tokenized_dataset",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -20,7 +20,12 @@ import oneflow as flow
 
 from libai.data.structures import DistTensorData, Instance
 
-from ..data_utils import create_masked_lm_predictions, get_samples_mapping
+from ..data_utils import (
+    build_cn_wwm_id_array,
+    build_start_piece_array,
+    create_masked_lm_predictions,
+    get_samples_mapping,
+)
 
 
 class BertDataset(flow.utils.data.Dataset):
@@ -43,6 +48,9 @@ class BertDataset(flow.utils.data.Dataset):
             Setting it to True assumes that the underlying dataset generates a
             label for the pair of sentences which is surfaced as
             sentence_target. Defaults to True.
+        masking_style: Masking style, one of "bert" and "bert-cn-wwm". Defaults to "bert".
+        legacy_masking: Use the original per-token masking loop, which reproduces the
+            samples of previous releases for a given seed. Defaults to False.
     """
 
     def __init__(
@@ -58,6 +66,7 @@ class BertDataset(flow.utils.data.Dataset):
         seed=1234,
         binary_head=True,
         masking_style="bert",
+        legacy_masking=False,
     ):
 
         # Params to store.
@@ -67,6 +76,7 @@ class BertDataset(flow.utils.data.Dataset):
         self.max_seq_length = max_seq_length
         self.binary_head = binary_head
         self.masking_style = masking_style
+        self.legacy_masking = legacy_masking
 
         # Dataset.
         self.indexed_dataset = indexed_dataset
@@ -88,6 +98,12 @@ class BertDataset(flow.utils.data.Dataset):
         self.tokenizer = tokenizer
         self.vocab_id_list = list(tokenizer.get_vocab().values())
         self.vocab_id_to_token_dict = {v: k for k, v in tokenizer.get_vocab().items()}
+        self.start_piece_array = build_start_piece_array(self.vocab_id_to_token_dict)
+        self.cn_wwm_id_array = (
+            build_cn_wwm_id_array(tokenizer, self.vocab_id_to_token_dict)
+            if masking_style == "bert-cn-wwm"
+            else None
+        )
 
         self.cls_id = tokenizer.cls_token_id
         self.sep_id = tokenizer.sep_token_id
@@ -98,16 +114,53 @@ class BertDataset(flow.utils.data.Dataset):
         return self.samples_mapping.shape[0]
 
     def __getitem__(self, idx):
+        buffers = allocate_sample_buffers(self.max_seq_length)
+        tokens_np, tokentypes_np, labels_np, padding_mask_np, loss_mask_np = buffers
+        is_next_random = self._fill_sample(idx, buffers)
+        return Instance(
+            input_ids=DistTensorData(flow.tensor(tokens_np)),
+            attention_mask=DistTensorData(flow.tensor(padding_mask_np)),
+            tokentype_ids=DistTensorData(flow.tensor(tokentypes_np)),
+            ns_labels=DistTensorData(
+                flow.tensor(int(is_next_random), dtype=flow.long), placement_idx=-1
+            ),
+            lm_labels=DistTensorData(flow.tensor(labels_np), placement_idx=-1),
+            loss_mask=DistTensorData(flow.tensor(loss_mask_np), placement_idx=-1),
+        )
+
+    def get_batch(self, indices):
+        """Build the samples of ``indices`` directly into batched arrays.
+
+        Returns the same Instance as stacking ``self[idx]`` for every index with
+        `Instance.stack`, but without creating per-sample tensors.
+        """
+        buffers = allocate_sample_buffers(self.max_seq_length, len(indices))
+        tokens_np, tokentypes_np, labels_np, padding_mask_np, loss_mask_np = buffers
+        is_next_random = np.zeros(len(indices), dtype=np.int64)
+        for i, idx in enumerate(indices):
+            out = tuple(buffer[i] for buffer in buffers)
+            is_next_random[i] = self._fill_sample(idx, out)
+        return Instance(
+            input_ids=DistTensorData(flow.from_numpy(tokens_np)),
+            attention_mask=DistTensorData(flow.from_numpy(padding_mask_np)),
+            tokentype_ids=DistTensorData(flow.from_numpy(tokentypes_np)),
+            ns_labels=DistTensorData(flow.from_numpy(is_next_random), placement_idx=-1),
+            lm_labels=DistTensorData(flow.from_numpy(labels_np), placement_idx=-1),
+            loss_mask=DistTensorData(flow.from_numpy(loss_mask_np), placement_idx=-1),
+        )
+
+    def _fill_sample(self, idx, out):
         start_idx, end_idx, seq_length = self.samples_mapping[idx]
-        sample = [self.indexed_dataset[i] for i in range(start_idx, end_idx)]
+        # All the sentences of a sample are adjacent, read them at once.
+        tokens, sentence_sizes = self.indexed_dataset.get_contiguous(start_idx, end_idx)
         # Note that this rng state should be numpy and not python since
         # python randint is inclusive whereas the numpy one is exclusive.
         # We % 2**32 since numpy requires the seed to be between 0 and 2**32 - 1
-
         np_rng = np.random.RandomState(seed=((self.seed + idx) % 2 ** 32))
-        return build_training_sample(
+        return fill_training_sample(
             self.tokenizer,
-            sample,
+            tokens,
+            sentence_sizes,
             seq_length,
             self.max_seq_length,  # needed for padding
             self.vocab_id_list,
@@ -119,7 +172,11 @@ class BertDataset(flow.utils.data.Dataset):
             self.masked_lm_prob,
             np_rng,
             self.binary_head,
+            out,
             masking_style=self.masking_style,
+            start_piece_array=self.start_piece_array,
+            cn_wwm_id_array=self.cn_wwm_id_array,
+            legacy_masking=self.legacy_masking,
         )
 
 
@@ -138,6 +195,9 @@ def build_training_sample(
     np_rng,
     binary_head,
     masking_style="bert",
+    start_piece_array=None,
+    cn_wwm_id_array=None,
+    legacy_masking=False,
 ):
     """Build training sample.
 
@@ -156,26 +216,102 @@ def build_training_sample(
         np_rng: Random number genenrator. Note that this rng state should be
               numpy and not python since python randint is inclusive for
               the upper bound whereas the numpy one is exclusive.
+        start_piece_array: Per-vocab boolean array of the starting word pieces.
+        cn_wwm_id_array: Per-vocab array of the ids without ## for bert-cn-wwm masking.
+        legacy_masking: Use the original per-token masking loop.
     """
+    sentence_sizes = np.array([len(sentence) for sentence in sample], dtype=np.int64)
+    tokens = np.concatenate(sample) if len(sample) > 0 else np.empty(0, dtype=np.int64)
+    out = allocate_sample_buffers(max_seq_length)
+    is_next_random = fill_training_sample(
+        tokenizer,
+        tokens,
+        sentence_sizes,
+        target_seq_length,
+        max_seq_length,
+        vocab_id_list,
+        vocab_id_to_token_dict,
+        cls_id,
+        sep_id,
+        mask_id,
+        pad_id,
+        masked_lm_prob,
+        np_rng,
+        binary_head,
+        out,
+        masking_style=masking_style,
+        start_piece_array=start_piece_array,
+        cn_wwm_id_array=cn_wwm_id_array,
+        legacy_masking=legacy_masking,
+    )
+    tokens_np, tokentypes_np, labels_np, padding_mask_np, loss_mask_np = out
 
+    train_sample = Instance(
+        input_ids=DistTensorData(flow.tensor(tokens_np)),
+        attention_mask=DistTensorData(flow.tensor(padding_mask_np)),
+        tokentype_ids=DistTensorData(flow.tensor(tokentypes_np)),
+        ns_labels=DistTensorData(
+            flow.tensor(int(is_next_random), dtype=flow.long), placement_idx=-1
+        ),
+        lm_labels=DistTensorData(flow.tensor(labels_np), placement_idx=-1),
+        loss_mask=DistTensorData(flow.tensor(loss_mask_np), placement_idx=-1),
+    )
+
+    return train_sample
+
+
+def fill_training_sample(
+    tokenizer,
+    tokens,
+    sentence_sizes,
+    target_seq_length,
+    max_seq_length,
+    vocab_id_list,
+    vocab_id_to_token_dict,
+    cls_id,
+    sep_id,
+    mask_id,
+    pad_id,
+    masked_lm_prob,
+    np_rng,
+    binary_head,
+    out,
+    masking_style="bert",
+    start_piece_array=None,
+    cn_wwm_id_array=None,
+    legacy_masking=False,
+):
+    """Build a training sample into the preallocated arrays ``out``, see
+    `allocate_sample_buffers`. Returns whether the segments were swapped.
+
+    The sentences are given as one flat token array and the size of every sentence.
+    Segments and truncation are computed as offsets into ``tokens`` and draw from
+    ``np_rng`` exactly like `build_training_sample` always did, so the samples are
+    identical for a given seed.
+    """
+
+    num_sentences = len(sentence_sizes)
     if binary_head:
         # We assume that we have at least two sentences in the sample
-        assert len(sample) > 1
+        assert num_sentences > 1
     assert target_seq_length <= max_seq_length
 
-    # Divide sample into two segments (A and B).
+    # Divide sample into two segments (A and B), as [start, end) offsets into tokens.
     if binary_head:
-        tokens_a, tokens_b, is_next_random = get_a_and_b_segments(sample, np_rng)
+        (a_start, a_end), (b_start, b_end), is_next_random = get_a_and_b_segments(
+            sentence_sizes, np_rng
+        )
     else:
-        tokens_a = []
-        for j in range(len(sample)):
-            tokens_a.extend(sample[j])
-        tokens_b = []
+        (a_start, a_end), (b_start, b_end) = (0, len(tokens)), (0, 0)
         is_next_random = False
 
     # Truncate to `target_sequence_length`.
     max_num_tokens = target_seq_length
-    truncate_segments(tokens_a, tokens_b, len(tokens_a), len(tokens_b), max_num_tokens, np_rng)
+    (front_a, back_a), (front_b, back_b) = truncate_segments(
+        a_end - a_start, b_end - b_start, max_num_tokens, np_rng
+    )
+    tokens_a = tokens[a_start + front_a : a_end - back_a]
+    tokens_b = tokens[b_start + front_b : b_end - back_b]
 
     # Build tokens and toketypes.
     tokens, tokentypes = create_tokens_and_tokentypes(tokens_a, tokens_b, cls_id, sep_id)
@@ -194,31 +330,39 @@ def build_training_sample(
         max_predictions_per_seq,
         np_rng,
         masking_style=masking_style,
+        start_piece_array=start_piece_array,
+        cn_wwm_id_array=cn_wwm_id_array,
+        legacy_masking=legacy_masking,
     )
 
     # Padding.
-    tokens_np, tokentypes_np, labels_np, padding_mask_np, loss_mask_np = pad_and_convert_to_numpy(
-        tokens, tokentypes, masked_positions, masked_labels, pad_id, max_seq_length
+    pad_and_convert_to_numpy(
+        tokens, tokentypes, masked_positions, masked_labels, pad_id, max_seq_length, out=out
     )
 
-    train_sample = Instance(
-        input_ids=DistTensorData(flow.tensor(tokens_np)),
-        attention_mask=DistTensorData(flow.tensor(padding_mask_np)),
-        tokentype_ids=DistTensorData(flow.tensor(tokentypes_np)),
-        ns_labels=DistTensorData(
-            flow.tensor(int(is_next_random), dtype=flow.long), placement_idx=-1
-        ),
-        lm_labels=DistTensorData(flow.tensor(labels_np), placement_idx=-1),
-        loss_mask=DistTensorData(flow.tensor(loss_mask_np), placement_idx=-1),
-    )
+    return is_next_random
 
-    return train_sample
+
+def allocate_sample_buffers(max_seq_length, batch_size=None):
+    """Allocate the tokens, tokentypes, labels, padding mask and loss mask arrays
+    of one sample, or of ``batch_size`` samples."""
+    shape = (max_seq_length,) if batch_size is None else (batch_size, max_seq_length)
+    return (
+        np.empty(shape, dtype=np.int64),
+        np.empty(shape, dtype=np.int64),
+        np.empty(shape, dtype=np.int64),
+        np.empty(shape, dtype=bool),
+        np.empty(shape, dtype=bool),
+    )
 
 
 def pad_and_convert_to_numpy(
-    tokens, tokentypes, masked_positions, masked_labels, pad_id, max_seq_length
+    tokens, tokentypes, masked_positions, masked_labels, pad_id, max_seq_length, out=None
 ):
-    """Pad sequences and convert them to numpy."""
+    """Pad sequences and convert them to numpy.
+
+    The results are written into ``out`` when it is given, see `allocate_sample_buffers`.
+    """
 
     # Some checks.
     num_tokens = len(tokens)
@@ -227,32 +371,36 @@ def pad_and_convert_to_numpy(
     assert len(tokentypes) == num_tokens
     assert len(masked_positions) == len(masked_labels)
 
+    if out is None:
+        out = allocate_sample_buffers(max_seq_length)
+    tokens_np, tokentypes_np, labels_np, padding_mask_np, loss_mask_np = out
+
     # Tokens and token types.
-    filler = [pad_id] * padding_length
-    tokens_np = np.array(tokens + filler, dtype=np.int64)
-    tokentypes_np = np.array(tokentypes + filler, dtype=np.int64)
+    tokens_np[:num_tokens] = tokens
+    tokens_np[num_tokens:] = pad_id
+    tokentypes_np[:num_tokens] = tokentypes
+    tokentypes_np[num_tokens:] = pad_id
 
     # Padding mask.
-    padding_mask_np = np.array([1] * num_tokens + [0] * padding_length, dtype=bool)
+    padding_mask_np[:num_tokens] = True
+    padding_mask_np[num_tokens:] = False
 
     # Lables and loss mask.
-    labels = [-1] * max_seq_length
-    loss_mask = [0] * max_seq_length
-    for i in range(len(masked_positions)):
-        assert masked_positions[i] < num_tokens
-        labels[masked_positions[i]] = masked_labels[i]
-        loss_mask[masked_positions[i]] = 1
-    labels_np = np.array(labels, dtype=np.int64)
-    loss_mask_np = np.array(loss_mask, dtype=bool)
+    masked_positions = np.asarray(masked_positions, dtype=np.int64)
+    assert (masked_positions < num_tokens).all()
+    labels_np.fill(-1)
+    labels_np[masked_positions] = masked_labels
+    loss_mask_np.fill(False)
+    loss_mask_np[masked_positions] = True
 
     return tokens_np, tokentypes_np, labels_np, padding_mask_np, loss_mask_np
 
 
-def get_a_and_b_segments(sample, np_rng):
-    """Divide sample into a and b segments."""
+def get_a_and_b_segments(sentence_sizes, np_rng):
+    """Divide sample into a and b segments, returned as [start, end) token offsets."""
 
     # Number of sentences in the sample.
-    n_sentences = len(sample)
+    n_sentences = len(sentence_sizes)
     # Make sure we always have two sentences.
     assert n_sentences > 1, "make sure each sample has at least two sentences."
 
@@ -262,65 +410,67 @@ def get_a_and_b_segments(sample, np_rng):
     if n_sentences >= 3:
         # Note that randin in numpy is exclusive.
         a_end = np_rng.randint(1, n_sentences)
-    tokens_a = []
-    for j in range(a_end):
-        tokens_a.extend(sample[j])
+    split = int(np.sum(sentence_sizes[:a_end]))
+    segment_a = (0, split)
 
     # Second part:
-    tokens_b = []
-    for j in range(a_end, n_sentences):
-        tokens_b.extend(sample[j])
+    segment_b = (split, int(np.sum(sentence_sizes)))
 
     # Random next:
     is_next_random = False
     if np_rng.random() < 0.5:
         is_next_random = True
-        tokens_a, tokens_b = tokens_b, tokens_a
+        segment_a, segment_b = segment_b, segment_a
 
-    return tokens_a, tokens_b, is_next_random
+    return segment_a, segment_b, is_next_random
 
 
-def truncate_segments(tokens_a, tokens_b, len_a, len_b, max_num_tokens, np_rng):
-    """Truncates a pair of sequences to a maximum sequence length."""
+def truncate_segments(len_a, len_b, max_num_tokens, np_rng):
+    """Truncates a pair of sequences to a maximum sequence length.
+
+    A token is removed from the longer segment (B on ties) until the pair fits, from
+    the front or the back with equal probability. Returns the number of tokens to
+    remove from the ``(front, back)`` of A and of B.
+    """
     assert len_a > 0
-    if len_a + len_b <= max_num_tokens:
-        return False
-    while len_a + len_b > max_num_tokens:
-        if len_a > len_b:
-            len_a -= 1
-            tokens = tokens_a
-        else:
-            len_b -= 1
-            tokens = tokens_b
-        if np_rng.random() < 0.5:
-            del tokens[0]
-        else:
-            tokens.pop()
-    return True
+    num_steps = len_a + len_b - max_num_tokens
+    if num_steps <= 0:
+        return (0, 0), (0, 0)
+
+    # The longer segment is cut until both have about the same length,
+    # then the cuts alternate between the two segments.
+    if len_a > len_b:
+        head, head_from_a = min(num_steps, len_a - len_b), True
+    else:
+        head, head_from_a = min(num_steps, len_b - len_a + 1), False
+    from_a = np.empty(num_steps, dtype=bool)
+    from_a[:head] = head_from_a
+    from_a[head:] = np.arange(num_steps - head) % 2 == int(head_from_a)
+
+    # One draw per removed token, as the per-token loop did.
+    from_front = np_rng.random_sample(num_steps) < 0.5
+    front_a = int(np.count_nonzero(from_a & from_front))
+    back_a = int(np.count_nonzero(from_a)) - front_a
+    front_b = int(np.count_nonzero(~from_a & from_front))
+    back_b = num_steps - front_a - back_a - front_b
+    return (front_a, back_a), (front_b, back_b)
 
 
 def create_tokens_and_tokentypes(tokens_a, tokens_b, cls_id, sep_id):
     """Merge segments A and B, add [CLS] and [SEP] and build tokentypes."""
 
-    tokens = []
-    tokentypes = []
-    # [CLS].
-    tokens.append(cls_id)
-    tokentypes.append(0)
-    # Segment A.
-    for token in tokens_a:
-        tokens.append(token)
-        tokentypes.append(0)
-    # [SEP].
-    tokens.append(sep_id)
-    tokentypes.append(0)
-    # Segment B.
-    for token in tokens_b:
-        tokens.append(token)
-        tokentypes.append(1)
-    if tokens_b:
-        # [SEP].
-        tokens.append(sep_id)
-        tokentypes.append(1)
+    len_a, len_b = len(tokens_a), len(tokens_b)
+    num_tokens = len_a + 2 + (len_b + 1 if len_b > 0 else 0)
+    tokens = np.empty(num_tokens, dtype=np.int64)
+    tokentypes = np.zeros(num_tokens, dtype=np.int64)
+    # [CLS], segment A and [SEP].
+    tokens[0] = cls_id
+    tokens[1 : len_a + 1] = tokens_a
+    tokens[len_a + 1] = sep_id
+    if len_b > 0:
+        # Segment B and [SEP].
+        tokens[len_a + 2 : -1] = tokens_b
+        tokens[-1] = sep_id
+        tokentypes[len_a + 2 :] = 1
 
     return tokens, tokentypes
@@ -0,0 +1,167 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sequence packing for fine-tuning datasets."""
+
+import bisect
+import logging
+
+import numpy as np
+import oneflow as flow
+
+from libai.data.structures import DistTensorData, Instance
+
+logger = logging.getLogger(__name__)
+
+
+def pack_by_length(lengths, max_seq_length):
+    """Bin-packs sequences into rows of ``max_seq_length`` tokens with best-fit decreasing.
+
+    Args:
+        lengths (Sequence[int]): length of every sequence, longer ones count as
+            ``max_seq_length``.
+        max_seq_length (int): capacity of a row.
+
+    Returns:
+        List[List[int]]: indices of the sequences of every row.
+    """
+    lengths = np.minimum(np.asarray(lengths, dtype=np.int64), max_seq_length)
+    rows = []
+    # (remaining capacity, row index) of the rows, kept sorted
+    remaining = []
+    for idx in np.argsort(-lengths, kind="stable"):
+        length = int(lengths[idx])
+        pos = bisect.bisect_left(remaining, (length, -1))
+        if pos == len(remaining):
+            rows.append([int(idx)])
+            bisect.insort(remaining, (max_seq_length - length, len(rows) - 1))
+        else:
+            capacity, row = remaining.pop(pos)
+            rows[row].append(int(idx))
+            bisect.insort(remaining, (capacity - length, row))
+    return rows
+
+
+def unpadded_length(sample, pad_values):
+    """Number of positions of ``sample`` up to the last one where a field of ``pad_values``
+    is not its padding value."""
+    not_pad = None
+    for key, value in pad_values.items():
+        field = sample.get(key).tensor.numpy() != value
+        not_pad = field if not_pad is None else not_pad | field
+    positions = np.flatnonzero(not_pad)
+    return int(positions[-1]) + 1 if len(positions) > 0 else 0
+
+
+def pack_instances(samples, max_seq_length, pad_values, lengths=None):
+    """Concatenates samples into one row of ``max_seq_length`` tokens.
+
+    Besides the fields in ``pad_values``, the row has ``position_ids`` restarting at 0 for
+    every sample and a block diagonal ``attention_mask`` with shape
+    (max_seq_length, max_seq_length), 1 where both tokens belong to the same sample.
+    The trailing padding forms its own block so that no row of the mask is empty.
+    Models apply their causal mask on top of it. ``lengths`` are the numbers of tokens
+    to take from every sample, by default all of them.
+    """
+    if lengths is None:
+        lengths = [len(sample.get(next(iter(pad_values))).tensor) for sample in samples]
+    fields = {key: [] for key in pad_values}
+    segment_ids, position_ids = [], []
+    num_tokens = 0
+    for segment, (sample, length) in enumerate(zip(samples, lengths), start=1):
+        length = int(min(length, max_seq_length - num_tokens))
+        if length <= 0:
+            break
+        for key in pad_values:
+            fields[key].append(sample.get(key).tensor[:length])
+        segment_ids.append(flow.full((length,), segment, dtype=flow.long))
+        position_ids.append(flow.arange(length, dtype=flow.long))
+        num_tokens += length
+
+    num_pad = max_seq_length - num_tokens
+    if num_pad > 0:
+        for key, value in pad_values.items():
+            fields[key].append(flow.full((num_pad,), value, dtype=fields[key][0].dtype))
+        segment_ids.append(flow.zeros(num_pad, dtype=flow.long))
+        position_ids.append(flow.zeros(num_pad, dtype=flow.long))
+
+    segment_ids = flow.cat(segment_ids)
+    attention_mask = segment_ids.unsqueeze(1) == segment_ids.unsqueeze(0)
+
+    packed = Instance()
+    for key in pad_values:
+        # keep the sbp and placement of the original field, e.g. labels on the last stage
+        template = samples[0].get(key)
+        packed.set(
+            key,
+            DistTensorData(
+                flow.cat(fields[key]),
+                sbp_list=template.sbp_list,
+                placement_idx=template.placement_idx,
+            ),
+        )
+    packed.set("position_ids", DistTensorData(flow.cat(position_ids)))
+    packed.set("attention_mask", DistTensorData(attention_mask))
+    return packed
+
+
+class PackedDataset(flow.utils.data.Dataset):
+    """Packs several unpadded examples of ``dataset`` into every sample of
+    ``max_seq_length`` tokens, so that short examples no longer waste a full padded row.
+
+    The rows are fixed once from the example lengths, so samplers, data parallel
+    partitioning and ``consumed_samples`` keep counting rows exactly like any dataset.
+    See :func:`pack_instances` for the fields of a row; models must take the block
+    diagonal ``attention_mask`` and the ``position_ids``, e.g. ``LlamaForCausalLM`` and
+    ``ChatGLMForConditionalGeneration``.
+
+    Args:
+        dataset (flow.utils.data.Dataset): returns :class:`Instance` s of unpadded 1-D fields.
+        max_seq_length (int): number of tokens of a packed row.
+        pad_values (dict): fields to pack and the value to pad them with,
+            e.g. ``{"input_ids": 0, "labels": -1}``.
+        lengths (Sequence[int], optional): length of every example. Defaults to None,
+            meaning they are read from the first field of ``pad_values`` of every example.
+        strip_padding (bool): drop the trailing padding of examples padded by ``dataset``,
+            see :func:`unpadded_length`. Defaults to False.
+    """
+
+    def __init__(self, dataset, max_seq_length, pad_values, lengths=None, strip_padding=False):
+        self.dataset = dataset
+        self.max_seq_length = max_seq_length
+        self.pad_values = dict(pad_values)
+        if lengths is None:
+            key = next(iter(self.pad_values))
+            lengths = [
+                unpadded_length(dataset[i], self.pad_values)
+                if strip_padding
+                else len(dataset[i].get(key).tensor)
+                for i in range(len(dataset))
+            ]
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.rows = pack_by_length(lengths, max_seq_length)
+        num_tokens = np.minimum(np.asarray(lengths), max_seq_length).sum()
+        logger.info(
+            f"Packed {len(lengths)} examples into {len(self.rows)} rows of {max_seq_length} "
+            f"tokens, {num_tokens / (len(self.rows) * max_seq_length):.1%} of them are filled"
+        )
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        row = self.rows[idx]
+        samples = [self.dataset[i] for i in row]
+        return pack_instances(samples, self.max_seq_length, self.pad_values, self.lengths[row])
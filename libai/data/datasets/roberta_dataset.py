@@ -20,7 +20,12 @@ import oneflow as flow
 
 from libai.data.structures import DistTensorData, Instance
 
-from ..data_utils import create_masked_lm_predictions, get_samples_mapping
+from ..data_utils import (
+    build_cn_wwm_id_array,
+    build_start_piece_array,
+    create_masked_lm_predictions,
+    get_samples_mapping,
+)
 from .bert_dataset import pad_and_convert_to_numpy
 
 
@@ -39,6 +44,9 @@ class RobertaDataset(flow.utils.data.Dataset):
         short_seq_prob: Probability of producing a short sequence. Defaults to 0.0.
         max_predictions_per_seq: Maximum number of mask tokens in each sentence. Defaults to None.
         seed: Seed for random number generator for reproducibility. Defaults to 1234.
+        masking_style: Masking style, one of "bert" and "bert-cn-wwm". Defaults to "bert".
+        legacy_masking: Use the original per-token masking loop, which reproduces the
+            samples of previous releases for a given seed. Defaults to False.
     """
 
     def __init__(
@@ -53,6 +61,7 @@ class RobertaDataset(flow.utils.data.Dataset):
         short_seq_prob=0.0,
         seed=1234,
         masking_style="bert",
+        legacy_masking=False,
     ):
         super().__init__()
 
@@ -62,6 +71,7 @@ class RobertaDataset(flow.utils.data.Dataset):
         self.masked_lm_prob = mask_lm_prob
         self.max_seq_length = max_seq_length
         self.masking_style = masking_style
+        self.legacy_masking = legacy_masking
 
         # Dataset.
         self.indexed_dataset = indexed_dataset
@@ -83,6 +93,12 @@ class RobertaDataset(flow.utils.data.Dataset):
         self.tokenizer = tokenizer
         self.vocab_id_list = list(tokenizer.get_vocab().values())
         self.vocab_id_to_token_dict = {v: k for k, v in tokenizer.get_vocab().items()}
+        self.start_piece_array = build_start_piece_array(self.vocab_id_to_token_dict)
+        self.cn_wwm_id_array = (
+            build_cn_wwm_id_array(tokenizer, self.vocab_id_to_token_dict)
+            if masking_style == "bert-cn-wwm"
+            else None
+        )
 
         self.cls_id = tokenizer.cls_token_id
         self.sep_id = tokenizer.sep_token_id
@@ -114,6 +130,9 @@ class RobertaDataset(flow.utils.data.Dataset):
             self.masked_lm_prob,
             np_rng,
             masking_style=self.masking_style,
+            start_piece_array=self.start_piece_array,
+            cn_wwm_id_array=self.cn_wwm_id_array,
+            legacy_masking=self.legacy_masking,
         )
 
 
@@ -131,6 +150,9 @@ def build_training_sample(
     masked_lm_prob,
     np_rng,
     masking_style="bert",
+    start_piece_array=None,
+    cn_wwm_id_array=None,
+    legacy_masking=False,
 ):
     """Build training sample.
 
@@ -149,6 +171,9 @@ def build_training_sample(
         np_rng: Random number genenrator. Note that this rng state should be
               numpy and not python since python randint is inclusive for
               the upper bound whereas the numpy one is exclusive.
+        start_piece_array: Per-vocab boolean array of the starting word pieces.
+        cn_wwm_id_array: Per-vocab array of the ids without ## for bert-cn-wwm masking.
+        legacy_masking: Use the original per-token masking loop.
     """
     assert target_seq_length <= max_seq_length
 
@@ -176,6 +201,9 @@ def build_training_sample(
         max_predictions_per_seq,
         np_rng,
         masking_style=masking_style,
+        start_piece_array=start_piece_array,
+        cn_wwm_id_array=cn_wwm_id_array,
+        legacy_masking=legacy_masking,
     )
 
     # Padding.
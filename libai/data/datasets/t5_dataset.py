@@ -15,14 +15,12 @@
 
 """T5 Style dataset."""
 
-import collections
-
 import numpy as np
 import oneflow as flow
 
 from libai.data.structures import DistTensorData, Instance
 
-from ..data_utils import create_masked_lm_predictions, get_samples_mapping
+from ..data_utils import build_start_piece_array, create_masked_lm_predictions, get_samples_mapping
 
 
 class T5Dataset(flow.utils.data.Dataset):
@@ -45,6 +43,8 @@ class T5Dataset(flow.utils.data.Dataset):
             Probability of producing a short sequence. Defaults to 0.0.
         seed (int, optional):
             Seed for random number generator for reproducibility. Defaults to 1234.
+        legacy_masking (bool, optional): Use the original per-token masking loop, which
+            reproduces the samples of previous releases for a given seed. Defaults to False.
     """
 
     def __init__(
@@ -59,6 +59,7 @@ class T5Dataset(flow.utils.data.Dataset):
         max_seq_length_dec,
         short_seq_prob,
         seed,
+        legacy_masking=False,
     ):
         # Params to store.
         self.name = name
@@ -66,6 +67,7 @@ class T5Dataset(flow.utils.data.Dataset):
         self.masked_lm_prob = masked_lm_prob
         self.max_seq_length = max_seq_length
         self.max_seq_length_dec = max_seq_length_dec
+        self.legacy_masking = legacy_masking
 
         # Dataset.
         self.indexed_dataset = indexed_dataset
@@ -92,6 +94,7 @@ class T5Dataset(flow.utils.data.Dataset):
         inv_vocab = {v: k for k, v in vocab.items()}
         self.vocab_id_list = list(inv_vocab.keys())
         self.vocab_id_to_token_dict = inv_vocab
+        self.start_piece_array = build_start_piece_array(self.vocab_id_to_token_dict)
         self.cls_id = vocab[tokenizer._cls_token]
         self.sep_id = vocab[tokenizer._sep_token]
         self.mask_id = vocab[tokenizer._mask_token]
@@ -105,17 +108,33 @@ class T5Dataset(flow.utils.data.Dataset):
         return self.samples_mapping.shape[0]
 
     def __getitem__(self, idx):
+        buffers = allocate_sample_buffers(self.max_seq_length, self.max_seq_length_dec)
+        self._fill_sample(idx, buffers)
+        return _buffers_to_instance(buffers)
+
+    def get_batch(self, indices):
+        """Build the samples of ``indices`` directly into batched arrays.
+
+        Returns the same Instance as stacking ``self[idx]`` for every index with
+        `Instance.stack`, but without creating per-sample tensors.
+        """
+        buffers = allocate_sample_buffers(
+            self.max_seq_length, self.max_seq_length_dec, len(indices)
+        )
+        for i, idx in enumerate(indices):
+            self._fill_sample(idx, tuple(buffer[i] for buffer in buffers))
+        return _buffers_to_instance(buffers)
 
+    def _fill_sample(self, idx, out):
         start_index, end_index, seq_length = self.samples_mapping[idx]
-        sample = []
-        for index in range(start_index, end_index):
-            sample.append(self.indexed_dataset[index])
+        # All the sentences of a sample are adjacent, read them at once.
+        tokens, _ = self.indexed_dataset.get_contiguous(start_index, end_index)
         # Note that this rng state should be numpy and not python since
         # python randint is inclusive whereas the numpy one is exclusive.
         np_rng = np.random.RandomState(seed=(self.seed + idx))
-        return build_training_sample(
+        fill_training_sample(
             self.tokenizer,
-            sample,
+            tokens,
             seq_length,
             self.max_seq_length,  # needed for padding
             self.max_seq_length_dec,
@@ -127,9 +146,12 @@ class T5Dataset(flow.utils.data.Dataset):
             self.pad_id,
             self.masked_lm_prob,
             np_rng,
+            out,
             self.bos_id,
             self.eos_id,
             self.sentinel_tokens,
+            start_piece_array=self.start_piece_array,
+            legacy_masking=self.legacy_masking,
         )
 
 
@@ -150,6 +172,8 @@ def build_training_sample(
     bos_id=None,
     eos_id=None,
     sentinel_tokens=None,
+    start_piece_array=None,
+    legacy_masking=False,
 ):
     """Build training sample.
 
@@ -171,16 +195,66 @@ def build_training_sample(
         bos_id: start of decoder example id
         eos_id: end of generation id
         sentinel_tokens: unique value to be substituted for every replaced span
+        start_piece_array: Per-vocab boolean array of the starting word pieces.
+        legacy_masking: Use the original per-token masking loop.
     """
 
-    assert target_seq_length <= max_seq_length
+    # flatten sentences into one array
+    tokens = np.concatenate(sample) if len(sample) > 0 else np.empty(0, dtype=np.int64)
+    buffers = allocate_sample_buffers(max_seq_length, max_seq_length_dec)
+    fill_training_sample(
+        tokenizer,
+        tokens,
+        target_seq_length,
+        max_seq_length,
+        max_seq_length_dec,
+        vocab_id_list,
+        vocab_id_to_token_dict,
+        cls_id,
+        sep_id,
+        mask_id,
+        pad_id,
+        masked_lm_prob,
+        np_rng,
+        buffers,
+        bos_id,
+        eos_id,
+        sentinel_tokens,
+        start_piece_array=start_piece_array,
+        legacy_masking=legacy_masking,
+    )
+    return _buffers_to_instance(buffers)
+
+
+def fill_training_sample(
+    tokenizer,
+    tokens,
+    target_seq_length,
+    max_seq_length,
+    max_seq_length_dec,
+    vocab_id_list,
+    vocab_id_to_token_dict,
+    cls_id,
+    sep_id,
+    mask_id,
+    pad_id,
+    masked_lm_prob,
+    np_rng,
+    out,
+    bos_id=None,
+    eos_id=None,
+    sentinel_tokens=None,
+    start_piece_array=None,
+    legacy_masking=False,
+):
+    """Build a training sample from the flat token array of its sentences into the
+    preallocated arrays ``out``, see `allocate_sample_buffers`.
+    """
 
-    # flatten sentences into one list
-    tokens = [token for sentence in sample for token in sentence]
+    assert target_seq_length <= max_seq_length
 
     # Truncate to `target_sequence_length`.
     max_num_tokens = target_seq_length
-    len(tokens) > max_num_tokens
     tokens = tokens[:max_num_tokens]
 
     # Masking.
@@ -199,18 +273,12 @@ def build_training_sample(
         max_ngrams=10,
         geometric_dist=True,
         masking_style="t5",
+        start_piece_array=start_piece_array,
+        legacy_masking=legacy_masking,
     )
 
     # Padding.
-    (
-        tokens_enc,
-        tokens_dec_in,
-        labels,
-        enc_mask,
-        dec_mask,
-        enc_dec_mask,
-        loss_mask,
-    ) = pad_and_convert_to_numpy(
+    pad_and_convert_to_numpy(
         tokens,
         masked_positions,
         masked_labels,
@@ -221,18 +289,38 @@ def build_training_sample(
         bos_id,
         eos_id,
         sentinel_tokens,
+        out=out,
     )
+    return out
+
 
-    sample = Instance(
-        encoder_input_ids=DistTensorData(tokens_enc),
-        decoder_input_ids=DistTensorData(tokens_dec_in),
-        encoder_attn_mask=DistTensorData(enc_mask),
-        decoder_attn_mask=DistTensorData(dec_mask),
-        encoder_decoder_attn_mask=DistTensorData(enc_dec_mask),
-        lm_labels=DistTensorData(labels, placement_idx=-1),
-        loss_mask=DistTensorData(loss_mask, placement_idx=-1),
+def allocate_sample_buffers(max_seq_length, max_seq_length_dec, batch_size=None):
+    """Allocate the encoder tokens, decoder tokens, labels, encoder mask, decoder mask,
+    encoder-decoder mask and loss mask arrays of one sample, or of ``batch_size`` samples.
+    """
+    batch = () if batch_size is None else (batch_size,)
+    return (
+        np.empty(batch + (max_seq_length,), dtype=np.int64),
+        np.empty(batch + (max_seq_length_dec,), dtype=np.int64),
+        np.empty(batch + (max_seq_length_dec,), dtype=np.int64),
+        np.empty(batch + (max_seq_length, max_seq_length), dtype=bool),
+        np.empty(batch + (max_seq_length_dec, max_seq_length_dec), dtype=bool),
+        np.empty(batch + (max_seq_length_dec, max_seq_length), dtype=bool),
+        np.empty(batch + (max_seq_length_dec,), dtype=bool),
+    )
+
+
+def _buffers_to_instance(buffers):
+    tokens_enc, tokens_dec_in, labels, enc_mask, dec_mask, enc_dec_mask, loss_mask = buffers
+    return Instance(
+        encoder_input_ids=DistTensorData(flow.from_numpy(tokens_enc)),
+        decoder_input_ids=DistTensorData(flow.from_numpy(tokens_dec_in)),
+        encoder_attn_mask=DistTensorData(flow.from_numpy(enc_mask)),
+        decoder_attn_mask=DistTensorData(flow.from_numpy(dec_mask)),
+        encoder_decoder_attn_mask=DistTensorData(flow.from_numpy(enc_dec_mask)),
+        lm_labels=DistTensorData(flow.from_numpy(labels), placement_idx=-1),
+        loss_mask=DistTensorData(flow.from_numpy(loss_mask), placement_idx=-1),
     )
-    return sample
 
 
 def pad_and_convert_to_numpy(
@@ -246,78 +334,76 @@ def pad_and_convert_to_numpy(
     bos_id=None,
     eos_id=None,
     sentinel_tokens=None,
+    out=None,
 ):
-    """Pad sequences and convert them to numpy."""
-
-    sentinel_tokens = collections.deque(sentinel_tokens)
-    t5_input = []
-    (t5_decoder_in, t5_decoder_out) = ([bos_id], [])
-    (start_index, end_index) = (0, None)
-    for span in masked_spans:
-        flag = sentinel_tokens.popleft()
-
-        # Append the same tokens in decoder input and output
-        t5_decoder_in.append(flag)
-        t5_decoder_in.extend(span.label)
-        t5_decoder_out.append(flag)
-        t5_decoder_out.extend(span.label)
+    """Pad sequences and convert them to numpy.
 
-        end_index = span.index[0]
-        t5_input.extend(tokens[start_index:end_index])
-        t5_input.append(flag)
+    Every masked span is replaced by its sentinel in the encoder input, and the
+    decoder input is <bos> followed by the sentinels and the span tokens. The results
+    are written into ``out`` when it is given, see `allocate_sample_buffers`.
+    """
 
-        # the next start index is the token after the last span token
-        start_index = span.index[-1] + 1
+    assert len(masked_positions) == len(masked_labels)
+    assert len(masked_spans) <= len(sentinel_tokens), "not enough sentinel tokens"
+    tokens = np.asarray(tokens, dtype=np.int64)
 
-    # Add <eos> token to the t5_decoder_out
-    t5_decoder_out.append(eos_id)
+    # Encoder-side padding.
+    num_tokens = len(tokens) + sum(
+        1 - (span.index[-1] + 1 - span.index[0]) for span in masked_spans
+    )
+    padding_length = max_seq_length - num_tokens
+    assert padding_length >= 0
 
-    # Add the remaining tokens to the t5 input
-    t5_input.extend(tokens[start_index:])
+    # Decoder-side padding.
+    num_tokens_dec = 1 + sum(1 + len(span.label) for span in masked_spans)
+    padding_length_dec = max_seq_length_dec - num_tokens_dec
+    assert padding_length_dec >= 0
 
-    # assert (len(t5_input) - len(masked_spans)) + \
-    #        (len(t5_decoder_in) - (len(masked_spans) + 1)) == len(tokens)
+    if out is None:
+        out = allocate_sample_buffers(max_seq_length, max_seq_length_dec)
+    tokens_enc, tokens_dec_in, labels, enc_mask, dec_mask, enc_dec_mask, loss_mask = out
 
-    # Some checks.
+    # Tokens.
+    tokens_dec_in[0] = bos_id
+    (enc_index, dec_index, start_index) = (0, 1, 0)
+    for flag, span in zip(sentinel_tokens, masked_spans):
+        # Copy the tokens before the span and its sentinel to the encoder input
+        end_index = span.index[0]
+        length = end_index - start_index
+        tokens_enc[enc_index : enc_index + length] = tokens[start_index:end_index]
+        tokens_enc[enc_index + length] = flag
+        enc_index += length + 1
 
-    # Encoder-side padding mask.
-    num_tokens = len(t5_input)
-    padding_length = max_seq_length - num_tokens
-    assert padding_length >= 0
-    assert len(masked_positions) == len(masked_labels)
+        # The sentinel and the span tokens to the decoder input
+        length = len(span.label)
+        tokens_dec_in[dec_index] = flag
+        tokens_dec_in[dec_index + 1 : dec_index + 1 + length] = span.label
+        dec_index += length + 1
 
-    # Tokens..
-    filler = [pad_id] * padding_length
-    tokens_enc = np.array(t5_input + filler, dtype=np.int64)
+        # the next start index is the token after the last span token
+        start_index = span.index[-1] + 1
 
-    # Decoder-side padding mask.
-    num_tokens_dec = len(t5_decoder_in)
-    padding_length_dec = max_seq_length_dec - num_tokens_dec
-    assert padding_length_dec >= 0
-    filler_dec = [pad_id] * padding_length_dec
-    tokens_dec_in = np.array(t5_decoder_in + filler_dec, dtype=np.int64)
+    # Add the remaining tokens to the t5 input
+    tokens_enc[enc_index:num_tokens] = tokens[start_index:]
+    tokens_enc[num_tokens:] = pad_id
+    tokens_dec_in[num_tokens_dec:] = pad_id
 
     # Create attention masks
-    enc_mask = make_attention_mask(tokens_enc, tokens_enc)
-    enc_dec_mask = make_attention_mask(tokens_dec_in, tokens_enc)
-    dec_mask = make_attention_mask(tokens_dec_in, tokens_dec_in)
-    dec_mask = dec_mask * make_history_mask(tokens_dec_in)
-
-    # Labels mask.
-    labels = t5_decoder_out + ([-1] * padding_length_dec)
-    labels = np.array(labels, dtype=np.int64)
+    enc_valid = tokens_enc >= 1
+    dec_valid = tokens_dec_in >= 1
+    np.logical_and(enc_valid[None, :], enc_valid[:, None], out=enc_mask)
+    np.logical_and(enc_valid[None, :], dec_valid[:, None], out=enc_dec_mask)
+    np.logical_and(dec_valid[None, :], dec_valid[:, None], out=dec_mask)
+    np.logical_and(dec_mask, np.tri(max_seq_length_dec, dtype=bool), out=dec_mask)
+
+    # Labels, the decoder input shifted left with <eos> added at the end.
+    labels[: num_tokens_dec - 1] = tokens_dec_in[1:num_tokens_dec]
+    labels[num_tokens_dec - 1] = eos_id
+    labels[num_tokens_dec:] = -1
 
     # Loss mask
-    loss_mask = ([1] * num_tokens_dec) + ([0] * padding_length_dec)
-    loss_mask = np.array(loss_mask, dtype=bool)
-
-    tokens_enc = flow.tensor(tokens_enc, dtype=flow.long)
-    tokens_dec_in = flow.tensor(tokens_dec_in, dtype=flow.long)
-    labels = flow.tensor(labels, dtype=flow.long)
-    enc_mask = flow.tensor(enc_mask, dtype=flow.bool)
-    dec_mask = flow.tensor(dec_mask, dtype=flow.bool)
-    enc_dec_mask = flow.tensor(enc_dec_mask, dtype=flow.bool)
-    loss_mask = flow.tensor(loss_mask, dtype=flow.bool)
+    loss_mask[:num_tokens_dec] = True
+    loss_mask[num_tokens_dec:] = False
 
     return tokens_enc, tokens_dec_in, labels, enc_mask, dec_mask, enc_dec_mask, loss_mask
 
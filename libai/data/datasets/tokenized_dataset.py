@@ -0,0 +1,233 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fine-tuning datasets tokenized once into indexed files."""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import oneflow as flow
+
+from libai.data.data_utils.dataset_utils import is_shared_folder
+from libai.data.data_utils.indexed_dataset import (
+    MMapIndexedDataset,
+    MMapIndexedDatasetBuilder,
+    data_file_path,
+    index_file_path,
+)
+from libai.utils import distributed as dist
+
+logger = logging.getLogger(__name__)
+
+
+# wrapped tokenizers whose settings change the token ids too, e.g. the basic tokenizer of Bert
+_SUB_TOKENIZERS = ("tokenizer", "basic_tokenizer", "wordpiece_tokenizer")
+
+
+def _tokenizer_settings(tokenizer, digest, depth=2):
+    """Hashes the class of ``tokenizer`` and its scalar settings, e.g. ``do_lower_case`` and
+    the special tokens and their ids, and those of its sub-tokenizers."""
+    digest.update(type(tokenizer).__name__.encode())
+    for name, value in sorted(vars(tokenizer).items()):
+        if isinstance(value, (bool, int, float, str, type(None))):
+            digest.update(f"{name}={value!r};".encode())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            digest.update(f"{name}={sorted(str(v) for v in value)};".encode())
+        elif name in _SUB_TOKENIZERS and depth > 0:
+            _tokenizer_settings(value, digest, depth - 1)
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Digest of what the token ids of ``tokenizer`` depend on: its class, its vocabulary,
+    its casing and its special tokens."""
+    try:
+        vocab = tokenizer.get_vocab()
+    except (AttributeError, NotImplementedError):
+        vocab = dict(getattr(tokenizer, "vocab", {}))
+        vocab.update(getattr(tokenizer, "added_tokens_encoder", {}))
+    digest = hashlib.sha1()
+    for token, idx in sorted(vocab.items(), key=lambda item: (item[1], item[0])):
+        digest.update(f"{token}\t{idx}\n".encode())
+    _tokenizer_settings(tokenizer, digest)
+    return digest.hexdigest()[:16]
+
+
+def pad_item(item, length, pad_value=0, dtype=np.int64):
+    """Copies ``item`` into a new array of ``length`` elements padded with ``pad_value``."""
+    padded = np.full(length, pad_value, dtype=dtype)
+    padded[: len(item)] = item[:length]
+    return padded
+
+
+# The encoder of the examples, set once in every worker of the pool instead of being
+# pickled with every chunk of examples.
+_encoder = None
+
+
+def _init_encoder(encoder):
+    global _encoder
+    _encoder = encoder
+
+
+def _encode(example):
+    return _encoder(example)
+
+
+class TokenizedDataset(flow.utils.data.Dataset):
+    """Tokenized fields of the examples of a fine-tuning dataset, in ``.bin``/``.idx`` files.
+
+    Every field is a :class:`MMapIndexedDataset` at ``{prefix}_{field}`` whose item ``i``
+    belongs to example ``i``. Items are read as numpy views of the mapped files, and the
+    dataset pickles as its paths, so that the workers of a data loader share the page
+    cache of the files instead of receiving copies of Python lists.
+
+    Use :func:`build_tokenized_dataset` to tokenize the examples once and load the cache.
+
+    Args:
+        prefix (str): path prefix of the files.
+        fields (dict): name and numpy dtype of every field, e.g.
+            ``{"input_ids": np.int32, "labels": np.int64}``.
+    """
+
+    def __init__(self, prefix, fields):
+        self.prefix = prefix
+        self.fields = dict(fields)
+        self.datasets = {
+            field: MMapIndexedDataset(self.field_prefix(prefix, field), skip_warmup=True)
+            for field in self.fields
+        }
+        sizes = {len(dataset) for dataset in self.datasets.values()}
+        assert len(sizes) == 1, f"fields of {prefix} have different numbers of examples"
+
+    @staticmethod
+    def field_prefix(prefix, field):
+        return f"{prefix}_{field}"
+
+    @classmethod
+    def exists(cls, prefix, fields):
+        return all(MMapIndexedDataset.exists(cls.field_prefix(prefix, field)) for field in fields)
+
+    @classmethod
+    def build(cls, prefix, examples, encoder, fields, num_workers=None, chunksize=256):
+        """Tokenizes ``examples`` with a pool of ``num_workers`` processes into the files of
+        ``prefix``.
+
+        ``encoder`` maps an example to a dict of a sequence, or None for an empty item, for
+        every field. It must be picklable, e.g. an object holding the tokenizer. The files
+        are written under temporary names and renamed at the end, so that an interrupted
+        build never leaves a cache which looks complete.
+        """
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        tmp_prefix = f"{prefix}.tmp{os.getpid()}"
+        builders = {
+            field: MMapIndexedDatasetBuilder(
+                data_file_path(cls.field_prefix(tmp_prefix, field)), dtype=dtype
+            )
+            for field, dtype in fields.items()
+        }
+
+        start = time.time()
+        if num_workers > 1:
+            pool = multiprocessing.Pool(num_workers, initializer=_init_encoder, initargs=(encoder,))
+            encoded = pool.imap(_encode, examples, chunksize)
+        else:
+            pool = None
+            encoded = map(encoder, examples)
+        num_examples = 0
+        for item in encoded:
+            for field, builder in builders.items():
+                value = item.get(field)
+                builder.add_item([] if value is None else value)
+            num_examples += 1
+            if num_examples % 100000 == 0:
+                logger.info(f"  > tokenized {num_examples} examples so far ...")
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        for field, builder in builders.items():
+            tmp_field_prefix = cls.field_prefix(tmp_prefix, field)
+            field_prefix = cls.field_prefix(prefix, field)
+            builder.end_document()
+            builder.finalize(index_file_path(tmp_field_prefix))
+            os.replace(data_file_path(tmp_field_prefix), data_file_path(field_prefix))
+            os.replace(index_file_path(tmp_field_prefix), index_file_path(field_prefix))
+        logger.info(
+            f"Tokenized {num_examples} examples into {prefix} with {num_workers} workers "
+            f"[took {time.time() - start:.3f} s]"
+        )
+
+    def __len__(self):
+        return len(next(iter(self.datasets.values())))
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        return {field: dataset[idx] for field, dataset in self.datasets.items()}
+
+    def get(self, field, idx):
+        return self.datasets[field][int(idx)]
+
+    def sizes(self, field):
+        """Length of the item of ``field`` of every example, read from the index only."""
+        return self.datasets[field].sizes
+
+
+def build_tokenized_dataset(
+    prefix,
+    fields,
+    read_examples,
+    encoder,
+    num_workers=None,
+    overwrite_cache=False,
+):
+    """Loads the :class:`TokenizedDataset` at ``prefix``, tokenizing the examples first if
+    the files do not exist yet.
+
+    Only one process per node, or one in total for a shared folder, builds the files while
+    the others wait for it, like the index mappings of the pretraining datasets.
+
+    Args:
+        prefix (str): path prefix of the files, usually named with
+            :func:`libai.utils.file_io.fingerprint`.
+        fields (dict): name and numpy dtype of every field.
+        read_examples (callable): returns the raw examples, only called to build the files.
+        encoder (callable): maps an example to a dict of its tokenized fields.
+        num_workers (int, optional): number of tokenizing processes. Defaults to None,
+            meaning the number of CPUs.
+        overwrite_cache (bool): rebuild the files even if they exist. Defaults to False.
+    """
+    folder = os.path.dirname(os.path.abspath(prefix))
+    os.makedirs(folder, exist_ok=True)
+    # NOTE: use `get_local_rank() == 0` to promise the files will be built in each node.
+    # use `get_rank() == 0` to promise the files will be built only once for a shared folder.
+    cur_rank = flow.env.get_rank() if is_shared_folder(folder) else flow.env.get_local_rank()
+    if cur_rank == 0:
+        if overwrite_cache or not TokenizedDataset.exists(prefix, fields):
+            logger.info(f" > could not find tokenized files {prefix}, building them ...")
+            TokenizedDataset.build(prefix, read_examples(), encoder, fields, num_workers)
+    dist.synchronize()
+
+    start = time.time()
+    dataset = TokenizedDataset(prefix, fields)
+    logger.info(
+        f"Loaded {len(dataset)} tokenized examples from {prefix} "
+        f"[took {time.time() - start:.3f} s]"
+    )
+    return dataset
@@ -13,9 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+import logging
+
+import numpy as np
 import oneflow as flow
 from oneflow.utils.data import Sampler
 
+from libai.data.structures import DistTensorData
+
+logger = logging.getLogger(__name__)
+
 
 class CyclicSampler(Sampler):
     """
@@ -32,6 +40,9 @@ class CyclicSampler(Sampler):
         data_parallel_rank: local rank for data parallelism.
         data_parallel_size: the size of data parallelism.
         seed: random seed, used for reproducing experiments (default: ``0``).
+
+    Datasets with a true ``supports_epoch_index`` attribute are indexed with
+    ``(epoch, index)`` pairs instead of indices.
     """
 
     def __init__(
@@ -80,18 +91,20 @@ class CyclicSampler(Sampler):
                 seq_idx = flow.arange(self.data_size_per_epoch).tolist()
                 indices = [start_idx + x for x in seq_idx[bucket_offset:]]
 
-            epoch += 1
-
             if hasattr(self.dataset, "supports_prefetch") and self.dataset.supports_prefetch:
                 self.dataset.prefetch(indices)
 
+            # datasets drawing random numbers per sample, e.g. the noise of T5 span corruption,
+            # are given the epoch too, so that the samples are the same across workers and resumes
+            with_epoch = getattr(self.dataset, "supports_epoch_index", False)
             for idx in indices:
-                batch.append(idx)
+                batch.append((epoch, idx) if with_epoch else idx)
                 if len(batch) == self.micro_batch_size:
                     self.consumed_samples += self.actual_batch_size
                     yield batch
                     batch = []
 
+            epoch += 1
             current_epoch_samples = 0
 
     def __len__(self):
@@ -183,3 +196,154 @@ class SingleRoundSampler(Sampler):
             return self.data_size // global_batch_size
         else:
             return (self.data_size + global_batch_size - 1) // global_batch_size
+
+
+def get_bucket_index(length, bucket_boundaries):
+    """Returns the index of the smallest boundary not less than ``length``,
+    or ``len(bucket_boundaries)`` for lengths beyond the last boundary.
+    """
+    return bisect.bisect_left(bucket_boundaries, length)
+
+
+def get_sequence_length(instance, length_keys=("attention_mask",), pad_value=0):
+    """Returns the number of positions of ``instance`` up to the last non padding one,
+    along the last dim of the ``length_keys`` fields. Works for a single sample and
+    for a stacked batch, where it returns the longest length of the batch.
+    """
+    length = 0
+    for key in length_keys:
+        value = instance.get(key)
+        tensor = value.tensor if isinstance(value, DistTensorData) else value
+        array = tensor.numpy()
+        non_pad = (array.reshape(-1, array.shape[-1]) != pad_value).any(axis=0).nonzero()[0]
+        if len(non_pad) > 0:
+            length = max(length, int(non_pad[-1]) + 1)
+    return length
+
+
+class LengthBucketSampler(CyclicSampler):
+    """
+    This sampler groups samples of similar length into the same global batch, so that
+    :class:`libai.data.build.BucketPaddingCollator` can trim their padding to the
+    boundary of their bucket. It keeps cyclic sampling, data parallel partitioning and
+    resuming from ``consumed_samples`` like :class:`CyclicSampler`.
+
+    Every epoch, samples are shuffled with ``seed + epoch``, split into buckets by length,
+    each bucket is cut into global batches, and the order of the global batches is
+    shuffled again. Data parallel rank ``i`` takes the ``i``-th micro batch of every
+    global batch, so all ranks trim to the same length. The remainder of every bucket
+    that does not fill a global batch is dropped for this epoch.
+
+    Arguments:
+        dataset: dataset to be sampled.
+        micro_batch_size: batch size for per model instance.
+        global_batch_size is micro_batch_size times data_parallel_size.
+        shuffle: whether to shuffle the dataset.
+        consumed_samples: the number of samples that have been trained at the current time,
+            used for resuming training (default: ``0``).
+        data_parallel_rank: local rank for data parallelism.
+        data_parallel_size: the size of data parallelism.
+        seed: random seed, used for reproducing experiments (default: ``0``).
+        bucket_boundaries: ascending upper bounds of the sample lengths of each bucket,
+            longer samples form one more bucket (default: ``(16, 32, 64, 128, 256)``).
+        lengths: length of every sample (default: ``None``, meaning
+            ``dataset.get_lengths()`` if the dataset has it, otherwise the lengths are
+            computed with :func:`get_sequence_length` by reading every sample once).
+        length_keys: fields to compute the lengths from (default: ``("attention_mask",)``).
+        pad_value: padding value of the ``length_keys`` fields (default: ``0``).
+    """
+
+    def __init__(
+        self,
+        dataset,
+        micro_batch_size,
+        shuffle=True,
+        consumed_samples=0,
+        data_parallel_rank=0,
+        data_parallel_size=1,
+        seed=0,
+        bucket_boundaries=(16, 32, 64, 128, 256),
+        lengths=None,
+        length_keys=("attention_mask",),
+        pad_value=0,
+    ):
+        super().__init__(
+            dataset,
+            micro_batch_size,
+            shuffle=shuffle,
+            consumed_samples=consumed_samples,
+            data_parallel_rank=data_parallel_rank,
+            data_parallel_size=data_parallel_size,
+            seed=seed,
+        )
+        self.bucket_boundaries = tuple(sorted(bucket_boundaries))
+        if lengths is None:
+            if hasattr(dataset, "get_lengths"):
+                lengths = dataset.get_lengths()
+            else:
+                logger.info("Computing the sample lengths for length bucketing")
+                lengths = [
+                    get_sequence_length(dataset[i], length_keys, pad_value)
+                    for i in range(self.data_size)
+                ]
+        assert len(lengths) == self.data_size, "lengths must match the size of the dataset"
+        self.bucket_ids = np.array(
+            [get_bucket_index(length, self.bucket_boundaries) for length in lengths],
+            dtype=np.int64,
+        )
+
+        bucket_sizes = np.bincount(self.bucket_ids, minlength=len(self.bucket_boundaries) + 1)
+        num_batches = (bucket_sizes // self.actual_batch_size).sum()
+        if num_batches == 0:
+            raise ValueError(
+                "No bucket has enough samples for a global batch of "
+                f"{self.actual_batch_size}, please use fewer bucket boundaries"
+            )
+        # `consumed_samples` counts the samples of all data parallel ranks
+        self.data_size_per_epoch = int(num_batches) * self.actual_batch_size
+        logger.info(
+            f"Length bucketing uses {self.data_size_per_epoch} of {self.data_size} samples "
+            f"per epoch, bucket sizes: {bucket_sizes.tolist()}"
+        )
+
+    def get_global_batches(self, epoch):
+        """Returns the global batches of ``epoch``, every one from a single bucket."""
+        generator = flow.Generator()
+        generator.manual_seed(self.seed + epoch)
+        if self.shuffle:
+            order = flow.randperm(self.data_size, generator=generator).numpy()
+        else:
+            order = np.arange(self.data_size)
+
+        batches = []
+        for bucket in range(len(self.bucket_boundaries) + 1):
+            indices = order[self.bucket_ids[order] == bucket]
+            num_samples = len(indices) // self.actual_batch_size * self.actual_batch_size
+            batches.extend(indices[:num_samples].reshape(-1, self.actual_batch_size).tolist())
+
+        if self.shuffle:
+            batch_order = flow.randperm(len(batches), generator=generator).tolist()
+            batches = [batches[i] for i in batch_order]
+        return batches
+
+    def __iter__(self):
+        epoch = self.consumed_samples // self.data_size_per_epoch
+        current_epoch_samples = self.consumed_samples % self.data_size_per_epoch
+        start_idx = self.data_parallel_rank * self.micro_batch_size
+
+        while True:
+            batch_offset = current_epoch_samples // self.actual_batch_size
+            batches = [
+                global_batch[start_idx : start_idx + self.micro_batch_size]
+                for global_batch in self.get_global_batches(epoch)[batch_offset:]
+            ]
+            epoch += 1
+
+            if hasattr(self.dataset, "supports_prefetch") and self.dataset.supports_prefetch:
+                self.dataset.prefetch([idx for batch in batches for idx in batch])
+
+            for batch in batches:
+                self.consumed_samples += self.actual_batch_size
+                yield batch
+
+            current_epoch_samples = 0
@@ -19,6 +19,7 @@ import math
 import os
 import time
 from collections import OrderedDict
+from contextlib import nullcontext
 from typing import Callable, Optional
 
 import oneflow as flow
@@ -416,19 +417,36 @@ class DefaultTrainer(TrainerBase):
         ret = [
             hooks.IterationTimer(),
             hooks.LRScheduler(),  # for beauty lr scheduler printer in `nn.Graph` mode
+        ]
+
+        ema_hook = None
+        if try_get_key(self.cfg, "train.model_ema.enabled", default=False):
+            ema_cfg = self.cfg.train.model_ema
+            ema_hook = hooks.ModelEMA(
+                momentum=ema_cfg.momentum,
+                schedule=ema_cfg.schedule,
+                update_period=ema_cfg.update_period,
+            )
+            # update the average before the checkpointer saves it, so that a resumed run
+            # starts from the average of the iteration the checkpoint was saved at
+            ret.append(ema_hook)
+
+        ret.append(
             hooks.PeriodicCheckpointer(
                 self.checkpointer,
                 self.cfg.train.checkpointer.period,
                 max_to_keep=self.cfg.train.checkpointer.max_to_keep,
-            ),
-        ]
+            )
+        )
 
         if self.cfg.train.evaluation.enabled:
             assert self.cfg.train.evaluation.eval_iter > 0, "run_iter must be positive number"
+            eval_with_ema = ema_hook is not None and self.cfg.train.model_ema.eval_with_ema
 
             def test_and_save_results():
                 model = self.graph_eval if self.cfg.graph.enabled else self.model
-                self._last_eval_results = self.test(self.cfg, self.test_loader, model)
+                with ema_hook.average_parameters() if eval_with_ema else nullcontext():
+                    self._last_eval_results = self.test(self.cfg, self.test_loader, model)
                 return self._last_eval_results
 
             ret.append(hooks.EvalHook(self.cfg.train.evaluation.eval_period, test_and_save_results))
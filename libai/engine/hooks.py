@@ -18,8 +18,10 @@ import datetime
 import logging
 import math
 import operator
+import os
 import time
-from collections import Counter
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 
 import oneflow as flow
 
@@ -27,6 +29,7 @@ from libai.evaluation import flatten_results_dict
 from libai.utils import distributed as dist
 from libai.utils.checkpoint import Checkpointer
 from libai.utils.checkpoint import PeriodicCheckpointer as _PeriodicCheckpointer
+from libai.utils.ema import MOMENTUM_SCHEDULES, MultiTensorEMA
 from libai.utils.events import EventWriter
 from libai.utils.timer import Timer
 
@@ -415,3 +418,94 @@ class LRScheduler(HookBase):
         if isinstance(self.scheduler, flow.optim.lr_scheduler._LRScheduler):
             logger.info("Loading scheduler from state_dict ...")
             self.scheduler.load_state_dict(state_dict)
+
+
+class ModelEMA(HookBase):
+    """
+    Keep an exponential moving average (EMA) of the model weights, i.e. its parameters
+    and floating point buffers, updated every ``update_period`` iterations.
+    The average is saved and resumed with the checkpoints under the ``model_ema`` key,
+    and :meth:`average_parameters` loads it into the model temporarily, e.g. to run
+    :class:`EvalHook` with the averaged weights.
+    """
+
+    def __init__(
+        self,
+        momentum=0.9999,
+        schedule="warmup",
+        update_period=1,
+        checkpointer=None,
+        **schedule_kwargs,
+    ):
+        """
+        Args:
+            momentum (float): weight of the previous average in every update.
+            schedule (str): schedule of the momentum over iterations, one of the keys of
+                :data:`libai.utils.ema.MOMENTUM_SCHEDULES`.
+            update_period (int): the period to update the average.
+            checkpointer (Checkpointer): saves the average, defaults to the checkpointer
+                of the trainer.
+            schedule_kwargs: extra arguments of the schedule, e.g. ``tau`` of ``"warmup"``.
+        """
+        assert schedule in MOMENTUM_SCHEDULES, f"unknown momentum schedule {schedule}"
+        self._momentum = momentum
+        self._schedule = MOMENTUM_SCHEDULES[schedule]
+        self._schedule_kwargs = schedule_kwargs
+        self._period = update_period
+        self._checkpointer = checkpointer
+
+    def before_train(self):
+        model = self.trainer.model
+        weights = OrderedDict(model.named_parameters())
+        # skip the non-persistent buffers, e.g. caches of inference mode
+        persistent = set(model.state_dict().keys())
+        for name, buffer in model.named_buffers():
+            if name in persistent and buffer.is_floating_point():
+                weights[name] = buffer
+        with flow.no_grad():
+            self._averages = OrderedDict(
+                (name, weight.detach().clone()) for name, weight in weights.items()
+            )
+        self.ema = MultiTensorEMA(self._averages.values(), weights.values())
+
+        checkpointer = self._checkpointer or getattr(self.trainer, "checkpointer", None)
+        if checkpointer is None:
+            return
+        checkpointer.checkpointables["model_ema"] = self
+        # the trainer resumed before the hooks were built, load the average here
+        if self.trainer.start_iter > 0 and checkpointer.has_checkpoint():
+            path = os.path.join(checkpointer.get_checkpoint_file(), "model_ema")
+            if checkpointer.path_manager.exists(path):
+                logger.info(f"Loading model_ema from {path}")
+                self.load_state_dict(flow.load(path, global_src_rank=0))
+
+    def after_step(self):
+        next_iter = self.trainer.iter + 1
+        if next_iter % self._period == 0:
+            momentum = self._schedule(
+                next_iter, self._momentum, max_step=self.trainer.max_iter, **self._schedule_kwargs
+            )
+            self.ema.update(momentum)
+
+    @contextmanager
+    def average_parameters(self):
+        """Loads the average into the model within the context, then restores it."""
+        self.ema.swap()
+        try:
+            yield
+        finally:
+            self.ema.swap()
+
+    def state_dict(self):
+        return OrderedDict(self._averages)
+
+    @flow.no_grad()
+    def load_state_dict(self, state_dict):
+        for name, average in self._averages.items():
+            if name not in state_dict:
+                logger.warning(f"{name} is not found in the model_ema state_dict")
+                continue
+            value = state_dict[name]
+            if average.is_global:
+                value = value.to_global(placement=average.placement, sbp=average.sbp)
+            average.copy_(value)
@@ -21,6 +21,12 @@ import oneflow as flow
 
 from libai.config import LazyConfig, try_get_key
 from libai.engine import DefaultTrainer
+from libai.inference.utils.graph_cache import (
+    DEFAULT_BATCH_BUCKETS,
+    DEFAULT_SEQ_BUCKETS,
+    GraphCache,
+    checkpoint_fingerprint,
+)
 from libai.utils import distributed as dist
 from libai.utils.logger import setup_logger
 
@@ -31,6 +37,14 @@ logger = logging.getLogger("libai.inference")
 class BasePipeline(metaclass=ABCMeta):
     """
     Base class for all task pipeline
+
+    Set ``use_graph=True`` to run :meth:`run_model` through eval ``nn.Graph`` s compiled
+    per (batch bucket, sequence bucket), see :class:`~libai.inference.utils.graph_cache.GraphCache`.
+    With ``graph_cache_dir`` the compiled plans are saved and reused by later processes.
+
+    ``device_type`` overrides ``train.dist.device_type`` of the config, e.g. ``"cpu"`` to run a
+    pipeline on a host without GPUs. The model, the inputs built by :meth:`preprocess` and the
+    tensors created during generation are all placed on this device type.
     """
 
     def __init__(
@@ -43,10 +57,17 @@ class BasePipeline(metaclass=ABCMeta):
         pipeline_num_layers=None,
         model_path=None,
         mode="libai",
+        use_graph=False,
+        graph_cache_dir=None,
+        batch_buckets=DEFAULT_BATCH_BUCKETS,
+        seq_buckets=DEFAULT_SEQ_BUCKETS,
+        device_type=None,
         **kwargs,
     ):
         # init cfg
         self.cfg = LazyConfig.load(config_file)
+        if device_type is not None:
+            self.cfg.train.dist.device_type = device_type
         flow.boxing.nccl.set_fusion_threshold_mbytes(
             try_get_key(self.cfg, "train.nccl_fusion_threshold_mb", default=16)
         )
@@ -76,6 +97,20 @@ class BasePipeline(metaclass=ABCMeta):
             self.tokenizer = None
         self.tokenizer = dist.broadcast_py_object(self.tokenizer, src=0)
 
+        # compiled eval graphs used by `run_model`
+        self.graph_cache = None
+        if use_graph:
+            checkpoint = model_path and checkpoint_fingerprint(model_path)
+            cache_key = f"{self.cfg.model}|{mode}|{checkpoint}"
+            self.graph_cache = GraphCache(
+                self.model,
+                cache_key=cache_key,
+                cache_dir=graph_cache_dir,
+                batch_buckets=batch_buckets,
+                seq_buckets=seq_buckets,
+                seq_pad_values=self.graph_seq_pad_values(),
+            )
+
         # set parameters
         (
             self._preprocess_params,
@@ -137,6 +172,23 @@ class BasePipeline(metaclass=ABCMeta):
             tokenizer = DefaultTrainer.build_tokenizer(cfg)
         return tokenizer
 
+    @property
+    def placement(self):
+        """Placement of the model inputs, the one of the first layer of the model."""
+        return dist.get_layer_placement(0)
+
+    def graph_seq_pad_values(self):
+        """Model inputs with a sequence dim and their padding value, used to pad the inputs
+        to the sequence buckets of the compiled graphs.
+        """
+        return {}
+
+    def run_model(self, **model_inputs):
+        """Runs the model forward, through the compiled graphs when ``use_graph`` is set."""
+        if self.graph_cache is not None:
+            return self.graph_cache(**model_inputs)
+        return self.model(**model_inputs)
+
     @abstractmethod
     def _parse_parameters(self, **pipeline_parameters):
         raise NotImplementedError("_parse_parameters not implemented")
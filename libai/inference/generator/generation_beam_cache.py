@@ -0,0 +1,157 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import oneflow as flow
+
+from libai.utils import distributed as dist
+
+
+class BeamIndex:
+    """
+    Parent pointers of the hypotheses of beam search, read by attention layers instead of
+    reordering their key/value cache at every step.
+
+    During beam search the cached states of every position stay in the row of the beam which
+    computed them. The rows of the cache are in beam major order, row ``beam * batch_size + i``
+    holding the states of beam ``beam`` of batch element ``i``, see :meth:`to_beam_major`.
+    ``history[n, t]`` is the beam whose row holds position ``t`` of hypothesis ``n``, so that
+    :meth:`reorder` only gathers the rows of this (batch_size * num_beams, length) int tensor
+    when beam search picks the next hypotheses.
+
+    Attention layers score the queries of every hypothesis against the keys of all beams of its
+    batch element and keep the scores of the beams given by ``history``, see
+    :meth:`attention_scores` and :meth:`context`. This costs ``num_beams`` times the flops of the
+    scores, but saves the gather of the whole key/value cache along the beams at every step.
+    The layers still concatenate the new keys and values to their cache, and the small
+    ``history`` tensor is still concatenated and gathered at every step.
+
+    Args:
+        num_beams (int): number of beams of every batch element.
+    """
+
+    def __init__(self, num_beams: int):
+        self.num_beams = num_beams
+        self.history = None
+
+    def to_beam_major(self, x: flow.Tensor):
+        """Reorders the rows of ``x`` from ``i * num_beams + beam`` to ``beam * batch_size + i``."""
+        batch_size = x.shape[0] // self.num_beams
+        x = x.view(batch_size, self.num_beams, *x.shape[1:]).transpose(0, 1)
+        return x.reshape(self.num_beams * batch_size, *x.shape[2:])
+
+    def from_beam_major(self, x: flow.Tensor):
+        """Inverse of :meth:`to_beam_major`."""
+        batch_size = x.shape[0] // self.num_beams
+        x = x.view(self.num_beams, batch_size, *x.shape[1:]).transpose(0, 1)
+        return x.reshape(self.num_beams * batch_size, *x.shape[2:])
+
+    def _slots(self, batch_beam_size, length, placement):
+        """
+        Beam holding every position of every hypothesis. The positions cached after the last
+        call of :meth:`reorder` are held by the beam of the hypothesis itself.
+        """
+        beams = flow.arange(
+            batch_beam_size,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=placement,
+        )
+        past_length = 0 if self.history is None else self.history.shape[1]
+        slots = (beams % self.num_beams).unsqueeze(1).expand(batch_beam_size, length - past_length)
+        if self.history is not None:
+            slots = flow.cat([self.history.to_global(placement=placement), slots], dim=1)
+        return slots
+
+    def reorder(self, past_key_values, beam_idx: flow.Tensor, num_states=2, length_dim=2):
+        """
+        Picks the parent pointers of the hypotheses ``beam_idx``. On the first call after the
+        prompt was processed, the first ``num_states`` cached states of every layer are moved to
+        beam major order once. Every layer of ``past_key_values`` is a tuple of states, or the
+        state itself.
+
+        Returns:
+            the cache to pass to the next step.
+        """
+        if self.history is None:
+            past_key_values = tuple(
+                self.to_beam_major(layer_past)
+                if isinstance(layer_past, flow.Tensor)
+                else tuple(self.to_beam_major(state) for state in layer_past[:num_states])
+                + tuple(layer_past[num_states:])
+                for layer_past in past_key_values
+            )
+        state = past_key_values[0]
+        state = state if isinstance(state, flow.Tensor) else state[0]
+        self.select(beam_idx, state.shape[length_dim])
+        return past_key_values
+
+    def select(self, beam_idx: flow.Tensor, length: int):
+        """
+        Picks the parent pointers of the hypotheses ``beam_idx`` for a cache of ``length``
+        positions already in beam major order, for caches :meth:`reorder` does not know about.
+        """
+        slots = self._slots(beam_idx.shape[0], length, beam_idx.placement)
+        self.history = slots.index_select(0, beam_idx)
+
+    def _group(self, x: flow.Tensor):
+        """(batch_size * beams, heads, length, dim) -> (batch_size, heads, beams * length, dim)"""
+        batch_size = x.shape[0] // self.num_beams
+        x = x.view(batch_size, self.num_beams, *x.shape[1:]).transpose(1, 2)
+        return x.reshape(batch_size, x.shape[1], -1, x.shape[-1])
+
+    def _ungroup(self, x: flow.Tensor):
+        """Inverse of :meth:`_group`."""
+        batch_size, num_heads = x.shape[:2]
+        x = x.view(batch_size, num_heads, self.num_beams, -1, x.shape[-1]).transpose(1, 2)
+        return x.reshape(batch_size * self.num_beams, num_heads, -1, x.shape[-1])
+
+    def _group_slots(self, key: flow.Tensor, query_length: int):
+        """Beam holding every key of the grouped scores, (batch_size, 1, beams * queries, keys)"""
+        batch_beam_size, length = key.shape[0], key.shape[2]
+        slots = self._slots(batch_beam_size, length, key.placement)
+        slots = slots.reshape(-1, self.num_beams, 1, length)
+        slots = slots.expand(slots.shape[0], self.num_beams, query_length, length)
+        return slots.reshape(slots.shape[0], 1, -1, length)
+
+    def attention_scores(self, query: flow.Tensor, key: flow.Tensor, alpha=1.0):
+        """
+        Attention scores of ``query`` of shape (batch_size * num_beams, heads, queries, dim)
+        against the cached ``key`` of shape (batch_size * num_beams, heads, keys, dim) in beam
+        major order, in the same layout as ``flow.matmul(query, key, transpose_b=True)`` on a
+        reordered cache.
+        """
+        slots = self._group_slots(key, query.shape[2])
+        query = self._group(query)
+        scores = None
+        for beam, beam_key in enumerate(flow.chunk(key, self.num_beams, dim=0)):
+            beam_scores = flow.matmul(query, beam_key, transpose_b=True, alpha=alpha)
+            if scores is None:
+                scores = beam_scores
+            else:
+                scores = flow.where((slots == beam).expand_as(scores), beam_scores, scores)
+        return self._ungroup(scores)
+
+    def context(self, attention_weights: flow.Tensor, value: flow.Tensor):
+        """
+        Weighted sum of the cached ``value`` in beam major order, the counterpart of
+        ``flow.matmul(attention_weights, value)`` on a reordered cache.
+        """
+        slots = self._group_slots(value, attention_weights.shape[2])
+        attention_weights = self._group(attention_weights)
+        context = None
+        for beam, beam_value in enumerate(flow.chunk(value, self.num_beams, dim=0)):
+            beam_weights = attention_weights * (slots == beam).to(attention_weights.dtype)
+            beam_context = flow.matmul(beam_weights, beam_value)
+            context = beam_context if context is None else context + beam_context
+        return self._ungroup(context)
@@ -38,56 +38,19 @@ class BeamScorer(ABC):
         raise NotImplementedError("This is an abstract method.")
 
 
-class BeamHypotheses:
-    def __init__(self, num_beams: int, length_penalty: float, early_stopping: bool):
-        """
-        Initialize n-best list of hypotheses.
-        """
-        self.length_penalty = length_penalty
-        self.early_stopping = early_stopping
-        self.num_beams = num_beams
-        self.beams = []
-        self.worst_score = 1e9
-
-    def __len__(self) -> int:
-        """
-        Number of hypotheses in the list.
-        """
-        return len(self.beams)
-
-    def add(
-        self, hyp: flow.Tensor, sum_logprobs: float, beam_indices: Optional[flow.Tensor] = None
-    ):
-        """
-        Add a new hypothesis to the list.
-        """
-        score = sum_logprobs / (hyp.shape[-1] ** self.length_penalty)
-        if len(self) < self.num_beams or score > self.worst_score:
-            self.beams.append((score, hyp, beam_indices))
-            if len(self) > self.num_beams:
-                sorted_next_scores = sorted([(s, idx) for idx, (s, _, _) in enumerate(self.beams)])
-                del self.beams[sorted_next_scores[0][1]]
-                self.worst_score = sorted_next_scores[1][0]
-            else:
-                self.worst_score = min(score, self.worst_score)
-
-    def is_done(self, best_sum_logprobs: float, cur_len: int) -> bool:
-        """
-        If there are enough hypotheses and that none of the hypotheses being generated
-        can become better than the worst one in the heap, then we are done with this sentence.
-        """
-
-        if len(self) < self.num_beams:
-            return False
-        elif self.early_stopping:
-            return True
-        else:
-            cur_score = best_sum_logprobs / cur_len ** self.length_penalty
-            ret = self.worst_score >= cur_score
-            return ret
-
-
 class BeamSearchScorer(BeamScorer):
+    """
+    Beam scorer keeping the finished hypotheses of every batch element in fixed size tensors:
+    (batch_size, num_beams) scores and lengths and (batch_size, num_beams, length) tokens.
+    A step of beam search is then a few batched tensor ops over all batch elements, instead of
+    python loops over the batch elements and their candidates syncing with ``.item()``.
+
+    A finished hypothesis is kept if fewer than ``num_beams`` hypotheses of its batch element
+    are finished, or if its length normalized score beats the worst kept one, which it then
+    replaces. Scores are normalized in float64, as python floats were, so the kept hypotheses
+    and the outputs are the same as the ones of a per-candidate scorer.
+    """
+
     def __init__(
         self,
         batch_size: int,
@@ -96,32 +59,9 @@ class BeamSearchScorer(BeamScorer):
         do_early_stopping: Optional[bool] = False,
         num_beam_hyps_to_keep: Optional[int] = 1,
         num_beam_groups: Optional[int] = 1,
+        device_type: Optional[str] = None,
         **kwargs,
     ):
-        self.num_beams = num_beams
-        self.length_penalty = length_penalty
-        self.do_early_stopping = do_early_stopping
-        self.num_beam_hyps_to_keep = num_beam_hyps_to_keep
-        self.num_beam_groups = num_beam_groups
-        self.group_size = self.num_beams // self.num_beam_groups
-
-        self._is_init = False
-        self._beam_hyps = [
-            BeamHypotheses(
-                num_beams=self.num_beams,
-                length_penalty=self.length_penalty,
-                early_stopping=self.do_early_stopping,
-            )
-            for _ in range(batch_size)
-        ]
-
-        self._done = flow.tensor(
-            [False for _ in range(batch_size)],
-            dtype=flow.bool,
-            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=flow.placement("cuda", list(range(dist.get_world_size()))),
-        )
-
         if not isinstance(num_beams, int) or num_beams <= 1:
             raise ValueError(
                 f"`num_beams` has to be an integer strictly greater than 1, but is {num_beams}."
@@ -146,10 +86,89 @@ class BeamSearchScorer(BeamScorer):
                 ", or `group_beam_search(...)`."
             )
 
+        self.batch_size = batch_size
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+        self.do_early_stopping = do_early_stopping
+        self.num_beam_hyps_to_keep = num_beam_hyps_to_keep
+        self.num_beam_groups = num_beam_groups
+        self.group_size = self.num_beams // self.num_beam_groups
+        # scores and tokens of the beams are small, every rank holds a copy of them
+        self.placement = dist.get_all_placement(device_type)
+
+        self._done = self._full((batch_size,), False, flow.bool)
+        self._hyp_scores = self._full((batch_size, num_beams), 0.0, flow.float64)
+        self._hyp_lengths = self._full((batch_size, num_beams), 0, flow.long)
+        self._hyp_counts = self._full((batch_size,), 0, flow.long)
+        self._hyp_tokens = None
+
     @property
     def is_done(self) -> bool:
         return self._done.all()
 
+    def _full(self, shape, value, dtype):
+        return flow.full(
+            shape,
+            value,
+            dtype=dtype,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=self.placement,
+        )
+
+    def _arange(self, n):
+        return flow.arange(
+            n,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=self.placement,
+        )
+
+    def _broadcast(self, tensor):
+        return tensor.to_global(
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=self.placement,
+        )
+
+    def _worst_hypotheses(self):
+        """Score and slot of the worst kept hypothesis of every batch element, +inf if none."""
+        filled = self._arange(self.num_beams).unsqueeze(0) < self._hyp_counts.unsqueeze(1)
+        scores = self._hyp_scores.masked_fill(flow.logical_not(filled), float("inf"))
+        slots = flow.argmin(scores, dim=1)
+        return flow.gather(scores, 1, slots.unsqueeze(1)).squeeze(1), slots
+
+    def _add_hypotheses(self, hyps: flow.Tensor, scores: flow.Tensor, add_mask: flow.Tensor):
+        """
+        Adds the finished hypothesis ``hyps[i]`` of length normalized score ``scores[i]`` to
+        batch element ``i`` for every ``i`` where ``add_mask`` is set.
+        """
+        length = hyps.shape[-1]
+        if self._hyp_tokens is None:
+            self._hyp_tokens = self._full((self.batch_size, self.num_beams, length), 0, flow.long)
+        elif self._hyp_tokens.shape[-1] < length:
+            pad = self._full(
+                (self.batch_size, self.num_beams, length - self._hyp_tokens.shape[-1]),
+                0,
+                flow.long,
+            )
+            self._hyp_tokens = flow.cat([self._hyp_tokens, pad], dim=-1)
+
+        is_full = self._hyp_counts >= self.num_beams
+        worst_scores, worst_slots = self._worst_hypotheses()
+        add_mask = add_mask & (flow.logical_not(is_full) | (scores > worst_scores))
+        slots = flow.where(is_full, worst_slots, self._hyp_counts)
+        slot_mask = (self._arange(self.num_beams).unsqueeze(0) == slots.unsqueeze(1)) & (
+            add_mask.unsqueeze(1)
+        )
+
+        self._hyp_scores = flow.where(
+            slot_mask, scores.unsqueeze(1).expand_as(self._hyp_scores), self._hyp_scores
+        )
+        self._hyp_lengths = self._hyp_lengths.masked_fill(slot_mask, length)
+        hyps = hyps.to(flow.long).unsqueeze(1).expand(self.batch_size, self.num_beams, length)
+        self._hyp_tokens[:, :, :length] = flow.where(
+            slot_mask.unsqueeze(-1).expand_as(hyps), hyps, self._hyp_tokens[:, :, :length]
+        )
+        self._hyp_counts = self._hyp_counts + add_mask.to(flow.long)
+
     def process(
         self,
         input_ids: flow.Tensor,
@@ -160,8 +179,14 @@ class BeamSearchScorer(BeamScorer):
         eos_token_id: Optional[int] = None,
         beam_indices: Optional[flow.Tensor] = None,
     ) -> Tuple[flow.Tensor]:
+        """
+        Picks the beams of the next step among the ``2 * group_size`` sorted candidates of
+        every batch element, and moves the candidates ending with ``eos_token_id`` ranked in
+        the top ``group_size`` to the finished hypotheses. ``beam_indices`` are not supported.
+        """
+        assert beam_indices is None, "`beam_indices` are not supported by BeamSearchScorer"
         cur_len = input_ids.shape[-1]
-        batch_size = len(self._beam_hyps)
+        batch_size = self.batch_size
         if not (batch_size == (input_ids.shape[0] // self.group_size)):
             if self.num_beam_groups > 1:
                 raise ValueError(
@@ -173,89 +198,59 @@ class BeamSearchScorer(BeamScorer):
                     f"A beam size of {input_ids.shape[0]} is used as the input, but a beam size of "
                     f"{self.group_size} is expected by the beam scorer."
                 )
-        next_beam_scores = flow.zeros(
-            (batch_size, self.group_size),
-            dtype=next_scores.dtype,
-            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=flow.placement("cuda", list(range(dist.get_world_size()))),
-        )
-        next_beam_tokens = flow.zeros(
-            (batch_size, self.group_size),
-            dtype=next_tokens.dtype,
-            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=flow.placement("cuda", list(range(dist.get_world_size()))),
-        )
-        next_beam_indices = flow.zeros(
-            (batch_size, self.group_size),
-            dtype=next_indices.dtype,
-            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=flow.placement("cuda", list(range(dist.get_world_size()))),
-        )
-
-        for batch_idx, beam_hyp in enumerate(self._beam_hyps):
-            if self._done[batch_idx]:
-                if self.num_beams < len(beam_hyp):
-                    raise ValueError(
-                        f"Batch can only be done if at least {self.num_beams} beams have "
-                        "been generated"
-                    )
-                if eos_token_id is None or pad_token_id is None:
-                    raise ValueError(
-                        "Generated beams >= num_beams -> eos_token_id and pad_token have "
-                        "to be defined"
-                    )
-                # pad the batch
-                next_beam_scores[batch_idx, :] = 0
-                next_beam_tokens[batch_idx, :] = pad_token_id
-                next_beam_indices[batch_idx, :] = 0
-                continue
-
-            # next tokens for this sentence
-            beam_idx = 0
-            for beam_token_rank, (next_token, next_score, next_index) in enumerate(
-                zip(next_tokens[batch_idx], next_scores[batch_idx], next_indices[batch_idx])
-            ):
-                batch_beam_idx = batch_idx * self.group_size + next_index
-                # add to generated hypotheses if end of sentence
-                if (eos_token_id is not None) and (next_token.item() == eos_token_id):
-                    # if beam_token does not belong to top num_beams tokens, it should not be added
-                    is_beam_token_worse_than_top_num_beams = beam_token_rank >= self.group_size
-                    if is_beam_token_worse_than_top_num_beams:
-                        continue
-                    if beam_indices is not None:
-                        beam_index = beam_indices[batch_beam_idx]
-                        beam_index = beam_index + (next_index,)
-                    else:
-                        beam_index = None
-
-                    beam_hyp.add(
-                        input_ids[batch_beam_idx].clone(),
-                        next_score.item(),
-                        beam_indices=beam_index,
-                    )
-                else:
-                    # add next predicted token since it is not eos_token
-                    next_beam_scores[batch_idx, beam_idx] = next_score
-                    next_beam_tokens[batch_idx, beam_idx] = next_token
-                    next_beam_indices[batch_idx, beam_idx] = batch_beam_idx
-                    beam_idx += 1
-
-                # once the beam for next step is full, don't add more tokens to it.
-                if beam_idx == self.group_size:
-                    break
-
-            if beam_idx < self.group_size:
-                raise ValueError(
-                    f"At most {self.group_size} tokens in {next_tokens[batch_idx]} can be equal "
-                    f"to `eos_token_id: {eos_token_id}`. Make sure {next_tokens[batch_idx]} "
-                    "are corrected."
-                )
+        if (eos_token_id is None or pad_token_id is None) and self._done.any():
+            raise ValueError(
+                "Generated beams >= num_beams -> eos_token_id and pad_token have to be defined"
+            )
 
-            # Check if we are done so that we can save a pad step if all(done)
-            self._done[batch_idx] = self._done[batch_idx] or beam_hyp.is_done(
-                next_scores[batch_idx].max().item(), cur_len
+        input_ids = self._broadcast(input_ids)
+        next_scores = self._broadcast(next_scores)
+        next_tokens = self._broadcast(next_tokens)
+        next_indices = self._broadcast(next_indices)
+        done = self._done
+        num_candidates = next_scores.shape[-1]
+        batch_offsets = self._arange(batch_size) * self.group_size
+        length_penalty = cur_len ** self.length_penalty
+
+        if eos_token_id is not None:
+            is_eos = next_tokens == eos_token_id
+        else:
+            is_eos = self._full(tuple(next_tokens.shape), False, flow.bool)
+
+        # finished hypotheses, only the candidates ranked in the top group_size are kept
+        hyp_scores = next_scores.to(flow.float64) / length_penalty
+        for rank in range(self.group_size):
+            rows = batch_offsets + next_indices[:, rank]
+            self._add_hypotheses(
+                input_ids.index_select(0, rows),
+                hyp_scores[:, rank],
+                is_eos[:, rank] & flow.logical_not(done),
             )
 
+        # the next beams are the first group_size candidates not ending with eos
+        is_beam = flow.logical_not(is_eos)
+        is_beam = is_beam & (flow.cumsum(is_beam.to(flow.long), dim=1) <= self.group_size)
+        positions = self._arange(num_candidates).unsqueeze(0)
+        order = flow.argsort(flow.where(is_beam, positions, positions + num_candidates), dim=1)
+        order = order[:, : self.group_size]
+        next_beam_scores = flow.gather(next_scores, 1, order)
+        next_beam_tokens = flow.gather(next_tokens, 1, order)
+        next_beam_indices = flow.gather(next_indices, 1, order) + batch_offsets.unsqueeze(1)
+
+        # pad the batch elements already done
+        done_mask = done.unsqueeze(1).expand_as(next_beam_scores)
+        next_beam_scores = next_beam_scores.masked_fill(done_mask, 0)
+        if pad_token_id is not None:
+            next_beam_tokens = next_beam_tokens.masked_fill(done_mask, pad_token_id)
+        next_beam_indices = next_beam_indices.masked_fill(done_mask, 0)
+
+        # check in one reduction if we are done so that we can save a pad step if all(done)
+        is_done = self._hyp_counts >= self.num_beams
+        if not self.do_early_stopping:
+            best_scores = flow.amax(next_scores, dim=1).to(flow.float64) / length_penalty
+            is_done = is_done & (self._worst_hypotheses()[0] >= best_scores)
+        self._done = done | is_done
+
         return UserDict(
             {
                 "next_beam_scores": next_beam_scores.view(-1),
@@ -275,99 +270,61 @@ class BeamSearchScorer(BeamScorer):
         eos_token_id: Optional[int] = None,
         beam_indices: Optional[flow.Tensor] = None,
     ):
-        batch_size = len(self._beam_hyps)
-        # finalize all open beam hypotheses and add to generated hypotheses
-        for batch_idx, beam_hyp in enumerate(self._beam_hyps):
-            if self._done[batch_idx]:
-                continue
-
-            # all open beam hypotheses are added to the beam hypothesis
-            # beam hypothesis class automatically keeps the best beams
-            for beam_id in range(self.num_beams):
-                batch_beam_idx = batch_idx * self.num_beams + beam_id
-                final_score = final_beam_scores[batch_beam_idx].item()
-                final_tokens = input_ids[batch_beam_idx]
-                beam_index = beam_indices[batch_beam_idx] if beam_indices is not None else None
-                beam_hyp.add(final_tokens, final_score, beam_indices=beam_index)
-
-        # select the best hypotheses
-        sent_lengths = flow.zeros(
-            batch_size * self.num_beam_hyps_to_keep,
-            dtype=flow.long,
-            sbp=input_ids.sbp,
-            placement=input_ids.placement,
-        )
-        best = []
-        best_indices = []
-        best_scores = flow.zeros(
-            batch_size * self.num_beam_hyps_to_keep,
-            dtype=flow.float32,
-            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=flow.placement("cuda", list(range(dist.get_world_size()))),
-        )
-
-        # retrieve best hypotheses
-        for i, beam_hyp in enumerate(self._beam_hyps):
-            sorted_hyps = sorted(beam_hyp.beams, key=lambda x: x[0])
-            for j in range(self.num_beam_hyps_to_keep):
-                best_hyp_tuple = sorted_hyps.pop()
-                best_score = best_hyp_tuple[0]
-                best_hyp = best_hyp_tuple[1]
-                best_index = best_hyp_tuple[2]
-                sent_lengths[self.num_beam_hyps_to_keep * i + j] = len(best_hyp)
-
-                # append hyp to lists
-                best.append(best_hyp)
+        sbp, placement = input_ids.sbp, input_ids.placement
+        input_ids = self._broadcast(input_ids)
+        final_beam_scores = self._broadcast(final_beam_scores)
+        cur_len = input_ids.shape[-1]
 
-                # append indices to list
-                best_indices.append(best_index)
+        # all open beam hypotheses of the batch elements not done are added to the finished
+        # hypotheses, which keep the best ones
+        not_done = flow.logical_not(self._done)
+        hyp_scores = final_beam_scores.to(flow.float64).view(self.batch_size, self.num_beams)
+        hyp_scores = hyp_scores / (cur_len ** self.length_penalty)
+        batch_offsets = self._arange(self.batch_size) * self.num_beams
+        for beam_id in range(self.num_beams):
+            self._add_hypotheses(
+                input_ids.index_select(0, batch_offsets + beam_id),
+                hyp_scores[:, beam_id],
+                not_done,
+            )
 
-                best_scores[i * self.num_beam_hyps_to_keep + j] = best_score
+        # select the best hypotheses
+        num_keep = self.num_beam_hyps_to_keep
+        slots = flow.argsort(self._hyp_scores, dim=1, descending=True)[:, :num_keep]
+        best_scores = flow.gather(self._hyp_scores, 1, slots).view(-1).to(flow.float32)
+        sent_lengths = flow.gather(self._hyp_lengths, 1, slots).view(-1)
+        width = self._hyp_tokens.shape[-1]
+        best = flow.gather(
+            self._hyp_tokens, 1, slots.unsqueeze(-1).expand(self.batch_size, num_keep, width)
+        ).view(-1, width)
 
         # prepare for adding eos
         sent_lengths_max = sent_lengths.max().item() + 1
         sent_max_len = (
             min(sent_lengths_max, max_length) if max_length is not None else sent_lengths_max
         )
-        decoded = flow.zeros(
-            (batch_size * self.num_beam_hyps_to_keep, sent_max_len),
-            dtype=flow.long,
-            sbp=input_ids.sbp,
-            placement=input_ids.placement,
-        )
-
-        if len(best_indices) > 0 and best_indices[0] is not None:
-            indices = flow.zeros(
-                (batch_size * self.num_beam_hyps_to_keep, sent_max_len),
-                dtype=flow.long,
-                sbp=input_ids.sbp,
-                placement=input_ids.placement,
-            )
-        else:
-            indices = None
+        if width < sent_max_len:
+            pad = self._full((best.shape[0], sent_max_len - width), 0, flow.long)
+            best = flow.cat([best, pad], dim=-1)
+        best = best[:, :sent_max_len]
 
         # shorter batches are padded if needed
-        if sent_lengths.min().item() != sent_lengths.max().item():
+        fill_value = 0
+        if sent_lengths.min().item() != sent_lengths_max - 1:
             assert pad_token_id is not None, "`pad_token_id` has to be defined"
-            decoded.fill_(pad_token_id)
-
-        if indices is not None:
-            indices.fill_(-1)
+            fill_value = pad_token_id
 
         # fill with hypotheses and eos_token_id if the latter fits in
-        for i, (hypo, best_idx) in enumerate(zip(best, best_indices)):
-            decoded[i, : sent_lengths[i]] = hypo
-
-            if indices is not None:
-                indices[i, : len(best_idx)] = flow.tensor(best_idx)
-
-            if sent_lengths[i] < sent_max_len:
-                decoded[i, sent_lengths[i]] = eos_token_id
+        positions = self._arange(sent_max_len).unsqueeze(0)
+        sent_lengths = sent_lengths.unsqueeze(1)
+        decoded = best.masked_fill(positions >= sent_lengths, fill_value)
+        if eos_token_id is not None:
+            decoded = decoded.masked_fill(positions == sent_lengths, eos_token_id)
 
         return UserDict(
             {
-                "sequences": decoded,
+                "sequences": decoded.to_global(sbp=sbp, placement=placement),
                 "sequence_scores": best_scores,
-                "beam_indices": indices,
+                "beam_indices": None,
             }
         )
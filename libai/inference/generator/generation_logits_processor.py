@@ -131,40 +131,31 @@ class HammingDiversityLogitsProcessor(object):
         return scores
 
 
-def _get_ngrams(ngram_size: int, prev_input_ids: flow.Tensor, num_hypos: int):
-    generated_ngrams = [{} for _ in range(num_hypos)]
-    for idx in range(num_hypos):
-        gen_tokens = prev_input_ids[idx].tolist()
-        generated_ngram = generated_ngrams[idx]
-        for ngram in zip(*[gen_tokens[i:] for i in range(ngram_size)]):
-            prev_ngram_tuple = tuple(ngram[:-1])
-            generated_ngram[prev_ngram_tuple] = generated_ngram.get(prev_ngram_tuple, []) + [
-                ngram[-1]
-            ]
-    return generated_ngrams
-
-
-def _get_generated_ngrams(banned_ngrams, prev_input_ids, ngram_size, cur_len):
-    start_idx = cur_len + 1 - ngram_size
-    ngram_idx = tuple(prev_input_ids[start_idx:cur_len].tolist())
-    return banned_ngrams.get(ngram_idx, [])
-
-
-def _calc_banned_ngram_tokens(
-    ngram_size: int, prev_input_ids: flow.Tensor, num_hypos: int, cur_len: int
-):
-    if cur_len + 1 < ngram_size:
-        return [[] for _ in range(num_hypos)]
-
-    generated_ngrams = _get_ngrams(ngram_size, prev_input_ids, num_hypos)
-
-    banned_tokens = [
-        _get_generated_ngrams(
-            generated_ngrams[hypo_idx], prev_input_ids[hypo_idx], ngram_size, cur_len
-        )
-        for hypo_idx in range(num_hypos)
-    ]
-    return banned_tokens
+def _get_ngrams(ngram_size: int, input_ids: flow.Tensor):
+    """
+    Splits every row of ``input_ids`` into its n-grams with rolling windows, returns the
+    (ngram_size - 1)-token prefixes of shape (num_rows, num_ngrams, ngram_size - 1), None for
+    unigrams, and the tokens following them of shape (num_rows, num_ngrams).
+    """
+    num_ngrams = input_ids.shape[-1] - ngram_size + 1
+    if ngram_size == 1:
+        return None, input_ids
+    prefixes = flow.stack([input_ids[:, i : i + num_ngrams] for i in range(ngram_size - 1)], dim=-1)
+    return prefixes, input_ids[:, ngram_size - 1 :]
+
+
+def _ban_ngram_tokens(scores, prefixes, next_tokens, current_prefixes):
+    """
+    Sets the scores of the tokens following the n-grams whose prefix is the current prefix
+    of the hypothesis to -inf, all on device without syncing to the host.
+    """
+    if prefixes is None:
+        # unigrams, every previous token is banned
+        matches = flow.ones_like(next_tokens)
+    else:
+        matches = flow.all(prefixes == current_prefixes.unsqueeze(1), dim=-1)
+    banned = flow.zeros_like(scores).scatter_add(1, next_tokens, matches.to(scores.dtype))
+    return scores.masked_fill(banned > 0, -float("inf"))
 
 
 class NoRepeatNGramLogitsProcessor(object):
@@ -176,16 +167,13 @@ class NoRepeatNGramLogitsProcessor(object):
         self.ngram_size = ngram_size
 
     def __call__(self, input_ids, scores) -> flow.Tensor:
-        num_batch_hypotheses = scores.shape[0]
         cur_len = input_ids.shape[-1]
-        banned_batch_tokens = _calc_banned_ngram_tokens(
-            self.ngram_size, input_ids, num_batch_hypotheses, cur_len
-        )
-
-        for i, banned_tokens in enumerate(banned_batch_tokens):
-            scores[i, banned_tokens] = -float("inf")
+        if cur_len < self.ngram_size:
+            return scores
 
-        return scores
+        prefixes, next_tokens = _get_ngrams(self.ngram_size, input_ids)
+        current_prefixes = input_ids[:, cur_len + 1 - self.ngram_size :]
+        return _ban_ngram_tokens(scores, prefixes, next_tokens, current_prefixes)
 
 
 class EncoderNoRepeatNGramLogitsProcessor(object):
@@ -199,27 +187,25 @@ class EncoderNoRepeatNGramLogitsProcessor(object):
         if len(encoder_input_ids.shape) == 1:
             encoder_input_ids = encoder_input_ids.unsqueeze(0)
         self.batch_size = encoder_input_ids.shape[0]
-        self.generated_ngrams = _get_ngrams(encoder_ngram_size, encoder_input_ids, self.batch_size)
+        if encoder_input_ids.shape[-1] < encoder_ngram_size:
+            self.prefixes, self.next_tokens = None, None
+        else:
+            self.prefixes, self.next_tokens = _get_ngrams(encoder_ngram_size, encoder_input_ids)
 
     def __call__(self, input_ids: flow.Tensor, scores: flow.Tensor) -> flow.Tensor:
+        cur_len = input_ids.shape[-1]
+        if self.next_tokens is None or cur_len + 1 < self.ngram_size:
+            return scores
+
         # B x num_beams
         num_hypos = scores.shape[0]
         num_beams = num_hypos // self.batch_size
-        cur_len = input_ids.shape[-1]
-        banned_batch_tokens = [
-            _get_generated_ngrams(
-                self.generated_ngrams[hypo_idx // num_beams],
-                input_ids[hypo_idx],
-                self.ngram_size,
-                cur_len,
-            )
-            for hypo_idx in range(num_hypos)
-        ]
-
-        for i, banned_tokens in enumerate(banned_batch_tokens):
-            scores[i, banned_tokens] = -float("inf")
-
-        return scores
+        next_tokens = self.next_tokens.repeat_interleave(num_beams, dim=0)
+        prefixes, current_prefixes = None, None
+        if self.prefixes is not None:
+            prefixes = self.prefixes.repeat_interleave(num_beams, dim=0)
+            current_prefixes = input_ids[:, cur_len + 1 - self.ngram_size :]
+        return _ban_ngram_tokens(scores, prefixes, next_tokens, current_prefixes)
 
 
 class MinLengthLogitsProcessor(object):
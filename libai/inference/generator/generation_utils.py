@@ -25,6 +25,7 @@ from oneflow import nn
 
 from libai.utils import distributed as dist
 
+from .generation_beam_cache import BeamIndex
 from .generation_beam_search import BeamScorer, BeamSearchScorer
 from .generation_logits_processor import (
     EncoderNoRepeatNGramLogitsProcessor,
@@ -55,6 +56,28 @@ logger = logging.getLogger(__name__)
 
 
 class Generator:
+    # parent pointers of the hypotheses during beam search, see `BeamIndex`
+    beam_index = None
+
+    @property
+    def generation_device_type(self):
+        """
+        Device type of the tensors created during generation, inferred from the parameters of
+        the model so that generation runs wherever the model was placed, e.g. on CPU-only hosts.
+        """
+        for param in self.parameters():
+            return param.placement.type if param.is_global else param.device.type
+        return dist.get_device_type()
+
+    def get_generation_placement(self, all_ranks=False):
+        """
+        Placement of the tensors created during generation: the one of the first layer, or all
+        ranks for the small tensors every rank needs a copy of.
+        """
+        if all_ranks:
+            return dist.get_all_placement(self.generation_device_type)
+        return dist.get_layer_placement(0, device_type=self.generation_device_type)
+
     def _prepare_model_inputs(
         self,
         inputs: Optional[flow.Tensor] = None,
@@ -101,7 +124,7 @@ class Generator:
                     shape,
                     dtype=flow.long,
                     sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                    placement=dist.get_layer_placement(0),
+                    placement=self.get_generation_placement(),
                 )
                 * -100
             )
@@ -113,7 +136,7 @@ class Generator:
                 (1, 1),
                 dtype=flow.long,
                 sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                placement=dist.get_layer_placement(0),
+                placement=self.get_generation_placement(),
             )
             * bos_token_id
         )
@@ -140,7 +163,7 @@ class Generator:
                 inputs.shape[:2],
                 dtype=flow.bool,
                 sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                placement=dist.get_layer_placement(0),
+                placement=self.get_generation_placement(),
             )
 
     def _prepare_encoder_decoder_kwargs_for_generation(
@@ -166,7 +189,7 @@ class Generator:
         else:
             decoder_start_token_id = (
                 decoder_start_token_id
-                if decoder_start_token_id
+                if decoder_start_token_id is not None
                 else self.cfg.decoder_start_token_id
             )
             return (
@@ -174,7 +197,7 @@ class Generator:
                     (batch_size, 1),
                     dtype=flow.long,
                     sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                    placement=dist.get_layer_placement(0),
+                    placement=self.get_generation_placement(),
                 )
                 * decoder_start_token_id
             )
@@ -205,7 +228,7 @@ class Generator:
         )
         expanded_return_idx = expanded_return_idx.to_global(
             sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=dist.get_layer_placement(0),
+            placement=input_ids.placement,
         )
 
         input_ids = input_ids.index_select(0, expanded_return_idx)
@@ -248,6 +271,7 @@ class Generator:
             attention_mask = model_kwargs["attention_mask"]
             pad = flow.ones(
                 (attention_mask.shape[0], 1),
+                dtype=attention_mask.dtype,
                 sbp=attention_mask.sbp,
                 placement=attention_mask.placement,
             )
@@ -257,6 +281,7 @@ class Generator:
             attention_mask = model_kwargs["decoder_attn_mask"]
             pad = flow.ones(
                 (attention_mask.shape[0], 1),
+                dtype=attention_mask.dtype,
                 sbp=attention_mask.sbp,
                 placement=attention_mask.placement,
             )
@@ -478,7 +503,11 @@ class Generator:
             stopping_criteria = validate_stopping_criteria(stopping_criteria, max_length)
 
         # keep track of which sequences are already finished
-        unfinished_sequences = flow.ones(input_ids.shape[0])
+        unfinished_sequences = flow.ones(
+            input_ids.shape[0],
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=self.get_generation_placement(),
+        )
         cur_len = input_ids.shape[-1]
         while True:
             if input_ids.size(0) > 1:
@@ -527,7 +556,7 @@ class Generator:
             # if eos_token was found in one sentence, set sentence to finished
             if eos_token_id is not None:
                 unfinished_sequences = unfinished_sequences.mul(
-                    next_tokens.ne(eos_token_id).prod(dim=0)
+                    next_tokens.ne(eos_token_id).to(unfinished_sequences.dtype)
                 )
 
             if unfinished_sequences.max() == 0 or stopping_criteria(input_ids, scores):
@@ -575,7 +604,11 @@ class Generator:
             stopping_criteria = validate_stopping_criteria(stopping_criteria, max_length)
         logits_warper = logits_warper if logits_warper is not None else LogitsProcessorList()
 
-        unfinished_sequences = flow.ones(input_ids.shape[0])
+        unfinished_sequences = flow.ones(
+            input_ids.shape[0],
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=self.get_generation_placement(),
+        )
         cur_len = input_ids.shape[-1]
 
         while True:
@@ -598,12 +631,12 @@ class Generator:
             probs = nn.functional.softmax(next_token_scores, dim=-1)
             probs = probs.to_global(
                 sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                placement=dist.get_layer_placement(0),
+                placement=self.get_generation_placement(),
             ).to_local()
             next_tokens = flow.multinomial(probs, num_samples=1).squeeze(1)
             next_tokens = next_tokens.to_global(
                 sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                placement=dist.get_layer_placement(0),
+                placement=self.get_generation_placement(),
             )
             unfinished_sequences = unfinished_sequences.to_global(
                 sbp=next_tokens.sbp, placement=next_tokens.placement
@@ -679,7 +712,7 @@ class Generator:
                 UserWarning,
             )
 
-        batch_size = len(beam_scorer._beam_hyps)
+        batch_size = beam_scorer.batch_size
         num_beams = beam_scorer.num_beams
 
         batch_beam_size, cur_len = input_ids.shape
@@ -696,10 +729,11 @@ class Generator:
             (batch_size, num_beams),
             dtype=flow.float,
             sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=dist.get_layer_placement(0),
+            placement=self.get_generation_placement(),
         )
         beam_scores[:, 1:] = -1e9
         beam_scores = beam_scores.view((batch_size * num_beams,))
+        self.beam_index = BeamIndex(num_beams)
 
         while True:
             # prepare model inputs
@@ -756,7 +790,7 @@ class Generator:
 
             # update past_key_value
             if model_kwargs["past"] is not None:
-                model_kwargs["past"] = self._reorder_cache(beam_idx)
+                model_kwargs["past"] = self._reorder_cache(model_kwargs["past"], beam_idx)
 
             # increase cur_len
             cur_len = cur_len + 1
@@ -780,6 +814,7 @@ class Generator:
             self.past_key_values = [None] * self.cfg.hidden_layers
         if "encoder_states" in self.__dir__():
             self.encoder_states = None
+        self.beam_index = None
 
         return sequence_outputs["sequences"]
 
@@ -854,6 +889,8 @@ class Generator:
 
         # 3. Prepare other model kwargs
         model_kwargs["use_cache"] = use_cache if use_cache is not None else self.cfg.use_cache
+        # the cache of an interrupted beam search is not read through its parent pointers
+        self.beam_index = None
 
         if self.cfg.is_encoder_decoder:
             att_mask_name = "encoder_attn_mask"
@@ -1061,6 +1098,7 @@ class Generator:
                 length_penalty=length_penalty,
                 do_early_stopping=early_stopping,
                 num_beam_hyps_to_keep=num_return_sequences,
+                device_type=self.generation_device_type,
             )
 
             # 11. Interleave input_ids with `num_beams` additional sequences per batch
@@ -47,6 +47,9 @@ class ImageClassificationPipeline(BasePipeline):
             mode,
             **kwargs,
         )
+        # precompute the per-block constants of window attention models, e.g. Swin
+        if hasattr(self.model, "set_inference_mode"):
+            self.model.set_inference_mode()
         if "num_classes" in self.cfg.model:
             self.num_classes = self.cfg.model.num_classes
         elif "num_classes" in self.cfg.model.cfg:
@@ -85,7 +88,7 @@ class ImageClassificationPipeline(BasePipeline):
         return mdoel_input_dict
 
     def forward(self, mdoel_input_dict) -> dict:
-        model_outputs_dict = self.model(**mdoel_input_dict)
+        model_outputs_dict = self.run_model(**mdoel_input_dict)
         return model_outputs_dict
 
     def postprocess(
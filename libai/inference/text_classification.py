@@ -70,6 +70,13 @@ class TextClassificationPipeline(BasePipeline):
             self.cfg.model.cfg["label2id"] = label2id
             self.cfg.model.cfg["id2label"] = id2label
 
+    def graph_seq_pad_values(self):
+        pad_token_id = self.tokenizer.pad_token_id
+        return {
+            "input_ids": 0 if pad_token_id is None else pad_token_id,
+            "attention_mask": 0,
+        }
+
     def _parse_parameters(self, **pipeline_parameters):
         preprocess_params = {}
         forward_params = {}
@@ -101,7 +108,7 @@ class TextClassificationPipeline(BasePipeline):
         return mdoel_input_dict
 
     def forward(self, mdoel_input_dict) -> dict:
-        model_outputs_dict = self.model(**mdoel_input_dict)
+        model_outputs_dict = self.run_model(**mdoel_input_dict)
         return model_outputs_dict
 
     def postprocess(
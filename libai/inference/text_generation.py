@@ -69,7 +69,9 @@ class TextGenerationPipeline(BasePipeline):
         **kwargs,
     ) -> dict:
         # tokenizer encoder
-        encoder_ids = self.tokenizer.encode(inputs, return_tensors="of", is_global=True)
+        encoder_ids = self.tokenizer.encode(
+            inputs, return_tensors="of", is_global=True, placement=self.placement
+        )
 
         encoder_input_dict = {
             "encoder_ids": encoder_ids,
@@ -0,0 +1,190 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+
+import oneflow as flow
+
+from libai.models.utils.graph_base import GraphBase
+from libai.utils import distributed as dist
+from libai.utils.file_io import fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+DEFAULT_SEQ_BUCKETS = (32, 64, 128, 256, 512)
+
+
+def get_bucket(size, buckets):
+    """Returns the smallest bucket not less than ``size``. Sizes beyond the largest
+    bucket are rounded up to a multiple of it, so the number of variants stays bounded
+    by the served range.
+    """
+    for bucket in buckets:
+        if size <= bucket:
+            return bucket
+    return -(-size // buckets[-1]) * buckets[-1]
+
+
+def checkpoint_fingerprint(model_path):
+    """Digest of the path, size and modification time of every file of the checkpoint at
+    ``model_path``, a file or a directory, so that plans compiled for other weights saved
+    at the same path are not reused.
+    """
+    if os.path.isdir(model_path):
+        paths = sorted(
+            os.path.join(root, name) for root, _, names in os.walk(model_path) for name in names
+        )
+    else:
+        paths = [model_path]
+    return fingerprint(paths)
+
+
+def _pad_dims(tensor, batch_pad, seq_pad, value=0):
+    if batch_pad == 0 and seq_pad == 0:
+        return tensor
+    is_bool = tensor.dtype == flow.bool
+    if is_bool:
+        tensor = tensor.to(flow.int8)
+    # pad sizes of flow.nn.functional.pad start from the last dim
+    pad = [0, 0] * (tensor.ndim - 2) + [0, seq_pad, 0, batch_pad]
+    if tensor.ndim == 1:
+        pad = [0, batch_pad]
+    tensor = flow.nn.functional.pad(tensor, pad, mode="constant", value=value)
+    return tensor.to(flow.bool) if is_bool else tensor
+
+
+class GraphCache:
+    """Eval ``nn.Graph`` s of a model, one per (batch bucket, sequence bucket).
+
+    Inputs are padded up to their bucket, so a handful of compiled graphs serve every
+    request shape, and outputs are sliced back to the request size. When ``cache_dir``
+    is set, the compiled plan of every graph is saved there with
+    ``nn.Graph.runtime_state_dict`` and reloaded by later processes, keyed by
+    ``cache_key``, the parallel layout and the input shapes, which skips the compilation.
+
+    Args:
+        model (nn.Module): The model in eval mode.
+        cache_key (str, optional): Identifies the model, e.g. its config and weight path.
+            Plans are only reused between processes with the same key, all ranks use the
+            key of rank 0. Defaults to "".
+        cache_dir (str, optional): Directory of the compiled plans. Defaults to None,
+            meaning graphs are compiled in every process.
+        batch_buckets (tuple[int], optional): Ascending batch sizes to pad to.
+        seq_buckets (tuple[int], optional): Ascending sequence lengths to pad to.
+        seq_pad_values (dict, optional): Inputs with a sequence dim (dim 1) and the value
+            they are padded with, e.g. ``{"input_ids": pad_token_id, "attention_mask": 0}``.
+            Other inputs are only padded along the batch dim.
+    """
+
+    def __init__(
+        self,
+        model,
+        cache_key="",
+        cache_dir=None,
+        batch_buckets=DEFAULT_BATCH_BUCKETS,
+        seq_buckets=DEFAULT_SEQ_BUCKETS,
+        seq_pad_values=None,
+    ):
+        self.model = model
+        if cache_dir is not None:
+            # the key may hold local file times, which differ between nodes without a shared
+            # filesystem, while all ranks must agree on the directory of the plans
+            cache_key = dist.broadcast_py_object(cache_key, src=0)
+        self.cache_key = cache_key
+        self.cache_dir = cache_dir
+        self.batch_buckets = tuple(sorted(batch_buckets))
+        self.seq_buckets = tuple(sorted(seq_buckets))
+        self.seq_pad_values = seq_pad_values or {}
+        self.graphs = {}
+
+    def plan_key(self, inputs):
+        info = {
+            "model": self.cache_key,
+            "oneflow": flow.__version__,
+            "layout": [
+                dist.get_world_size(),
+                dist.get_data_parallel_size(),
+                dist.get_tensor_parallel_size(),
+                dist.get_pipeline_parallel_size(),
+            ],
+            "inputs": [
+                [name, str(tensor.dtype), list(tensor.shape)]
+                for name, tensor in sorted(inputs.items())
+            ],
+        }
+        return hashlib.sha1(json.dumps(info, sort_keys=True).encode()).hexdigest()
+
+    def pad_inputs(self, inputs):
+        """Pads ``inputs`` to their bucket and returns them with the original
+        (batch size, sequence length).
+        """
+        batch_size = next(iter(inputs.values())).shape[0]
+        seq_lens = {inputs[name].shape[1] for name in self.seq_pad_values if name in inputs}
+        assert len(seq_lens) <= 1, f"inputs have different sequence lengths {seq_lens}"
+        seq_len = seq_lens.pop() if seq_lens else None
+
+        batch_pad = get_bucket(batch_size, self.batch_buckets) - batch_size
+        seq_pad = get_bucket(seq_len, self.seq_buckets) - seq_len if seq_len else 0
+        padded = {}
+        for name, tensor in inputs.items():
+            if name in self.seq_pad_values:
+                padded[name] = _pad_dims(tensor, batch_pad, seq_pad, self.seq_pad_values[name])
+            else:
+                padded[name] = _pad_dims(tensor, batch_pad, 0)
+        return padded, (batch_size, seq_len)
+
+    def get_graph(self, inputs):
+        key = self.plan_key(inputs)
+        if key in self.graphs:
+            return self.graphs[key]
+
+        graph = GraphBase(self.model, is_train=False)
+        plan_dir = os.path.join(self.cache_dir, key) if self.cache_dir else None
+        plan_file = os.path.join(plan_dir, f"rank_{dist.get_rank()}") if plan_dir else None
+        has_plan = plan_dir is not None and os.path.exists(os.path.join(plan_dir, "done"))
+        if dist.broadcast_py_object(has_plan, src=0):
+            logger.info(f"Loading the compiled eval graph from {plan_dir}")
+            graph.load_runtime_state_dict(flow.load(plan_file))
+        elif plan_dir is not None:
+            graph.enable_save_runtime_state_dict()
+            graph(**inputs)
+            os.makedirs(plan_dir, exist_ok=True)
+            flow.save(graph.runtime_state_dict(), plan_file)
+            dist.synchronize()
+            if dist.is_main_process():
+                open(os.path.join(plan_dir, "done"), "w").close()
+            logger.info(f"Saved the compiled eval graph to {plan_dir}")
+        self.graphs[key] = graph
+        return graph
+
+    def __call__(self, **inputs):
+        padded, (batch_size, seq_len) = self.pad_inputs(inputs)
+        outputs = self.get_graph(padded)(**padded)
+
+        padded_seq_len = next(
+            (padded[name].shape[1] for name in self.seq_pad_values if name in padded), None
+        )
+        for name, value in outputs.items():
+            if not isinstance(value, flow.Tensor):
+                continue
+            value = value[:batch_size]
+            if seq_len != padded_seq_len and value.ndim > 1 and value.shape[1] == padded_seq_len:
+                value = value[:, :seq_len]
+            outputs[name] = value
+        return outputs
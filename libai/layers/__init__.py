@@ -19,11 +19,12 @@ from .embedding import Embedding, SinePositionalEmbedding, VocabEmbedding, Patch
 from .layer_norm import LayerNorm, RMSLayerNorm
 from .linear import Linear, Linear1D
 from .conv import Conv1D
-from .lm_logits import LMLogits
+from .lm_logits import LMLogits, LMLogitsLoss
 from .mlp import MLP
 from .transformer_layer import TransformerLayer
 from .attention import MultiheadAttention
 from .droppath import DropPath, drop_path
+from .contrastive import ContrastiveQueue, info_nce_loss
 
 __all__ = [
     "Embedding",
@@ -41,6 +42,9 @@ __all__ = [
     "MultiheadAttention",
     "ParallelCrossEntropyLoss",
     "LMLogits",
+    "LMLogitsLoss",
     "drop_path",
     "DropPath",
+    "ContrastiveQueue",
+    "info_nce_loss",
 ]
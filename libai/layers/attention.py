@@ -212,18 +212,19 @@ class MultiheadAttention(nn.Module):
 
         # [S(0), S(1)] x [S(0), B] = [S(0), S(1)]
         if attention_mask is not None:
+            # an explicit mask already contains the causal part if any,
+            # e.g. the block diagonal mask of packed sequences
             if self.scale_mask_softmax_fusion:
-                if self.attn_mask_type == AttnMaskType.padding:
-                    attention_mask = (
-                        attention_mask.expand_as(attention_scores) if use_cache else attention_mask
-                    )
-                    attention_weights = flow._C.fused_scale_mask_softmax_dropout(
-                        attention_scores,
-                        attention_mask,
-                        fill_value=-10000.0,
-                        scale=self.coeff,
-                        p=self.attention_dropout_prob,
-                    )[0]
+                attention_mask = (
+                    attention_mask.expand_as(attention_scores) if use_cache else attention_mask
+                )
+                attention_weights = flow._C.fused_scale_mask_softmax_dropout(
+                    attention_scores,
+                    attention_mask,
+                    fill_value=-10000.0,
+                    scale=self.coeff,
+                    p=self.attention_dropout_prob,
+                )[0]
             else:
                 if self.coeff is not None:
                     attention_scores *= self.coeff
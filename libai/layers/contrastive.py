@@ -0,0 +1,180 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import oneflow as flow
+from oneflow import nn
+
+from libai.utils import distributed as dist
+
+
+def all_gather(x):
+    """Gathers ``x``, split along the batch dim across data parallel ranks, to all ranks.
+
+    Unlike the all-gather of ``torch.distributed``, the gradient of the gathered tensor
+    is not dropped for the rows of other ranks: the backward of ``to_global`` sums the
+    gradients of all ranks and scatters them back to the rank owning every row.
+    """
+    if not x.is_global:
+        return x
+    return x.to_global(sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]))
+
+
+def _arange(n, like):
+    if like.is_global:
+        return flow.arange(n, sbp=like.sbp, placement=like.placement)
+    return flow.arange(n, device=like.device)
+
+
+class ContrastiveQueue(nn.Module):
+    """Fixed size FIFO queue of keys, used as extra negatives of :func:`info_nce_loss`.
+
+    The queue is a preallocated ring buffer of shape
+    (data_parallel_size, size // data_parallel_size, dim), split along dim 0 across data
+    parallel ranks, so every rank stores and enqueues its own keys without communication.
+    It is initialized with random unit vectors as in MoCo, and the queued keys are saved
+    with the model. The write pointer is not, so a resumed run starts overwriting from
+    the oldest slot of the buffer. Enqueueing is done in eager mode.
+
+    Args:
+        size (int): number of keys of the queue, divisible by the data parallel size.
+        dim (int): dimension of the keys.
+        layer_idx (int, optional): stage of the pipeline holding the queue. Defaults to -1.
+    """
+
+    def __init__(self, size, dim, layer_idx=-1):
+        super().__init__()
+        num_ranks = dist.get_data_parallel_size()
+        assert size % num_ranks == 0, "queue size must be divisible by the data parallel size"
+        queue = flow.randn(
+            num_ranks,
+            size // num_ranks,
+            dim,
+            sbp=dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast]),
+            placement=dist.get_layer_placement(layer_idx),
+        )
+        self.register_buffer("queue", nn.functional.normalize(queue, dim=-1))
+        self.ptr = 0
+
+    @property
+    def capacity(self):
+        return self.queue.shape[1]
+
+    @flow.no_grad()
+    def enqueue(self, keys):
+        """Replaces the oldest keys with ``keys`` of shape (batch_size, dim)."""
+        num_ranks = self.queue.shape[0]
+        keys = keys.detach().to_global(placement=self.queue.placement)
+        keys = keys.to_global(sbp=self.queue.sbp).view(num_ranks, -1, keys.shape[-1])
+        num_keys = keys.shape[1]
+        assert self.capacity % num_keys == 0, "queue size must be divisible by the batch size"
+        self.queue[:, self.ptr : self.ptr + num_keys] = keys
+        self.ptr = (self.ptr + num_keys) % self.capacity
+
+    def blocks(self, block_size):
+        """Yields the queued keys in blocks of at most ``block_size`` keys, every block
+        taking a slice of the local keys of every rank.
+        """
+        step = max(block_size // self.queue.shape[0], 1)
+        for start in range(0, self.capacity, step):
+            block = self.queue[:, start : start + step]
+            yield block.reshape(-1, block.shape[-1])
+
+
+def info_nce_loss(
+    query,
+    keys,
+    labels,
+    queue=None,
+    temperature=1.0,
+    block_size=4096,
+    query_index=None,
+):
+    """InfoNCE loss of every query against the gathered ``keys`` and the ``queue``.
+
+    The loss of a query is ``logsumexp(logits) - logits[label]`` over the logits with all
+    candidates. The logits are computed block by block with an online logsumexp, and the
+    gradients of ``query`` and ``keys`` are expressed with the softmax weighted sums of
+    the candidates, so at most a (num_queries, block_size) block of logits is held in
+    memory, also during backward.
+
+    Args:
+        query (flow.Tensor): queries of shape (num_queries, dim).
+        keys (flow.Tensor): candidates of shape (num_keys, dim), split or broadcast along
+            dim 0. They are gathered to all ranks with :func:`all_gather` and receive
+            gradients if they require grad.
+        labels (flow.Tensor): index in the gathered ``keys`` of the positive key of
+            every query.
+        queue (ContrastiveQueue, optional): extra negatives without gradient.
+        temperature (float, optional): softmax temperature. Defaults to 1.0.
+        block_size (int, optional): number of candidates per block. Defaults to 4096.
+        query_index (flow.Tensor, optional): index in the gathered ``keys`` of every query
+            itself, excluded from its candidates, e.g. when queries and keys are the same
+            embeddings as in SimCSE. Defaults to None.
+
+    Returns:
+        flow.Tensor: the mean loss of all queries.
+    """
+    keys = all_gather(keys)
+    num_keys = keys.shape[0]
+    # small tensors holding all queries on every rank
+    query_all = all_gather(query).detach()
+    keys_detached = keys.detach()
+
+    def key_blocks():
+        for start in range(0, num_keys, block_size):
+            block = keys_detached[start : start + block_size]
+            logits = flow.matmul(query_all, block, transpose_b=True) / temperature
+            if query_index is not None:
+                index = _arange(block.shape[0], logits) + start
+                self_mask = index.unsqueeze(0) == query_index.unsqueeze(1)
+                logits = logits.masked_fill(self_mask, -1e12)
+            yield block, logits
+
+    def queue_blocks():
+        if queue is not None:
+            for block in queue.blocks(block_size):
+                yield block, flow.matmul(query_all, block, transpose_b=True) / temperature
+
+    # online logsumexp of the logits and softmax weighted sum of the candidates
+    row_max, row_sum, weighted = None, None, None
+    for blocks in (key_blocks(), queue_blocks()):
+        for block, logits in blocks:
+            block_max = flow.amax(logits, dim=1)
+            new_max = block_max if row_max is None else flow.maximum(row_max, block_max)
+            probs = flow.exp(logits - new_max.unsqueeze(1))
+            if row_max is None:
+                row_sum, weighted = probs.sum(dim=1), flow.matmul(probs, block)
+            else:
+                scale = flow.exp(row_max - new_max)
+                row_sum = row_sum * scale + probs.sum(dim=1)
+                weighted = weighted * scale.unsqueeze(1) + flow.matmul(probs, block)
+            row_max = new_max
+    lse = row_max + flow.log(row_sum)
+    weighted = weighted / row_sum.unsqueeze(1)
+
+    # `surrogate - surrogate.detach()` is 0 with the gradients of `lse`: d(lse) / d(query)
+    # is the softmax weighted sum of the candidates, d(lse) / d(keys) the one of the queries
+    surrogate = (query * weighted).sum() / temperature
+    if keys.requires_grad:
+        key_weights = []
+        for block, logits in key_blocks():
+            probs = flow.exp(logits - lse.unsqueeze(1))
+            key_weights.append(flow.matmul(probs, query_all, transpose_a=True))
+        key_weights = flow.cat(key_weights, dim=0)
+        surrogate = surrogate + (keys * key_weights).sum() / temperature
+
+    positives = (query * flow.index_select(keys, 0, labels)).sum(dim=-1) / temperature
+    num_queries = lse.shape[0]
+    return (lse.sum() + surrogate - surrogate.detach()) / num_queries - positives.mean()
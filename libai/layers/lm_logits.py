@@ -18,6 +18,8 @@ from oneflow import nn
 
 from libai.utils import distributed as dist
 
+from .cross_entropy import ParallelCrossEntropyLoss
+
 
 class LMLogits(nn.Module):
     def __init__(self, vocab_size, bias=False):
@@ -34,6 +36,8 @@ class LMLogits(nn.Module):
             if bias
             else None
         )
+        # holds no parameters, used by `chunked_loss`
+        self.loss_chunk = LMLogitsLoss()
 
     def forward(self, input, word_embeddings):
         """LM logits using word embedding weights"""
@@ -59,3 +63,58 @@ class LMLogits(nn.Module):
         if self.bias is not None:
             logits = logits + self.bias
         return logits
+
+    def chunked_loss(self, input, word_embeddings, target, chunk_size):
+        """Cross entropy of the LM logits computed ``chunk_size`` tokens at a time,
+        equal to ``ParallelCrossEntropyLoss()(self(input, word_embeddings), target)``.
+
+        The logits of a chunk keep the vocab parallel [S(0), S(2)] sbp and are only alive
+        inside :class:`LMLogitsLoss`, which nn.Graph recomputes in backward, so the peak
+        memory holds the logits of one chunk instead of the whole sequence.
+
+        Args:
+            input (flow.Tensor): hidden states with shape (batch_size, seq_length, hidden_size)
+                and sbp signature [S(0), B].
+            word_embeddings (flow.Tensor): word embedding weights with sbp signature [B, S(0)].
+            target (flow.Tensor): target with shape (batch_size, seq_length) and
+                sbp signature [S(0), B].
+            chunk_size (int): number of tokens of the sequence computed at a time.
+
+        Returns:
+            flow.Tensor: the loss of every token with shape (batch_size * seq_length,).
+        """
+        assert input.ndim == 3
+        assert input.shape[0:2] == target.shape
+
+        w = word_embeddings.to_global(placement=input.placement)
+        input = input.to_global(grad_sbp=input.sbp)
+
+        seq_length = input.shape[1]
+        lm_loss = [
+            self.loss_chunk(
+                input[:, start : start + chunk_size],
+                w,
+                self.bias,
+                target[:, start : start + chunk_size],
+            )
+            for start in range(0, seq_length, chunk_size)
+        ]
+        lm_loss = lm_loss[0] if len(lm_loss) == 1 else flow.cat(lm_loss, dim=1)
+        return lm_loss.view(-1)
+
+
+class LMLogitsLoss(nn.Module):
+    """LM logits and their cross entropy for one chunk of tokens, see
+    :meth:`LMLogits.chunked_loss`. ``GraphBase`` sets activation checkpointing on it when
+    training, so its logits are never stored for backward.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lm_loss = ParallelCrossEntropyLoss()
+
+    def forward(self, input, word_embeddings, bias, target):
+        logits = flow._C.matmul(input, word_embeddings, transpose_b=True)
+        if bias is not None:
+            logits = logits + bias
+        return self.lm_loss(logits, target).view(target.shape)
@@ -14,15 +14,41 @@
 # limitations under the License.
 
 
-from .bert_model import BertForPreTraining, BertModel, BertForClassification
-from .roberta_model import RobertaForPreTraining, RobertaForCausalLM, RobertaModel
+import importlib
+
 from .build import build_graph, build_model
-from .t5_model import T5ForPreTraining, T5Model
-from .gpt_model import GPTForPreTraining, GPTModel
-from .vision_transformer import VisionTransformer
-from .swin_transformer import SwinTransformer
-from .swin_transformer_v2 import SwinTransformerV2
-from .resmlp import ResMLP
+
+# Model classes are imported on first access (PEP 562), so that using one model does not
+# import every other model of the zoo.
+_LAZY_ATTRS = {
+    "BertModel": ".bert_model",
+    "BertForPreTraining": ".bert_model",
+    "BertForClassification": ".bert_model",
+    "RobertaModel": ".roberta_model",
+    "RobertaForCausalLM": ".roberta_model",
+    "RobertaForPreTraining": ".roberta_model",
+    "T5Model": ".t5_model",
+    "T5ForPreTraining": ".t5_model",
+    "GPTModel": ".gpt_model",
+    "GPTForPreTraining": ".gpt_model",
+    "VisionTransformer": ".vision_transformer",
+    "SwinTransformer": ".swin_transformer",
+    "SwinTransformerV2": ".swin_transformer_v2",
+    "ResMLP": ".resmlp",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
+
 
 __all__ = [
     "build_model",
@@ -35,6 +35,9 @@ from .utils import init_method_normal, scaled_init_method_normal
 
 class BertExtendedAttnMask(nn.Module):
     def forward(self, attention_mask):
+        if attention_mask.dim() == 3:
+            # [b, s, s] mask, e.g. the block diagonal mask of packed sequences
+            return attention_mask.unsqueeze(1)
         # We create a 3D attention mask from a 2D tensor mask.
         # [b, 1, s]
         attention_mask_b1s = attention_mask.unsqueeze(1)
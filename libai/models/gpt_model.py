@@ -194,11 +194,13 @@ class GPTModel(nn.Module):
             "amp_enabled": cfg.amp_enabled,
         }
 
-    def forward(self, input_ids):
+    def forward(self, input_ids, return_hidden_states=False):
         """
 
         Args:
             input_ids (flow.LongTensor): Indices of input sequence tokens in vocabulary.
+            return_hidden_states (bool, optional): Whether to skip the LM head and return the
+                final hidden states, e.g. for ``LMLogits.chunked_loss``. Defaults to False.
 
         Returns:
             flow.Tensor: logits
@@ -208,6 +210,8 @@ class GPTModel(nn.Module):
         input_embeds = self.embeddings(input_ids, 0)
 
         transformer_output = self.transformer(input_embeds, attention_mask=None)
+        if return_hidden_states:
+            return transformer_output
 
         output = self.lm_head(transformer_output, self.embeddings.token_embeddings.weight)
 
@@ -327,6 +331,8 @@ class GPTForPreTraining(nn.Module):
         super().__init__()
         self.GPT_model = GPTModel(cfg)
         self.loss_func = GPTLoss()
+        # compute the LM head and loss this many tokens at a time, see `LMLogits.chunked_loss`
+        self.lm_loss_chunk_size = cfg.get("lm_loss_chunk_size", None)
 
     def forward(
         self,
@@ -347,6 +353,16 @@ class GPTForPreTraining(nn.Module):
                 :code:`{"masked_lm_loss": loss_value}` when training,
                 :code:`{"prediction_scores": logits}` when evaluating.
         """
+        if labels is not None and self.lm_loss_chunk_size:
+            hidden_states = self.GPT_model(input_ids, return_hidden_states=True)
+            lm_loss = self.GPT_model.lm_head.chunked_loss(
+                hidden_states,
+                self.GPT_model.embeddings.token_embeddings.weight,
+                labels,
+                self.lm_loss_chunk_size,
+            )
+            return {"lm_loss": lm_loss.mean()}
+
         logits = self.GPT_model(input_ids)
         if labels is not None:
             lm_loss = self.loss_func(logits, labels)
@@ -37,6 +37,27 @@ def window_reverse(windows, window_size, H, W):
     return x
 
 
+def window_partition_index(H, W, window_size, shift_size=0):
+    """
+    Token index that maps a (B, H*W, C) feature map to its (shifted) windows, so that
+    ``x[:, index]`` equals ``window_partition(flow.roll(x, -shift_size), window_size)``
+    and ``x[:, flow.argsort(index)]`` undoes it, each in a single copy.
+
+    Args:
+        H (int): Height of image
+        W (int): Width of image
+        window_size (int): Window size
+        shift_size (int): Shift size for SW-MSA
+    Returns:
+        index: (H*W,)
+    """
+    rows = (flow.arange(H) + shift_size) % H
+    cols = (flow.arange(W) + shift_size) % W
+    index = rows.unsqueeze(1) * W + cols.unsqueeze(0)  # H, W
+    index = index.view(H // window_size, window_size, W // window_size, window_size)
+    return index.permute(0, 2, 1, 3).flatten()
+
+
 class WindowAttention(nn.Module):
     """Window based multi-head self attention (W-MSA) module with relative position bias.
     It supports both of shifted and non-shifted window.
@@ -110,6 +131,33 @@ class WindowAttention(nn.Module):
         self.fused_bias_add_dropout = fused_bias_add_dropout
         self.p = proj_drop
 
+        # relative position bias materialized by `set_inference_mode`
+        self.register_buffer("cached_relative_position_bias", None, persistent=False)
+
+    def get_relative_position_bias(self):
+        """Returns the relative position bias of shape (1, nH, Wh*Ww, Wh*Ww)."""
+        relative_position_bias = self.relative_position_bias_table[
+            self.relative_position_index.view(-1)
+        ].view(
+            self.window_size[0] * self.window_size[1],
+            self.window_size[0] * self.window_size[1],
+            -1,
+        )  # Wh*Ww,Wh*Ww,nH
+        relative_position_bias = relative_position_bias.permute(
+            2, 0, 1
+        ).contiguous()  # nH, Wh*Ww, Wh*Ww
+        return relative_position_bias.unsqueeze(0)
+
+    def set_inference_mode(self, mode=True):
+        """Materialize the relative position bias once so that evaluation forwards skip the
+        gather. Call it again after the weights change, it is only used when not training.
+        """
+        if mode:
+            with flow.no_grad():
+                self.cached_relative_position_bias = self.get_relative_position_bias()
+        else:
+            self.cached_relative_position_bias = None
+
     def forward(self, x, mask):
         """
         Args:
@@ -128,18 +176,11 @@ class WindowAttention(nn.Module):
         # attn = flow.matmul(q, k.transpose(-2, -1))
         attn = flow.matmul(q, k, transpose_b=True)
 
-        relative_position_bias = self.relative_position_bias_table[
-            self.relative_position_index.view(-1)
-        ].view(
-            self.window_size[0] * self.window_size[1],
-            self.window_size[0] * self.window_size[1],
-            -1,
-        )  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(
-            2, 0, 1
-        ).contiguous()  # nH, Wh*Ww, Wh*Ww
-        unsqueeze_relative_position_bias = relative_position_bias.unsqueeze(0)
-        attn = attn + unsqueeze_relative_position_bias
+        if not self.training and self.cached_relative_position_bias is not None:
+            relative_position_bias = self.cached_relative_position_bias
+        else:
+            relative_position_bias = self.get_relative_position_bias()
+        attn = attn + relative_position_bias
 
         if mask is not None:
             nW = mask.shape[0]
@@ -272,6 +313,36 @@ class SwinTransformerBlock(nn.Module):
 
         self.register_buffer("attn_mask", attn_mask)
 
+        # token index of the cyclic shift + window partition, used by `set_inference_mode`
+        partition_index = window_partition_index(
+            *self.input_resolution, self.window_size, self.shift_size
+        )
+        reverse_index = flow.argsort(partition_index)
+        self.register_buffer(
+            "partition_index",
+            partition_index.to_global(
+                placement=dist.get_layer_placement(layer_idx),
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            ),
+            persistent=False,
+        )
+        self.register_buffer(
+            "reverse_index",
+            reverse_index.to_global(
+                placement=dist.get_layer_placement(layer_idx),
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            ),
+            persistent=False,
+        )
+        self.inference_mode = False
+
+    def set_inference_mode(self, mode=True):
+        """When not training, replace roll + window_partition (and window_reverse + roll)
+        with a single index gather, and use the materialized relative position bias.
+        """
+        self.inference_mode = mode
+        self.attn.set_inference_mode(mode)
+
     def forward(self, x):
         H, W = self.input_resolution
         B, L, C = x.shape
@@ -279,35 +350,45 @@ class SwinTransformerBlock(nn.Module):
 
         shortcut = x
         x = self.norm1(x)
-        x = x.view(B, H, W, C)
 
-        # cyclic shift
-        if self.shift_size > 0:
-            shifted_x = flow.roll(x, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
+        if self.inference_mode and not self.training:
+            # cyclic shift + partition windows in one gather
+            x_windows = flow.index_select(x, 1, self.partition_index).view(
+                -1, self.window_size * self.window_size, C
+            )  # nW*B, window_size*window_size, C
+            attn_windows = self.attn(x_windows, self.attn_mask)
+            # merge windows + reverse cyclic shift in one gather
+            x = flow.index_select(attn_windows.view(B, H * W, C), 1, self.reverse_index)
         else:
-            shifted_x = x
-
-        # partition windows
-        x_windows = window_partition(
-            shifted_x, self.window_size
-        )  # nW*B, window_size, window_size, C
-        x_windows = x_windows.view(
-            -1, self.window_size * self.window_size, C
-        )  # nW*B, window_size*window_size, C
-
-        # W-MSA/SW-MSA
-        attn_windows = self.attn(x_windows, self.attn_mask)  # nW*B, window_size*window_size, C
+            x = x.view(B, H, W, C)
 
-        # merge windows
-        attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
-        shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
-
-        # reverse cyclic shift
-        if self.shift_size > 0:
-            x = flow.roll(shifted_x, shifts=(self.shift_size, self.shift_size), dims=(1, 2))
-        else:
-            x = shifted_x
-        x = x.view(B, H * W, C)
+            # cyclic shift
+            if self.shift_size > 0:
+                shifted_x = flow.roll(x, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
+            else:
+                shifted_x = x
+
+            # partition windows
+            x_windows = window_partition(
+                shifted_x, self.window_size
+            )  # nW*B, window_size, window_size, C
+            x_windows = x_windows.view(
+                -1, self.window_size * self.window_size, C
+            )  # nW*B, window_size*window_size, C
+
+            # W-MSA/SW-MSA
+            attn_windows = self.attn(x_windows, self.attn_mask)  # nW*B, window_size*window_size, C
+
+            # merge windows
+            attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
+            shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
+
+            # reverse cyclic shift
+            if self.shift_size > 0:
+                x = flow.roll(shifted_x, shifts=(self.shift_size, self.shift_size), dims=(1, 2))
+            else:
+                x = shifted_x
+            x = x.view(B, H * W, C)
 
         # FFN
         x = shortcut + self.drop_path(x)
@@ -689,6 +770,14 @@ class SwinTransformer(nn.Module):
         else:
             return {"prediction_scores": x}
 
+    def set_inference_mode(self, mode=True):
+        """Precompute the relative position bias and the window gather index of every block
+        for serving. Call it after the weights are loaded, it only takes effect in eval mode.
+        """
+        for module in self.modules():
+            if isinstance(module, SwinTransformerBlock):
+                module.set_inference_mode(mode)
+
     @staticmethod
     def set_pipeline_stage_id(model):
         dist_utils = dist.get_dist_util()
@@ -56,6 +56,27 @@ def window_reverse(windows, window_size, H, W):
     return x
 
 
+def window_partition_index(H, W, window_size, shift_size=0):
+    """
+    Token index that maps a (B, H*W, C) feature map to its (shifted) windows, so that
+    ``x[:, index]`` equals ``window_partition(flow.roll(x, -shift_size), window_size)``
+    and ``x[:, flow.argsort(index)]`` undoes it, each in a single copy.
+
+    Args:
+        H (int): Height of image
+        W (int): Width of image
+        window_size (int): Window size
+        shift_size (int): Shift size for SW-MSA
+    Returns:
+        index: (H*W,)
+    """
+    rows = (flow.arange(H) + shift_size) % H
+    cols = (flow.arange(W) + shift_size) % W
+    index = rows.unsqueeze(1) * W + cols.unsqueeze(0)  # H, W
+    index = index.view(H // window_size, window_size, W // window_size, window_size)
+    return index.permute(0, 2, 1, 3).flatten()
+
+
 class WindowAttention(nn.Module):
     r"""Window based multi-head self attention (W-MSA) module with relative position bias.
     It supports both of shifted and non-shifted window.
@@ -205,6 +226,60 @@ class WindowAttention(nn.Module):
         self.proj_drop = nn.Dropout(proj_drop)
         self.softmax = nn.Softmax(dim=-1)
 
+        # relative position bias and qkv bias materialized by `set_inference_mode`
+        self.register_buffer("cached_relative_position_bias", None, persistent=False)
+        self.register_buffer("cached_qkv_bias", None, persistent=False)
+
+    def get_qkv_bias(self):
+        if self.q_bias is None:
+            return None
+        return flow.concat(
+            [
+                self.q_bias,
+                flow.zeros(
+                    self.v_bias.shape,
+                    requires_grad=False,
+                    placement=dist.get_layer_placement(
+                        self.layer_idx, device_type=self.v_bias.placement.type
+                    ),
+                    sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+                ),
+                self.v_bias,
+            ],
+            dim=0,
+        )
+
+    def get_relative_position_bias(self):
+        """Returns the relative position bias of shape (1, nH, Wh*Ww, Wh*Ww)."""
+        # NOTE: use relative_coords_table and meta network to generate relative_position_bias
+        relative_position_bias_table = self.cpb_mlp(self.relative_coords_table).view(
+            -1, self.num_heads
+        )
+        relative_position_bias = relative_position_bias_table[
+            self.relative_position_index.view(-1)
+        ].view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1
+        )  # Wh*Ww,Wh*Ww,nH
+        relative_position_bias = relative_position_bias.permute(
+            2, 0, 1
+        ).contiguous()  # nH, Wh*Ww, Wh*Ww
+
+        # NOTE: constrained to a range of -16~16
+        return 16 * flow.sigmoid(relative_position_bias).unsqueeze(0)
+
+    def set_inference_mode(self, mode=True):
+        """Run the continuous position bias MLP and build the qkv bias once so that evaluation
+        forwards skip them. Call it again after the weights change, it is only used when not
+        training.
+        """
+        if mode:
+            with flow.no_grad():
+                self.cached_relative_position_bias = self.get_relative_position_bias()
+                self.cached_qkv_bias = self.get_qkv_bias()
+        else:
+            self.cached_relative_position_bias = None
+            self.cached_qkv_bias = None
+
     def forward(self, x, mask=None):
         """
         Args:
@@ -213,23 +288,8 @@ class WindowAttention(nn.Module):
         """
         B_, N, C = x.shape
 
-        qkv_bias = None
-        if self.q_bias is not None:
-            qkv_bias = flow.concat(
-                [
-                    self.q_bias,
-                    flow.zeros(
-                        self.v_bias.shape,
-                        requires_grad=False,
-                        placement=dist.get_layer_placement(
-                            self.layer_idx, device_type=self.v_bias.placement.type
-                        ),
-                        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                    ),
-                    self.v_bias,
-                ],
-                dim=0,
-            )
+        use_cache = not self.training and self.cached_relative_position_bias is not None
+        qkv_bias = self.cached_qkv_bias if use_cache else self.get_qkv_bias()
         qkv = self.qkv(x) + qkv_bias.unsqueeze(0).unsqueeze(0)
         qkv = qkv.reshape(B_, N, 3, self.num_heads, -1).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]
@@ -241,21 +301,10 @@ class WindowAttention(nn.Module):
         logit_scale = flow.clamp(self.logit_scale, min=-1e6, max=math.log(1.0 / 0.01)).exp()
         attn = attn * logit_scale
 
-        # NOTE: use relative_coords_table and meta network to generate relative_position_bias
-        relative_position_bias_table = self.cpb_mlp(self.relative_coords_table).view(
-            -1, self.num_heads
-        )
-        relative_position_bias = relative_position_bias_table[
-            self.relative_position_index.view(-1)
-        ].view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1
-        )  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(
-            2, 0, 1
-        ).contiguous()  # nH, Wh*Ww, Wh*Ww
-
-        # NOTE: constrained to a range of -16~16
-        relative_position_bias = 16 * flow.sigmoid(relative_position_bias).unsqueeze(0)
+        if use_cache:
+            relative_position_bias = self.cached_relative_position_bias
+        else:
+            relative_position_bias = self.get_relative_position_bias()
         attn = attn + relative_position_bias
 
         if mask is not None:
@@ -393,41 +442,83 @@ class SwinTransformerBlock(nn.Module):
 
         self.register_buffer("attn_mask", attn_mask)
 
+        # token index of the cyclic shift + window partition, used by `set_inference_mode`
+        partition_index = window_partition_index(
+            *self.input_resolution, self.window_size, self.shift_size
+        )
+        reverse_index = flow.argsort(partition_index)
+        self.register_buffer(
+            "partition_index",
+            partition_index.to_global(
+                placement=dist.get_layer_placement(layer_idx),
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            ),
+            persistent=False,
+        )
+        self.register_buffer(
+            "reverse_index",
+            reverse_index.to_global(
+                placement=dist.get_layer_placement(layer_idx),
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            ),
+            persistent=False,
+        )
+        self.inference_mode = False
+
+    def set_inference_mode(self, mode=True):
+        """When not training, replace roll + window_partition (and window_reverse + roll)
+        with a single index gather, and use the materialized relative position bias.
+        """
+        self.inference_mode = mode
+        self.attn.set_inference_mode(mode)
+
     def forward(self, x):
         H, W = self.input_resolution
         B, L, C = x.shape
         assert L == H * W, "input feature has wrong size"
 
         shortcut = x
-        x = x.view(B, H, W, C)
 
-        # cyclic shift
-        if self.shift_size > 0:
-            shifted_x = flow.roll(x, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
+        if self.inference_mode and not self.training:
+            # cyclic shift + partition windows in one gather
+            x_windows = flow.index_select(x, 1, self.partition_index).view(
+                -1, self.window_size * self.window_size, C
+            )  # nW*B, window_size*window_size, C
+            attn_windows = self.attn(x_windows, mask=self.attn_mask)
+            # merge windows + reverse cyclic shift in one gather
+            x = flow.index_select(attn_windows.view(B, H * W, C), 1, self.reverse_index)
         else:
-            shifted_x = x
+            x = x.view(B, H, W, C)
 
-        # partition windows
-        x_windows = window_partition(
-            shifted_x, self.window_size
-        )  # nW*B, window_size, window_size, C
-        x_windows = x_windows.view(
-            -1, self.window_size * self.window_size, C
-        )  # nW*B, window_size*window_size, C
-
-        # W-MSA/SW-MSA
-        attn_windows = self.attn(x_windows, mask=self.attn_mask)  # nW*B, window_size*window_size, C
-
-        # merge windows
-        attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
-        shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
-
-        # reverse cyclic shift
-        if self.shift_size > 0:
-            x = flow.roll(shifted_x, shifts=(self.shift_size, self.shift_size), dims=(1, 2))
-        else:
-            x = shifted_x
-        x = x.view(B, H * W, C)
+            # cyclic shift
+            if self.shift_size > 0:
+                shifted_x = flow.roll(x, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
+            else:
+                shifted_x = x
+
+            # partition windows
+            x_windows = window_partition(
+                shifted_x, self.window_size
+            )  # nW*B, window_size, window_size, C
+            x_windows = x_windows.view(
+                -1, self.window_size * self.window_size, C
+            )  # nW*B, window_size*window_size, C
+
+            # W-MSA/SW-MSA
+            attn_windows = self.attn(
+                x_windows, mask=self.attn_mask
+            )  # nW*B, window_size*window_size, C
+
+            # merge windows
+            attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
+            shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
+
+            # reverse cyclic shift
+            if self.shift_size > 0:
+                x = flow.roll(shifted_x, shifts=(self.shift_size, self.shift_size), dims=(1, 2))
+            else:
+                x = shifted_x
+            x = x.view(B, H * W, C)
         # NOTE: res-post-norm
         x = shortcut + self.drop_path(self.norm1(x))
 
@@ -817,6 +908,14 @@ class SwinTransformerV2(nn.Module):
         else:
             return {"prediction_scores": x}
 
+    def set_inference_mode(self, mode=True):
+        """Precompute the relative position bias and the window gather index of every block
+        for serving. Call it after the weights are loaded, it only takes effect in eval mode.
+        """
+        for module in self.modules():
+            if isinstance(module, SwinTransformerBlock):
+                module.set_inference_mode(mode)
+
     @staticmethod
     def set_pipeline_stage_id(model):
         dist_utils = dist.get_dist_util()
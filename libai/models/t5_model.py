@@ -260,6 +260,7 @@ class T5Model(flow.nn.Module):
         decoder_attn_mask,
         encoder_decoder_attn_mask,
         use_cache=False,
+        return_hidden_states=False,
     ):
         """
 
@@ -284,6 +285,8 @@ class T5Model(flow.nn.Module):
             use_cache (bool, optional):
                 It will be set to True, when the model is in the inference
                 phase and used for incremental decoding. Defaults to False.
+            return_hidden_states (bool, optional): Whether to skip the LM head and return the
+                final decoder states, e.g. for ``LMLogits.chunked_loss``. Defaults to False.
 
         Returns:
             flow.Tensor: logits
@@ -329,6 +332,8 @@ class T5Model(flow.nn.Module):
             self.set_cache(encoder_states, past_key_values=presents)
 
         decoder_states = self.decoder.final_layernorm(dec_hidden_states)
+        if return_hidden_states:
+            return decoder_states
         logits = self.lm_head(decoder_states, self.embedding.word_embeddings.weight)
         return logits
 
@@ -352,6 +357,9 @@ class T5Loss(flow.nn.Module):
 
     def forward(self, logits, lm_labels, loss_mask):
         lm_loss = self.lm_loss(logits, lm_labels)
+        return self.masked_mean(lm_loss, loss_mask)
+
+    def masked_mean(self, lm_loss, loss_mask):
         loss_mask = loss_mask.to_global(placement=lm_loss.placement)
         loss_mask = loss_mask.float()
         denominator = loss_mask.sum().to_global(
@@ -375,6 +383,8 @@ class T5ForPreTraining(flow.nn.Module):
         super().__init__()
         self.t5_model = T5Model(cfg)
         self.loss_func = T5Loss()
+        # compute the LM head and loss this many tokens at a time, see `LMLogits.chunked_loss`
+        self.lm_loss_chunk_size = cfg.get("lm_loss_chunk_size", None)
 
     def set_cache(self, encoder_states, past_key_values):
         self.t5_model.set_cache(encoder_states, past_key_values)
@@ -429,6 +439,24 @@ class T5ForPreTraining(flow.nn.Module):
                 :code:`{"masked_lm_loss": loss_value}` when training,
                 :code:`{"prediction_scores": logits}` when evaluating.
         """
+        if lm_labels is not None and self.lm_loss_chunk_size:
+            decoder_states = self.t5_model(
+                encoder_input_ids,
+                decoder_input_ids,
+                encoder_attn_mask,
+                decoder_attn_mask,
+                encoder_decoder_attn_mask,
+                use_cache=use_cache,
+                return_hidden_states=True,
+            )
+            lm_loss = self.t5_model.lm_head.chunked_loss(
+                decoder_states,
+                self.t5_model.embedding.word_embeddings.weight,
+                lm_labels,
+                self.lm_loss_chunk_size,
+            )
+            return self.loss_func.masked_mean(lm_loss, loss_mask)
+
         logits = self.t5_model(
             encoder_input_ids,
             decoder_input_ids,
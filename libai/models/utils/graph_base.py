@@ -19,7 +19,7 @@ import oneflow as flow
 from oneflow import nn
 from oneflow.utils.global_view import global_mode
 
-from libai.layers import TransformerLayer
+from libai.layers import LMLogitsLoss, TransformerLayer
 from libai.utils import distributed as dist
 
 logger = logging.getLogger(__name__)
@@ -68,6 +68,7 @@ class GraphBase(nn.Graph):
                 self.config.enable_zero(True, stage=zero_stage)
 
             self.set_pipeline_stage_id()
+            self.set_lm_loss_checkpoint()
 
         self.config.allow_fuse_add_to_output(True)
         self.config.allow_fuse_model_update_ops(True)
@@ -141,6 +142,18 @@ class GraphBase(nn.Graph):
                     if isinstance(module_block.to(nn.Module), TransformerLayer):
                         module_block.to(nn.graph.GraphModule).activation_checkpointing = True
 
+    def set_lm_loss_checkpoint(self):
+        # Recompute the logits of chunked LM losses in backward instead of storing them,
+        # see `LMLogits.chunked_loss`.
+        if hasattr(self.model, "origin"):
+            for module_block in self.model.modules():
+                if isinstance(module_block.origin, LMLogitsLoss):
+                    module_block.config.activation_checkpointing = True
+        else:
+            for module_block in self.model.modules():
+                if isinstance(module_block.to(nn.Module), LMLogitsLoss):
+                    module_block.to(nn.graph.GraphModule).activation_checkpointing = True
+
     def set_pipeline_stage_id(self):
         if hasattr(self.model, "origin"):
             if hasattr(type(self.model.origin), "set_pipeline_stage_id"):
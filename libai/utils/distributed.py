@@ -302,6 +302,17 @@ def get_dist_util():
     return _DIST_UTIL
 
 
+def get_device_type(device_type=None):
+    """
+    Get the device type to place tensors on, ``device_type`` if given, otherwise the one of the
+    initialized distributed environment. Falls back to "cpu" when cuda is not available.
+    """
+    device_type = get_dist_util().device_type if device_type is None else device_type
+    if not flow.cuda.is_available() and device_type == "cuda":
+        device_type = "cpu"
+    return device_type
+
+
 def get_layer_placement(layer_idx, device_type=None):
     """
     Get ``flow.placement`` object with the initialized distributed environment
@@ -313,15 +324,24 @@ def get_layer_placement(layer_idx, device_type=None):
         device_type (str, optional): device type. Defaults to "cuda".
     """
     dist_util = get_dist_util()
-    device_type = dist_util.device_type if device_type is None else device_type
-    if not flow.cuda.is_available() and device_type == "cuda":
-        device_type = "cpu"
     return flow.placement(
-        device_type,
+        get_device_type(device_type),
         dist_util.get_layer_ranks(layer_idx),
     )
 
 
+def get_all_placement(device_type=None):
+    """
+    Get ``flow.placement`` object over all ranks, used for the small tensors every rank
+    needs a copy of, e.g. the scores of beam search.
+
+    Args:
+        device_type (str, optional): device type. Defaults to the one of the initialized
+            distributed environment.
+    """
+    return flow.placement(get_device_type(device_type), list(range(get_world_size())))
+
+
 def get_nd_sbp(sbp_list):
     """Get nd sbp signature list, which is consistent with 1D/2D mesh GPUs.
 
@@ -438,7 +458,7 @@ def convert_to_distributed_default_setting(t):
 def ttol(tensor, pure_local=False, ranks=None):
     """Global tensor to local tensor."""
     if tensor.is_global:
-        placement = tensor.placement if not ranks else flow.placement("cuda", ranks)
+        placement = tensor.placement if not ranks else flow.placement(tensor.placement.type, ranks)
         if pure_local:
             tensor = tensor.to_global(placement=placement).to_local()
         else:
@@ -457,10 +477,11 @@ def tton(tensor, local_only=False, ranks=None):
     return tensor.numpy()
 
 
-def tensor_to_rank0(tensor, device="cuda", to_local=False):
-    """Global tensor to rank0."""
-    assert device in ["cpu", "cuda"], f"not supported for device:{device}"
+def tensor_to_rank0(tensor, device=None, to_local=False):
+    """Global tensor to rank0, on ``device`` or on the device type of ``tensor`` if not given."""
+    assert device in [None, "cpu", "cuda"], f"not supported for device:{device}"
     if tensor.is_global:
+        device = tensor.placement.type if device is None else device
         # Consider if it's 2d mesh, ranks should be [[0]] instead of [0]
         placement = flow.placement(device, ranks=[0] if tensor.placement.ranks.ndim == 1 else [[0]])
         tensor = tensor.to_global(
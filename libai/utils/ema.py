@@ -0,0 +1,193 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import math
+from collections import OrderedDict
+
+import oneflow as flow
+
+from libai.utils import distributed as dist
+
+logger = logging.getLogger(__name__)
+
+
+def constant_momentum(step, momentum, **kwargs):
+    return momentum
+
+
+def cosine_momentum(step, momentum, max_step, final_momentum=1.0, **kwargs):
+    """Increases the momentum from ``momentum`` to ``final_momentum`` with a half cosine,
+    as in MoCo v3 and BYOL.
+    """
+    step = min(step, max_step)
+    return (
+        final_momentum
+        - (final_momentum - momentum) * (1.0 + math.cos(math.pi * step / max_step)) / 2
+    )
+
+
+def warmup_momentum(step, momentum, tau=2000, **kwargs):
+    """Ramps the momentum up as ``momentum * (1 - exp(-step / tau))``, so that the
+    average follows the early weights closely, as in the model EMA of YOLOv5.
+    """
+    return momentum * (1.0 - math.exp(-step / tau))
+
+
+MOMENTUM_SCHEDULES = {
+    "constant": constant_momentum,
+    "cosine": cosine_momentum,
+    "warmup": warmup_momentum,
+}
+
+
+def _local(tensor):
+    return tensor.to_local() if tensor.is_global else tensor
+
+
+def _on_all_ranks(flag):
+    """Whether ``flag`` is true on every rank."""
+    flags = flow.tensor([int(flag)], dtype=flow.int32).to_global(
+        placement=dist.get_all_placement("cpu"), sbp=flow.sbp.split(0)
+    )
+    return bool(flags.to_global(sbp=flow.sbp.broadcast).min().to_local().numpy())
+
+
+def _bucket_key(tensor):
+    if tensor.is_global:
+        return (str(tensor.placement), str(tensor.sbp), str(tensor.dtype))
+    return (str(tensor.device), str(tensor.dtype))
+
+
+class _EMABucket:
+    """Targets and sources with the same placement, sbp and dtype.
+
+    The local shards of the targets are moved into one flat buffer, the targets keep
+    their identity and point to views of it. If views are not supported for these
+    tensors, the bucket falls back to updating the targets one by one.
+    """
+
+    def __init__(self, targets, sources):
+        self.targets = targets
+        self.sources = sources
+        self.flat = self._flatten_targets()
+
+    def _flatten_targets(self):
+        local_targets = [_local(t) for t in self.targets]
+        flat = flow.cat([t.detach().flatten() for t in local_targets])
+        offset = 0
+        for target, local in zip(self.targets, local_targets):
+            view = flat[offset : offset + local.numel()].view(local.shape)
+            if target.is_global:
+                view = view.to_global(placement=target.placement, sbp=target.sbp)
+            target.data = view
+            offset += local.numel()
+        shared = self._shares_storage(flat, self.targets[0])
+        if self.targets[0].is_global and dist.get_world_size() > 1:
+            # all ranks run the same global ops, so they must agree on the way to update
+            shared = _on_all_ranks(shared)
+        return flat if shared else None
+
+    @staticmethod
+    def _shares_storage(flat, target):
+        """Checks that ``target.data`` set to a view of ``flat`` keeps sharing its memory,
+        on a scratch buffer going through the same ops, so the weights are not touched.
+        """
+        local = _local(target)
+        scratch = flow.zeros(flat.shape, dtype=flat.dtype, device=flat.device)
+        view = scratch[: local.numel()].view(local.shape)
+        if target.is_global:
+            view = view.to_global(placement=target.placement, sbp=target.sbp)
+        holder = target.detach().clone()
+        holder.data = view
+        scratch.fill_(1)
+        # the shard is empty on the ranks out of the placement, nothing to update there
+        if flat.numel() == 0:
+            return True
+        return bool((_local(holder) == 1).all().numpy())
+
+    def update(self, momentum):
+        if self.flat is not None:
+            sources = flow.cat([_local(s).detach().flatten() for s in self.sources])
+            self.flat.mul_(momentum).add_(sources, alpha=1.0 - momentum)
+        else:
+            for target, source in zip(self.targets, self.sources):
+                target.mul_(momentum).add_(source.detach(), alpha=1.0 - momentum)
+
+
+class MultiTensorEMA:
+    """Exponential moving average of ``sources`` kept in ``targets``, updated in place:
+    ``target = momentum * target + (1 - momentum) * source``.
+
+    Tensor pairs are grouped into buckets of the same placement, sbp and dtype, and the
+    targets of every bucket are moved into one contiguous buffer once. An update is then
+    a single concat of the sources and a single in-place lerp per bucket, instead of a
+    few kernels and a new allocation per tensor. Targets keep being regular tensors,
+    e.g. the parameters of a momentum encoder, so modules use them as before.
+
+    Args:
+        targets (Iterable[flow.Tensor]): tensors holding the average, updated in place.
+        sources (Iterable[flow.Tensor]): tensors to average, with the shapes, placements
+            and sbp of ``targets``.
+        bucket_size (int, optional): maximum number of elements of a bucket.
+            Defaults to 2 ** 25.
+    """
+
+    def __init__(self, targets, sources, bucket_size=2 ** 25):
+        targets, sources = list(targets), list(sources)
+        assert len(targets) == len(sources), "targets and sources must have the same length"
+
+        groups = OrderedDict()
+        for target, source in zip(targets, sources):
+            assert target.shape == source.shape, f"{target.shape} != {source.shape}"
+            groups.setdefault(_bucket_key(target), []).append((target, source))
+
+        self.buckets = []
+        with flow.no_grad():
+            for pairs in groups.values():
+                start, numel = 0, 0
+                for i, (target, _) in enumerate(pairs):
+                    numel += target.numel()
+                    if numel >= bucket_size or i == len(pairs) - 1:
+                        bucket_targets, bucket_sources = zip(*pairs[start : i + 1])
+                        self.buckets.append(_EMABucket(list(bucket_targets), list(bucket_sources)))
+                        start, numel = i + 1, 0
+
+        num_fallback = sum(bucket.flat is None for bucket in self.buckets)
+        if num_fallback > 0:
+            logger.warning(
+                f"{num_fallback} of {len(self.buckets)} EMA buckets cannot be flattened, "
+                "their tensors are updated one by one"
+            )
+
+    @flow.no_grad()
+    def update(self, momentum):
+        for bucket in self.buckets:
+            bucket.update(momentum)
+
+    @flow.no_grad()
+    def copy_sources_to_targets(self):
+        for bucket in self.buckets:
+            for target, source in zip(bucket.targets, bucket.sources):
+                target.copy_(source.detach())
+
+    @flow.no_grad()
+    def swap(self):
+        """Exchanges the values of targets and sources, calling it twice restores them."""
+        for bucket in self.buckets:
+            for target, source in zip(bucket.targets, bucket.sources):
+                value = target.detach().clone()
+                target.copy_(source.detach())
+                source.copy_(value)
@@ -18,6 +18,7 @@
 import base64
 import concurrent.futures
 import errno
+import hashlib
 import logging
 import os
 import shutil
@@ -39,7 +40,7 @@ from libai.utils.non_blocking_io import NonBlockingIOManager
 # --------------------------------------------------------
 
 
-__all__ = ["LazyPath", "PathManager", "get_cache_dir", "file_lock"]
+__all__ = ["LazyPath", "PathManager", "get_cache_dir", "file_lock", "fingerprint"]
 
 
 def get_cache_dir(cache_dir: Optional[str] = None) -> str:
@@ -95,6 +96,21 @@ def file_lock(path: str):  # type: ignore
     return portalocker.Lock(path + ".lock", timeout=3600)  # type: ignore
 
 
+def fingerprint(paths: Iterable[str], *args: Any) -> str:
+    """
+    Returns a digest of the path, size and modification time of every file of
+    ``paths`` and of the ``repr`` of ``args``, e.g. to name a cache derived from the
+    files, which is rebuilt whenever they or the way they are processed change.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    for arg in args:
+        digest.update(repr(arg).encode())
+    return digest.hexdigest()[:16]
+
+
 class LazyPath(os.PathLike):
     """
     A path that's lazily evaluated when it's used.
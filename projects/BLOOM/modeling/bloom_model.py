@@ -22,7 +22,7 @@ from libai.inference.generator.generation_utils import Generator
 from libai.layers import Embedding, LayerNorm, LMLogits
 from libai.models.utils import init_method_normal, scaled_init_method_normal
 from libai.utils import distributed as dist
-from projects.BLOOM.modeling.mask import _expand_mask, _make_causal_mask, build_alibi_tensor
+from projects.BLOOM.modeling.mask import BloomMaskCache, _expand_mask
 from projects.BLOOM.modeling.transformers import BloomBlock
 
 
@@ -88,6 +88,10 @@ class BloomModel(nn.Module):
         # Final Layer Norm
         self.ln_f = LayerNorm(self.embed_dim, eps=layer_norm_epsilon, layer_idx=hidden_layers - 1)
 
+        # ALiBi bias and causal mask reused across decoding steps
+        max_length = cfg.get("max_length", None) if cfg is not None else None
+        self.mask_cache = BloomMaskCache(n_head, max_length=max_length)
+
     @classmethod
     def from_config(cls, cfg):
         return {
@@ -116,7 +120,7 @@ class BloomModel(nn.Module):
         _, src_length = input_shape
 
         if src_length > 1:
-            combined_attention_mask = _make_causal_mask(
+            combined_attention_mask = self.mask_cache.get_causal_mask(
                 input_shape, past_key_values_length=past_key_values_length
             )
 
@@ -227,7 +231,9 @@ class BloomModel(nn.Module):
                 placement=dist.get_layer_placement(0),
             )
 
-        alibi = build_alibi_tensor(attention_mask, self.num_heads, hidden_states.dtype)
+        alibi = self.mask_cache.get_alibi(
+            attention_mask, hidden_states.dtype, past_key_values_length=past_key_values_length
+        )
 
         causal_mask = self._prepare_attn_mask(
             attention_mask,
@@ -351,6 +357,10 @@ class BloomForCausalLM(nn.Module, Generator):
         inputs_embeds=None,
         **kwargs,
     ) -> dict:
+        # `Generator` passes the cache of the previous step as `past`
+        if past_key_values is None:
+            past_key_values = kwargs.get("past", None)
+
         # only last token for input_ids if past is not None
         if past_key_values:
             input_ids = input_ids[:, -1].unsqueeze(-1)
@@ -389,6 +399,7 @@ class BloomForCausalLM(nn.Module, Generator):
         )
         return self._convert_to_bloom_cache(reordered_past)
 
+    @staticmethod
     def _convert_to_standard_cache(
         past_key_value,
         batch_size,
@@ -407,6 +418,7 @@ class BloomForCausalLM(nn.Module, Generator):
             for layer_past in past_key_value
         )
 
+    @staticmethod
     def _convert_to_bloom_cache(past_key_value):
         """
         Converts the cache to the format expected by Bloom,
@@ -62,19 +62,21 @@ def _expand_mask(mask, tgt_length):
     return expanded_mask.expand(batch_size, 1, tgt_length, src_length)
 
 
-def build_alibi_tensor(attention_mask, num_heads, dtype):
-    batch_size, seq_length = attention_mask.shape
+def build_alibi_slopes(num_heads, placement):
+    """
+    Returns the `[num_heads]` ALiBi slopes, they only depend on the number of heads.
+    """
     closest_power_of_2 = 2 ** math.floor(math.log2(num_heads))
     base = flow.tensor(
         2 ** (-(2 ** -(math.log2(closest_power_of_2) - 3))),
         sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-        placement=attention_mask.placement,
+        placement=placement,
     )
     powers = flow.arange(
         1,
         1 + closest_power_of_2,
         sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-        placement=attention_mask.placement,
+        placement=placement,
     )
     slopes = flow.pow(base, powers)
 
@@ -82,7 +84,7 @@ def build_alibi_tensor(attention_mask, num_heads, dtype):
         extra_base = flow.tensor(
             2 ** (-(2 ** -(math.log2(2 * closest_power_of_2) - 3))),
             sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=attention_mask.placement,
+            placement=placement,
         )
         num_remaining_heads = min(closest_power_of_2, num_heads - closest_power_of_2)
         extra_powers = flow.arange(
@@ -90,10 +92,92 @@ def build_alibi_tensor(attention_mask, num_heads, dtype):
             1 + 2 * num_remaining_heads,
             2,
             sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=attention_mask.placement,
+            placement=placement,
         )
         slopes = flow.cat([slopes, flow.pow(extra_base, extra_powers)], dim=0)
+    return slopes
+
+
+def build_alibi_tensor(attention_mask, num_heads, dtype, slopes=None):
+    batch_size, seq_length = attention_mask.shape
+    if slopes is None:
+        slopes = build_alibi_slopes(num_heads, attention_mask.placement)
 
     arange_tensor = ((attention_mask.cumsum(dim=-1) - 1) * attention_mask)[:, None, :]
     alibi = slopes[..., None] * arange_tensor
     return alibi.reshape(batch_size * num_heads, 1, seq_length).to(dtype)
+
+
+class BloomMaskCache:
+    """
+    Keeps the ALiBi bias and the causal mask of a `BloomModel` across forward passes.
+
+    The ALiBi slopes are computed once. During incremental decoding, i.e. when the
+    attention mask only gets new columns appended and the length of the past key
+    values matches the cached bias, only the columns of the new tokens are computed
+    and appended to the cached bias. Causal masks are slices of one preallocated
+    `[max_length, max_length]` buffer, which is only rebuilt when a longer sequence
+    comes in.
+    """
+
+    def __init__(self, num_heads, max_length=None):
+        self.num_heads = num_heads
+        self.max_length = max_length
+        self.slopes = None
+        self.causal_buffer = None
+        self.reset()
+
+    def reset(self):
+        """Drops the cached ALiBi bias, e.g. before a new prompt."""
+        self.alibi = None
+        # Number of non-padding tokens of every sample seen by the cached bias.
+        self.num_valid_tokens = None
+
+    def get_alibi(self, attention_mask, dtype, past_key_values_length=0):
+        batch_size, seq_length = attention_mask.shape
+        if self.slopes is None or self.slopes.placement != attention_mask.placement:
+            self.slopes = build_alibi_slopes(self.num_heads, attention_mask.placement)
+            self.reset()
+
+        cached_length = 0 if self.alibi is None else self.alibi.shape[-1]
+        if (
+            past_key_values_length == 0
+            or cached_length != past_key_values_length
+            or cached_length >= seq_length
+            or self.alibi.shape[0] != batch_size * self.num_heads
+            or self.alibi.dtype != dtype
+        ):
+            self.alibi = build_alibi_tensor(attention_mask, self.num_heads, dtype, self.slopes)
+            self.num_valid_tokens = attention_mask.sum(dim=-1, keepdim=True)
+            return self.alibi
+
+        # Position of a new token = number of valid tokens before it, 0 for padding.
+        new_mask = attention_mask[:, cached_length:]
+        positions = (self.num_valid_tokens + new_mask.cumsum(dim=-1) - 1) * new_mask
+        self.num_valid_tokens = self.num_valid_tokens + new_mask.sum(dim=-1, keepdim=True)
+        new_alibi = (self.slopes[..., None] * positions[:, None, :]).reshape(
+            batch_size * self.num_heads, 1, seq_length - cached_length
+        )
+        self.alibi = flow.cat([self.alibi, new_alibi.to(dtype)], dim=-1)
+        return self.alibi
+
+    def get_causal_mask(self, input_ids_shape, past_key_values_length):
+        batch_size, target_length = input_ids_shape
+        total_length = target_length + past_key_values_length
+        if self.causal_buffer is None or self.causal_buffer.shape[0] < total_length:
+            self.causal_buffer = _build_causal_buffer(max(total_length, self.max_length or 0))
+        # Row `past + i` of the buffer masks the keys after token `i` of the target.
+        mask = self.causal_buffer[
+            past_key_values_length : past_key_values_length + target_length, :total_length
+        ]
+        return mask[None, None, :, :].expand(batch_size, 1, target_length, total_length)
+
+
+def _build_causal_buffer(length):
+    seq_ids = flow.arange(
+        length,
+        dtype=flow.long,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+    return seq_ids[:, None] < seq_ids[None, :]
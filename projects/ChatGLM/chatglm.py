@@ -167,7 +167,7 @@ class CoreAttention(flow.nn.Module):
 
         if attn_mask is not None:
             if attn_mask.dtype == flow.bool:
-                attn_mask.masked_fill_(attn_mask.logical_not(), float("-inf"))
+                attn_bias = attn_bias.masked_fill(attn_mask.logical_not(), float("-inf"))
             else:
                 attn_bias += attn_mask
 
@@ -745,7 +745,20 @@ class ChatGLMModel(ChatGLMPreTrainedModel):
                     [flow.ones((batch_size, self.pre_seq_len)), attention_mask], dim=-1
                 )
 
-        if full_attention_mask is None:
+        if full_attention_mask is None and attention_mask is not None and attention_mask.dim() == 3:
+            # block diagonal mask of packed sequences with 1 for the tokens to attend,
+            # see `libai.data.datasets.PackedDataset`
+            causal_mask = flow.ones(
+                seq_length,
+                seq_length,
+                dtype=flow.bool,
+                placement=attention_mask.placement,
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            ).tril()
+            full_attention_mask = flow.logical_not(
+                flow.logical_and(attention_mask.bool(), causal_mask)
+            ).unsqueeze(1)
+        elif full_attention_mask is None:
             if past_key_values and seq_length != 1:
                 full_attention_mask = self.get_masks(
                     input_ids, past_key_values, padding_mask=attention_mask
@@ -28,7 +28,15 @@ logger = setup_logger()
 
 
 class ChatGLMTrainDataset(Dataset):
-    def __init__(self, path, tokenizer, max_source_len=128, max_target_len=128, max_length=None):
+    def __init__(
+        self,
+        path,
+        tokenizer,
+        max_source_len=128,
+        max_target_len=128,
+        max_length=None,
+        pad=True,
+    ):
         with open(path, "r", encoding="utf-8") as f:
             self.data = json.load(f)
         self.tokenizer = tokenizer
@@ -38,6 +46,8 @@ class ChatGLMTrainDataset(Dataset):
             self.max_len = max_source_len + max_target_len + 1
         else:
             self.max_len = max_length
+        # set pad=False to return unpadded examples, e.g. for `PackedDataset`
+        self.pad = pad
 
         example = self._preprocess(0)
         self.log_dataset_example(example)
@@ -64,7 +74,7 @@ class ChatGLMTrainDataset(Dataset):
         labels = labels[: self.max_len - 1] + [self.tokenizer.eos_token_id]
 
         # left pad
-        pad_len = self.max_len - len(input_ids)
+        pad_len = self.max_len - len(input_ids) if self.pad else 0
         input_ids = [self.tokenizer.pad_token_id] * pad_len + input_ids
         labels = [self.tokenizer.pad_token_id] * pad_len + labels
         labels = [(l if l != self.tokenizer.pad_token_id else IGNORE_INDEX) for l in labels]
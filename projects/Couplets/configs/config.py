@@ -12,7 +12,7 @@ from modeling.model import Seq2Seq  # noqa
 
 from libai.config import get_config  # noqa
 from libai.config import LazyCall  # noqa
-from libai.data.build import build_nlp_train_loader, build_nlp_test_loader  # noqa
+from libai.data.build import build_nlp_test_loader, build_nlp_train_loader  # noqa
 
 optim = get_config("common/optim.py").optim
 graph = get_config("common/models/graph.py").graph
@@ -28,6 +28,18 @@ dataloader.train = LazyCall(build_nlp_train_loader)(
         )
     ],
     num_workers=4,
+    length_bucketing=dict(
+        enabled=False,
+        bucket_boundaries=[16, 32, 48],
+        length_keys=["encoder_attn_mask", "decoder_attn_mask"],
+        trim_fields={
+            "encoder_input_ids": [1],
+            "decoder_input_ids": [1],
+            "encoder_attn_mask": [1, 2],
+            "decoder_attn_mask": [1, 2],
+            "encoder_decoder_attn_mask": [1, 2],
+        },
+    ),
 )
 dataloader.test = [
     LazyCall(build_nlp_test_loader)(
@@ -56,6 +68,35 @@ transformer_cfg = dict(
     bias_dropout_fusion=False,
     scale_mask_softmax_fusion=False,
     apply_query_key_layer_scaling=True,
+    # Inference
+    is_encoder_decoder=True,
+    max_length=64,
+    min_length=0,
+    do_sample=False,
+    early_stopping=False,
+    num_beams=1,
+    num_beam_groups=1,
+    diversity_penalty=0.0,
+    temperature=1.0,
+    top_k=50,
+    top_p=1.0,
+    typical_p=1.0,
+    repetition_penalty=1.0,
+    length_penalty=1.0,
+    no_repeat_ngram_size=0,
+    encoder_no_repeat_ngram_size=0,
+    num_return_sequences=1,
+    output_scores=False,
+    forced_bos_token_id=None,
+    forced_eos_token_id=None,
+    remove_invalid_values=False,
+    exponential_decay_length_penalty=None,
+    use_cache=True,
+    # Tokenizer, the ids are taken from the vocab file by infer.py and distribute_infer.py
+    pad_token_id=None,
+    eos_token_id=None,
+    bos_token_id=None,
+    decoder_start_token_id=None,
 )
 model = LazyCall(Seq2Seq)(cfg=transformer_cfg)
 
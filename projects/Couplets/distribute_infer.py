@@ -5,19 +5,19 @@ dir_path = os.path.abspath(os.path.dirname(__file__))  # noqa
 sys.path.append(dir_path)  # noqa
 
 import oneflow as flow  # noqa
-from dataset.mask import make_sequence_mask  # noqa
 from tokenizer.tokenizer import CoupletsTokenizer  # noqa
 
-from libai.data.structures import DistTensorData  # noqa
 from libai.inference.basic import BasePipeline  # noqa
 from libai.utils import distributed as dist  # noqa
 
 
 def get_global_tensor(rawdata):
-    t = flow.tensor(rawdata, dtype=flow.long).unsqueeze(0)
-    dtd = DistTensorData(t)
-    dtd.to_global()
-    return dtd.tensor
+    return flow.tensor(
+        rawdata,
+        dtype=flow.long,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
 
 
 class CoupletPipeline(BasePipeline):
@@ -48,43 +48,35 @@ class CoupletPipeline(BasePipeline):
     def build_tokenizer(self, cfg):
         return CoupletsTokenizer(cfg.vocab_file)
 
-    def generate(self, sentence):
+    def generate(self, sentences):
         # Encode
-        sentence = " ".join([word for word in sentence])
-        tokens_list = self.tokenizer.tokenize(sentence)
-        encoder_ids_list = (
-            [self.tokenizer.bos_id]
-            + self.tokenizer.convert_tokens_to_ids(tokens_list)
-            + [self.tokenizer.eos_id]
+        encoder_ids_lists = [self.tokenizer.encode(sentence) for sentence in sentences]
+        max_len = max(len(ids_list) for ids_list in encoder_ids_lists)
+        encoder_input_ids = get_global_tensor(
+            [
+                ids_list + [self.tokenizer.pad_id] * (max_len - len(ids_list))
+                for ids_list in encoder_ids_lists
+            ]
+        )
+
+        # Decode with the cached keys and values of the decoder
+        outputs = self.model.generate(
+            encoder_input_ids,
+            max_length=min(max_len + 11, self.cfg.model.cfg.max_position_embeddings),
+            **self.tokenizer.generation_kwargs,
         )
-        seq_len = len(encoder_ids_list)
-        encoder_input_ids = get_global_tensor(encoder_ids_list)
-        encoder_states = self.model.encode(encoder_input_ids, None)
-
-        # Decode
-        decoder_ids_list = [self.tokenizer.bos_id]
-        decoder_input_ids = get_global_tensor(decoder_ids_list)
-        for i in range(seq_len + 10):
-            mask_array = make_sequence_mask(decoder_ids_list)
-            decoder_attn_mask = get_global_tensor(mask_array)
-            logits = self.model.decode(decoder_input_ids, decoder_attn_mask, encoder_states, None)
-            prob = logits[:, -1]
-            _, next_word = flow.max(prob, dim=1)
-            next_word = next_word.item()
-            decoder_ids_list = decoder_ids_list + [next_word]
-            decoder_input_ids = get_global_tensor(decoder_ids_list)
-            if next_word == self.tokenizer.eos_id:
-                break
-        result_tokens_list = self.tokenizer.convert_ids_to_tokens(decoder_ids_list)
-
-        return "".join(result_tokens_list).replace("<bos>", "").replace("<eos>", "")
+        return [self.tokenizer.decode(ids_list) for ids_list in dist.tton(outputs).tolist()]
 
     def preprocess(self, sentence) -> dict:
         input_dict = {"sentence": sentence}
         return input_dict
 
     def forward(self, input_dict) -> dict:
-        model_output = self.generate(input_dict["sentence"])
+        sentence = input_dict["sentence"]
+        if isinstance(sentence, str):
+            model_output = self.generate([sentence])[0]
+        else:
+            model_output = self.generate(sentence)
         model_out_dict = {"下联": model_output}
         return model_out_dict
 
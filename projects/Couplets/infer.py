@@ -1,25 +1,33 @@
+import argparse
 import os
 import sys
+import time
 
 dir_path = os.path.abspath(os.path.dirname(__file__))
 sys.path.append(dir_path)
 
 import oneflow as flow  # noqa
-from dataset.mask import make_padding_mask, make_sequence_mask  # noqa
 from modeling.model import Seq2Seq  # noqa
 from tokenizer.tokenizer import CoupletsTokenizer  # noqa
 
 from libai.config import LazyConfig  # noqa
-from libai.data.structures import DistTensorData  # noqa
 from libai.engine.default import DefaultTrainer  # noqa
+from libai.utils import distributed as dist  # noqa
 from libai.utils.checkpoint import Checkpointer  # noqa
 
 
 def get_global_tensor(rawdata):
-    t = flow.tensor(rawdata, dtype=flow.long).unsqueeze(0)
-    dtd = DistTensorData(t)
-    dtd.to_global()
-    return dtd.tensor
+    return flow.tensor(
+        rawdata,
+        dtype=flow.long,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+
+
+def pad_batch(ids_lists, pad_id):
+    max_len = max(len(ids_list) for ids_list in ids_lists)
+    return [ids_list + [pad_id] * (max_len - len(ids_list)) for ids_list in ids_lists]
 
 
 class GeneratorForEager:
@@ -29,44 +37,75 @@ class GeneratorForEager:
         Checkpointer(self.model).load(checkpoint_file)
         self.tokenizer = CoupletsTokenizer(vocab_file)
 
-    def infer(self, sentence):
-        # Encode
-        sentence = " ".join([word for word in sentence])
-        tokens_list = self.tokenizer.tokenize(sentence)
-        encoder_ids_list = (
-            [self.tokenizer.bos_id]
-            + self.tokenizer.convert_tokens_to_ids(tokens_list)
-            + [self.tokenizer.eos_id]
+    def infer_batch(self, sentences, **kwargs):
+        """
+        Second lines of a batch of first lines. The first lines are encoded once and the second
+        lines decoded with the cached keys and values of the decoder, see `Generator.generate`.
+        """
+        encoder_ids_lists = [self.tokenizer.encode(sentence) for sentence in sentences]
+        encoder_input_ids = get_global_tensor(pad_batch(encoder_ids_lists, self.tokenizer.pad_id))
+        # the second line is about as long as the first one
+        max_length = min(encoder_input_ids.shape[1] + 11, self.model.cfg.max_position_embeddings)
+        kwargs.setdefault("max_length", max_length)
+        outputs = self.model.generate(
+            encoder_input_ids, **self.tokenizer.generation_kwargs, **kwargs
         )
-        seq_len = len(encoder_ids_list)
-        encoder_input_ids = get_global_tensor(encoder_ids_list)
-        encoder_states = self.model.encode(encoder_input_ids, None)
-
-        # Decode
-        decoder_ids_list = [self.tokenizer.bos_id]
-        decoder_input_ids = get_global_tensor(decoder_ids_list)
-        for i in range(seq_len + 10):
-            mask_array = make_sequence_mask(decoder_ids_list)
-            decoder_attn_mask = get_global_tensor(mask_array)
-            logits = self.model.decode(decoder_input_ids, decoder_attn_mask, encoder_states, None)
-            prob = logits[:, -1]
-            _, next_word = flow.max(prob, dim=1)
-            next_word = next_word.item()
-            decoder_ids_list = decoder_ids_list + [next_word]
-            decoder_input_ids = get_global_tensor(decoder_ids_list)
-            if next_word == self.tokenizer.eos_id:
-                break
-        result_tokens_list = self.tokenizer.convert_ids_to_tokens(decoder_ids_list)
-
-        return "".join(result_tokens_list).replace("<bos>", "").replace("<eos>", "")
+        return [self.tokenizer.decode(ids_list) for ids_list in dist.tton(outputs).tolist()]
+
+    def infer(self, sentence, **kwargs):
+        return self.infer_batch([sentence], **kwargs)[0]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the second lines of couplets.")
+    parser.add_argument("--config_file", type=str, default="output/couplet/config.yaml")
+    parser.add_argument("--checkpoint_file", type=str, default="output/couplet/model_final")
+    parser.add_argument("--vocab_file", type=str, default="data_test/couplets/vocab.txt")
+    parser.add_argument(
+        "--input_file",
+        type=str,
+        default=None,
+        help="file of first lines, one per line. Reads the first line from stdin if not set",
+    )
+    parser.add_argument("--output_file", type=str, default=None, help="defaults to stdout")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--num_beams", type=int, default=1)
+    return parser.parse_args()
+
+
+def infer_file(generator, args):
+    with open(args.input_file, "r", encoding="utf-8") as f:
+        sentences = [line.strip() for line in f if line.strip()]
+
+    results = []
+    num_tokens = 0
+    start = time.perf_counter()
+    for i in range(0, len(sentences), args.batch_size):
+        batch = sentences[i : i + args.batch_size]
+        results.extend(generator.infer_batch(batch, num_beams=args.num_beams))
+        num_tokens += sum(len(result) for result in results[-len(batch) :])
+    elapsed = time.perf_counter() - start
+
+    if args.output_file is not None:
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            f.writelines(result + "\n" for result in results)
+    else:
+        for sentence, result in zip(sentences, results):
+            print(f"{sentence}\t{result}")
+    print(
+        f"{len(sentences)} couplets in {elapsed:.2f}s, "
+        f"{len(sentences) / elapsed:.2f} couplets/s, {num_tokens / elapsed:.2f} tokens/s",
+        file=sys.stderr,
+    )
 
 
 if __name__ == "__main__":
-    config_file = "output/couplet/config.yaml"
-    checkpoint_file = "output/couplet/model_final"
-    vocab_file = "data_test/couplets/vocab.txt"
-    generator = GeneratorForEager(config_file, checkpoint_file, vocab_file)
-
-    sentence = input("上联：\n")
-    result = generator.infer(sentence)
-    print("下联：\n" + result)
+    args = parse_args()
+    generator = GeneratorForEager(args.config_file, args.checkpoint_file, args.vocab_file)
+
+    if args.input_file is not None:
+        infer_file(generator, args)
+    else:
+        sentence = input("上联：\n")
+        result = generator.infer(sentence, num_beams=args.num_beams)
+        print("下联：\n" + result)
@@ -1,6 +1,7 @@
 import oneflow as flow
 from oneflow import nn
 
+from libai.inference.generator.generation_utils import Generator
 from libai.layers.cross_entropy import ParallelCrossEntropyLoss
 from libai.utils import distributed as dist
 
@@ -20,20 +21,49 @@ class Seq2SeqLoss(nn.Module):
         return lm_loss
 
 
-class Seq2Seq(nn.Module):
+class Seq2Seq(nn.Module, Generator):
     def __init__(self, cfg):
         super().__init__()
+        self.cfg = cfg
         self.language_model = TransformerModel(cfg)
         self.loss_func = Seq2SeqLoss()
 
     def forward(
         self,
-        encoder_input_ids,
-        decoder_input_ids,
-        encoder_attn_mask,
-        decoder_attn_mask,
-        encoder_decoder_attn_mask,
+        encoder_input_ids=None,
+        decoder_input_ids=None,
+        encoder_attn_mask=None,
+        decoder_attn_mask=None,
+        encoder_decoder_attn_mask=None,
+        encoder_states=None,
+        past_key_values=None,
+        use_cache=False,
+        only_encoder=False,
     ):
+        """
+        The arguments after ``encoder_decoder_attn_mask`` are only used by :meth:`generate`,
+        which encodes the inputs once with ``only_encoder=True`` and then decodes from
+        ``encoder_states``, with the (batch_size, seq_length) padding mask of the inputs as
+        ``encoder_attn_mask``.
+        """
+        if only_encoder:
+            seq_length = encoder_input_ids.shape[1]
+            encoder_attn_mask = encoder_attn_mask.unsqueeze(1).expand(-1, seq_length, -1)
+            return self.encode(encoder_input_ids, encoder_attn_mask.to(flow.long))
+
+        if encoder_states is not None:
+            logits = self.decode(
+                decoder_input_ids,
+                decoder_attn_mask,
+                encoder_states,
+                encoder_decoder_attn_mask,
+                past_key_values=past_key_values,
+                use_cache=use_cache,
+            )
+            if use_cache:
+                logits, past_key_values = logits
+            return {"logits": logits, "past_key_values": past_key_values if use_cache else None}
+
         logits = self.language_model(
             encoder_input_ids,
             decoder_input_ids,
@@ -74,29 +104,81 @@ class Seq2Seq(nn.Module):
         decoder_attn_mask,
         encoder_states,
         encoder_decoder_attn_mask,
+        past_key_values=None,
+        use_cache=False,
     ):
-        decoder_input_embeddings = self.language_model.embedding(decoder_input_ids)
+        # the cached keys of self attention have shape (batch_size, heads, past_length, head_size)
+        past_length = 0 if past_key_values is None else past_key_values[0][0].shape[2]
+        decoder_input_embeddings = self.language_model.embedding(decoder_input_ids, past_length)
         decoder_extended_attn_mask = self.language_model.extended_attn_mask(decoder_attn_mask)
         if encoder_decoder_attn_mask is not None:
             encoder_decoder_extended_attn_mask = self.language_model.extended_attn_mask(
                 encoder_decoder_attn_mask
             )
-            decoder_states = self.language_model.decoder(
-                decoder_input_embeddings,
-                decoder_extended_attn_mask,
-                encoder_states,
-                encoder_decoder_extended_attn_mask,
-            )
         else:
-            decoder_states = self.language_model.decoder(
-                decoder_input_embeddings,
-                decoder_extended_attn_mask,
-                encoder_states,
-                None,
-            )
+            encoder_decoder_extended_attn_mask = None
+        decoder_states = self.language_model.decoder(
+            decoder_input_embeddings,
+            decoder_extended_attn_mask,
+            encoder_states,
+            encoder_decoder_extended_attn_mask,
+            past_key_values=past_key_values,
+            use_cache=use_cache,
+        )
+        if use_cache:
+            decoder_states, presents = decoder_states
+            return self.language_model.lm_head(decoder_states), presents
         logits = self.language_model.lm_head(decoder_states)
         return logits
 
+    def _reorder_cache(self, past, beam_idx):
+        # only the self attention states differ between the beams of an input, the cross
+        # attention ones are computed from the same encoder states
+        reordered_past = ()
+        for layer_past in past:
+            beam_idx = beam_idx.to_global(placement=layer_past[0].placement)
+            reordered_past += (
+                tuple(state.index_select(0, beam_idx) for state in layer_past[:2])
+                + tuple(layer_past[2:]),
+            )
+        return reordered_past
+
+    def prepare_inputs_for_generation(
+        self,
+        input_ids,
+        past=None,
+        encoder_attn_mask=None,
+        encoder_decoder_attn_mask=None,
+        use_cache=None,
+        encoder_outputs=None,
+    ):
+        key_length = input_ids.shape[1]
+        # cut decoder_input_ids if past is used
+        if past is not None:
+            input_ids = input_ids[:, -1:]
+        batch_size, query_length = input_ids.shape
+
+        # causal mask of the new positions over the whole prefix
+        decoder_attn_mask = flow.tril(
+            flow.ones(
+                (key_length, key_length),
+                dtype=flow.long,
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+                placement=input_ids.placement,
+            )
+        )[-query_length:]
+        decoder_attn_mask = decoder_attn_mask.unsqueeze(0).expand(batch_size, -1, -1)
+        encoder_decoder_attn_mask = encoder_decoder_attn_mask.to(flow.long).unsqueeze(1)
+        encoder_decoder_attn_mask = encoder_decoder_attn_mask.expand(-1, query_length, -1)
+        return {
+            "decoder_input_ids": input_ids,
+            "decoder_attn_mask": decoder_attn_mask,
+            "encoder_decoder_attn_mask": encoder_decoder_attn_mask,
+            "encoder_states": encoder_outputs,
+            "past_key_values": past,
+            "use_cache": use_cache,
+        }
+
     @staticmethod
     def set_pipeline_stage_id(model):
         dist_utils = dist.get_dist_util()
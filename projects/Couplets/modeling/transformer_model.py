@@ -44,12 +44,14 @@ class TransformerEmbedding(nn.Module):
         ).unsqueeze(0)
         self.embedding_dropout = nn.Dropout(embedding_dropout_prob)
 
-    def forward(self, input_ids):
+    def forward(self, input_ids, past_length=0):
         seq_length = input_ids.size()[1]
 
         word_embeddings = self.word_embedding(input_ids)
         position_ids = (
-            self.position_ids[:, :seq_length].expand_as(input_ids).to_global(sbp=input_ids.sbp)
+            self.position_ids[:, past_length : past_length + seq_length]
+            .expand_as(input_ids)
+            .to_global(sbp=input_ids.sbp)
         )
         positional_encodings = self.positional_encoding(position_ids)
         embeddings = word_embeddings * math.sqrt(self.hidden_size) + positional_encodings
@@ -161,16 +163,28 @@ class TransformerDecoder(nn.Module):
         decoder_extended_attn_mask,
         encoder_states,
         encoder_decoder_extended_attn_mask,
+        past_key_values=None,
+        use_cache=False,
     ):
+        if past_key_values is None:
+            past_key_values = [None] * len(self.decoder_layers)
+        presents = []
         dec_hidden_states = decoder_input_embeddings
-        for layer in self.decoder_layers:
+        for layer, past_key_value in zip(self.decoder_layers, past_key_values):
             dec_hidden_states = layer(
                 dec_hidden_states,
                 decoder_extended_attn_mask,
                 encoder_states,
                 encoder_decoder_extended_attn_mask,
+                past_key_value=past_key_value,
+                use_cache=use_cache,
             )
+            if use_cache:
+                dec_hidden_states, present = dec_hidden_states
+                presents.append(present)
         decoder_states = self.decoder_final_layernorm(dec_hidden_states)
+        if use_cache:
+            return decoder_states, presents
         return decoder_states
 
 
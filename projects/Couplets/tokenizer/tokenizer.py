@@ -44,3 +44,28 @@ class CoupletsTokenizer:
             token = self.inv_vocab[token_id]
             tokens_list.append(token)
         return tokens_list
+
+    def encode(self, sentence):
+        """Ids of a line of characters, with or without spaces between them, in <bos> and <eos>."""
+        tokens_list = self.tokenize(" ".join([word for word in sentence]))
+        return [self.bos_id] + self.convert_tokens_to_ids(tokens_list) + [self.eos_id]
+
+    def decode(self, ids_list):
+        """Text of generated ids, up to the first <eos>."""
+        tokens_list = []
+        for token_id in ids_list:
+            if token_id == self.eos_id:
+                break
+            if token_id not in (self.bos_id, self.pad_id):
+                tokens_list.append(self.inv_vocab[token_id])
+        return "".join(tokens_list)
+
+    @property
+    def generation_kwargs(self):
+        """Special token ids passed to `Generator.generate`."""
+        return dict(
+            pad_token_id=self.pad_id,
+            eos_token_id=self.eos_id,
+            bos_token_id=self.bos_id,
+            decoder_start_token_id=self.bos_id,
+        )
@@ -194,6 +194,28 @@ def prob_mask_like(shape, prob, placement=None, sbp=None):
         return flow.zeros(shape, placement=placement, sbp=sbp).float().uniform_(0, 1) < prob
 
 
+def cond_scale_keep_mask(batch, placement=None, sbp=None):
+    # keep mask for a classifier free guidance batch made of
+    # the conditional half followed by the null-conditioned half
+    return flow.cat(
+        (
+            prob_mask_like((batch,), 1.0, placement=placement, sbp=sbp),
+            prob_mask_like((batch,), 0.0, placement=placement, sbp=sbp),
+        ),
+        dim=0,
+    )
+
+
+def double_batch(val):
+    if isinstance(val, flow.Tensor):
+        return flow.cat((val, val), dim=0)
+    if isinstance(val, dict):
+        return {k: double_batch(v) for k, v in val.items()}
+    if isinstance(val, (list, tuple)):
+        return type(val)(double_batch(v) for v in val)
+    return val
+
+
 # gaussian diffusion helper functions
 
 
@@ -700,13 +722,17 @@ class DiffusionPriorNetwork(nn.Module):
         self.learned_query = nn.Parameter(flow.randn(dim))
         self.causal_transformer = CausalTransformer(dim=dim, **kwargs)
 
-    def forward_with_cond_scale(self, *args, cond_scale=1.0, **kwargs):
-        logits = self.forward(*args, **kwargs)
-
+    def forward_with_cond_scale(self, image_embed, *args, cond_scale=1.0, **kwargs):
         if cond_scale == 1:
-            return logits
+            return self.forward(image_embed, *args, **kwargs)
 
-        null_logits = self.forward(*args, cond_drop_prob=1.0, **kwargs)
+        # conditional and null-conditioned predictions in a single doubled batch
+        batch = image_embed.shape[0]
+        logits, null_logits = self.forward(
+            *double_batch((image_embed, *args)),
+            cond_keep_mask=cond_scale_keep_mask(batch),
+            **double_batch(kwargs),
+        ).chunk(2, dim=0)
         return null_logits + (logits - null_logits) * cond_scale
 
     def forward(
@@ -718,6 +744,7 @@ class DiffusionPriorNetwork(nn.Module):
         text_encodings=None,
         mask=None,
         cond_drop_prob=0.0,
+        cond_keep_mask=None,
     ):
         batch, dim, dtype = *image_embed.shape, image_embed.dtype
 
@@ -751,7 +778,7 @@ class DiffusionPriorNetwork(nn.Module):
 
         # classifier free guidance
 
-        keep_mask = prob_mask_like((batch,), 1 - cond_drop_prob)
+        keep_mask = default(cond_keep_mask, lambda: prob_mask_like((batch,), 1 - cond_drop_prob))
         keep_mask = rearrange(keep_mask, "b -> b 1").to_global(
             placement=get_default_placement(), sbp=get_default_sbp()
         )
@@ -1579,15 +1606,18 @@ class Unet(nn.Module):
 
         return self.__class__(**{**self._locals, **updated_kwargs})
 
-    def forward_with_cond_scale(self, *args, cond_scale=1.0, **kwargs):
-        logits = self.forward(*args, **kwargs)
-
+    def forward_with_cond_scale(self, x, *args, cond_scale=1.0, **kwargs):
         if cond_scale == 1:
-            return logits
+            return self.forward(x, *args, **kwargs)
 
-        null_logits = self.forward(
-            *args, text_cond_drop_prob=1.0, image_cond_drop_prob=1.0, **kwargs
-        )
+        # conditional and null-conditioned predictions in a single doubled batch,
+        # both image and text conditions are dropped for the second half
+        batch_size = x.shape[0]
+        logits, null_logits = self.forward(
+            *double_batch((x, *args)),
+            cond_keep_mask=cond_scale_keep_mask(batch_size),
+            **double_batch(kwargs),
+        ).chunk(2, dim=0)
         return null_logits + (logits - null_logits) * cond_scale
 
     def forward(
@@ -1601,6 +1631,7 @@ class Unet(nn.Module):
         text_mask=None,
         image_cond_drop_prob=0.0,
         text_cond_drop_prob=0.0,
+        cond_keep_mask=None,
         blur_sigma=None,
         blur_kernel_size=None,
     ):
@@ -1628,8 +1659,11 @@ class Unet(nn.Module):
 
         # conditional dropout
 
-        image_keep_mask = prob_mask_like((batch_size,), 1 - image_cond_drop_prob)
-        text_keep_mask = prob_mask_like((batch_size,), 1 - text_cond_drop_prob)
+        if exists(cond_keep_mask):
+            image_keep_mask = text_keep_mask = cond_keep_mask
+        else:
+            image_keep_mask = prob_mask_like((batch_size,), 1 - image_cond_drop_prob)
+            text_keep_mask = prob_mask_like((batch_size,), 1 - text_cond_drop_prob)
 
         text_keep_mask = rearrange(text_keep_mask, "b -> b 1 1")
 
@@ -20,6 +20,7 @@ import oneflow as flow
 from oneflow import nn
 
 from libai.layers.linear import Linear
+from libai.utils import distributed as dist
 
 
 class MultiheadAttention(nn.Module):
@@ -90,7 +91,24 @@ class MultiheadAttention(nn.Module):
         hidden_states: flow.Tensor,
         attention_mask: flow.Tensor = None,
         mem=None,
+        beam_index=None,
+        sep=None,
     ):
+        """
+        Args:
+            hidden_states (flow.Tensor): shape is [bsz, tgt_len, hidden_size].
+            attention_mask (flow.Tensor, optional): dense mask of shape
+                [bsz, 1, tgt_len, mem_len + tgt_len], 1 for the keys a query attends to.
+                Defaults to None.
+            mem (flow.Tensor, optional): hidden states of the previous tokens, shape is
+                [bsz, mem_len, hidden_size]. Defaults to None.
+            beam_index (BeamIndex, optional): parent pointers of beam search, ``mem`` is then in
+                beam major order and read through them. Defaults to None.
+            sep (int or flow.Tensor, optional): used instead of ``attention_mask``, the tokens
+                before ``sep`` in ``hidden_states`` are seen by all the tokens, the others only by
+                the tokens after them. The memory is seen by all the tokens. An int, or a tensor of
+                shape [bsz]. Defaults to None, which is the same as 0.
+        """
         attention_mask = (
             attention_mask.to_global(placement=hidden_states.placement)
             if attention_mask is not None
@@ -99,6 +117,12 @@ class MultiheadAttention(nn.Module):
 
         bsz, tgt_len = hidden_states.size()[:2]
 
+        if mem is None:
+            # the prompt is processed as usual before the memory is moved to beam major order
+            beam_index = None
+        elif beam_index is not None:
+            hidden_states = beam_index.to_beam_major(hidden_states)
+
         if mem is not None:
             hidden_states = flow.cat((mem, hidden_states), dim=1)
         query_key_value = self.query_key_value(hidden_states)
@@ -108,7 +132,57 @@ class MultiheadAttention(nn.Module):
         if mem is not None:
             query = query[:, :, -tgt_len:]
 
-        context = flow._C.fused_multi_head_attention_inference_v2(
+        if beam_index is not None:
+            visible = self.visible_keys(attention_mask, sep, tgt_len, key.shape[2], key.placement)
+            context = self.beam_attention(
+                beam_index.from_beam_major(query), key, value, beam_index, visible
+            )
+        elif attention_mask is None and self.is_causal(sep) and query.placement.type == "cuda":
+            context = self.fused_attention(query, key, value)
+        else:
+            visible = self.visible_keys(attention_mask, sep, tgt_len, key.shape[2], key.placement)
+            context = self.masked_attention(query, key, value, visible)
+        output = self.dense(context)
+
+        if self.bias_dropout_fusion:
+            output, bias = output
+            output = flow._C.fused_bias_add_dropout(
+                output, bias, p=self.output_dropout_prob, axis=output.ndim - 1
+            )
+        else:
+            output = self.output_dropout(output)
+
+        return output
+
+    @staticmethod
+    def is_causal(sep):
+        # a single token before sep is seen by all the tokens in causal attention too
+        return sep is None or (isinstance(sep, int) and sep <= 1)
+
+    @staticmethod
+    def visible_keys(attention_mask, sep, query_length, key_length, placement):
+        """
+        Float mask of the keys every query attends to, broadcastable to the attention scores.
+        Without ``attention_mask`` it is built from ``sep`` on the device, from the positions of
+        the queries and keys.
+        """
+        if attention_mask is not None:
+            return attention_mask
+        memory_length = key_length - query_length
+        sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+        keys = flow.arange(key_length, sbp=sbp, placement=placement)
+        queries = flow.arange(memory_length, key_length, sbp=sbp, placement=placement)
+        visible = keys.unsqueeze(0) <= queries.unsqueeze(1)
+        if isinstance(sep, flow.Tensor):
+            sep = sep.to_global(placement=placement).view(-1, 1, 1)
+            before_sep = keys.view(1, 1, -1) < memory_length + sep
+            visible = flow.logical_or(visible.unsqueeze(0), before_sep).unsqueeze(1)
+        elif sep:
+            visible = flow.logical_or(visible, keys.unsqueeze(0) < memory_length + sep)
+        return visible.to(flow.float32)
+
+    def fused_attention(self, query, key, value):
+        return flow._C.fused_multi_head_attention_inference_v2(
             query=query,
             key=key,
             value=value,
@@ -120,17 +194,33 @@ class MultiheadAttention(nn.Module):
             value_layout="BHMK",
             output_layout="BM(HK)",
         )
-        output = self.dense(context)
 
-        if self.bias_dropout_fusion:
-            output, bias = output
-            output = flow._C.fused_bias_add_dropout(
-                output, bias, p=self.output_dropout_prob, axis=output.ndim - 1
-            )
-        else:
-            output = self.output_dropout(output)
+    def masked_softmax(self, attention_scores, visible):
+        visible = visible.to(attention_scores.dtype)
+        attention_scores = flow.mul(attention_scores, visible) - 10000.0 * (1 - visible)
+        attention_weights = flow.softmax(attention_scores, dim=-1)
+        return self.dropout(attention_weights)
 
-        return output
+    def masked_attention(self, query, key, value, visible):
+        """The counterpart of :meth:`fused_attention` for any mask, in the same layout."""
+        attention_scores = flow.matmul(
+            query, key, transpose_b=True, alpha=1.0 / math.sqrt(float(self.head_size))
+        )
+        attention_weights = self.masked_softmax(attention_scores, visible)
+        context = flow.matmul(attention_weights, value)
+        return context.transpose(1, 2).flatten(2)
+
+    def beam_attention(self, query, key, value, beam_index, visible):
+        """
+        Attention of ``query`` in hypothesis order over ``key`` and ``value`` computed from
+        the memory in beam major order, read through the parent pointers of beam search.
+        """
+        attention_scores = beam_index.attention_scores(
+            query, key, alpha=1.0 / math.sqrt(float(self.head_size))
+        )
+        attention_weights = self.masked_softmax(attention_scores, visible)
+        context = beam_index.context(attention_weights, value)
+        return context.transpose(1, 2).flatten(2)
 
     def extra_repr(self) -> str:
         return "hidden_size={}, num_heads={}".format(
@@ -85,6 +85,8 @@ class TransformerLayer(nn.Module):
         hidden_states,
         attention_mask,
         mem=None,
+        beam_index=None,
+        sep=None,
     ):
         hidden_states = hidden_states.to_global(placement=dist.get_layer_placement(self.layer_idx))
         attention_mask = (
@@ -104,6 +106,8 @@ class TransformerLayer(nn.Module):
             layernorm_output,
             attention_mask=attention_mask,
             mem=mem,
+            beam_index=beam_index,
+            sep=sep,
         )
 
         hidden_states = hidden_states + attention_output
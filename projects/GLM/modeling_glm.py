@@ -27,6 +27,61 @@ from projects.GLM.layers.embedding_layer import GLMEmbedding
 from projects.GLM.layers.transformer_layer import TransformerLayer
 
 
+class GLMMemory:
+    """
+    Memory of GLM during generation, the input hidden states of every layer for all the
+    previous tokens. They are written into preallocated per-layer buffers at a cursor instead of
+    being concatenated to the memory at every step, the buffers double in length when full.
+
+    ``memory[i]`` is the memory of layer ``i``, of shape (batch_size, length, hidden_size), or
+    None while it is empty.
+
+    Args:
+        capacity (int): initial length of the buffers.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.length = 0
+        self.buffers = None
+
+    def __len__(self):
+        return 0 if self.buffers is None else len(self.buffers)
+
+    def __getitem__(self, idx):
+        if self.length == 0:
+            return None
+        return self.buffers[idx][:, : self.length]
+
+    def _allocate(self, hidden, buffer=None):
+        new_buffer = flow.empty(
+            (hidden.shape[0], self.capacity, hidden.shape[2]),
+            dtype=hidden.dtype,
+            sbp=hidden.sbp,
+            placement=hidden.placement,
+        )
+        if buffer is not None:
+            new_buffer[:, : self.length] = buffer[:, : self.length]
+        return new_buffer
+
+    def apply(self, fn):
+        """Replaces every buffer ``buffer`` with ``fn(buffer)``."""
+        self.buffers = [fn(buffer) for buffer in self.buffers]
+
+    def write(self, hiddens):
+        """Appends the hidden states ``hiddens`` of the new tokens, one tensor per layer."""
+        new_length = self.length + hiddens[0].shape[1]
+        if self.buffers is None or new_length > self.capacity:
+            while self.capacity < new_length:
+                self.capacity *= 2
+            buffers = self.buffers or [None] * len(hiddens)
+            self.buffers = [self._allocate(h, b) for h, b in zip(hiddens, buffers)]
+        for buffer, hidden in zip(self.buffers, hiddens):
+            buffer[:, self.length : new_length] = hidden.to_global(placement=buffer.placement)
+        self.length = new_length
+        return self
+
+
 class Transformer(nn.Module):
     def __init__(
         self,
@@ -67,12 +122,14 @@ class Transformer(nn.Module):
         self.layers = nn.ModuleList([build_layer(i) for i in range(self.num_layers)])
         self.final_layernorm = LayerNorm(hidden_size, eps=layernorm_epsilon, layer_idx=-1)
 
-    def forward(self, hidden_states, attention_mask, memory_states=None):
+    def forward(self, hidden_states, attention_mask, memory_states=None, beam_index=None, sep=None):
         mem_layers = [hidden_states.detach()]
 
         for i, layer in enumerate(self.layers):
             mem_i = memory_states[i] if memory_states is not None else None
-            hidden_states = layer(hidden_states, attention_mask, mem=mem_i)
+            hidden_states = layer(
+                hidden_states, attention_mask, mem=mem_i, beam_index=beam_index, sep=sep
+            )
             mem_layers.append(hidden_states.detach())
 
         output = self.final_layernorm(hidden_states)
@@ -171,6 +228,7 @@ class GLMModel(nn.Module):
         attention_mask=None,
         memory_states=None,
         output_predict=True,
+        beam_index=None,
     ):
         input_ids = input_ids.to_global(placement=dist.get_layer_placement(0))
         position_ids = (
@@ -180,20 +238,22 @@ class GLMModel(nn.Module):
         )
         attention_mask = (
             attention_mask.to_global(placement=dist.get_layer_placement(0))
-            if attention_mask is not None
-            else None
+            if isinstance(attention_mask, flow.Tensor)
+            else attention_mask
         )
 
         batch_size, query_length = input_ids.size()
-        memory_length = memory_states[0].size(1) if memory_states is not None else 0
-        is_scalar = flow.numel(attention_mask) == 1
-        is_sep = is_scalar or flow.numel(attention_mask) == batch_size
-
-        if is_sep:
-            sep = attention_mask.item() if is_scalar else attention_mask
-            attention_mask = self.build_mask_matrix(
-                batch_size, query_length, sep, memory_length=memory_length, is_scalar=is_scalar
-            )
+        memory_length = self.memory_length(memory_states)
+
+        # sep is passed to the attention layers, which build the mask of `build_mask_matrix`
+        # from it on the device
+        sep = None
+        if attention_mask is None or isinstance(attention_mask, int):
+            sep, attention_mask = attention_mask, None
+        elif flow.numel(attention_mask) == 1:
+            sep, attention_mask = int(attention_mask.item()), None
+        elif flow.numel(attention_mask) == batch_size:
+            sep, attention_mask = attention_mask.view(-1), None
         else:
             if attention_mask.dim() == 2:
                 attention_mask = attention_mask.unsqueeze(1).unsqueeze(1)
@@ -202,9 +262,13 @@ class GLMModel(nn.Module):
         input_embeds = self.embeddings(input_ids, position_ids)
 
         logits, mem_layers = self.transformer(
-            input_embeds, attention_mask=attention_mask, memory_states=memory_states
+            input_embeds,
+            attention_mask=attention_mask,
+            memory_states=memory_states,
+            beam_index=beam_index,
+            sep=sep,
         )
-        mem_layers = self.update_mems(mem_layers, memory_states)
+        mem_layers = self.update_mems(mem_layers, memory_states, beam_index)
 
         if output_predict:
             logits = self.lm_head(logits, self.embeddings.word_embeddings.weight)
@@ -243,8 +307,21 @@ class GLMModel(nn.Module):
         )
         return m
 
-    def update_mems(self, hiddens, mems):
-        memory_length = mems[0].size(1) if mems is not None else 0
+    @staticmethod
+    def memory_length(mems):
+        if mems is None:
+            return 0
+        if isinstance(mems, GLMMemory):
+            return mems.length
+        return mems[0].size(1)
+
+    def update_mems(self, hiddens, mems, beam_index=None):
+        memory_length = self.memory_length(mems)
+        if memory_length > 0 and beam_index is not None:
+            # the memory of beam search is kept in beam major order, see `BeamIndex`
+            hiddens = [beam_index.to_beam_major(hidden) for hidden in hiddens]
+        if isinstance(mems, GLMMemory):
+            return mems.write(hiddens)
         query_length = hiddens[0].size(1)
         new_memory_length = memory_length + query_length
 
@@ -395,7 +472,12 @@ class GLMForConditionalGeneration(nn.Module, Generator):
         **kwargs,
     ):
         lm_logits, mems = self.glm(
-            input_ids, position_ids, attention_mask, memory_states=memory_states, **kwargs
+            input_ids,
+            position_ids,
+            attention_mask,
+            memory_states=memory_states,
+            beam_index=self.beam_index,
+            **kwargs,
         )
         loss = None
         if labels is not None:
@@ -405,13 +487,14 @@ class GLMForConditionalGeneration(nn.Module, Generator):
     def _reorder_cache(self, past, beam_idx):
         if past is None:
             return past
-        reordered_decoder_past = ()
-        for layer_past_states in past:
-            beam_idx = beam_idx.to_global(placement=layer_past_states.placement)
-            reordered_decoder_past = reordered_decoder_past + (
-                layer_past_states.index_select(0, beam_idx),
-            )
-        return reordered_decoder_past
+        if isinstance(past, GLMMemory):
+            if self.beam_index.history is None:
+                # the memory of beam search is kept in beam major order, see `BeamIndex`
+                past.apply(self.beam_index.to_beam_major)
+            self.beam_index.select(beam_idx, past.length)
+            return past
+        # the memory of every layer is a (batch_size * num_beams, length, hidden_size) tensor
+        return self.beam_index.reorder(past, beam_idx, length_dim=1)
 
     def prepare_inputs_for_generation(
         self,
@@ -424,17 +507,19 @@ class GLMForConditionalGeneration(nn.Module, Generator):
         attention_mask = generation_attention_mask
         # only last token for inputs_ids if past is defined in kwargs
         seq_length = input_ids.shape[1]
-        if past:
+        if past is not None:
             if position_ids is not None:
                 position_ids = position_ids[:, :, seq_length - 1].unsqueeze(-1)
-            if attention_mask is not None:
-                attention_mask = attention_mask[:, :, seq_length - 1, :seq_length].unsqueeze(-2)
+            # the new token sees the whole memory and itself, the mask of sep=0, which the
+            # attention layers build without a dense mask
+            attention_mask = 0
             input_ids = input_ids[:, -1].unsqueeze(-1)
         else:
             if position_ids is not None:
                 position_ids = position_ids[:, :, :seq_length]
             if attention_mask is not None:
                 attention_mask = attention_mask[:, :, :seq_length, :seq_length]
+            past = GLMMemory()
         return {
             "input_ids": input_ids,
             "position_ids": position_ids,
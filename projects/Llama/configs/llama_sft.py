@@ -49,6 +49,12 @@ dataloader.train = LazyCall(build_nlp_train_loader)(
             path=os.path.join(dataset_path, "train"), tokenizer=tokenization.tokenizer
         )
     ],
+    sequence_packing=dict(
+        enabled=False,
+        max_seq_length=512,
+        pad_values={"input_ids": 0, "labels": -1},
+        strip_padding=True,
+    ),
 )
 dataloader.test = [
     LazyCall(build_nlp_test_loader)(
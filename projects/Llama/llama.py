@@ -176,7 +176,12 @@ class MultiheadAttention(nn.Module):
         cos_cached: flow.Tensor = None,
         sin_cached: flow.Tensor = None,
         use_cache: bool = False,
+        beam_index=None,
     ):
+        if past_key_value is None:
+            # the prompt is processed as usual before the cache is moved to beam major order
+            beam_index = None
+
         if encoder_states is not None:
             encoder_states = encoder_states.to_global(placement=hidden_states.placement)
 
@@ -198,10 +203,15 @@ class MultiheadAttention(nn.Module):
         cos, sin = self.rotary_embed(
             value, seq_len=kv_seq_len, cos_cached=cos_cached, sin_cached=sin_cached
         )
+        if position_ids is None:
+            # the positions of the new tokens follow the cached ones
+            cos, sin = cos[kv_seq_len - tgt_len :], sin[kv_seq_len - tgt_len :]
         query, key = apply_rotary_pos_emb(query, key, cos, sin, position_ids)
 
         if past_key_value is not None:
             past_key, past_value = past_key_value
+            if beam_index is not None:
+                key, value = beam_index.to_beam_major(key), beam_index.to_beam_major(value)
             key = flow.cat((past_key.type_as(key), key), dim=2)
             value = flow.cat((past_value.type_as(value), value), dim=2)
 
@@ -210,12 +220,18 @@ class MultiheadAttention(nn.Module):
             past_key_value = (key, value)
 
         # [bsz, num_heads, tgt_len, src_len] with [S(0), S(1)]
-        attention_scores = flow.matmul(query, key, transpose_b=True, alpha=self.norm_factor)
+        if beam_index is not None:
+            attention_scores = beam_index.attention_scores(query, key, alpha=self.norm_factor)
+        else:
+            attention_scores = flow.matmul(query, key, transpose_b=True, alpha=self.norm_factor)
         attention_weights = attention_scores + attention_mask
 
         attention_weights = flow.softmax(attention_weights, dim=-1)
         # Context shape: [bsz, num_heads, tgt_len, head_size] with [S(0), S(1)]
-        context = flow.matmul(attention_weights, value)
+        if beam_index is not None:
+            context = beam_index.context(attention_weights, value)
+        else:
+            context = flow.matmul(attention_weights, value)
 
         # Change shape: [bsz, num_heads, tgt_len, head_size] -> [bsz, tgt_len, num_heads, head_size]
         context = context.transpose(1, 2)
@@ -249,15 +265,27 @@ class CasualMask(nn.Module):
         bsz, tgt_len = input_ids.size()
         casual_mask = self.mask[:tgt_len, :tgt_len]
         if past_length > 0:
-            # in case past_key_values are used, we need to add a prefix ones mask to casual mask
-            casual_mask = flow.cat(
-                [flow.ones(tgt_len, past_length, dtype=self.dtype), casual_mask], dim=-1
+            # in case past_key_values are used, the cached positions are all visible
+            past_mask = flow.zeros(
+                tgt_len,
+                past_length,
+                dtype=self.dtype,
+                sbp=self.mask.sbp,
+                placement=self.mask.placement,
             )
+            casual_mask = flow.cat([past_mask, casual_mask], dim=-1)
         casual_mask = (
             casual_mask.unsqueeze(0).unsqueeze(1).expand(bsz, 1, tgt_len, tgt_len + past_length)
         )
         casual_mask = casual_mask.to_global(sbp=input_ids.sbp)
-        if attention_mask is not None:
+        if attention_mask is not None and attention_mask.dim() == 3:
+            # block diagonal mask of packed sequences with 1 for the tokens to attend,
+            # see `libai.data.datasets.PackedDataset`
+            attention_mask = attention_mask.unsqueeze(1).to_global(placement=casual_mask.placement)
+            casual_mask = casual_mask.masked_fill(
+                attention_mask == 0, flow.finfo(casual_mask.dtype).min
+            )
+        elif attention_mask is not None:
             bsz, src_len = attention_mask.size()
             attention_mask = (
                 attention_mask[:, None, None, :]
@@ -330,6 +358,8 @@ class LlamaDecoderLayer(nn.Module):
         cos_cached=None,
         sin_cached=None,
         use_cache=False,
+        position_ids=None,
+        beam_index=None,
     ):
         hidden_states = hidden_states.to_global(placement=dist.get_layer_placement(self.layer_idx))
 
@@ -338,6 +368,10 @@ class LlamaDecoderLayer(nn.Module):
             attention_mask = attention_mask.to_global(
                 placement=dist.get_layer_placement(self.layer_idx)
             )
+        if position_ids is not None:
+            position_ids = position_ids.to_global(
+                placement=dist.get_layer_placement(self.layer_idx)
+            )
 
         if past_key_value is not None:
             if self.is_decoder:
@@ -352,10 +386,12 @@ class LlamaDecoderLayer(nn.Module):
         attention_output = self.self_attn(
             layernorm_output,
             attention_mask=attention_mask,
+            position_ids=position_ids,
             past_key_value=self_attn_past_key_value,
             cos_cached=cos_cached,
             sin_cached=sin_cached,
             use_cache=use_cache,
+            beam_index=beam_index,
         )
 
         if use_cache:
@@ -467,6 +503,8 @@ class LlamaModel(nn.Module):
         past_key_values=None,
         use_cache=False,
         set_cache=None,
+        position_ids=None,
+        beam_index=None,
     ):
         if use_cache:
             presents = []
@@ -480,7 +518,9 @@ class LlamaModel(nn.Module):
                 past_key_value=past_key_value,
                 cos_cached=self.cos_cached,
                 sin_cached=self.sin_cached,
-                use_cache=False,
+                use_cache=use_cache,
+                position_ids=position_ids,
+                beam_index=beam_index,
             )
             if use_cache:
                 hidden_states, present = hidden_states
@@ -559,7 +599,9 @@ class LlamaForCausalLM(nn.Module, Generator):
         self.past_key_values = [None] * hidden_layers
         self.past_length = 0
 
-    def forward(self, input_ids, attention_mask=None, labels=None, use_cache=False):
+    def forward(
+        self, input_ids, attention_mask=None, labels=None, use_cache=False, position_ids=None
+    ):
         input_ids = input_ids.to_global(placement=dist.get_layer_placement(0))
         attention_mask = (
             attention_mask.to_global(placement=dist.get_layer_placement(0))
@@ -590,6 +632,8 @@ class LlamaForCausalLM(nn.Module, Generator):
             past_key_values=self.past_key_values,
             use_cache=use_cache,
             set_cache=self.set_cache,
+            position_ids=position_ids,
+            beam_index=self.beam_index,
         )
 
         logits = self.lm_head(output)
@@ -611,12 +655,24 @@ class LlamaForCausalLM(nn.Module, Generator):
             f"num_layers:' {self.cfg.hidden_layers}"
         )
 
-    def prepare_inputs_for_generation(self, input_ids: flow.Tensor, **kwargs):
+        self.past_key_values = past_key_values
+
+    def _reorder_cache(self, past, beam_idx):
+        # the cached keys and values stay in place, only the parent pointers are gathered
+        return self.beam_index.reorder(past, beam_idx)
+
+    def prepare_inputs_for_generation(
+        self, input_ids: flow.Tensor, past=None, use_cache=None, **kwargs
+    ):
+        attention_mask = None
         if "attention_mask" in kwargs:
             attention_mask = kwargs.pop("attention_mask").float()
             attention_mask = attention_mask - 1
             attention_mask.masked_fill_(attention_mask == -1, flow.finfo(flow.float32).min)
-        return {"input_ids": input_ids, "attention_mask": attention_mask}
+        if past is not None:
+            input_ids = input_ids[:, -1:]
+            self.past_key_values = past
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "use_cache": use_cache}
 
     @classmethod
     def from_config(cls, cfg):
@@ -67,7 +67,9 @@ class TextGenerationPipeline(BasePipeline):
 
     def preprocess(self, inputs, **kwargs) -> dict:
         # tokenizer encoderW
-        inputs = self.tokenizer.tokenize(inputs, add_bos=True, padding=True)
+        inputs = self.tokenizer.tokenize(
+            inputs, add_bos=True, padding=True, placement=self.placement
+        )
         inputs = {
             "input_ids": inputs,
         }
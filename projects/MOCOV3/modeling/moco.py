@@ -21,13 +21,12 @@
 # --------------------------------------------------------
 
 
-import math
-
 import oneflow as flow
 import oneflow.nn as nn
 
-from libai.layers import Linear
-from libai.utils.distributed import get_world_size
+from libai.layers import ContrastiveQueue, Linear, info_nce_loss
+from libai.utils import distributed as dist
+from libai.utils.ema import MultiTensorEMA, cosine_momentum
 
 
 class MoCo(nn.Module):
@@ -37,12 +36,22 @@ class MoCo(nn.Module):
     """
 
     def __init__(
-        self, base_encoder, momentum_encoder, dim=256, mlp_dim=4096, T=1.0, m=0.99, max_iter=300
+        self,
+        base_encoder,
+        momentum_encoder,
+        dim=256,
+        mlp_dim=4096,
+        T=1.0,
+        m=0.99,
+        max_iter=300,
+        queue_size=0,
     ):
         """
         dim: feature dimension (default: 256)
         mlp_dim: hidden dimension in MLPs (default: 4096)
         T: softmax temperature (default: 1.0)
+        queue_size: number of momentum keys of previous steps used as extra negatives,
+            0 to use the keys of the current global batch only (default: 0)
         """
         super(MoCo, self).__init__()
 
@@ -56,12 +65,15 @@ class MoCo(nn.Module):
         self.max_iter = max_iter
 
         self._build_projector_and_predictor_mlps(dim, mlp_dim)
+        self.queue = ContrastiveQueue(queue_size, dim) if queue_size > 0 else None
 
         for param_b, param_m in zip(
             self.base_encoder.parameters(), self.momentum_encoder.parameters()
         ):
             param_m.data.copy_(param_b.data)  # initialize
             param_m.requires_grad = False  # not update by gradient
+        # built at the first update, after the parameters are placed
+        self.momentum_ema = None
 
     def _build_mlp(self, num_layers, input_dim, mlp_dim, output_dim, last_bn=True):
         mlp = []
@@ -89,10 +101,11 @@ class MoCo(nn.Module):
     @flow.no_grad()
     def _update_momentum_encoder(self, m):
         """Momentum update of the momentum encoder"""
-        for param_b, param_m in zip(
-            self.base_encoder.parameters(), self.momentum_encoder.parameters()
-        ):
-            param_m.data = param_m.data * m + param_b.data * (1.0 - m)
+        if self.momentum_ema is None:
+            self.momentum_ema = MultiTensorEMA(
+                self.momentum_encoder.parameters(), self.base_encoder.parameters()
+            )
+        self.momentum_ema.update(m)
 
     def contrastive_loss(self, q, k):
 
@@ -100,23 +113,19 @@ class MoCo(nn.Module):
         q = nn.functional.normalize(q, dim=1)
         k = nn.functional.normalize(k, dim=1)
 
-        # gather all targets
-        # k = concat_all_gather(k).to_global(sbp=q.sbp, placement=q.placement)
-        k = k.to_global(sbp=flow.sbp.broadcast)
-
-        # Einstein sum is more intuitive
-        logits = flow.einsum("nc,mc->nm", q, k) / self.T
-        N = logits.shape[0] // get_world_size()
-        labels = (flow.arange(N, dtype=flow.long) + N * flow.env.get_rank()).to_global(
-            sbp=flow.sbp.split(0), placement=logits.placement
+        # the positive of every query is the key of the same sample,
+        # the keys of all ranks and the queue are the negatives
+        labels = flow.arange(
+            k.shape[0],
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=q.placement,
         )
-
-        return nn.CrossEntropyLoss()(logits, labels) * (2 * self.T)
+        loss = info_nce_loss(q, k, labels, queue=self.queue, temperature=self.T)
+        return loss * (2 * self.T)
 
     def adjust_moco_momentum(self, cu_iter, m):
         """Adjust moco momentum based on current epoch"""
-        m = 1.0 - 0.5 * (1.0 + math.cos(math.pi * cu_iter / self.max_iter)) * (1.0 - m)
-        return m
+        return cosine_momentum(cu_iter, m, max_step=self.max_iter)
 
     def forward(self, images, labels=None, cu_iter=0, m=0.99):
 
@@ -135,10 +144,12 @@ class MoCo(nn.Module):
                 k1 = self.momentum_encoder(x1)["prediction_scores"]
                 k2 = self.momentum_encoder(x2)["prediction_scores"]
 
-            return (
-                {"losses": self.contrastive_loss(q1, k2) + self.contrastive_loss(q2, k1)},
-                {"m": m},
-            )
+            losses = self.contrastive_loss(q1, k2) + self.contrastive_loss(q2, k1)
+            if self.queue is not None:
+                self.queue.enqueue(nn.functional.normalize(k1, dim=1))
+                self.queue.enqueue(nn.functional.normalize(k2, dim=1))
+
+            return {"losses": losses}, {"m": m}
         else:
             return self.base_encoder(images)
 
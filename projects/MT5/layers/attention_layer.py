@@ -132,6 +132,7 @@ class MultiheadAttention(nn.Module):
         use_cache: bool = False,
         position_bias=None,
         query_length=None,
+        beam_index=None,
     ):
         """
 
@@ -150,7 +151,12 @@ class MultiheadAttention(nn.Module):
                 each shape is [bsz, num_heads, src_len, head_size]. Defaults to None.
             use_cache (bool, optional): it will be set to True, when the model is in the inference
                 phase and used for incremental decoding. Defaults to False.
+            beam_index (BeamIndex, optional): parent pointers of beam search, the cache is
+                then in beam major order and read through them. Defaults to None.
         """
+        if past_key_value is None:
+            # the first step is processed as usual before the cache is moved to beam major order
+            beam_index = None
 
         if encoder_states is not None:
             encoder_states = encoder_states.to_global(placement=hidden_states.placement)
@@ -200,13 +206,17 @@ class MultiheadAttention(nn.Module):
                 )
             if past_key_value is not None:
                 past_key, past_value = past_key_value
+                if beam_index is not None:
+                    key, value = beam_index.to_beam_major(key), beam_index.to_beam_major(value)
                 key = flow.cat((past_key.type_as(key), key), dim=2)
                 value = flow.cat((past_value.type_as(value), value), dim=2)
 
         if use_cache:
             past_key_value = (key, value)
 
-        if self.is_cross_attention or use_cache:
+        if beam_index is not None:
+            attention_scores = beam_index.attention_scores(query, key)
+        elif self.is_cross_attention or use_cache:
             attention_scores = flow.matmul(query, key, transpose_b=True, alpha=1)
 
         if position_bias is None:
@@ -241,7 +251,10 @@ class MultiheadAttention(nn.Module):
             attention_weights = flow.softmax(attention_scores, dim=-1)
             attention_weights = self.dropout(attention_weights)
 
-        context = flow.matmul(attention_weights, value)
+        if beam_index is not None:
+            context = beam_index.context(attention_weights, value)
+        else:
+            context = flow.matmul(attention_weights, value)
 
         """ transpose [batch_size, num_head, seq_len, head_size] to
             [seq_len, batch_size, num_head, head_size]
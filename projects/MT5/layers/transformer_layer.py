@@ -136,6 +136,7 @@ class TransformerLayer(nn.Module):
         use_cache=False,
         position_bias=None,
         encoder_decoder_position_bias=None,
+        beam_index=None,
     ):
         """
         Args:
@@ -154,6 +155,7 @@ class TransformerLayer(nn.Module):
                 and cross attention.
             use_cache: it will be set to `True` when the model is in the inference phase and
                 used for incremental decoding.
+            beam_index: parent pointers of beam search the self attention cache is read through.
         """
         hidden_states = hidden_states.to_global(placement=dist.get_layer_placement(self.layer_idx))
 
@@ -181,6 +183,7 @@ class TransformerLayer(nn.Module):
             past_key_value=self_attn_past_key_value,
             position_bias=position_bias,
             use_cache=use_cache,
+            beam_index=beam_index,
         )
 
         attention_output = self.drop_path(attention_output)
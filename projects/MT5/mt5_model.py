@@ -242,6 +242,7 @@ class MT5Model(flow.nn.Module, Generator):
                 position_bias=position_bias,
                 encoder_decoder_position_bias=encoder_decoder_position_bias,
                 use_cache=use_cache,
+                beam_index=self.beam_index,
             )
             if use_cache:
                 dec_hidden_states, present = dec_hidden_states
@@ -273,25 +274,10 @@ class MT5Model(flow.nn.Module, Generator):
         )
         self.past_key_values = past_key_values
 
-    def _reorder_cache(self, beam_idx):
-        past_key_values = self.past_key_values
-        reordered_decoder_past = ()
-        for layer_past_states in past_key_values:
-            # get the correct batch idx from layer past batch dim
-            # batch dim of `past` is at 2nd position
-            reordered_layer_past_states = ()
-            for layer_past_state in layer_past_states:
-                # need to set correct `past` for each of the four key / value states
-                beam_idx = beam_idx.to_global(placement=layer_past_state.placement)
-                reordered_layer_past_states = reordered_layer_past_states + (
-                    layer_past_state.index_select(0, beam_idx),
-                )
-
-            assert reordered_layer_past_states[0].shape == layer_past_states[0].shape
-            assert len(reordered_layer_past_states) == len(layer_past_states)
-
-            reordered_decoder_past = reordered_decoder_past + (reordered_layer_past_states,)
-        return reordered_decoder_past
+    def _reorder_cache(self, past, beam_idx):
+        # the cached self attention keys and values stay in place, only the parent pointers are
+        # gathered. The cross attention ones are the same for all beams of a batch element.
+        return self.beam_index.reorder(past, beam_idx, num_states=2)
 
     def prepare_inputs_for_generation(
         self,
@@ -312,7 +298,7 @@ class MT5Model(flow.nn.Module, Generator):
             input_ids.size(),
             dtype=flow.bool,
             sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=flow.placement("cuda", list(range(dist.get_world_size()))),
+            placement=self.get_generation_placement(all_ranks=True),
         )
         return {
             "decoder_input_ids": input_ids,
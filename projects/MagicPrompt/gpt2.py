@@ -184,6 +184,7 @@ class GPTModel(nn.Module, Generator):
             attention_mask=None,
             past_key_values=self.past_key_values,
             use_cache=use_cache,
+            beam_index=self.beam_index,
         )
 
         logits = self.lm_head(transformer_output, self.embeddings.token_embeddings.weight)
@@ -203,15 +204,9 @@ class GPTModel(nn.Module, Generator):
 
         self.past_key_values = past_key_values
 
-    def _reorder_cache(self, beam_idx):
-        past_key_values = self.past_key_values
-        return tuple(
-            tuple(
-                past_state.index_select(0, beam_idx.to(past_state.device))
-                for past_state in layer_past
-            )
-            for layer_past in past_key_values
-        )
+    def _reorder_cache(self, past, beam_idx):
+        # the cached keys and values stay in place, only the parent pointers are gathered
+        return self.beam_index.reorder(past, beam_idx)
 
     def prepare_inputs_for_generation(
         self,
@@ -310,7 +305,14 @@ class Transformer(nn.Module):
         self.layers = nn.ModuleList([build_layer(i) for i in range(self.hidden_layers)])
         self.layernorm_f = LayerNorm(hidden_size, eps=layernorm_epsilon, layer_idx=-1)
 
-    def forward(self, hidden_states, attention_mask, past_key_values=None, use_cache=False):
+    def forward(
+        self,
+        hidden_states,
+        attention_mask,
+        past_key_values=None,
+        use_cache=False,
+        beam_index=None,
+    ):
         if use_cache:
             presents = []
 
@@ -320,6 +322,7 @@ class Transformer(nn.Module):
                 attention_mask,
                 past_key_value=past_key_value,
                 use_cache=use_cache,
+                beam_index=beam_index,
             )
             if use_cache:
                 hidden_states, present = hidden_states
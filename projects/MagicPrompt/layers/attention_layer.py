@@ -141,6 +141,7 @@ class MultiheadAttention(nn.Module):
         attention_mask: flow.Tensor = None,
         past_key_value: Tuple[flow.Tensor, flow.Tensor] = None,
         use_cache: bool = False,
+        beam_index=None,
     ):
         """
 
@@ -159,7 +160,13 @@ class MultiheadAttention(nn.Module):
                 each shape is [bsz, num_heads, src_len, head_size]. Defaults to None.
             use_cache (bool, optional): it will be set to True, when the model is in the inference
                 phase and used for incremental decoding. Defaults to False.
+            beam_index (BeamIndex, optional): parent pointers of beam search, the cache is
+                then in beam major order and read through them. Defaults to None.
         """
+        if past_key_value is None:
+            # the prompt is processed as usual before the cache is moved to beam major order
+            beam_index = None
+
         if encoder_states is not None:
             encoder_states = encoder_states.to_global(placement=hidden_states.placement)
 
@@ -192,13 +199,18 @@ class MultiheadAttention(nn.Module):
             query, key, value = flow.chunk(query_key_value, chunks=3, dim=-1)
             if past_key_value is not None:
                 past_key, past_value = past_key_value
+                if beam_index is not None:
+                    key, value = beam_index.to_beam_major(key), beam_index.to_beam_major(value)
                 key = flow.cat((past_key.type_as(key), key), dim=2)
                 value = flow.cat((past_value.type_as(value), value), dim=2)
 
         if use_cache:
             past_key_value = (key, value)
 
-        attention_scores = flow.matmul(query, key, transpose_b=True, alpha=self.norm_factor)
+        if beam_index is not None:
+            attention_scores = beam_index.attention_scores(query, key, alpha=self.norm_factor)
+        else:
+            attention_scores = flow.matmul(query, key, transpose_b=True, alpha=self.norm_factor)
 
         if not self.is_cross_attention:
             query_length, key_length = query.size(-2), key.size(-2)
@@ -257,7 +269,10 @@ class MultiheadAttention(nn.Module):
                 attention_weights = flow.softmax(attention_scores, dim=-1)
                 attention_weights = self.dropout(attention_weights)
 
-        context = flow.matmul(attention_weights, value)
+        if beam_index is not None:
+            context = beam_index.context(attention_weights, value)
+        else:
+            context = flow.matmul(attention_weights, value)
         context = context.transpose(1, 2)
         output = self.dense(context.flatten(2))
 
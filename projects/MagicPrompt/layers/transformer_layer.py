@@ -139,6 +139,7 @@ class TransformerLayer(nn.Module):
         encoder_attention_mask=None,
         past_key_value=None,
         use_cache=False,
+        beam_index=None,
     ):
         """
         Args:
@@ -157,6 +158,7 @@ class TransformerLayer(nn.Module):
                 and cross attention.
             use_cache: it will be set to `True` when the model is in the inference phase and
                 used for incremental decoding.
+            beam_index: parent pointers of beam search the self attention cache is read through.
         """
         hidden_states = hidden_states.to_global(placement=dist.get_layer_placement(self.layer_idx))
 
@@ -182,6 +184,7 @@ class TransformerLayer(nn.Module):
             attention_mask=attention_mask,
             past_key_value=self_attn_past_key_value,
             use_cache=use_cache,
+            beam_index=beam_index,
         )
         attention_output = self.drop_path(attention_output)
 
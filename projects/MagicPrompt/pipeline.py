@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import oneflow as flow
+
 from libai.inference.basic import BasePipeline
 from libai.utils import distributed as dist
 
@@ -71,7 +73,10 @@ class TextGenerationPipeline(BasePipeline):
             self.tokenizer.pad_token = "[PAD]"
         inputs = self.tokenizer(inputs, return_tensors="of", padding=True)
         inputs = {
-            "input_ids": inputs.input_ids,
+            "input_ids": inputs.input_ids.to_global(
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+                placement=self.placement,
+            ),
         }
 
         return inputs
@@ -17,6 +17,25 @@ cfg = dict(
     N_importance=128,
     chunk=64 * 1204,
     dataset_type="Blender",
+    # empty-space skipping with an occupancy grid
+    use_occupancy_grid=False,
+    grid_resolution=128,
+    grid_bound=1.5,
+    grid_threshold=0.01,
+    grid_update_interval=16,
+    grid_warmup_steps=256,
+    march_steps=16,
+    early_stop_threshold=1e-4,
+    # xyz encoding, "frequency" or "hashgrid"
+    xyz_encoding="frequency",
+    hash_levels=16,
+    hash_features_per_level=2,
+    log2_hashmap_size=19,
+    hash_base_resolution=16,
+    hash_finest_resolution=2048,
+    hash_bound=1.5,
+    # width and height of the evaluated images, used by the streaming SSIM
+    img_wh=None,
 )
 
 cfg = DictConfig(cfg)
@@ -42,11 +42,19 @@ train.evaluation.eval_period = 1000
 train.log_period = 50
 train.optim_type = "adam"
 train.lr_scheduler_type = "cosine"
+train.xyz_encoding = "frequency"  # frequency or hashgrid
 
 # Redefining model config
 model.cfg.dataset_type = train.dataset_type
 model.cfg.loss_func = nn.MSELoss()
 model.cfg.noise_std = 0.0 if train.dataset_type == "Blender" else 1.0
+model.cfg.xyz_encoding = train.xyz_encoding
+model.cfg.img_wh = (400, 400) if train.dataset_type == "Blender" else (504, 378)
+if train.xyz_encoding == "hashgrid":
+    # The hash encoding carries most of the capacity, so a small MLP is enough
+    model.cfg.D = 2
+    model.cfg.W = 64
+    model.cfg.skips = []
 # Redefining evaluator
 train.evaluation = dict(
     enabled=True,
@@ -67,7 +75,7 @@ train.evaluation = dict(
 # also implements the corresponding optimizer.
 if train.optim_type == "adam":
     optimizer = flow.optim.Adam
-    lr = 5e-4
+    lr = 1e-2 if train.xyz_encoding == "hashgrid" else 5e-4
 elif train.optim_type == "sgd":
     optimizer = flow.optim.SGD
     lr = 5e-2
@@ -13,11 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 import glob
+import hashlib
 import json
 import os
 import re
 import sys
+import tempfile
 from collections import OrderedDict
 from typing import Optional
 
@@ -450,27 +453,125 @@ def trun_dict_to_instance(dict):
 
 
 class NerfBaseDataset(Dataset):
-    def __init__(self, root_dir, split, img_wh):
+    def __init__(self, root_dir, split, img_wh, cache_dir=None, precrop_iters=500):
+        """
+        Args:
+            root_dir: str,
+            split: str,
+            img_wh: tuple,
+            cache_dir: str, directory of the preprocessed ray buffers, default to root_dir
+            precrop_iters: int, number of training iterations sampling rays from the
+                    center crop of the images only
+        """
         super(NerfBaseDataset, self).__init__()
         self.root_dir = root_dir
         self.split = split
         self.img_wh = img_wh
+        self.cache_dir = root_dir if cache_dir is None else cache_dir
+        self.precrop_iters = precrop_iters
         self.transform = T.Compose([T.ToTensor()])
+        self._buffer = None
+        self._counter = None
         os.environ["ONEFLOW_DISABLE_VIEW"] = "true"
 
     def load_meta(self):
         pass
 
+    def __getstate__(self):
+        # the memory-mapped buffers are reopened in every worker instead of being pickled
+        state = self.__dict__.copy()
+        state["_buffer"] = None
+        state["_counter"] = None
+        return state
+
+    @property
+    def buffer(self):
+        """(num_rays, 8 + 3) memory-mapped rays and rgbs, shared by all the workers."""
+        if self._buffer is None:
+            self._buffer = np.load(self.buffer_path, mmap_mode="r")
+        return self._buffer
+
+    def build_ray_buffer(self, num_images, load_fn, key):
+        """
+        Writes the rays and rgbs of all the training images once to a memory-mapped
+        ``.npy`` file, which is reused as long as ``key`` does not change.
+
+        Args:
+            num_images: int, number of training images
+            load_fn: callable, maps an image index to its (h*w, 8) rays and (h*w, 3) rgbs
+            key: str, description of the preprocessing used to fingerprint the buffer
+        """
+        w, h = self.img_wh
+        self.num_images = num_images
+        self.num_rays = num_images * h * w
+        fingerprint = hashlib.md5(key.encode("utf-8")).hexdigest()[:16]
+        self.buffer_path = os.path.join(self.cache_dir, f"rays_{self.split}_{fingerprint}.npy")
+        if not os.path.exists(self.buffer_path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self.buffer_path}.{os.getpid()}.tmp.npy"
+            buffer = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.float32, shape=(self.num_rays, 11)
+            )
+            for i in range(num_images):
+                rays, rgbs = load_fn(i)
+                buffer[i * h * w : (i + 1) * h * w, :8] = rays.numpy()
+                buffer[i * h * w : (i + 1) * h * w, 8:] = rgbs.numpy()
+            buffer.flush()
+            del buffer
+            os.replace(tmp_path, self.buffer_path)
+
+        # pixel indices of the center crop used during the first precrop_iters iterations
+        dH, dW = int(h // 2 * 0.5), int(w // 2 * 0.5)
+        rows = np.arange(h // 2 - dH, h // 2 + dH)
+        cols = np.arange(w // 2 - dW, w // 2 + dW)
+        self.precrop_pixels = (rows[:, None] * w + cols[None, :]).reshape(-1)
+
+        # iteration counter shared by all the workers through a memory-mapped file
+        fd, self.counter_path = tempfile.mkstemp(suffix=".iter")
+        os.close(fd)
+        np.memmap(self.counter_path, dtype=np.int64, mode="w+", shape=(1,)).flush()
+        atexit.register(os.remove, self.counter_path)
+
+    def sample_rays(self):
+        """Samples a batch of random rays over the whole buffer with one gather."""
+        if self._counter is None:
+            self._counter = np.memmap(self.counter_path, dtype=np.int64, mode="r+", shape=(1,))
+        w, h = self.img_wh
+        if self._counter[0] < self.precrop_iters:
+            images = np.random.randint(0, self.num_images, size=self.batchsize)
+            pixels = self.precrop_pixels[
+                np.random.randint(0, len(self.precrop_pixels), size=self.batchsize)
+            ]
+            select_inds = images * h * w + pixels
+        else:
+            select_inds = np.random.randint(0, self.num_rays, size=self.batchsize)
+        self._counter[0] += 1
+        # sorted indices keep the reads from the memory-mapped buffer local
+        batch = np.asarray(self.buffer[np.sort(select_inds)])
+        return OrderedDict(rays=batch[:, :8], rgbs=batch[:, 8:])
+
 
 class BlenderDataset(NerfBaseDataset):
-    def __init__(self, root_dir, split="train", img_wh=(800, 800), batchsize=1024, **kwargs):
+    def __init__(
+        self,
+        root_dir,
+        split="train",
+        img_wh=(800, 800),
+        batchsize=1024,
+        cache_dir=None,
+        precrop_iters=500,
+        **kwargs,
+    ):
         """
         Args:
             root_dir: str,
             split: str,
             img_wh: tuple,
+            batchsize: int, batchsize of rays
+            cache_dir: str, directory of the preprocessed ray buffer, default to root_dir
+            precrop_iters: int, number of iterations sampling from the image center crops
         """
-        super(BlenderDataset, self).__init__(root_dir, split, img_wh)
+        super(BlenderDataset, self).__init__(root_dir, split, img_wh, cache_dir, precrop_iters)
         self.white_back = True
         self.batchsize = batchsize
         self.load_meta()
@@ -494,46 +595,45 @@ class BlenderDataset(NerfBaseDataset):
         self.directions = get_ray_directions(h, w, self.focal)  # (h, w, 3)
 
         if self.split == "train":  # create buffer of all rays and rgb data
-            self.image_paths = []
-            self.poses = []
-            self.all_rays = []
-            self.all_rgbs = []
-            self.indexs = [
-                i * self.img_wh[0] * self.img_wh[1] for i in range(len(self.meta["frames"]))
+            self.poses = [
+                np.array(frame["transform_matrix"])[:3, :4] for frame in self.meta["frames"]
+            ]
+            self.image_paths = [
+                os.path.join(self.root_dir, f"{frame['file_path']}.png")
+                for frame in self.meta["frames"]
             ]
-            for frame in self.meta["frames"]:
-                pose = np.array(frame["transform_matrix"])[:3, :4]
-                self.poses += [pose]
-                c2w = flow.Tensor(pose)
-                image_path = os.path.join(self.root_dir, f"{frame['file_path']}.png")
-                self.image_paths += [image_path]
-                img = Image.open(image_path)
+
+            def load_fn(i):
+                c2w = flow.Tensor(self.poses[i])
+                img = Image.open(self.image_paths[i])
                 img = img.resize(self.img_wh, Image.LANCZOS)
                 img = self.transform(img)  # (4, h, w)
                 img = img.view(4, -1).permute(1, 0)  # (h*w, 4) RGBA
                 img = img[:, :3] * img[:, -1:] + (1 - img[:, -1:])  # blend A to RGB
-                self.all_rgbs += [img]
                 rays_o, rays_d = get_rays(self.directions, c2w)  # both (h*w, 3)
-                self.all_rays += [
-                    flow.cat(
-                        [
-                            rays_o,
-                            rays_d,
-                            self.near * flow.ones_like(rays_o[:, :1]),
-                            self.far * flow.ones_like(rays_o[:, :1]),
-                        ],
-                        1,
-                    )
-                ]  # (h*w, 8)
-            self.all_rays = flow.cat(self.all_rays, 0)  # (len(self.meta['frames])*h*w, 3)
-            self.all_rgbs = flow.cat(self.all_rgbs, 0)  # (len(self.meta['frames])*h*w, 3)
-            self.num_iter = 0
-            self.dH = int(self.img_wh[0] // 2 * 0.5)
-            self.dW = int(self.img_wh[1] // 2 * 0.5)
+                rays = flow.cat(
+                    [
+                        rays_o,
+                        rays_d,
+                        self.near * flow.ones_like(rays_o[:, :1]),
+                        self.far * flow.ones_like(rays_o[:, :1]),
+                    ],
+                    1,
+                )  # (h*w, 8)
+                return rays, img
+
+            self.build_ray_buffer(
+                len(self.meta["frames"]),
+                load_fn,
+                key=json.dumps(
+                    ["Blender", os.path.abspath(self.root_dir), list(self.img_wh), self.poses],
+                    default=lambda x: x.tolist(),
+                ),
+            )
 
     def __len__(self):
         if self.split == "train":
-            return int(len(self.all_rays) / self.batchsize)
+            return int(self.num_rays / self.batchsize)
         elif self.split == "val":
             return 8  # only validate 8 images (to support <=8 gpus)
         elif self.split == "vis":
@@ -543,48 +643,7 @@ class BlenderDataset(NerfBaseDataset):
 
     def __getitem__(self, idx):
         if self.split == "train":  # use data in the buffers
-            idx = idx % len(self.indexs)
-            if self.num_iter < 500:
-                coords = flow.stack(
-                    flow.meshgrid(
-                        flow.linspace(
-                            self.img_wh[1] // 2 - self.dH,
-                            self.img_wh[1] // 2 + self.dH - 1,
-                            2 * self.dH,
-                        ),
-                        flow.linspace(
-                            self.img_wh[0] // 2 - self.dW,
-                            self.img_wh[0] // 2 + self.dW - 1,
-                            2 * self.dW,
-                        ),
-                    ),
-                    -1,
-                )
-            else:
-                coords = flow.stack(
-                    flow.meshgrid(
-                        flow.linspace(0, self.img_wh[1] - 1, self.img_wh[1]),
-                        flow.linspace(0, self.img_wh[0] - 1, self.img_wh[0]),
-                    ),
-                    -1,
-                )  # (H, W, 2)
-            coords = flow.reshape(coords, [-1, 2])  # (H * W, 2)
-            select_inds = np.random.choice(
-                coords.shape[0], size=[self.batchsize], replace=False
-            )  # (N_rand,)
-            select_coords = coords[select_inds].long()  # (N_rand, 2)
-            rays = self.all_rays[
-                self.indexs[idx] : self.indexs[idx] + self.img_wh[0] * self.img_wh[1]
-            ]
-            rgbs = self.all_rgbs[
-                self.indexs[idx] : self.indexs[idx] + self.img_wh[0] * self.img_wh[1]
-            ]
-            rays = rays.view(self.img_wh[1], self.img_wh[0], -1)
-            rgbs = rgbs.view(self.img_wh[1], self.img_wh[0], -1)
-            rays = rays[select_coords[:, 0], select_coords[:, 1]]  # (N_rand, 3)
-            rgbs = rgbs[select_coords[:, 0], select_coords[:, 1]]  # (N_rand, 3)
-            self.num_iter += 1
-            sample = OrderedDict(rays=rays, rgbs=rgbs)  # # a alignment point with nerf_pytorch
+            sample = self.sample_rays()
 
         elif self.split == "val" or self.split == "test":  # create data for each image separately
             frame = self.meta["frames"][idx]
@@ -635,6 +694,8 @@ class LLFFDataset(NerfBaseDataset):
         spheric_poses=False,
         val_num=1,
         batchsize=1024,
+        cache_dir=None,
+        precrop_iters=500,
     ):
         """
         Args:
@@ -646,8 +707,10 @@ class LLFFDataset(NerfBaseDataset):
             val_num: int, number of val images (used for multigpu training, validate same image
                     for all gpus)
             batchsize: int, batchsize of rays
+            cache_dir: str, directory of the preprocessed ray buffer, default to root_dir
+            precrop_iters: int, number of iterations sampling from the image center crops
         """
-        super(LLFFDataset, self).__init__(root_dir, split, img_wh)
+        super(LLFFDataset, self).__init__(root_dir, split, img_wh, cache_dir, precrop_iters)
         self.spheric_poses = spheric_poses
         self.val_num = max(1, val_num)  # at least 1
         self.batchsize = batchsize
@@ -704,14 +767,11 @@ class LLFFDataset(NerfBaseDataset):
         self.hwf = np.array([self.img_wh[1], self.img_wh[0], self.focal])
         if self.split == "train":  # create buffer of all rays and rgb data
             # use first N_images-1 to train, the LAST is val
-            self.all_rays = []
-            self.all_rgbs = []
-            self.indexs = [
-                i * self.img_wh[0] * self.img_wh[1] for i in range(len(self.image_paths) - 1)
-            ]
-            for i, image_path in enumerate(self.image_paths):
-                if i == val_idx:  # exclude the val image
-                    continue
+            train_idxs = [i for i in range(len(self.image_paths)) if i != val_idx]
+
+            def load_fn(j):
+                i = train_idxs[j]
+                image_path = self.image_paths[i]
                 c2w = flow.Tensor(self.poses[i])
                 img = Image.open(image_path).convert("RGB")
                 assert (
@@ -720,7 +780,6 @@ class LLFFDataset(NerfBaseDataset):
                 img = img.resize(self.img_wh, Image.LANCZOS)
                 img = self.transform(img)  # (3, h, w)
                 img = img.view(3, -1).permute(1, 0)  # (h*w, 3) RGB
-                self.all_rgbs += [img]
 
                 rays_o, rays_d = get_rays(self.directions, c2w)  # both (h*w, 3)
                 if not self.spheric_poses:
@@ -732,23 +791,32 @@ class LLFFDataset(NerfBaseDataset):
                     near = self.bounds.min()
                     far = min(8 * near, self.bounds.max())  # focus on central object only
 
-                self.all_rays += [
-                    flow.concat(
-                        [
-                            rays_o,
-                            rays_d,
-                            near * flow.ones_like(rays_o[:, :1]),
-                            far * flow.ones_like(rays_o[:, :1]),
-                        ],
-                        1,
-                    )
-                ]  # (h*w, 8)
-
-            self.all_rays = flow.cat(self.all_rays, 0)  # ((N_images-1)*h*w, 8)
-            self.all_rgbs = flow.cat(self.all_rgbs, 0)  # ((N_images-1)*h*w, 3)
-            self.num_iter = 0
-            self.dH = int(self.img_wh[0] // 2 * 0.5)
-            self.dW = int(self.img_wh[1] // 2 * 0.5)
+                rays = flow.concat(
+                    [
+                        rays_o,
+                        rays_d,
+                        near * flow.ones_like(rays_o[:, :1]),
+                        far * flow.ones_like(rays_o[:, :1]),
+                    ],
+                    1,
+                )  # (h*w, 8)
+                return rays, img
+
+            self.build_ray_buffer(
+                len(train_idxs),
+                load_fn,
+                key=json.dumps(
+                    [
+                        "LLFF",
+                        os.path.abspath(self.root_dir),
+                        list(self.img_wh),
+                        bool(self.spheric_poses),
+                        self.image_paths,
+                        poses_bounds,
+                    ],
+                    default=lambda x: x.tolist(),
+                ),
+            )
 
         elif self.split == "val":
             self.c2w_val = self.poses[val_idx]
@@ -769,7 +837,7 @@ class LLFFDataset(NerfBaseDataset):
 
     def __len__(self):
         if self.split == "train":
-            return int(len(self.all_rays) / self.batchsize)
+            return int(self.num_rays / self.batchsize)
         elif self.split == "vis":
             return len(self.render_poses)
         elif self.split == "val":
@@ -779,48 +847,7 @@ class LLFFDataset(NerfBaseDataset):
 
     def __getitem__(self, idx):
         if self.split == "train":  # use data in the buffers
-            idx = idx % len(self.indexs)
-            if self.num_iter < 500:
-                coords = flow.stack(
-                    flow.meshgrid(
-                        flow.linspace(
-                            self.img_wh[1] // 2 - self.dH,
-                            self.img_wh[1] // 2 + self.dH - 1,
-                            2 * self.dH,
-                        ),
-                        flow.linspace(
-                            self.img_wh[0] // 2 - self.dW,
-                            self.img_wh[0] // 2 + self.dW - 1,
-                            2 * self.dW,
-                        ),
-                    ),
-                    -1,
-                )
-            else:
-                coords = flow.stack(
-                    flow.meshgrid(
-                        flow.linspace(0, self.img_wh[1] - 1, self.img_wh[1]),
-                        flow.linspace(0, self.img_wh[0] - 1, self.img_wh[0]),
-                    ),
-                    -1,
-                )  # (H, W, 2)
-            coords = flow.reshape(coords, [-1, 2])  # (H * W, 2)
-            select_inds = np.random.choice(
-                coords.shape[0], size=[self.batchsize], replace=False
-            )  # (N_rand,)
-            select_coords = coords[select_inds].long()  # (N_rand, 2)
-            rays = self.all_rays[
-                self.indexs[idx] : self.indexs[idx] + self.img_wh[0] * self.img_wh[1]
-            ]
-            rgbs = self.all_rgbs[
-                self.indexs[idx] : self.indexs[idx] + self.img_wh[0] * self.img_wh[1]
-            ]
-            rays = rays.view(self.img_wh[1], self.img_wh[0], -1)
-            rgbs = rgbs.view(self.img_wh[1], self.img_wh[0], -1)
-            rays = rays[select_coords[:, 0], select_coords[:, 1]]  # (N_rand, 3)
-            rgbs = rgbs[select_coords[:, 0], select_coords[:, 1]]  # (N_rand, 3)
-            self.num_iter += 1
-            sample = OrderedDict(rays=rays, rgbs=rgbs)  # a alignment point with nerf_pytorch
+            sample = self.sample_rays()
 
         elif self.split in ["val", "test"]:
             if self.split == "val":
@@ -55,6 +55,9 @@ class NerfEvaluator(ClsEvaluator):
         outputs.pop(typ)
         outputs.pop("losses")
         outputs.pop("rgbs")
+        # metrics accumulated while streaming the rendered chunks
+        psnr = outputs.pop("psnr", None)
+        ssim = outputs.pop("ssim", None)
         results = {k: v.squeeze(0) for k, v in outputs.items()}
         if len(self._predictions) == 0:
             W, H = self.img_wh
@@ -74,8 +77,12 @@ class NerfEvaluator(ClsEvaluator):
             depth.save(
                 os.path.join(self.image_save_path, f"depth_{self.current_time()}.png"), quality=100
             )
-        psnr = self.psnr(results[f"rgb_{typ}"], rgbs)
-        self._predictions.append({"losses": losses.item(), "psnr": psnr.item()})
+        if psnr is None:
+            psnr = self.psnr(results[f"rgb_{typ}"], rgbs)
+        prediction = {"losses": losses.item(), "psnr": psnr.item()}
+        if ssim is not None:
+            prediction["ssim"] = ssim.item()
+        self._predictions.append(prediction)
 
     def evaluate(self):
         if not dist.is_main_process():
@@ -88,10 +95,8 @@ class NerfEvaluator(ClsEvaluator):
         total_correct_num["psnr"] = 0
         total_samples = 0
         for prediction in predictions:
-            losses = prediction["losses"]
-            psnr = prediction["psnr"]
-            total_correct_num["losses"] += losses
-            total_correct_num["psnr"] += psnr
+            for key, value in prediction.items():
+                total_correct_num[key] = total_correct_num.get(key, 0) + value
             total_samples += 1
 
         self._results = OrderedDict()
@@ -0,0 +1,117 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import math
+
+import oneflow as flow
+import oneflow.nn.functional as F
+
+
+class StreamingImageMetrics(object):
+    def __init__(self, width, window_size=11, sigma=1.5, data_range=1.0):
+        """
+        Accumulates the PSNR and SSIM of an image whose pixels are fed chunk by chunk in
+        raster order, so that the metrics never need the whole rendered image at once.
+        SSIM uses a gaussian window without padding, rows are processed as soon as
+        ``window_size`` of them are available and only the last ``window_size - 1`` rows
+        are kept between two updates.
+
+        Args:
+            width (int): the width of the image
+            window_size (int): size of the gaussian window of SSIM
+            sigma (float): standard deviation of the gaussian window of SSIM
+            data_range (float): value range of the pixels
+        """
+        self.width = width
+        self.window_size = window_size
+        self.C1 = (0.01 * data_range) ** 2
+        self.C2 = (0.03 * data_range) ** 2
+
+        gauss = flow.tensor(
+            [
+                math.exp(-((x - window_size // 2) ** 2) / (2 * sigma ** 2))
+                for x in range(window_size)
+            ]
+        )
+        gauss = gauss / gauss.sum()
+        window = gauss.unsqueeze(1) @ gauss.unsqueeze(0)  # (window_size, window_size)
+        self.window = window.expand(3, 1, window_size, window_size).contiguous()
+
+        self.squared_error = 0.0
+        self.num_values = 0
+        self.ssim_sum = 0.0
+        self.ssim_count = 0
+        self._tail_pred = None
+        self._tail_gt = None
+        self._rows_pred = None
+        self._rows_gt = None
+
+    def update(self, pred, gt):
+        """
+        Inputs:
+            pred (tensor): (N, 3) rendered pixels following the previously fed ones
+            gt (tensor): (N, 3) ground truth pixels
+        """
+        pred, gt = pred.float(), gt.float()
+        self.squared_error = self.squared_error + ((pred - gt) ** 2).sum()
+        self.num_values += pred.numel()
+
+        # group the pixels into complete rows
+        if self._tail_pred is not None:
+            pred = flow.cat([self._tail_pred, pred], 0)
+            gt = flow.cat([self._tail_gt, gt], 0)
+        num_rows = pred.shape[0] // self.width
+        num_full = num_rows * self.width
+        self._tail_pred, self._tail_gt = pred[num_full:], gt[num_full:]
+        if num_rows == 0:
+            return
+        rows_pred = pred[:num_full].view(num_rows, self.width, 3)
+        rows_gt = gt[:num_full].view(num_rows, self.width, 3)
+        if self._rows_pred is not None:
+            rows_pred = flow.cat([self._rows_pred, rows_pred], 0)
+            rows_gt = flow.cat([self._rows_gt, rows_gt], 0)
+
+        if rows_pred.shape[0] >= self.window_size:
+            self._accumulate_ssim(rows_pred, rows_gt)
+            rows_pred = rows_pred[-(self.window_size - 1) :]
+            rows_gt = rows_gt[-(self.window_size - 1) :]
+        self._rows_pred, self._rows_gt = rows_pred, rows_gt
+
+    def _accumulate_ssim(self, rows_pred, rows_gt):
+        if rows_pred.is_global and not self.window.is_global:
+            self.window = self.window.to_global(placement=rows_pred.placement, sbp=rows_pred.sbp)
+        x = rows_pred.permute(2, 0, 1).unsqueeze(0)  # (1, 3, rows, W)
+        y = rows_gt.permute(2, 0, 1).unsqueeze(0)
+
+        def filt(t):
+            return F.conv2d(t, self.window, groups=3)
+
+        mu_x, mu_y = filt(x), filt(y)
+        sigma_x = filt(x * x) - mu_x ** 2
+        sigma_y = filt(y * y) - mu_y ** 2
+        sigma_xy = filt(x * y) - mu_x * mu_y
+        ssim_map = ((2 * mu_x * mu_y + self.C1) * (2 * sigma_xy + self.C2)) / (
+            (mu_x ** 2 + mu_y ** 2 + self.C1) * (sigma_x + sigma_y + self.C2)
+        )
+        self.ssim_sum = self.ssim_sum + ssim_map.sum()
+        self.ssim_count += ssim_map.numel()
+
+    def psnr(self):
+        mse = self.squared_error / self.num_values
+        return -10 * flow.log(mse) / math.log(10)
+
+    def ssim(self):
+        if self.ssim_count == 0:
+            return None
+        return self.ssim_sum / self.ssim_count
@@ -12,6 +12,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import math
+
 import oneflow as flow
 import oneflow.nn as nn
 import oneflow.nn.functional as F
@@ -65,6 +67,94 @@ class Embedding(nn.Module):
         return flow.cat(out, -1)
 
 
+class HashEmbedding(nn.Module):
+    def __init__(
+        self,
+        in_channels=3,
+        n_levels=16,
+        n_features_per_level=2,
+        log2_hashmap_size=19,
+        base_resolution=16,
+        finest_resolution=2048,
+        bound=1.5,
+    ):
+        """
+        Multiresolution hash encoding of Instant-NGP (https://arxiv.org/abs/2201.05989),
+        embeds x to (x, f_1(x), ..., f_L(x)) where f_l trilinearly interpolates the learned
+        features stored at the hashed corners of the level l grid cell containing x.
+        in_channels: number of input channels (3 for xyz)
+        n_levels: number of grid resolutions
+        n_features_per_level: number of features stored per hash table entry
+        log2_hashmap_size: log2 of the number of entries of each level hash table
+        base_resolution: resolution of the coarsest level
+        finest_resolution: resolution of the finest level
+        bound: half side length of the cube [-bound, bound]^3 covered by the grids
+        """
+        super(HashEmbedding, self).__init__()
+        assert in_channels == 3, "HashEmbedding only supports 3D inputs"
+        self.in_channels = in_channels
+        self.n_levels = n_levels
+        self.n_features_per_level = n_features_per_level
+        self.hashmap_size = 2 ** log2_hashmap_size
+        self.bound = bound
+        self.out_channels = in_channels + n_levels * n_features_per_level
+
+        growth = math.exp(
+            (math.log(finest_resolution) - math.log(base_resolution)) / max(n_levels - 1, 1)
+        )
+        resolutions = [math.floor(base_resolution * growth ** level) for level in range(n_levels)]
+        self.embeddings = nn.Parameter(
+            flow.empty(n_levels * self.hashmap_size, n_features_per_level).uniform_(-1e-4, 1e-4)
+        )
+
+        placement = dist.get_layer_placement(0)
+        sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+        # the 8 corners of a grid cell
+        offsets = [[(i >> 2) & 1, (i >> 1) & 1, i & 1] for i in range(8)]
+        for name, value in (
+            ("resolutions", flow.tensor(resolutions, dtype=flow.float32)),
+            ("level_offsets", flow.arange(n_levels, dtype=flow.int64) * self.hashmap_size),
+            ("corner_offsets", flow.tensor(offsets, dtype=flow.int64)),
+            ("primes", flow.tensor([1, 2654435761, 805459861], dtype=flow.int64)),
+        ):
+            self.register_buffer(
+                name, value.to_global(placement=placement, sbp=sbp), persistent=False
+            )
+
+    def forward(self, x):
+        """
+        Inputs:
+            x (Tensor): (B, self.in_channels)
+
+        Outputs:
+            out (Tensor): (B, self.out_channels)
+        """
+        B = x.shape[0]
+        x_ = ((x + self.bound) / (2 * self.bound)).clamp(0, 1)
+        # (B, n_levels, 3) positions in grid units of every level
+        pos = x_.unsqueeze(1) * self.resolutions.view(1, -1, 1)
+        pos_floor = flow.floor(pos)
+        frac = pos - pos_floor
+
+        # (B, n_levels, 8, 3) integer coordinates of the cell corners
+        corners = pos_floor.to(flow.int64).unsqueeze(2) + self.corner_offsets
+        hashed = corners * self.primes
+        hashed = (
+            flow.bitwise_xor(flow.bitwise_xor(hashed[..., 0], hashed[..., 1]), hashed[..., 2])
+            % self.hashmap_size
+        )
+        index = hashed + self.level_offsets.view(1, -1, 1)  # (B, n_levels, 8)
+        features = flow.index_select(self.embeddings, 0, index.view(-1)).view(
+            B, self.n_levels, 8, self.n_features_per_level
+        )
+
+        # (B, n_levels, 8) trilinear interpolation weights
+        frac = frac.unsqueeze(2)
+        weights = flow.where(self.corner_offsets.to(flow.bool), frac, 1 - frac).prod(-1)
+        out = (weights.unsqueeze(-1).to(features.dtype) * features).sum(2)
+        return flow.cat([x, out.view(B, -1).to(x.dtype)], -1)
+
+
 class NeRF(nn.Module):  # a alignment point with nerf_pytorch
     def __init__(
         self, D=8, W=256, input_ch=63, input_ch_views=27, output_ch=5, skips=[4], use_viewdirs=True
@@ -144,3 +234,100 @@ class NeRF(nn.Module):  # a alignment point with nerf_pytorch
         else:
             outputs = self.output_linear(h)
         return outputs
+
+
+class OccupancyGrid(nn.Module):
+    def __init__(
+        self,
+        resolution=128,
+        bound=1.5,
+        decay=0.95,
+        threshold=0.01,
+        update_ratio=0.25,
+    ):
+        """
+        Maintains a binary occupancy grid over the cube [-bound, bound]^3 so that ray
+        marching can skip empty space. The grid keeps an exponential moving maximum of
+        the density of every cell and is refreshed periodically from the NeRF sigma.
+
+        resolution: number of cells along each axis
+        bound: half of the side length of the scene bounding box
+        decay: decay factor of the cell density at every update
+        threshold: density threshold above which a cell is considered occupied
+        update_ratio: fraction of the cells re-evaluated at every update
+        """
+        super(OccupancyGrid, self).__init__()
+        self.resolution = resolution
+        self.bound = bound
+        self.decay = decay
+        self.threshold = threshold
+        self.update_ratio = update_ratio
+        placement = dist.get_layer_placement(0)
+        sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+        num_cells = resolution ** 3
+        self.register_buffer(
+            "density_grid",
+            flow.zeros(num_cells, dtype=flow.float32, placement=placement, sbp=sbp),
+        )
+        # every cell is occupied until the first update
+        self.register_buffer(
+            "bitfield",
+            flow.ones(num_cells, dtype=flow.int8, placement=placement, sbp=sbp),
+        )
+
+    def cell_index(self, xyz):
+        """
+        Inputs:
+            xyz (Tensor): (..., 3) world coordinates
+
+        Outputs:
+            index (Tensor): (...) flattened cell index of each point
+            inside (Tensor): (...) whether the point lies inside the grid bounds
+        """
+        rel = (xyz + self.bound) / (2 * self.bound)  # [0, 1) inside the bounding box
+        inside = ((rel >= 0) & (rel < 1)).all(-1)
+        ijk = (rel.clamp(0, 1 - 1e-6) * self.resolution).to(flow.int64)
+        index = (ijk[..., 0] * self.resolution + ijk[..., 1]) * self.resolution + ijk[..., 2]
+        return index, inside
+
+    def forward(self, xyz):
+        """
+        Inputs:
+            xyz (Tensor): (..., 3) world coordinates
+
+        Outputs:
+            occupied (Tensor): (...) bool mask of the points falling into occupied cells
+        """
+        index, inside = self.cell_index(xyz)
+        occupied = flow.index_select(self.bitfield, 0, index.view(-1)).view(index.shape)
+        return occupied.to(flow.bool) & inside
+
+    @flow.no_grad()
+    def update(self, density_fn, chunk=1024 * 64):
+        """
+        Re-evaluates the density of a random subset of cells at a jittered position,
+        decays the whole grid and rebuilds the occupancy bitfield.
+
+        Inputs:
+            density_fn (callable): maps (N, 3) world coordinates to (N, 1) raw sigma
+            chunk (int): number of points queried at once
+        """
+        R = self.resolution
+        num_cells = R ** 3
+        num_update = max(int(num_cells * self.update_ratio), 1)
+        placement, sbp = self.density_grid.placement, self.density_grid.sbp
+        cells = flow.randint(0, num_cells, (num_update,), placement=placement, sbp=sbp)
+        ijk = flow.stack([cells // (R * R), (cells // R) % R, cells % R], -1).to(flow.float32)
+        jitter = flow.rand(num_update, 3, placement=placement, sbp=sbp)
+        xyz = (ijk + jitter) / R * (2 * self.bound) - self.bound
+
+        sigmas = flow.cat(
+            [density_fn(xyz[i : i + chunk]).view(-1) for i in range(0, num_update, chunk)], 0
+        )
+        density_grid = self.density_grid * self.decay
+        sampled = flow.maximum(flow.index_select(density_grid, 0, cells), flow.relu(sigmas))
+        density_grid = flow.scatter(density_grid, 0, cells, sampled.to(density_grid.dtype))
+        self.density_grid.copy_(density_grid)
+
+        threshold = min(self.threshold, density_grid.mean().item())
+        self.bitfield.copy_((density_grid > threshold).to(flow.int8))
@@ -19,7 +19,9 @@ import oneflow as flow
 import oneflow.nn as nn
 
 from libai.config.config import configurable
-from projects.NeRF.modeling.NeRF import Embedding, NeRF
+from libai.utils import distributed as dist
+from projects.NeRF.evaluation.streaming_metrics import StreamingImageMetrics
+from projects.NeRF.modeling.NeRF import Embedding, HashEmbedding, NeRF, OccupancyGrid
 
 
 class NerfSystem(nn.Module):
@@ -39,6 +41,22 @@ class NerfSystem(nn.Module):
         chunk=32 * 1204,
         dataset_type="Blender",
         loss_func=None,
+        use_occupancy_grid=False,
+        grid_resolution=128,
+        grid_bound=1.5,
+        grid_threshold=0.01,
+        grid_update_interval=16,
+        grid_warmup_steps=256,
+        march_steps=16,
+        early_stop_threshold=1e-4,
+        xyz_encoding="frequency",
+        hash_levels=16,
+        hash_features_per_level=2,
+        log2_hashmap_size=19,
+        hash_base_resolution=16,
+        hash_finest_resolution=2048,
+        hash_bound=1.5,
+        img_wh=None,
     ):
         """
         Args:
@@ -55,6 +73,27 @@ class NerfSystem(nn.Module):
             chunk (int): chunk size to split the input to avoid OOM
             dataset_type (str): the dataset applied for training and evaluating
             loss_func (callable): type of loss function
+            use_occupancy_grid (bool): skip empty space with an occupancy grid while marching
+            grid_resolution (int): number of occupancy grid cells along each axis
+            grid_bound (float): half side length of the cube covered by the occupancy grid
+            grid_threshold (float): density threshold of an occupied cell
+            grid_update_interval (int): number of training steps between grid updates
+            grid_warmup_steps (int): number of training steps before the first grid update,
+                every cell is considered occupied until then
+            march_steps (int): number of samples evaluated per ray at each marching step
+            early_stop_threshold (float): stop marching a ray once its transmittance
+                drops below this value, 0 disables early stopping
+            xyz_encoding (str): encoding of xyz, "frequency" for the positional encoding
+                or "hashgrid" for the multiresolution hash encoding. With "hashgrid",
+                in_channels_xyz is inferred from the encoder
+            hash_levels (int): number of levels of the hash encoding
+            hash_features_per_level (int): number of features per level of the hash encoding
+            log2_hashmap_size (int): log2 of the hash table size of each level
+            hash_base_resolution (int): coarsest resolution of the hash encoding
+            hash_finest_resolution (int): finest resolution of the hash encoding
+            hash_bound (float): half side length of the cube covered by the hash encoding
+            img_wh (tuple(int)): the width and height of the validation images, used to
+                compute SSIM while streaming the rendered rays
         """
         super(NerfSystem, self).__init__()
         self.N_samples = N_samples
@@ -65,7 +104,20 @@ class NerfSystem(nn.Module):
         self.chunk = chunk
         self.white_back = True if dataset_type == "Blender" else False
         self.loss_func = nn.MSELoss() if loss_func is None else loss_func
-        self.embedding_xyz = Embedding(3, 10)  # 10 is the default number
+        assert xyz_encoding in ["frequency", "hashgrid"], "Unsupported xyz encoding"
+        if xyz_encoding == "hashgrid":
+            self.embedding_xyz = HashEmbedding(
+                3,
+                n_levels=hash_levels,
+                n_features_per_level=hash_features_per_level,
+                log2_hashmap_size=log2_hashmap_size,
+                base_resolution=hash_base_resolution,
+                finest_resolution=hash_finest_resolution,
+                bound=hash_bound,
+            )
+            in_channels_xyz = self.embedding_xyz.out_channels
+        else:
+            self.embedding_xyz = Embedding(3, 10)  # 10 is the default number
         self.embedding_dir = Embedding(3, 4)  # 4 is the default number
         self.nerf_coarse = NeRF(
             D=D,
@@ -86,6 +138,21 @@ class NerfSystem(nn.Module):
                 skips=skips,
             )
             self.models += [self.nerf_fine]
+        self.grid_update_interval = grid_update_interval
+        self.grid_warmup_steps = grid_warmup_steps
+        self.march_steps = march_steps
+        self.early_stop_threshold = early_stop_threshold
+        self.occupancy_grid = (
+            OccupancyGrid(
+                resolution=grid_resolution,
+                bound=grid_bound,
+                threshold=grid_threshold,
+            )
+            if use_occupancy_grid
+            else None
+        )
+        self.num_updates = 0
+        self.img_wh = img_wh
 
     @classmethod
     def from_config(cls, cfg):
@@ -103,6 +170,22 @@ class NerfSystem(nn.Module):
             "chunk": cfg.chunk,
             "dataset_type": cfg.dataset_type,
             "loss_func": cfg.loss_func,
+            "use_occupancy_grid": cfg.get("use_occupancy_grid", False),
+            "grid_resolution": cfg.get("grid_resolution", 128),
+            "grid_bound": cfg.get("grid_bound", 1.5),
+            "grid_threshold": cfg.get("grid_threshold", 0.01),
+            "grid_update_interval": cfg.get("grid_update_interval", 16),
+            "grid_warmup_steps": cfg.get("grid_warmup_steps", 256),
+            "march_steps": cfg.get("march_steps", 16),
+            "early_stop_threshold": cfg.get("early_stop_threshold", 1e-4),
+            "xyz_encoding": cfg.get("xyz_encoding", "frequency"),
+            "hash_levels": cfg.get("hash_levels", 16),
+            "hash_features_per_level": cfg.get("hash_features_per_level", 2),
+            "log2_hashmap_size": cfg.get("log2_hashmap_size", 19),
+            "hash_base_resolution": cfg.get("hash_base_resolution", 16),
+            "hash_finest_resolution": cfg.get("hash_finest_resolution", 2048),
+            "hash_bound": cfg.get("hash_bound", 1.5),
+            "img_wh": cfg.get("img_wh", None),
         }
 
     def sample_pdf(self, bins, weights, N_importance, det=False, eps=1e-5):
@@ -165,6 +248,7 @@ class NerfSystem(nn.Module):
         chunk=1024 * 32,
         white_back=False,
         weights_only=False,
+        valid_mask=None,
     ):
         """
         Helper function that performs model inference.
@@ -183,6 +267,9 @@ class NerfSystem(nn.Module):
             dir_embedded (tensor): (N_rays, embed_dir_channels) embedded directions
             z_vals (tensor): (N_rays, N_samples_) depths of the sampled positions
             weights_only (tensor): do inference on sigma only or not
+            valid_mask (tensor): (N_rays, N_samples_) samples to evaluate, the others are
+                                 treated as empty space. If given, rays are marched
+                                 with early stopping on transmittance
 
         Outputs:
             if weights_only:
@@ -194,33 +281,10 @@ class NerfSystem(nn.Module):
         """
         N_samples_ = xyz_.shape[1]
         # Embed directions
-        xyz_ = xyz_.view(-1, 3)  # (N_rays*N_samples_, 3)
         if not weights_only:
             dir_embedded = dir_embedded[:, None].expand(
                 dir_embedded.shape[0], N_samples_, dir_embedded.shape[1]
             )
-            dir_embedded = dir_embedded.reshape(-1, dir_embedded.shape[-1])
-
-        # Perform model inference to get rgb and raw sigma
-        B = xyz_.shape[0]
-        out_chunks = []
-        for i in range(0, B, chunk):
-            # Embed positions by chunk
-            xyz_embedded = embedding_xyz(xyz_[i : i + chunk])
-            if not weights_only:
-                xyzdir_embedded = flow.cat([xyz_embedded, dir_embedded[i : i + chunk]], 1)
-            else:
-                xyzdir_embedded = xyz_embedded
-            out_chunk = model(xyzdir_embedded)
-            out_chunks = out_chunks + [out_chunk]
-
-        out = flow.cat(out_chunks, 0)
-        if weights_only:
-            sigmas = out.view(N_rays, N_samples_)
-        else:
-            rgbsigma = out.view(N_rays, N_samples_, 4)
-            rgbs = rgbsigma[..., :3]  # (N_rays, N_samples_, 3)
-            sigmas = rgbsigma[..., 3]  # (N_rays, N_samples_)
 
         # Convert these values using volume rendering (Section 4)
         deltas = z_vals[:, 1:].clone() - z_vals[:, :-1].clone()  # (N_rays, N_samples_-1)
@@ -233,6 +297,32 @@ class NerfSystem(nn.Module):
         # to convert to real world distance (accounts for non-unit directions).
         deltas = deltas * flow.norm(no_norm_dir_.unsqueeze(1), dim=-1)
 
+        # Perform model inference to get rgb and raw sigma
+        if valid_mask is None:
+            out = self.query_model(
+                model,
+                embedding_xyz,
+                xyz_.reshape(-1, 3),
+                None if weights_only else dir_embedded.reshape(-1, dir_embedded.shape[-1]),
+                chunk,
+            )
+        else:
+            out = self.march(
+                model,
+                embedding_xyz,
+                xyz_,
+                None if weights_only else dir_embedded,
+                deltas,
+                valid_mask,
+                chunk,
+            )
+        if weights_only:
+            sigmas = out.view(N_rays, N_samples_)
+        else:
+            rgbsigma = out.view(N_rays, N_samples_, 4)
+            rgbs = rgbsigma[..., :3]  # (N_rays, N_samples_, 3)
+            sigmas = rgbsigma[..., 3]  # (N_rays, N_samples_)
+
         noise = (
             flow.randn(sigmas.shape).to_global(placement=sigmas.placement, sbp=sigmas.sbp)
             * noise_std
@@ -264,6 +354,98 @@ class NerfSystem(nn.Module):
 
         return rgb_final, depth_final, weights
 
+    def query_model(self, model, embedding_xyz, xyz_, dir_embedded, chunk, valid_mask=None):
+        """
+        Evaluates the model on flattened sample positions by chunk.
+
+        Inputs:
+            model (nn.Module): NeRF model (coarse or fine)
+            embedding_xyz (nn.Module): embedding module for xyz
+            xyz_ (tensor): (B, 3) sampled positions
+            dir_embedded (tensor): (B, embed_dir_channels) embedded directions, or None
+                                   to infer sigma only
+            chunk (int): number of positions evaluated at once
+            valid_mask (tensor): (B,) positions to evaluate, the outputs of the others
+                                 are left to zero (no density)
+
+        Outputs:
+            out (tensor): (B, 4) rgb and raw sigma, or (B, 1) raw sigma
+        """
+        sigma_only = dir_embedded is None
+        if valid_mask is not None:
+            B = xyz_.shape[0]
+            indices = flow.nonzero(valid_mask).view(-1)
+            xyz_ = flow.index_select(xyz_, 0, indices)
+            if not sigma_only:
+                dir_embedded = flow.index_select(dir_embedded, 0, indices)
+
+        out_chunks = []
+        for i in range(0, xyz_.shape[0], chunk):
+            # Embed positions by chunk
+            xyz_embedded = embedding_xyz(xyz_[i : i + chunk])
+            if not sigma_only:
+                xyzdir_embedded = flow.cat([xyz_embedded, dir_embedded[i : i + chunk]], 1)
+            else:
+                xyzdir_embedded = xyz_embedded
+            out_chunk = model(xyzdir_embedded, sigma_only=sigma_only)
+            out_chunks = out_chunks + [out_chunk]
+
+        if valid_mask is None:
+            return flow.cat(out_chunks, 0)
+
+        out_channels = 1 if sigma_only else 4
+        out = flow.zeros(B, out_channels, sbp=valid_mask.sbp, placement=valid_mask.placement)
+        if len(out_chunks) == 0:
+            return out
+        values = flow.cat(out_chunks, 0)
+        return flow.scatter(
+            out.to(values.dtype), 0, indices.unsqueeze(-1).expand(-1, out_channels), values
+        )
+
+    def march(self, model, embedding_xyz, xyz_, dir_embedded, deltas, valid_mask, chunk):
+        """
+        Marches the rays by groups of self.march_steps samples, only evaluating the
+        samples in occupied space and stopping each ray once its transmittance falls
+        below self.early_stop_threshold.
+
+        Inputs:
+            model (nn.Module): NeRF model (coarse or fine)
+            embedding_xyz (nn.Module): embedding module for xyz
+            xyz_ (tensor): (N_rays, N_samples_, 3) sampled positions
+            dir_embedded (tensor): (N_rays, N_samples_, embed_dir_channels) embedded
+                                   directions, or None to infer sigma only
+            deltas (tensor): (N_rays, N_samples_) real world distance between samples
+            valid_mask (tensor): (N_rays, N_samples_) samples in occupied space
+            chunk (int): number of positions evaluated at once
+
+        Outputs:
+            out (tensor): (N_rays, N_samples_, 4) rgb and raw sigma, or
+                          (N_rays, N_samples_, 1) raw sigma, zero for the skipped samples
+        """
+        N_rays, N_samples_ = valid_mask.shape
+        transmittance = flow.ones(N_rays, sbp=deltas.sbp, placement=deltas.placement)
+        out_steps = []
+        for i in range(0, N_samples_, self.march_steps):
+            j = min(i + self.march_steps, N_samples_)
+            step_mask = valid_mask[:, i:j]
+            if self.early_stop_threshold > 0:
+                step_mask = step_mask & (transmittance > self.early_stop_threshold).unsqueeze(-1)
+            dir_step = None
+            if dir_embedded is not None:
+                dir_step = dir_embedded[:, i:j].reshape(N_rays * (j - i), -1)
+            out_step = self.query_model(
+                model,
+                embedding_xyz,
+                xyz_[:, i:j].reshape(-1, 3),
+                dir_step,
+                chunk,
+                valid_mask=step_mask.reshape(-1),
+            ).view(N_rays, j - i, -1)
+            sigmas = flow.relu(out_step[..., -1].detach())
+            transmittance = transmittance * flow.exp(-(deltas[:, i:j] * sigmas).sum(-1))
+            out_steps.append(out_step)
+        return flow.cat(out_steps, 1)
+
     def render_rays(
         self,
         models,
@@ -319,6 +501,10 @@ class NerfSystem(nn.Module):
         xyz_coarse_sampled = rays_o.unsqueeze(1) + rays_d.unsqueeze(1) * z_vals.unsqueeze(
             2
         )  # (N_rays, N_samples, 3)
+        # skip the samples falling into empty space
+        valid_mask = (
+            self.occupancy_grid(xyz_coarse_sampled) if self.occupancy_grid is not None else None
+        )
         if test_time:
             weights_coarse = self.inference(
                 rays.shape[0],
@@ -333,6 +519,7 @@ class NerfSystem(nn.Module):
                 chunk,
                 white_back,
                 weights_only=True,
+                valid_mask=valid_mask,
             )
             result = {"opacity_coarse": weights_coarse.sum(1)}
         else:
@@ -349,6 +536,7 @@ class NerfSystem(nn.Module):
                 chunk,
                 white_back,
                 weights_only=False,
+                valid_mask=valid_mask,
             )
             result = {
                 "rgb_coarse": rgb_coarse,
@@ -369,6 +557,9 @@ class NerfSystem(nn.Module):
 
             xyz_fine_sampled = rays_o.unsqueeze(1) + rays_d.unsqueeze(1) * z_vals.unsqueeze(2)
             # (N_rays, N_samples+N_importance, 3)
+            valid_mask = (
+                self.occupancy_grid(xyz_fine_sampled) if self.occupancy_grid is not None else None
+            )
 
             model_fine = models[1]
             rgb_fine, depth_fine, weights_fine = self.inference(
@@ -384,6 +575,7 @@ class NerfSystem(nn.Module):
                 chunk,
                 white_back,
                 weights_only=False,
+                valid_mask=valid_mask,
             )
             result["rgb_fine"] = rgb_fine
             result["depth_fine"] = depth_fine
@@ -416,6 +608,68 @@ class NerfSystem(nn.Module):
             results[k] = flow.cat(v, 0)
         return results
 
+    def render_image(self, rays, rgbs=None):
+        """
+        Renders the rays of a whole image by fixed-size chunks. Every chunk is split
+        across the data parallel ranks, then written into preallocated output buffers,
+        while the metrics against ``rgbs`` are accumulated chunk by chunk.
+
+        Inputs:
+            rays (tensor): (H*W, 3+3+2) the rays of the image in raster order
+            rgbs (tensor): (H*W, 3) the ground truth colors, or None
+
+        Outputs:
+            results (dict): (H*W, ...) rendered buffers such as rgb, depth and opacity
+            metrics (StreamingImageMetrics): the accumulated metrics, None without rgbs
+        """
+        B = rays.shape[0]
+        typ = "fine" if self.N_importance > 0 else "coarse"
+        placement = rays.placement
+        split_sbp = dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast])
+        broadcast_sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+        metrics = None
+        if rgbs is not None:
+            metrics = StreamingImageMetrics(self.img_wh[0] if self.img_wh is not None else B)
+
+        results = collections.OrderedDict()
+        for i in range(0, B, self.chunk):
+            rays_chunk = rays[i : i + self.chunk].to_global(placement=placement, sbp=split_sbp)
+            rendered_ray_chunks = self.render_rays(
+                self.models,
+                [self.embedding_xyz, self.embedding_dir],
+                rays_chunk,
+                self.N_samples,
+                self.use_disp,
+                self.perturb,
+                self.N_importance,
+                False,
+                self.noise_std,
+                self.chunk,
+                self.white_back,
+            )
+            for k, v in rendered_ray_chunks.items():
+                v = v.to_global(placement=placement, sbp=broadcast_sbp)
+                if k not in results:
+                    results[k] = flow.zeros(
+                        (B,) + tuple(v.shape[1:]), dtype=v.dtype, placement=placement, sbp=v.sbp
+                    )
+                results[k][i : i + v.shape[0]] = v
+            if metrics is not None:
+                metrics.update(results[f"rgb_{typ}"][i : i + self.chunk], rgbs[i : i + self.chunk])
+        return results, metrics
+
+    def update_occupancy_grid(self):
+        """Refresh the occupancy grid from the coarse model every grid_update_interval steps."""
+        self.num_updates += 1
+        if (
+            self.num_updates >= self.grid_warmup_steps
+            and self.num_updates % self.grid_update_interval == 0
+        ):
+            self.occupancy_grid.update(
+                lambda xyz: self.nerf_coarse(self.embedding_xyz(xyz), sigma_only=True),
+                self.chunk,
+            )
+
     def forward(self, rays, rgbs=None, c2w=None, valid_mask=None):
         """
         Inputs:
@@ -429,6 +683,8 @@ class NerfSystem(nn.Module):
                         model predictions.
         """
         if c2w is None:
+            if self.occupancy_grid is not None:
+                self.update_occupancy_grid()
             rays = rays.squeeze()  # (H*W, 3)
             rgbs = rgbs.squeeze()  # (H*W, 3)
             results = self.forward_features(rays)
@@ -439,7 +695,7 @@ class NerfSystem(nn.Module):
         else:
             if rgbs is None:
                 rays = rays.squeeze()  # (H*W, 3)
-                results = self.forward_features(rays)
+                results, _ = self.render_image(rays)
                 typ = "fine" if "rgb_fine" in results else "coarse"
                 re = collections.OrderedDict()
                 re[typ] = flow.Tensor([0.0]).to_global(sbp=rays.sbp, placement=rays.placement)
@@ -449,7 +705,7 @@ class NerfSystem(nn.Module):
             else:
                 rays = rays.squeeze()  # (H*W, 3)
                 rgbs = rgbs.squeeze()  # (H*W, 3)
-                results = self.forward_features(rays)
+                results, metrics = self.render_image(rays, rgbs)
                 losses = self.loss_func(results["rgb_coarse"], rgbs)
                 if "rgb_fine" in results:
                     losses += self.loss_func(results["rgb_fine"], rgbs)
@@ -457,6 +713,10 @@ class NerfSystem(nn.Module):
                 re = collections.OrderedDict()
                 re["losses"] = losses
                 re[typ] = flow.Tensor([0.0]).to_global(sbp=losses.sbp, placement=losses.placement)
+                re["psnr"] = metrics.psnr()
+                ssim = metrics.ssim()
+                if ssim is not None:
+                    re["ssim"] = ssim
                 for key, value in results.items():
                     re[key] = value.unsqueeze(0)
                 re["rgbs"] = rgbs.unsqueeze(0)
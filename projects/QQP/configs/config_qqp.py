@@ -30,6 +30,11 @@ dataloader.train = LazyCall(build_nlp_train_loader)(
         ),
     ],
     num_workers=4,
+    length_bucketing=dict(
+        enabled=False,
+        bucket_boundaries=[64, 128, 256],
+        trim_fields={"model_input": [1], "attention_mask": [1], "tokentype_ids": [1]},
+    ),
 )
 dataloader.test = [
     LazyCall(build_nlp_test_loader)(
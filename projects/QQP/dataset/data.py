@@ -14,19 +14,52 @@
 # limitations under the License.
 
 import logging
+import os
 from abc import ABC, abstractmethod
 
+import numpy as np
 from oneflow.utils.data import Dataset
 
-from .data_utils import build_sample, build_tokens_types_paddings_from_text
+from libai.data.datasets.tokenized_dataset import build_tokenized_dataset, tokenizer_fingerprint
+from libai.utils.file_io import fingerprint
+
+from .data_utils import build_sample, build_tokens_types_paddings_from_ids
 
 logger = logging.getLogger("libai." + __name__)
 
 
+class PairEncoder:
+    """Tokenizes both texts of a sample, trimmed and padded later by
+    `build_tokens_types_paddings_from_ids`."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, sample):
+        return {
+            "text_a_ids": self.tokenizer.tokenize(sample["text_a"]),
+            "text_b_ids": self.tokenizer.tokenize(sample["text_b"]),
+            "labels": [sample["label"]],
+        }
+
+
 class GLUEAbstractDataset(ABC, Dataset):
-    """GLUE base dataset class."""
+    """GLUE base dataset class.
+
+    The texts of the samples are tokenized once into indexed files next to the first data
+    file, or in ``cache_dir``, and the files are parsed again only when they change.
+    """
 
-    def __init__(self, task_name, dataset_name, datapaths, tokenizer, max_seq_length):
+    def __init__(
+        self,
+        task_name,
+        dataset_name,
+        datapaths,
+        tokenizer,
+        max_seq_length,
+        cache_dir=None,
+        tokenize_workers=None,
+    ):
         # Store inputs.
         self.task_name = task_name
         self.dataset_name = dataset_name
@@ -38,9 +71,26 @@ class GLUEAbstractDataset(ABC, Dataset):
         for path in datapaths:
             string += " " + path
         logger.info(string)
-        self.samples = []
-        for datapath in datapaths:
-            self.samples.extend(self.process_samples_from_single_path(datapath))
+
+        key = fingerprint(datapaths, tokenizer_fingerprint(tokenizer), self.cache_args())
+        prefix = os.path.join(
+            cache_dir if cache_dir is not None else os.path.dirname(datapaths[0]),
+            "cached_{}_{}_{}".format(self.task_name, self.dataset_name, key),
+        )
+
+        def read_samples():
+            samples = []
+            for datapath in datapaths:
+                samples.extend(self.process_samples_from_single_path(datapath))
+            return samples
+
+        self.samples = build_tokenized_dataset(
+            prefix,
+            {"text_a_ids": np.int32, "text_b_ids": np.int32, "labels": np.int64},
+            read_samples,
+            PairEncoder(tokenizer),
+            num_workers=tokenize_workers,
+        )
         logger.info("  >> total number of samples: {}".format(len(self.samples)))
 
     def __len__(self):
@@ -48,12 +98,26 @@ class GLUEAbstractDataset(ABC, Dataset):
 
     def __getitem__(self, idx):
         raw_sample = self.samples[idx]
-        ids, types, paddings = build_tokens_types_paddings_from_text(
-            raw_sample["text_a"], raw_sample["text_b"], self.tokenizer, self.max_seq_length
+        ids, types, paddings = build_tokens_types_paddings_from_ids(
+            raw_sample["text_a_ids"].tolist(),
+            raw_sample["text_b_ids"].tolist(),
+            self.max_seq_length,
+            self.tokenizer.cls,
+            self.tokenizer.sep,
+            self.tokenizer.pad,
         )
-        sample = build_sample(ids, types, paddings, raw_sample["label"], raw_sample["uid"])
+        sample = build_sample(ids, types, paddings, int(raw_sample["labels"][0]), None)
         return sample
 
+    def get_lengths(self):
+        """Number of tokens of every sample before padding, used by `LengthBucketSampler`."""
+        sizes = self.samples.sizes("text_a_ids") + self.samples.sizes("text_b_ids") + 3
+        return np.minimum(sizes, self.max_seq_length)
+
+    def cache_args(self):
+        """Arguments of `process_samples_from_single_path` the tokenized files depend on."""
+        return None
+
     @abstractmethod
     def process_samples_from_single_path(self, datapath):
         """Abstract method that takes a single path / filename and
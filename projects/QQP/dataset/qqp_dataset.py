@@ -24,10 +24,30 @@ LABELS = [0, 1]
 
 
 class QQPDataset(GLUEAbstractDataset):
-    def __init__(self, dataset_name, data_paths, tokenizer, max_seq_length, test_label=0):
+    def __init__(
+        self,
+        dataset_name,
+        data_paths,
+        tokenizer,
+        max_seq_length,
+        test_label=0,
+        cache_dir=None,
+        tokenize_workers=None,
+    ):
         self.test_label = test_label
         self.dataset_name = dataset_name
-        super().__init__("QQP", dataset_name, data_paths, tokenizer, max_seq_length)
+        super().__init__(
+            "QQP",
+            dataset_name,
+            data_paths,
+            tokenizer,
+            max_seq_length,
+            cache_dir=cache_dir,
+            tokenize_workers=tokenize_workers,
+        )
+
+    def cache_args(self):
+        return self.test_label
 
     def process_samples_from_single_path(self, filename):
         """ "Implement abstract method."""
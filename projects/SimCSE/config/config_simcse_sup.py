@@ -32,6 +32,11 @@ dataloader.train = LazyCall(build_nlp_train_loader)(
             max_len=64,
         )
     ],
+    length_bucketing=dict(
+        enabled=False,
+        bucket_boundaries=[16, 32, 48],
+        trim_fields={"input_ids": [2], "attention_mask": [2]},
+    ),
 )
 
 dataloader.test = [
@@ -60,6 +65,8 @@ simcse_cfg.update(
         intermediate_size=3072,
         pretrained_model_weight="./data/pytorch_model.bin",
         temp=0.05,
+        # extra negatives from previous steps, needs `graph.enabled = False`
+        queue_size=0,
         pooler_type="cls",
         bias_gelu_fusion=False,
         bias_dropout_fusion=False,
@@ -32,6 +32,11 @@ dataloader.train = LazyCall(build_nlp_train_loader)(
             path2="./data/STS/cnsd-sts-train.txt",
         )
     ],
+    length_bucketing=dict(
+        enabled=False,
+        bucket_boundaries=[16, 32, 48],
+        trim_fields={"input_ids": [2], "attention_mask": [2]},
+    ),
 )
 
 dataloader.test = [
@@ -66,6 +71,8 @@ simcse_cfg.update(
         pretrained_model_weight="./data/pytorch_model.bin",
         pooler_type="cls",
         temp=0.05,
+        # extra negatives from previous steps, needs `graph.enabled = False`
+        queue_size=0,
     )
 )
 
@@ -13,13 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import random
 
 import jsonlines
+import numpy as np
 import oneflow as flow
 from oneflow.utils.data import Dataset
 
+from libai.data.datasets.tokenized_dataset import (
+    build_tokenized_dataset,
+    pad_item,
+    tokenizer_fingerprint,
+)
 from libai.data.structures import DistTensorData, Instance
+from libai.utils.file_io import fingerprint
 
 
 def load_data(name, path):
@@ -85,53 +93,94 @@ def load_data(name, path):
 
 
 def padding_for_ids(data, pad_id=0, max_len=64):
-    data["input_ids"] = data["input_ids"] + [pad_id] * (max_len - len(data["input_ids"]))
-    data["attention_mask"] = data["attention_mask"] + [0] * (max_len - len(data["attention_mask"]))
-
-    data["input_ids"] = [data["input_ids"], data["input_ids"]]
-    data["attention_mask"] = [data["attention_mask"], data["attention_mask"]]
+    input_ids = pad_item(data["input_ids"], max_len, pad_id)
+    attention_mask = pad_item(data["attention_mask"], max_len)
 
     return Instance(
-        input_ids=DistTensorData(flow.tensor(data["input_ids"], dtype=flow.long)),
-        attention_mask=DistTensorData(flow.tensor(data["attention_mask"], dtype=flow.long)),
+        input_ids=DistTensorData(flow.tensor(np.stack([input_ids, input_ids]), dtype=flow.long)),
+        attention_mask=DistTensorData(
+            flow.tensor(np.stack([attention_mask, attention_mask]), dtype=flow.long)
+        ),
+    )
+
+
+class SentenceEncoder:
+    """Token ids of every sentence of an example, truncated and between [CLS] and [SEP]."""
+
+    def __init__(self, tokenizer, max_len):
+        self.tokenizer = tokenizer
+        self.max_len = max_len
+        self.cls_id = tokenizer.cls_token_id
+        self.sep_id = tokenizer.sep_token_id
+
+    def text2id(self, text):
+        tokens = self.tokenizer.tokenize(text)
+        ids = self.tokenizer.convert_tokens_to_ids(tokens)
+        ids = ids[: self.max_len - 2]
+        return [self.cls_id] + ids + [self.sep_id]
+
+    def __call__(self, example):
+        sentences = [example] if isinstance(example, str) else example
+        return {f"sentence_{i}": self.text2id(sentence) for i, sentence in enumerate(sentences)}
+
+
+def load_tokenized_data(name, paths, tokenizer, max_len, num_sentences, cache_dir, workers):
+    """The examples of ``load_data`` tokenized once with :class:`SentenceEncoder` into indexed
+    files, next to the first data file or in ``cache_dir``."""
+    data_paths = [path for _, path in paths if path is not None]
+    key = fingerprint(data_paths, name, tokenizer_fingerprint(tokenizer), max_len)
+    prefix = os.path.join(
+        cache_dir if cache_dir is not None else os.path.dirname(data_paths[0]),
+        f"cached_{name}_{max_len}_{key}",
+    )
+
+    def read_examples():
+        data = []
+        for data_name, path in paths:
+            data.extend(load_data(data_name, path))
+        return data
+
+    return build_tokenized_dataset(
+        prefix,
+        {f"sentence_{i}": np.int32 for i in range(num_sentences)},
+        read_examples,
+        SentenceEncoder(tokenizer, max_len),
+        num_workers=workers,
     )
 
 
 class TrainDataset_unsup(Dataset):
     # unsup
-    def __init__(self, name, path, tokenizer, max_len, path2=None):
+    def __init__(
+        self, name, path, tokenizer, max_len, path2=None, cache_dir=None, tokenize_workers=None
+    ):
         self.name = name
-        self.data = load_data(name, path) + load_data("add", path2)
-        random.shuffle(self.data)
+        self.data = load_tokenized_data(
+            name, [(name, path), ("add", path2)], tokenizer, max_len, 1, cache_dir, tokenize_workers
+        )
+        # the order of the examples, drawn from the state of `random` like a shuffled list
+        self.order = np.random.RandomState(random.getrandbits(32)).permutation(len(self.data))
         self.tokenizer = tokenizer
         self.max_len = max_len
         self.pad_id = self.tokenizer.pad_token_id
-        self.cls_id = self.tokenizer.cls_token_id
-        self.sep_id = self.tokenizer.sep_token_id
 
     def __len__(self):
         return len(self.data)
 
-    def text2id(self, text):
-        tokens = self.tokenizer.tokenize(text)
-        ids = self.tokenizer.convert_tokens_to_ids(tokens)
-
-        ids = ids[: self.max_len - 2]
-        ids = [self.cls_id] + ids + [self.sep_id]
-
-        attention_mask = [1] * len(ids)
-
+    def __getitem__(self, index):
+        ids = self.data.get("sentence_0", self.order[index])
         return padding_for_ids(
             data={
                 "input_ids": ids,
-                "attention_mask": attention_mask,
+                "attention_mask": np.ones(len(ids), dtype=np.int64),
             },
             pad_id=self.pad_id,
             max_len=self.max_len,
         )
 
-    def __getitem__(self, index):
-        return self.text2id(self.data[index])
+    def get_lengths(self):
+        """Number of tokens of every example, used by `LengthBucketSampler`."""
+        return self.data.sizes("sentence_0")[self.order]
 
 
 class TestDataset_unsup(Dataset):
@@ -183,6 +232,32 @@ class TestDataset_unsup(Dataset):
 
 
 class TrainDataset_sup(Dataset):
+    def __init__(self, name, path, tokenizer, max_len=64, cache_dir=None, tokenize_workers=None):
+        self.data = load_tokenized_data(
+            name, [(name, path)], tokenizer, max_len, 3, cache_dir, tokenize_workers
+        )
+        self.max_len = max_len
+        self.pad_id = tokenizer.pad_token_id
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        sentences = [self.data.get(f"sentence_{i}", index) for i in range(3)]
+        ids = [pad_item(sentence, self.max_len, self.pad_id) for sentence in sentences]
+        masks = [pad_item(np.ones(len(sentence)), self.max_len) for sentence in sentences]
+        return Instance(
+            input_ids=DistTensorData(flow.tensor(np.stack(ids), dtype=flow.long)),
+            attention_mask=DistTensorData(flow.tensor(np.stack(masks), dtype=flow.long)),
+        )
+
+    def get_lengths(self):
+        """Number of tokens of the longest sentence of every example."""
+        return np.maximum.reduce([self.data.sizes(f"sentence_{i}") for i in range(3)])
+
+
+class TestDataset_sup(Dataset):
+    # sts datasets
     def __init__(self, name, path, tokenizer, max_len=64):
         self.data = load_data(name, path)
         self.tokenizer = tokenizer
@@ -208,17 +283,6 @@ class TrainDataset_sup(Dataset):
         ids, attention_mask = self.pad_text(ids)
         return ids, attention_mask
 
-    def __getitem__(self, index):
-        ids0, mask0 = self.text2id(self.data[index][0])
-        ids1, mask1 = self.text2id(self.data[index][1])
-        ids2, mask2 = self.text2id(self.data[index][2])
-        return Instance(
-            input_ids=DistTensorData(flow.tensor([ids0, ids1, ids2], dtype=flow.long)),
-            attention_mask=DistTensorData(flow.tensor([mask0, mask1, mask2], dtype=flow.long)),
-        )
-
-
-class TestDataset_sup(TrainDataset_sup):
     def __getitem__(self, index):
         label = int(self.data[index][2])
         ids0, mask0 = self.text2id(self.data[index][0])
@@ -16,6 +16,7 @@
 import oneflow as flow
 from oneflow import nn
 
+from libai.layers import ContrastiveQueue, info_nce_loss
 from libai.utils import distributed as dist
 from projects.SimCSE.modeling.model_utils import MLPLayer, cosine_similarity
 from projects.SimCSE.utils.load_huggingface_weight import load_huggingface_bert
@@ -29,6 +30,10 @@ class Simcse_sup(nn.Module):
         self.bert = BertForSimCSE(cfg)
         self.mlp = MLPLayer(cfg)
         self.pooler_type = cfg.pooler_type
+        self.temp = cfg.get("temp", 0.05)
+        # embeddings of previous steps used as extra negatives, enqueued in eager mode
+        queue_size = cfg.get("queue_size", 0)
+        self.queue = ContrastiveQueue(queue_size, cfg.hidden_size) if queue_size > 0 else None
 
         if cfg.pretrained_model_weight is not None:
             load_huggingface_bert(
@@ -86,19 +91,19 @@ class Simcse_sup(nn.Module):
             )
             use_row = self.create_use_row(labels)
             labels = (use_row - use_row % 3 * 2) + 1
-            sim = cosine_similarity(out.unsqueeze(1), out.unsqueeze(0))
-            sim = (
-                sim
-                - flow.eye(
-                    out.size(0),
-                    sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                    placement=out.placement,
-                )
-                * 1e12
+            out = nn.functional.normalize(out, dim=-1)
+            # queries are the anchors and the entailments, the contradictions are
+            # hard negatives
+            loss = info_nce_loss(
+                flow.index_select(out, dim=0, index=use_row),
+                out,
+                labels,
+                queue=self.queue,
+                temperature=self.temp,
+                query_index=use_row,
             )
-            sim = flow.index_select(sim, dim=0, index=use_row)
-            sim = sim / 0.05
-            loss = nn.CrossEntropyLoss()(sim, labels)
+            if self.queue is not None:
+                self.queue.enqueue(out)
             return {"loss": loss}
         else:
             bs = input_ids.size(0)
@@ -16,6 +16,7 @@
 import oneflow as flow
 from oneflow import nn
 
+from libai.layers import ContrastiveQueue, info_nce_loss
 from libai.utils import distributed as dist
 from projects.SimCSE.modeling.model_utils import MLPLayer, cosine_similarity
 from projects.SimCSE.utils.load_huggingface_weight import load_huggingface_bert
@@ -29,6 +30,10 @@ class Simcse_unsup(nn.Module):
         self.bert = BertForSimCSE(cfg)
         self.mlp = MLPLayer(cfg)
         self.pooler_type = cfg.pooler_type
+        self.temp = cfg.get("temp", 0.05)
+        # embeddings of previous steps used as extra negatives, enqueued in eager mode
+        queue_size = cfg.get("queue_size", 0)
+        self.queue = ContrastiveQueue(queue_size, cfg.hidden_size) if queue_size > 0 else None
 
         if cfg.pretrained_model_weight is not None:
             load_huggingface_bert(
@@ -73,19 +78,19 @@ class Simcse_unsup(nn.Module):
                 sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
                 placement=out.placement,
             )
-            labels = (labels - labels % 2 * 2) + 1
-            sim = cosine_similarity(out.unsqueeze(1), out.unsqueeze(0))
-            sim = (
-                sim
-                - flow.eye(
-                    out.size(0),
-                    sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-                    placement=out.placement,
-                )
-                * 1e12
+            # the positive of every sentence is its other dropout view
+            positives = (labels - labels % 2 * 2) + 1
+            out = nn.functional.normalize(out, dim=-1)
+            loss = info_nce_loss(
+                out,
+                out,
+                positives,
+                queue=self.queue,
+                temperature=self.temp,
+                query_index=labels,
             )
-            sim = sim / 0.05
-            loss = nn.CrossEntropyLoss()(sim, labels)
+            if self.queue is not None:
+                self.queue.enqueue(out)
             return {"loss": loss}
         else:
             bs, num_sent = input_ids.size(0), input_ids.size(1)
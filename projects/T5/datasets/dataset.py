@@ -25,6 +25,8 @@ from oneflow.utils.data import Dataset
 
 from libai.data.structures import DistTensorData, Instance
 
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
 
 def get_data(path):
     total_data = []
@@ -36,6 +38,25 @@ def get_data(path):
     return total_data
 
 
+def _splitmix64(x):
+    """Mixes uint64 ``x`` into well distributed random bits, the output function of splitmix64."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def random_keys(seed, epochs, indices, num_keys):
+    """Uniform uint64 keys of shape (len(indices), num_keys), a counter based function of
+    ``(seed, epoch, index)`` for every row, so that no generator state is shared by the rows.
+    """
+    with np.errstate(over="ignore"):
+        row_keys = _splitmix64(np.full(len(indices), seed, dtype=np.uint64) + _GOLDEN_GAMMA)
+        row_keys = _splitmix64(row_keys ^ (np.asarray(epochs, dtype=np.uint64) + _GOLDEN_GAMMA))
+        row_keys = _splitmix64(row_keys ^ (np.asarray(indices, dtype=np.uint64) + _GOLDEN_GAMMA))
+        counters = (np.arange(1, num_keys + 1, dtype=np.uint64) * _GOLDEN_GAMMA)[None]
+        return _splitmix64(row_keys[:, None] + counters)
+
+
 def compute_input_and_target_lengths(inputs_length, noise_density, mean_noise_span_length):
     """This function is copy of `random_spans_helper <https://github.com/google-research/
     text-to-text-transfer-transformer/blob/84f8bcc14b5f2c03de51bd3587609ba8f6bbd1cd/
@@ -89,6 +110,9 @@ class UnsuperviseT5Dataset(Dataset):
     ec13aeb8689cfafaa6a7a9e9595d110edbe34123/fengshen/data/t5_dataloader/t5_datasets.py#L61.
     """
 
+    # `CyclicSampler` passes the epoch, which seeds the noise of the samples in `collate_fn`
+    supports_epoch_index = True
+
     def __init__(self, data_path):
         # [{input_ids: ...}, {input_ids: ...}, ...]
         self.data = get_data(data_path)
@@ -97,11 +121,24 @@ class UnsuperviseT5Dataset(Dataset):
         return len(self.data)
 
     def __getitem__(self, index):
-        x = self.data[index]
+        epoch, index = index if isinstance(index, tuple) else (0, index)
+        x = dict(self.data[index], epoch=epoch, index=index)
         return x
 
 
 class collate_fn:
+    """
+    Span corruption of T5 for a batch of examples of the same length.
+
+    The noise masks of the whole batch are drawn at once: the random segmentations of the noise
+    and non-noise tokens of every row pick their boundaries with the smallest random keys, and
+    the sentinels replacing the spans are numbered with cumulative sums. The keys are a function
+    of ``seed`` and of the ``epoch`` and ``index`` of every example, so that an example gets the
+    same noise in any worker and after resuming, see :class:`UnsuperviseT5Dataset`.
+    Examples without them draw their keys from ``np.random``. ``build_nlp_train_loader`` sets
+    ``seed`` to the one of the training, ``train.seed``.
+    """
+
     def __init__(
         self,
         vocab_size,
@@ -111,7 +148,9 @@ class collate_fn:
         eos_token_id=1,
         pad_token_id=0,
         decoder_start_token_id=0,
+        seed=0,
     ):
+        self.seed = seed
         self.max_seq_length = max_seq_length
         self.eos_token_id = eos_token_id
         self.pad_token_id = pad_token_id
@@ -132,16 +171,15 @@ class collate_fn:
         }
         input_ids = np.array(batch["input_ids"])
         batch_size, expanded_input_length = input_ids.shape
-        mask_indices = np.asarray(
-            [self.random_spans_noise_mask(expanded_input_length) for i in range(batch_size)]
-        )
-        labels_mask = ~mask_indices
-
-        input_ids_sentinel = self.create_sentinel_ids(mask_indices.astype(np.int8))
-        labels_sentinel = self.create_sentinel_ids(labels_mask.astype(np.int8))
+        if "epoch" in batch and "index" in batch:
+            epochs, indices = batch["epoch"], batch["index"]
+        else:
+            epochs = np.zeros(batch_size, dtype=np.int64)
+            indices = np.random.randint(np.iinfo(np.int64).max, size=batch_size)
+        mask_indices = self.random_spans_noise_masks(expanded_input_length, epochs, indices)
 
-        batch["input_ids"] = self.filter_input_ids(input_ids, input_ids_sentinel)
-        batch["labels"] = self.filter_input_ids(input_ids, labels_sentinel)
+        batch["input_ids"] = self.corrupt_spans(input_ids, mask_indices)
+        batch["labels"] = self.corrupt_spans(input_ids, ~mask_indices)
 
         if batch["input_ids"].shape[-1] != self.max_seq_length:
             raise ValueError(
@@ -181,6 +219,72 @@ class collate_fn:
             loss_mask=DistTensorData(flow.tensor(batch["labels"])),
         )
 
+    def corrupt_spans(self, input_ids, mask_indices):
+        """
+        Replaces every span of ``mask_indices`` by a sentinel, numbered down from
+        ``vocab_size - 1``, and appends eos. The same as ``filter_input_ids`` with the ids of
+        ``create_sentinel_ids``.
+        """
+        batch_size = input_ids.shape[0]
+        span_starts = mask_indices.copy()
+        span_starts[:, 1:] &= ~mask_indices[:, :-1]
+        sentinel_ids = self.vocab_size - np.cumsum(span_starts, axis=-1)
+
+        input_ids = np.where(span_starts, sentinel_ids, input_ids)
+        input_ids = input_ids[~mask_indices | span_starts].reshape((batch_size, -1))
+        return np.concatenate(
+            [input_ids, np.full((batch_size, 1), self.eos_token_id, dtype=np.int32)], axis=-1
+        )
+
+    def random_spans_noise_masks(self, length, epochs, indices):
+        """
+        Noise masks of shape (batch_size, length) of the examples ``indices`` of ``epochs``,
+        the batched version of ``random_spans_noise_mask``: the noise spans and the non-noise
+        spans interleave, starting with a non-noise one.
+        """
+        num_noise_tokens = int(np.round(length * self.noise_density))
+        # avoid degeneracy by ensuring positive numbers of noise and nonnoise tokens.
+        num_noise_tokens = min(max(num_noise_tokens, 1), length - 1)
+        num_noise_spans = int(np.round(num_noise_tokens / self.mean_noise_span_length))
+        # avoid degeneracy by ensuring positive number of noise spans
+        num_noise_spans = max(num_noise_spans, 1)
+        num_nonnoise_tokens = length - num_noise_tokens
+
+        keys = random_keys(self.seed, epochs, indices, length - 2)
+
+        def _random_boundaries(keys, num_items, num_segments):
+            # the ends of `num_segments` non-empty segments of `num_items` items, the segments
+            # start at the `num_segments - 1` items with the smallest keys besides the first one
+            batch_size = keys.shape[0]
+            if num_segments == 1:
+                starts = np.empty((batch_size, 0), dtype=np.int64)
+            else:
+                starts = np.argpartition(keys, num_segments - 2, axis=-1)[:, : num_segments - 1]
+            return np.concatenate(
+                [
+                    np.zeros((batch_size, 1), dtype=np.int64),
+                    np.sort(starts, axis=-1) + 1,
+                    np.full((batch_size, 1), num_items, dtype=np.int64),
+                ],
+                axis=-1,
+            )
+
+        noise_ends = _random_boundaries(
+            keys[:, : num_noise_tokens - 1], num_noise_tokens, num_noise_spans
+        )
+        nonnoise_ends = _random_boundaries(
+            keys[:, num_noise_tokens - 1 :], num_nonnoise_tokens, num_noise_spans
+        )
+
+        # noise span k follows the first k non-noise spans and the first k - 1 noise spans
+        span_starts = nonnoise_ends[:, 1:] + noise_ends[:, :-1]
+        span_ends = nonnoise_ends[:, 1:] + noise_ends[:, 1:]
+        rows = np.arange(len(keys))[:, None]
+        span_edges = np.zeros((len(keys), length + 1), dtype=np.int8)
+        span_edges[rows, span_starts] = 1
+        span_edges[rows, span_ends] = -1
+        return np.cumsum(span_edges[:, :length], axis=-1, dtype=np.int8) > 0
+
     def filter_input_ids(self, input_ids, sentinel_ids):
         batch_size = input_ids.shape[0]
 
@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import numpy as np
+
+from projects.T5.datasets.dataset import collate_fn
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Samples/s of the T5 span corruption collator")
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--max_seq_length", type=int, default=512)
+    parser.add_argument("--noise_density", type=float, default=0.15)
+    parser.add_argument("--mean_noise_span_length", type=float, default=3)
+    parser.add_argument("--vocab_size", type=int, default=12902)
+    parser.add_argument("--iters", type=int, default=20)
+    return parser.parse_args()
+
+
+def per_example_corruption(collator, input_ids):
+    """Span corruption drawing the noise mask of every example on its own, like the collator
+    did before the masks of a batch were drawn at once."""
+    batch_size, length = input_ids.shape
+    mask_indices = np.asarray([collator.random_spans_noise_mask(length) for _ in range(batch_size)])
+    input_ids_sentinel = collator.create_sentinel_ids(mask_indices.astype(np.int8))
+    labels_sentinel = collator.create_sentinel_ids((~mask_indices).astype(np.int8))
+    return (
+        collator.filter_input_ids(input_ids, input_ids_sentinel),
+        collator.filter_input_ids(input_ids, labels_sentinel),
+    )
+
+
+def batched_corruption(collator, input_ids, epochs, indices):
+    mask_indices = collator.random_spans_noise_masks(input_ids.shape[1], epochs, indices)
+    return (
+        collator.corrupt_spans(input_ids, mask_indices),
+        collator.corrupt_spans(input_ids, ~mask_indices),
+    )
+
+
+def samples_per_second(fn, batch_size, iters):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return batch_size * iters / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    collator = collate_fn(
+        vocab_size=args.vocab_size,
+        max_seq_length=args.max_seq_length,
+        noise_density=args.noise_density,
+        mean_noise_span_length=args.mean_noise_span_length,
+    )
+    rng = np.random.RandomState(0)
+    input_ids = rng.randint(
+        0, args.vocab_size - 100, size=(args.batch_size, collator.expanded_inputs_length)
+    )
+    epochs = np.zeros(args.batch_size, dtype=np.int64)
+    indices = np.arange(args.batch_size)
+    examples = [dict(input_ids=ids, epoch=0, index=i) for i, ids in enumerate(input_ids.tolist())]
+
+    results = {
+        "per-example span corruption": samples_per_second(
+            lambda: per_example_corruption(collator, input_ids), args.batch_size, args.iters
+        ),
+        "batched span corruption": samples_per_second(
+            lambda: batched_corruption(collator, input_ids, epochs, indices),
+            args.batch_size,
+            args.iters,
+        ),
+        "collate_fn": samples_per_second(lambda: collator(examples), args.batch_size, args.iters),
+    }
+    print(
+        f"batch size {args.batch_size}, {collator.expanded_inputs_length} tokens "
+        f"-> {args.max_seq_length} inputs and {collator.targets_length} targets"
+    )
+    for name, value in results.items():
+        print(f"{name:>28}: {value:10.1f} samples/s")
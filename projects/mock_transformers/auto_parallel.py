@@ -0,0 +1,370 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tensor parallel rewriting of (mocked) transformers models, driven by per-model policies.
+
+A policy lists which linear layers are column parallel and which are row parallel, matched by
+the suffix of their module name. Every column parallel layer should be followed by a row parallel
+one, so the activations between them stay split and only the output of the row parallel layer
+needs to be reduced. Linear layers matched by neither list are kept data parallel.
+
+Typical usage, the model is built without allocating the full linear weights and every rank
+only reads its own shard of them from the checkpoint files:
+
+.. code-block:: python
+
+    import init_env  # noqa, mock torch before importing transformers
+    from auto_parallel import load_tensor_parallel_model
+
+    dist.setup_dist_util(parallel_config)
+    model = load_tensor_parallel_model("meta-llama/Llama-2-7b-hf", dtype=flow.float16)
+"""
+
+import glob
+import logging
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import oneflow as flow
+from oneflow import nn
+
+from libai.layers import Conv1D, Linear
+from libai.utils import distributed as dist
+
+logger = logging.getLogger(__name__)
+
+
+TENSOR_PARALLEL_POLICIES = {
+    "llama": dict(
+        col=["q_proj", "k_proj", "v_proj", "gate_proj", "up_proj", "lm_head"],
+        row=["o_proj", "down_proj"],
+    ),
+    "baichuan": dict(
+        col=["W_pack", "gate_proj", "up_proj", "lm_head"],
+        row=["o_proj", "down_proj"],
+    ),
+    "bloom": dict(
+        col=["query_key_value", "dense_h_to_4h"],
+        row=["self_attention.dense", "dense_4h_to_h"],
+    ),
+    "opt": dict(
+        col=["q_proj", "k_proj", "v_proj", "fc1"],
+        row=["out_proj", "fc2"],
+    ),
+    "gpt2": dict(
+        col=["attn.c_attn", "attn.q_attn", "mlp.c_fc"],
+        row=["attn.c_proj", "mlp.c_proj"],
+    ),
+}
+
+
+def get_policy(model_type):
+    if model_type not in TENSOR_PARALLEL_POLICIES:
+        raise KeyError(
+            f"No tensor parallel policy for model type '{model_type}', "
+            f"available: {sorted(TENSOR_PARALLEL_POLICIES.keys())}"
+        )
+    return TENSOR_PARALLEL_POLICIES[model_type]
+
+
+def _skip_init(weight):
+    # Weights are loaded from checkpoint right after
+    return weight
+
+
+class _LinearPlaceholder(nn.Module):
+    """Records the arguments of a linear layer without allocating its weight."""
+
+    def __init__(self, in_features, out_features, bias=True, transposed=False):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.has_bias = bias
+        # `transformers.pytorch_utils.Conv1D` stores the weight as (in_features, out_features)
+        self.transposed = transposed
+
+    def forward(self, x):
+        raise RuntimeError(
+            "Linear layer is not materialized, "
+            "call `shard_linear_layers` before running the model"
+        )
+
+
+def _linear_placeholder(in_features, out_features, bias=True, *args, **kwargs):
+    return _LinearPlaceholder(in_features, out_features, bias=bias)
+
+
+def _conv1d_placeholder(nf, nx):
+    return _LinearPlaceholder(nx, nf, bias=True, transposed=True)
+
+
+@contextmanager
+def defer_linear_init(conv1d_modules=()):
+    """Build linear layers as placeholders inside this context.
+
+    ``nn.Linear`` is replaced for the duration of the context, as well as the ``Conv1D``
+    attribute of each module in ``conv1d_modules`` (e.g. ``modeling_gpt2``).
+    """
+    patched = [(nn, "Linear", _linear_placeholder)]
+    patched += [(module, "Conv1D", _conv1d_placeholder) for module in conv1d_modules]
+    originals = [(obj, name, getattr(obj, name)) for obj, name, _ in patched]
+    try:
+        for obj, name, placeholder in patched:
+            setattr(obj, name, placeholder)
+        yield
+    finally:
+        for obj, name, original in originals:
+            setattr(obj, name, original)
+
+
+def _match(name, patterns):
+    return any(name == p or name.endswith("." + p) for p in patterns)
+
+
+def get_parallel_mode(name, policy):
+    if _match(name, policy.get("col", [])):
+        return "col"
+    if _match(name, policy.get("row", [])):
+        return "row"
+    return "data"
+
+
+def _linear_spec(module):
+    """Returns (in_features, out_features, bias, transposed) of a linear like module."""
+    if isinstance(module, _LinearPlaceholder):
+        return module.in_features, module.out_features, module.has_bias, module.transposed
+    if isinstance(module, (Linear, Conv1D)):
+        return None
+    if isinstance(module, nn.Linear):
+        return module.in_features, module.out_features, module.bias is not None, False
+    if type(module).__name__ == "Conv1D" and hasattr(module, "nf"):
+        nx, nf = module.weight.shape
+        return nx, nf, module.bias is not None, True
+    return None
+
+
+def shard_linear_layers(model, policy, dtype=flow.float32, layer_idx=0):
+    """Replace the linear layers of ``model`` with LiBai ``Linear`` (or ``Conv1D`` for the
+    transposed ones) according to ``policy``.
+
+    Placeholders built under `defer_linear_init` become layers with uninitialized weights, which
+    only hold the local shard on every rank. Layers that already have weights keep them.
+
+    Returns:
+        dict: module name -> parallel mode of the replaced layers.
+    """
+    modes = {}
+    modules = dict(model.named_modules())
+    for name, module in modules.items():
+        spec = _linear_spec(module)
+        if spec is None:
+            continue
+        in_features, out_features, bias, transposed = spec
+        parallel = get_parallel_mode(name, policy)
+        layer_cls = Conv1D if transposed else Linear
+        new_module = layer_cls(
+            in_features,
+            out_features,
+            bias=bias,
+            parallel=parallel,
+            init_method=_skip_init,
+            dtype=dtype,
+            layer_idx=layer_idx,
+        )
+        if not isinstance(module, _LinearPlaceholder):
+            with flow.no_grad():
+                for key, param in new_module.named_parameters():
+                    src = getattr(module, key).to(dtype)
+                    if not src.is_global:
+                        src = src.to_global(
+                            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+                            placement=param.placement,
+                        )
+                    param.copy_(src.to_global(sbp=param.sbp, placement=param.placement))
+        elif "weight" in module._parameters:
+            # Weight tied with the input embeddings before the layer was materialized
+            new_module.weight = module.weight
+
+        parent_name, _, child_name = name.rpartition(".")
+        parent = modules[parent_name] if parent_name else model
+        setattr(parent, child_name, new_module)
+        modes[name] = parallel
+    return modes
+
+
+def _split_axis(sbp, ndim):
+    for axis in range(ndim):
+        if sbp == flow.sbp.split(axis):
+            return axis
+    return None
+
+
+def get_local_slices(tensor, rank=None):
+    """Index of the physical shard of the global ``tensor`` on ``rank`` (this rank by default).
+
+    Returns None when ``rank`` is not in the placement of ``tensor``.
+    """
+    rank = dist.get_rank() if rank is None else rank
+    ranks = np.asarray(tensor.placement.ranks)
+    coords = np.argwhere(ranks == rank)
+    if len(coords) == 0:
+        return None
+    coord = coords[0]
+    shape = tuple(tensor.shape)
+    bounds = [[0, size] for size in shape]
+    for dim, sbp in enumerate(tensor.sbp):
+        axis = _split_axis(sbp, len(shape))
+        if axis is None:
+            continue
+        # Same balanced split as OneFlow, the first `size % parts` shards get one more element
+        start, stop = bounds[axis]
+        parts = ranks.shape[dim]
+        size, rem = divmod(stop - start, parts)
+        index = coord[dim]
+        begin = start + index * size + min(index, rem)
+        bounds[axis] = [begin, begin + size + (1 if index < rem else 0)]
+    return tuple(slice(start, stop) for start, stop in bounds)
+
+
+def _read_checkpoint(path):
+    """Yields (key, reader) of every tensor in a checkpoint file, ``reader(slices)`` returns the
+    requested part of the tensor as a numpy array."""
+    if path.endswith(".safetensors"):
+        from safetensors import safe_open
+
+        with safe_open(path, framework="numpy") as f:
+            for key in f.keys():
+                yield key, lambda slices, key=key: f.get_slice(key)[slices]
+    else:
+        state_dict = flow.load(path)
+        for key in list(state_dict.keys()):
+            value = state_dict.pop(key)
+            yield key, lambda slices, value=value: value.numpy()[slices]
+        del state_dict
+
+
+def find_checkpoint_files(model_dir):
+    """Checkpoint files of a transformers model directory, safetensors preferred."""
+    for pattern in ("*.safetensors", "*.bin"):
+        files = sorted(glob.glob(os.path.join(model_dir, pattern)))
+        files = [f for f in files if not os.path.basename(f).startswith("training_args")]
+        if files:
+            return files
+    raise FileNotFoundError(f"No '.safetensors' or '.bin' checkpoint file found in {model_dir}")
+
+
+def load_sharded_checkpoint(model, checkpoint_files, base_model_prefix=None):
+    """Load every parameter and buffer of ``model`` from ``checkpoint_files``, each rank only
+    reads the shard it holds. Files are read one at a time.
+
+    Returns:
+        list: names of the model tensors not found in the checkpoint.
+    """
+    targets = dict(model.state_dict())
+    missing = set(targets.keys())
+    prefix = base_model_prefix + "." if base_model_prefix else None
+    for path in checkpoint_files:
+        for key, reader in _read_checkpoint(path):
+            name = key
+            if name not in targets and prefix is not None:
+                # Checkpoint of the base model loaded into a model with a head, or the reverse
+                if prefix + key in targets:
+                    name = prefix + key
+                elif key.startswith(prefix):
+                    name = key[len(prefix) :]
+            if name not in targets:
+                continue
+            target = targets[name]
+            slices = get_local_slices(target)
+            if slices is not None:
+                local = target.to_local()
+                value = flow.tensor(reader(slices), dtype=target.dtype, device=local.device)
+                assert value.shape == local.shape, (
+                    f"shape mismatch for {name}: checkpoint shard {tuple(value.shape)}, "
+                    f"model shard {tuple(local.shape)}"
+                )
+                with flow.no_grad():
+                    local.copy_(value)
+            missing.discard(name)
+    return sorted(missing)
+
+
+def load_tensor_parallel_model(
+    pretrained_model_name_or_path,
+    policy=None,
+    dtype=flow.float16,
+    trust_remote_code=False,
+    conv1d_modules=None,
+):
+    """Build a ``AutoModelForCausalLM`` with the tensor parallel layout of ``policy`` and load
+    the weights of ``pretrained_model_name_or_path`` into it shard by shard.
+
+    The distributed environment must be set up with ``dist.setup_dist_util`` before. The model is
+    placed on ``dist.get_layer_placement(0)``, so ``device_type="cpu"`` builds it on CPU.
+
+    Args:
+        pretrained_model_name_or_path (str): local model directory or model id on the hub.
+        policy (dict, optional): tensor parallel policy, looked up by ``config.model_type``
+            in ``TENSOR_PARALLEL_POLICIES`` by default.
+        dtype (flow.dtype, optional): dtype of the model. Defaults to ``flow.float16``.
+        trust_remote_code (bool, optional): allow models defined in the model directory.
+        conv1d_modules (list, optional): modules whose ``Conv1D`` layers should be sharded too,
+            the gpt2 modeling module by default for gpt2 models.
+    """
+    from oneflow.utils.global_view import global_mode
+    from transformers import AutoConfig, AutoModelForCausalLM
+    from transformers.modeling_utils import no_init_weights
+
+    model_dir = pretrained_model_name_or_path
+    if not os.path.isdir(model_dir):
+        from huggingface_hub import snapshot_download
+
+        model_dir = snapshot_download(
+            pretrained_model_name_or_path,
+            allow_patterns=["*.json", "*.safetensors", "*.bin", "*.py", "*.model"],
+        )
+
+    config = AutoConfig.from_pretrained(model_dir, trust_remote_code=trust_remote_code)
+    policy = get_policy(config.model_type) if policy is None else policy
+    if conv1d_modules is None:
+        conv1d_modules = []
+        if config.model_type == "gpt2":
+            from transformers.models.gpt2 import modeling_gpt2
+
+            conv1d_modules.append(modeling_gpt2)
+
+    placement_sbp_dict = dict(
+        placement=dist.get_layer_placement(0),
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+    )
+    with global_mode(True, **placement_sbp_dict), no_init_weights():
+        with defer_linear_init(conv1d_modules):
+            model = AutoModelForCausalLM.from_config(
+                config, torch_dtype=dtype, trust_remote_code=trust_remote_code
+            )
+        shard_linear_layers(model, policy, dtype=dtype)
+    if getattr(config, "tie_word_embeddings", False) and hasattr(model, "tie_weights"):
+        model.tie_weights()
+
+    checkpoint_files = find_checkpoint_files(model_dir)
+    missing = load_sharded_checkpoint(
+        model, checkpoint_files, base_model_prefix=getattr(model, "base_model_prefix", None)
+    )
+    # Tied weights and non-persistent buffers are not saved in checkpoints
+    if missing and dist.is_main_process():
+        logger.warning(f"Tensors not found in {model_dir}: {missing}")
+
+    return model.eval()
@@ -15,72 +15,18 @@
 
 import init_env  # noqa
 import oneflow as flow
+from auto_parallel import load_tensor_parallel_model
 from Baichuan import modeling_baichuan
 from omegaconf import DictConfig
 from oneflow.utils.global_view import global_mode
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoTokenizer
 
-from libai.layers import Linear, RMSLayerNorm
+from libai.layers import RMSLayerNorm
 from libai.utils import distributed as dist
 
-# ------replace RMSNorm to libai------
 modeling_baichuan.RMSNorm = RMSLayerNorm
 
 
-# ----------replace MLP to libai -----
-temp_class = modeling_baichuan.MLP
-
-
-class LiBaiMLP(temp_class):
-    def __init__(
-        self,
-        hidden_size: int,
-        intermediate_size: int,
-        hidden_act: str,
-    ):
-        super().__init__(
-            hidden_size,
-            intermediate_size,
-            hidden_act,
-        )
-
-        self.gate_proj = Linear(
-            hidden_size, intermediate_size, bias=False, parallel="col", dtype=flow.float16
-        )
-        self.up_proj = Linear(
-            hidden_size, intermediate_size, bias=False, parallel="col", dtype=flow.float16
-        )
-        self.down_proj = Linear(
-            intermediate_size, hidden_size, bias=False, parallel="row", dtype=flow.float16
-        )
-
-
-modeling_baichuan.MLP = LiBaiMLP
-
-
-# ----------replace Attention to libai -----
-temp_class = modeling_baichuan.Attention
-
-
-class LiBaiAttention(temp_class):
-    def __init__(self, config):
-        super().__init__(config)
-
-        self.W_pack = Linear(
-            self.hidden_size, 3 * self.hidden_size, bias=False, parallel="col", dtype=flow.float16
-        )
-        self.o_proj = Linear(
-            self.num_heads * self.head_dim,
-            self.hidden_size,
-            bias=False,
-            parallel="row",
-            dtype=flow.float16,
-        )
-
-
-modeling_baichuan.Attention = LiBaiAttention
-
-
 if __name__ == "__main__":
     # set dist config
     parallel_config = DictConfig(
@@ -89,27 +35,18 @@ if __name__ == "__main__":
             tensor_parallel_size=2,
             pipeline_parallel_size=1,  # set to 1, unsupport pipeline parallel now
             pipeline_num_layers=None,
-            device_type="cpu",
+            device_type="cuda",  # "cpu" works as well
         )
     )
     dist.setup_dist_util(parallel_config)
 
-    placement_sbp_dict = dict(
-        placement=flow.env.all_device_placement("cuda"),
-        sbp=flow.sbp.broadcast,
+    # initial model with the tensor parallel policy of its model type,
+    # every rank only loads its own shard of the weights
+    model = load_tensor_parallel_model(
+        "libai/projects/mock_transformers/Baichuan",
+        dtype=flow.float16,
+        trust_remote_code=True,
     )
-
-    # initial and load model
-    with global_mode(True, **placement_sbp_dict):
-        model = AutoModelForCausalLM.from_pretrained(
-            "libai/projects/mock_transformers/Baichuan",
-            torch_dtype=flow.float16,
-            trust_remote_code=True,
-        )
-
-    # set model to cuda
-    dist.set_device_type("cuda")
-    model._apply(dist.convert_to_distributed_default_setting)
     # initial tokenizer
     tokenizer = AutoTokenizer.from_pretrained(
         "libai/projects/mock_transformers/Baichuan", trust_remote_code=True
@@ -125,6 +62,10 @@ if __name__ == "__main__":
     )
 
     # generate id
+    placement_sbp_dict = dict(
+        placement=dist.get_layer_placement(0),
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+    )
     with global_mode(True, **placement_sbp_dict):
         generated_ids = model.generate(input_ids, max_new_tokens=64, repetition_penalty=1.1)
     out_put_ids = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
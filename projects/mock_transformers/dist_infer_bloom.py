@@ -15,68 +15,13 @@
 
 import init_env  # noqa
 import oneflow as flow
+from auto_parallel import load_tensor_parallel_model
 from omegaconf import DictConfig
 from oneflow.utils.global_view import global_mode
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from transformers.models.bloom import modeling_bloom
+from transformers import AutoTokenizer
 
-from libai.layers import Embedding, Linear
 from libai.utils import distributed as dist
 
-# ------replace attention to libai------
-temp_class = modeling_bloom.BloomAttention
-
-
-class LiBaiBloomAttention(temp_class):
-    def __init__(self, config):
-        super().__init__(config)
-
-        hidden_size = config.hidden_size
-
-        self.query_key_value = Linear(
-            hidden_size, 3 * hidden_size, bias=True, parallel="col", dtype=flow.float16
-        )
-        self.dense = Linear(hidden_size, hidden_size, bias=True, parallel="row", dtype=flow.float16)
-
-
-modeling_bloom.BloomAttention = LiBaiBloomAttention
-
-
-# ----------replace Decoder to libai -----
-temp_class = modeling_bloom.BloomMLP
-
-
-class LiBaiBloomMLP(temp_class):
-    def __init__(self, config):
-        super().__init__(config)
-
-        hidden_size = config.hidden_size
-
-        self.dense_h_to_4h = Linear(
-            hidden_size, 4 * hidden_size, bias=True, parallel="col", dtype=flow.float16
-        )
-        self.dense_4h_to_h = Linear(
-            4 * hidden_size, hidden_size, bias=True, parallel="row", dtype=flow.float16
-        )
-
-
-modeling_bloom.BloomMLP = LiBaiBloomMLP
-
-
-# ----------replace Embedding to libai -----
-temp_class = modeling_bloom.BloomModel
-
-
-class LiBaiBloomModel(temp_class):
-    def __init__(self, config):
-        super().__init__(config)
-
-        self.word_embeddings = Embedding(config.vocab_size, self.embed_dim, dtype=flow.float16)
-
-
-modeling_bloom.BloomModel = LiBaiBloomModel
-
-
 if __name__ == "__main__":
     # set dist config
     parallel_config = DictConfig(
@@ -85,25 +30,14 @@ if __name__ == "__main__":
             tensor_parallel_size=2,
             pipeline_parallel_size=1,  # set to 1, unsupport pipeline parallel now
             pipeline_num_layers=None,
-            device_type="cpu",
+            device_type="cuda",  # "cpu" works as well
         )
     )
     dist.setup_dist_util(parallel_config)
 
-    placement_sbp_dict = dict(
-        placement=flow.env.all_device_placement("cuda"),
-        sbp=flow.sbp.broadcast,
-    )
-
-    # initial and load model
-    with global_mode(True, **placement_sbp_dict):
-        model = AutoModelForCausalLM.from_pretrained(
-            "bigscience/bloom-560m", torch_dtype=flow.float16
-        )
-
-    # set model to cuda
-    dist.set_device_type("cuda")
-    model._apply(dist.convert_to_distributed_default_setting)
+    # initial model with the tensor parallel policy of its model type,
+    # every rank only loads its own shard of the weights
+    model = load_tensor_parallel_model("bigscience/bloom-560m", dtype=flow.float16)
     # initial tokenizer
     tokenizer = AutoTokenizer.from_pretrained("bigscience/bloom-560m", use_fast=False)
 
@@ -117,6 +51,10 @@ if __name__ == "__main__":
     )
 
     # generate id
+    placement_sbp_dict = dict(
+        placement=dist.get_layer_placement(0),
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+    )
     with global_mode(True, **placement_sbp_dict):
         generated_ids = model.generate(input_ids, max_length=30)
     out_put_ids = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
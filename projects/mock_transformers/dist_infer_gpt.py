@@ -15,104 +15,13 @@
 
 import init_env  # noqa
 import oneflow as flow
+from auto_parallel import load_tensor_parallel_model
 from omegaconf import DictConfig
 from oneflow.utils.global_view import global_mode
-from transformers import AutoModelForCausalLM, AutoTokenizer, pytorch_utils
-from transformers.models.gpt2 import modeling_gpt2
+from transformers import AutoTokenizer
 
-from libai.layers import Conv1D
 from libai.utils import distributed as dist
 
-
-# ------replace Conv1D to libai------
-class LiBaiConv1d(Conv1D):
-    def __init__(
-        self,
-        nf,
-        nx,
-        bias=True,
-        parallel="data",
-        init_method=flow.nn.init.xavier_normal_,
-        skip_bias_add=False,
-        dtype=flow.float32,
-        layer_idx=0,
-    ):
-        super().__init__(
-            in_features=nx,
-            out_features=nf,
-            bias=bias,
-            parallel=parallel,
-            init_method=init_method,
-            skip_bias_add=skip_bias_add,
-            dtype=dtype,
-            layer_idx=layer_idx,
-        )
-
-
-pytorch_utils.Conv1D = LiBaiConv1d
-
-
-# ------replace attention to libai------
-temp_class = modeling_gpt2.GPT2Attention
-
-
-class LiBaiGPT2Attention(temp_class):
-    def __init__(self, config, is_cross_attention=False, layer_idx=None):
-        super().__init__(config, is_cross_attention=is_cross_attention, layer_idx=layer_idx)
-
-        if is_cross_attention:
-            self.c_attn = Conv1D(
-                in_features=self.embed_dim,
-                out_features=2 * self.embed_dim,
-                parallel="col",
-                dtype=flow.float16,
-            )
-            self.q_attn = Conv1D(
-                in_features=self.embed_dim,
-                out_features=self.embed_dim,
-                parallel="col",
-                dtype=flow.float16,
-            )
-        else:
-            self.c_attn = Conv1D(
-                in_features=self.embed_dim,
-                out_features=3 * self.embed_dim,
-                parallel="col",
-                dtype=flow.float16,
-            )
-        self.c_proj = Conv1D(
-            in_features=self.embed_dim,
-            out_features=self.embed_dim,
-            parallel="row",
-            dtype=flow.float16,
-        )
-
-
-modeling_gpt2.GPT2Attention = LiBaiGPT2Attention
-
-
-# ------replace mlp to libai------
-temp_class = modeling_gpt2.GPT2MLP
-
-
-class LiBaiGPT2MLP(temp_class):
-    def __init__(self, intermediate_size, config):
-        super().__init__(intermediate_size, config)
-        embed_dim = config.hidden_size
-        self.c_fc = Conv1D(
-            in_features=embed_dim,
-            out_features=intermediate_size,
-            parallel="col",
-            dtype=flow.float16,
-        )
-        self.c_proj = Conv1D(
-            in_features=intermediate_size,
-            out_features=embed_dim,
-            parallel="row",
-            dtype=flow.float16,
-        )
-
-
 if __name__ == "__main__":
     # set dist config
     parallel_config = DictConfig(
@@ -121,23 +30,14 @@ if __name__ == "__main__":
             tensor_parallel_size=2,
             pipeline_parallel_size=1,  # set to 1, unsupport pipeline parallel now
             pipeline_num_layers=None,
-            device_type="cpu",
+            device_type="cuda",  # "cpu" works as well
         )
     )
     dist.setup_dist_util(parallel_config)
 
-    placement_sbp_dict = dict(
-        placement=flow.env.all_device_placement("cuda"),
-        sbp=flow.sbp.broadcast,
-    )
-
-    # initial and load model
-    with global_mode(True, **placement_sbp_dict):
-        model = AutoModelForCausalLM.from_pretrained("gpt2", torch_dtype=flow.float16)
-
-    # set model to cuda
-    dist.set_device_type("cuda")
-    model._apply(dist.convert_to_distributed_default_setting)
+    # initial model with the tensor parallel policy of its model type,
+    # every rank only loads its own shard of the weights
+    model = load_tensor_parallel_model("gpt2", dtype=flow.float16)
     # initial tokenizer
     tokenizer = AutoTokenizer.from_pretrained("gpt2", use_fast=False)
 
@@ -151,6 +51,10 @@ if __name__ == "__main__":
     )
 
     # generate id
+    placement_sbp_dict = dict(
+        placement=dist.get_layer_placement(0),
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+    )
     with global_mode(True, **placement_sbp_dict):
         generated_ids = model.generate(input_ids, max_length=30)
     out_put_ids = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
@@ -15,59 +15,13 @@
 
 import init_env  # noqa
 import oneflow as flow
+from auto_parallel import load_tensor_parallel_model
 from omegaconf import DictConfig
 from oneflow.utils.global_view import global_mode
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from transformers.models.opt import modeling_opt
+from transformers import AutoTokenizer
 
-from libai.layers import Linear
 from libai.utils import distributed as dist
 
-# ------replace attention to libai------
-temp_class = modeling_opt.OPTAttention
-
-
-class LiBaiOPTAttention(temp_class):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        embed_dim = kwargs["embed_dim"]
-        bias = kwargs["bias"]
-        self.k_proj = Linear(embed_dim, embed_dim, bias=bias, parallel="col", dtype=flow.float16)
-        self.v_proj = Linear(embed_dim, embed_dim, bias=bias, parallel="col", dtype=flow.float16)
-        self.q_proj = Linear(embed_dim, embed_dim, bias=bias, parallel="col", dtype=flow.float16)
-        self.out_proj = Linear(embed_dim, embed_dim, bias=bias, parallel="row", dtype=flow.float16)
-
-
-modeling_opt.OPTAttention = LiBaiOPTAttention
-
-
-# ----------replace Decoder to libai -----
-temp_class = modeling_opt.OPTDecoderLayer
-
-
-class LiBaiOPTDecoderLayer(temp_class):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        config = args[0]
-        self.fc1 = Linear(
-            self.embed_dim,
-            config.ffn_dim,
-            bias=config.enable_bias,
-            parallel="col",
-            dtype=flow.float16,
-        )
-        self.fc2 = Linear(
-            config.ffn_dim,
-            self.embed_dim,
-            bias=config.enable_bias,
-            parallel="row",
-            dtype=flow.float16,
-        )
-
-
-modeling_opt.OPTDecoderLayer = LiBaiOPTDecoderLayer
-
-
 if __name__ == "__main__":
     # set dist config
     parallel_config = DictConfig(
@@ -76,23 +30,14 @@ if __name__ == "__main__":
             tensor_parallel_size=2,
             pipeline_parallel_size=1,  # set to 1, unsupport pipeline parallel now
             pipeline_num_layers=None,
-            device_type="cpu",
+            device_type="cuda",  # "cpu" works as well
         )
     )
     dist.setup_dist_util(parallel_config)
 
-    placement_sbp_dict = dict(
-        placement=flow.env.all_device_placement("cuda"),
-        sbp=flow.sbp.broadcast,
-    )
-
-    with global_mode(True, **placement_sbp_dict):
-        # initial and load model
-        model = AutoModelForCausalLM.from_pretrained("facebook/opt-125m", torch_dtype=flow.float16)
-
-    # set model to cuda
-    dist.set_device_type("cuda")
-    model._apply(dist.convert_to_distributed_default_setting)
+    # initial model with the tensor parallel policy of its model type,
+    # every rank only loads its own shard of the weights
+    model = load_tensor_parallel_model("facebook/opt-125m", dtype=flow.float16)
     # initial tokenizer
     tokenizer = AutoTokenizer.from_pretrained("facebook/opt-125m", use_fast=False)
 
@@ -105,6 +50,11 @@ if __name__ == "__main__":
         placement=dist.get_layer_placement(0),
     )
 
+    # generate id
+    placement_sbp_dict = dict(
+        placement=dist.get_layer_placement(0),
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+    )
     with global_mode(True, **placement_sbp_dict):
         generated_ids = model.generate(input_ids, max_length=30)
     out_put_ids = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
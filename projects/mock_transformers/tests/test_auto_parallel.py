@@ -0,0 +1,134 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import oneflow as flow
+from omegaconf import DictConfig
+from oneflow import nn
+from safetensors.numpy import save_file
+
+from libai.layers import Linear
+from libai.utils import distributed as dist
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from auto_parallel import (  # noqa: E402
+    TENSOR_PARALLEL_POLICIES,
+    defer_linear_init,
+    get_local_slices,
+    get_parallel_mode,
+    load_sharded_checkpoint,
+    shard_linear_layers,
+)
+
+
+class ToyMLP(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.gate_proj = nn.Linear(8, 16, bias=False)
+        self.up_proj = nn.Linear(8, 16, bias=False)
+        self.down_proj = nn.Linear(16, 8, bias=False)
+        self.norm = nn.LayerNorm(8)
+
+    def forward(self, x):
+        x = self.norm(x)
+        return self.down_proj(flow.nn.functional.silu(self.gate_proj(x)) * self.up_proj(x))
+
+
+class TestAutoParallel(unittest.TestCase):
+    def setUp(self):
+        dist.setup_dist_util(
+            DictConfig(
+                dict(
+                    data_parallel_size=1,
+                    tensor_parallel_size=1,
+                    pipeline_parallel_size=1,
+                    device_type="cpu",
+                )
+            )
+        )
+
+    def test_llama_policy(self):
+        policy = TENSOR_PARALLEL_POLICIES["llama"]
+        self.assertEqual(get_parallel_mode("model.layers.0.mlp.gate_proj", policy), "col")
+        self.assertEqual(get_parallel_mode("model.layers.0.mlp.up_proj", policy), "col")
+        self.assertEqual(get_parallel_mode("model.layers.0.mlp.down_proj", policy), "row")
+        self.assertEqual(get_parallel_mode("model.layers.0.self_attn.o_proj", policy), "row")
+        self.assertEqual(get_parallel_mode("model.layers.0.self_attn.rotary_emb", policy), "data")
+
+        bloom = TENSOR_PARALLEL_POLICIES["bloom"]
+        self.assertEqual(get_parallel_mode("h.0.self_attention.dense", bloom), "row")
+        self.assertEqual(get_parallel_mode("h.0.mlp.dense_h_to_4h", bloom), "col")
+
+    def test_local_slices(self):
+        # 2 tensor parallel ranks, odd size is split as OneFlow does: 5 -> 3 + 2
+        tensor = SimpleNamespace(
+            shape=(5, 4), placement=SimpleNamespace(ranks=[0, 1]), sbp=(flow.sbp.split(0),)
+        )
+        self.assertEqual(get_local_slices(tensor, rank=0), (slice(0, 3), slice(0, 4)))
+        self.assertEqual(get_local_slices(tensor, rank=1), (slice(3, 5), slice(0, 4)))
+        self.assertIsNone(get_local_slices(tensor, rank=2))
+
+        # data parallel x tensor parallel mesh
+        tensor = SimpleNamespace(
+            shape=(4, 6),
+            placement=SimpleNamespace(ranks=[[0, 1, 2], [3, 4, 5]]),
+            sbp=(flow.sbp.broadcast, flow.sbp.split(1)),
+        )
+        self.assertEqual(get_local_slices(tensor, rank=4), (slice(0, 4), slice(2, 4)))
+
+    def test_shard_and_load(self):
+        rng = np.random.RandomState(0)
+        state_dict = {
+            "gate_proj.weight": rng.randn(16, 8).astype(np.float32),
+            "up_proj.weight": rng.randn(16, 8).astype(np.float32),
+            "down_proj.weight": rng.randn(8, 16).astype(np.float32),
+            "norm.weight": rng.rand(8).astype(np.float32),
+            "norm.bias": rng.rand(8).astype(np.float32),
+        }
+
+        placement = dist.get_layer_placement(0)
+        sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+        with defer_linear_init():
+            model = ToyMLP()
+        model = model.to_global(placement=placement, sbp=sbp)
+        modes = shard_linear_layers(model, TENSOR_PARALLEL_POLICIES["llama"])
+        self.assertEqual(modes, {"gate_proj": "col", "up_proj": "col", "down_proj": "row"})
+        self.assertIsInstance(model.down_proj, Linear)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "model.safetensors")
+            save_file(state_dict, path)
+            missing = load_sharded_checkpoint(model, [path])
+        self.assertEqual(missing, [])
+
+        x = rng.randn(2, 8).astype(np.float32)
+        output = model(flow.tensor(x, placement=placement, sbp=sbp))
+
+        h = (x - x.mean(-1, keepdims=True)) / np.sqrt(x.var(-1, keepdims=True) + 1e-5)
+        h = h * state_dict["norm.weight"] + state_dict["norm.bias"]
+        gate = h @ state_dict["gate_proj.weight"].T
+        up = h @ state_dict["up_proj.weight"].T
+        expected = (gate / (1 + np.exp(-gate)) * up) @ state_dict["down_proj.weight"].T
+        self.assertTrue(np.allclose(output.numpy(), expected, atol=1e-4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -33,6 +33,11 @@ dataloader.train = LazyCall(build_nlp_train_loader)(
         ),
     ],
     num_workers=4,
+    length_bucketing=dict(
+        enabled=False,
+        bucket_boundaries=[32, 64, 96],
+        trim_fields={"input_ids": [1], "attention_mask": [1], "token_type_ids": [1]},
+    ),
 )
 dataloader.test = [
     LazyCall(build_nlp_test_loader)(
@@ -15,18 +15,23 @@
 
 import logging
 import os
-import time
 from enum import Enum
 from typing import Optional, Union
 
+import numpy as np
 import oneflow as flow
-from filelock import FileLock
 from oneflow.utils.data import Dataset
 
+from libai.data.datasets.tokenized_dataset import (
+    build_tokenized_dataset,
+    pad_item,
+    tokenizer_fingerprint,
+)
 from libai.data.structures import DistTensorData, Instance
+from libai.utils.file_io import fingerprint
 
-from .utils import EncodePattern
-from .utils_glue import glue_convert_examples_to_features, glue_output_modes, glue_processors
+from .utils import EncodePattern, ExampleEncoder, split_files
+from .utils_glue import glue_output_modes, glue_processors
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +43,12 @@ class Split(Enum):
 
 
 class GlueDataset(Dataset):
+    """
+    Examples of a GLUE task, tokenized once into indexed files shared by the workers of
+    the data loaders, see :class:`libai.data.datasets.TokenizedDataset`. The files are named
+    after the data files and the tokenizer, and rebuilt when either changes.
+    """
+
     def __init__(
         self,
         task_name,
@@ -48,6 +59,7 @@ class GlueDataset(Dataset):
         pattern: Union[str, EncodePattern] = EncodePattern.bert_pattern,
         cache_dir: Optional[str] = None,
         overwrite_cache: bool = False,
+        tokenize_workers: Optional[int] = None,
     ):
         self.processor = glue_processors[task_name]()
         self.output_mode = glue_output_modes[task_name]
@@ -61,71 +73,72 @@ class GlueDataset(Dataset):
                 pattern = EncodePattern[pattern]
             except KeyError:
                 raise KeyError("pattern is not a valid pattern method")
-        # Load data features from cache or dataset file
-        cached_features_file = os.path.join(
-            cache_dir if cache_dir is not None else data_dir,
-            f"cached_{mode.value}_{tokenizer.__class__.__name__}_{max_seq_length}_{task_name}",
-        )
+        self.max_seq_length = max_seq_length
+        self.pad_id = tokenizer.pad_token_id
         label_list = self.processor.get_labels()
         self.label_list = label_list
 
-        # Make sure only the first process in distributed training processes the dataset,
-        # and the others will use the cache.
-        lock_path = cached_features_file + ".lock"
-        with FileLock(lock_path):
-
-            if os.path.exists(cached_features_file) and not overwrite_cache:
-                start = time.time()
-                self.features = flow.load(cached_features_file)
-                logger.info(
-                    f"Loading features from cached file {cached_features_file} [took %.3f s]",
-                    time.time() - start,
-                )
+        # Load data features from cache or dataset file
+        key = fingerprint(
+            split_files(data_dir, mode.value),
+            tokenizer_fingerprint(tokenizer),
+            max_seq_length,
+            pattern,
+            label_list,
+        )
+        cached_features_prefix = os.path.join(
+            cache_dir if cache_dir is not None else data_dir,
+            f"cached_{mode.value}_{tokenizer.__class__.__name__}_{max_seq_length}_{task_name}_"
+            f"{key}",
+        )
+        fields = {"input_ids": np.int32, "token_type_ids": np.int8}
+        # the examples of the test split have no labels
+        if mode != Split.test:
+            fields["labels"] = np.float32 if self.output_mode == "regression" else np.int64
+
+        def read_examples():
+            logger.info(f"Creating features from dataset file at {data_dir}")
+            if mode == Split.dev:
+                return self.processor.get_dev_examples(data_dir)
+            elif mode == Split.test:
+                return self.processor.get_test_examples(data_dir)
             else:
-                logger.info(f"Creating features from dataset file at {data_dir}")
-
-                if mode == Split.dev:
-                    examples = self.processor.get_dev_examples(data_dir)
-                elif mode == Split.test:
-                    examples = self.processor.get_test_examples(data_dir)
-                else:
-                    examples = self.processor.get_train_examples(data_dir)
-
-                self.features = glue_convert_examples_to_features(
-                    examples,
-                    tokenizer,
-                    max_length=max_seq_length,
-                    pattern=pattern,
-                    label_list=label_list,
-                    output_mode=self.output_mode,
-                )
-                start = time.time()
-                flow.save(self.features, cached_features_file)
-                logger.info(
-                    f"Saving features into cached file {cached_features_file} "
-                    f"[took {time.time() - start:.3f} s]"
-                )
+                return self.processor.get_train_examples(data_dir)
+
+        self.features = build_tokenized_dataset(
+            cached_features_prefix,
+            fields,
+            read_examples,
+            ExampleEncoder(tokenizer, max_seq_length, pattern, label_list, self.output_mode),
+            num_workers=tokenize_workers,
+            overwrite_cache=overwrite_cache,
+        )
 
     def __len__(self):
         return len(self.features)
 
     def __getitem__(self, i):
         feature = self.features[i]
-        tensors = {}
-        for k, v in feature.__dict__.items():
-            if v is not None:
-                if k == "label":
-                    dtype = flow.long if isinstance(v, int) else flow.float
-                    t = flow.tensor(v, dtype=dtype)
-                    tensors[k] = DistTensorData(t, placement_idx=-1)
-                elif k == "attention_mask":
-                    t = flow.tensor(v, dtype=flow.bool)
-                    tensors[k] = DistTensorData(t)
-                else:
-                    t = flow.tensor(v, dtype=flow.long)
-                    tensors[k] = DistTensorData(t)
+        input_ids = pad_item(feature["input_ids"], self.max_seq_length, self.pad_id)
+        attention_mask = np.arange(self.max_seq_length) < len(feature["input_ids"])
+        token_type_ids = pad_item(feature["token_type_ids"], self.max_seq_length)
+        tensors = dict(
+            input_ids=DistTensorData(flow.tensor(input_ids, dtype=flow.long)),
+            attention_mask=DistTensorData(flow.tensor(attention_mask, dtype=flow.bool)),
+            token_type_ids=DistTensorData(flow.tensor(token_type_ids, dtype=flow.long)),
+        )
+        if "labels" in feature:
+            if self.output_mode == "regression":
+                t = flow.tensor(float(feature["labels"][0]), dtype=flow.float)
+            else:
+                t = flow.tensor(int(feature["labels"][0]), dtype=flow.long)
+            tensors["labels"] = DistTensorData(t, placement_idx=-1)
         sample = Instance(**tensors)
         return sample
 
     def get_labels(self):
         return self.label_list
+
+    def get_lengths(self):
+        """Number of tokens of every example, used by `LengthBucketSampler`."""
+        return self.features.sizes("input_ids")
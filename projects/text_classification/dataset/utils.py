@@ -15,6 +15,7 @@
 
 import csv
 import json
+import os
 from dataclasses import dataclass
 from enum import Enum
 from typing import List, Optional, Union
@@ -78,6 +79,90 @@ class InputFeatures:
     labels: Optional[Union[int, float]] = None
 
 
+def split_files(data_dir, split_name):
+    """Data files of a split, e.g. `dev.json` or `dev_matched.tsv` for `dev`."""
+    return [
+        os.path.join(data_dir, name)
+        for name in sorted(os.listdir(data_dir))
+        if name.startswith(split_name) and os.path.isfile(os.path.join(data_dir, name))
+    ]
+
+
+class ExampleEncoder:
+    """
+    Encodes an `InputExample` into its unpadded `input_ids` and `token_type_ids` and its
+    label id. It holds the tokenizer, so that a pool of processes can tokenize examples with it.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        max_length,
+        pattern=EncodePattern.bert_pattern,
+        label_list=None,
+        output_mode=None,
+    ):
+        if pattern == EncodePattern.bert_pattern:
+            self.added_special_tokens = [2, 3]
+        elif pattern == EncodePattern.roberta_pattern:
+            self.added_special_tokens = [2, 4]
+        else:
+            raise KeyError("pattern is not a valid EncodePattern")
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.pattern = pattern
+        self.label_map = {label: i for i, label in enumerate(label_list)}
+        self.output_mode = output_mode
+
+    def __call__(self, example):
+        tokenizer = self.tokenizer
+        start_token = [] if tokenizer.start_token is None else [tokenizer.start_token]
+        end_token = [] if tokenizer.end_token is None else [tokenizer.end_token]
+
+        tokens_a = tokenizer.tokenize(example.text_a)
+
+        tokens_b = None
+        if example.text_b:
+            tokens_b = tokenizer.tokenize(example.text_b)
+            _truncate_seq_pair(tokens_a, tokens_b, self.max_length - self.added_special_tokens[1])
+        else:
+            if len(tokens_a) > self.max_length - self.added_special_tokens[0]:
+                tokens_a = tokens_a[: (self.max_length - self.added_special_tokens[0])]
+
+        tokens = start_token + tokens_a + end_token
+        token_type_ids = [0] * len(tokens)
+        if tokens_b:
+            if self.pattern is EncodePattern.bert_pattern:
+                tokens += tokens_b + end_token
+            else:
+                tokens += end_token + tokens_b + end_token
+            token_type_ids += [1] * (len(tokens) - len(token_type_ids))
+
+        label = None
+        if example.label is not None:
+            if self.output_mode == "classification":
+                label = self.label_map[example.label]
+            elif self.output_mode == "regression":
+                label = float(example.label)
+
+        return {
+            "input_ids": tokenizer.convert_tokens_to_ids(tokens),
+            "token_type_ids": token_type_ids,
+            "labels": label,
+        }
+
+
+def _truncate_seq_pair(tokens_a, tokens_b, max_length):
+    while True:
+        total_length = len(tokens_a) + len(tokens_b)
+        if total_length <= max_length:
+            break
+        if len(tokens_a) > len(tokens_b):
+            tokens_a.pop()
+        else:
+            tokens_b.pop()
+
+
 class DataProcessor:
     """Base class for data converters for sequence classification data sets."""
 
@@ -16,7 +16,7 @@
 import logging
 import os
 
-from .utils import DataProcessor, EncodePattern, InputExample, InputFeatures
+from .utils import DataProcessor, EncodePattern, ExampleEncoder, InputExample, InputFeatures
 
 logger = logging.getLogger(__name__)
 
@@ -39,50 +39,17 @@ def glue_convert_examples_to_features(
             output_mode = glue_output_modes[task]
             logger.info(f"Using output mode {output_mode} for task {task}")
 
-    label_map = {label: i for i, label in enumerate(label_list)}
-
-    start_token = [] if tokenizer.start_token is None else [tokenizer.start_token]
-    end_token = [] if tokenizer.end_token is None else [tokenizer.end_token]
+    encoder = ExampleEncoder(tokenizer, max_length, pattern, label_list, output_mode)
     pad_id = tokenizer.pad_token_id
 
-    if pattern == EncodePattern.bert_pattern:
-        added_special_tokens = [2, 3]
-    elif pattern == EncodePattern.roberta_pattern:
-        added_special_tokens = [2, 4]
-    else:
-        raise KeyError("pattern is not a valid EncodePattern")
-
     features = []
     for (ex_index, example) in enumerate(examples):
         if ex_index % 10000 == 0:
             logger.info("Writing example %d of %d" % (ex_index, len(examples)))
 
-        tokens_a = tokenizer.tokenize(example.text_a)
-
-        tokens_b = None
-        if example.text_b:
-            tokens_b = tokenizer.tokenize(example.text_b)
-            _truncate_seq_pair(tokens_a, tokens_b, max_length - added_special_tokens[1])
-        else:
-            if len(tokens_a) > max_length - added_special_tokens[0]:
-                tokens_a = tokens_a[: (max_length - added_special_tokens[0])]
-
-        if pattern is EncodePattern.bert_pattern:
-            tokens = start_token + tokens_a + end_token
-            token_type_ids = [0] * len(tokens)
-            if tokens_b:
-                tokens += tokens_b + end_token
-                token_type_ids += [1] * (len(tokens) - len(token_type_ids))
-        elif pattern is EncodePattern.roberta_pattern:
-            tokens = start_token + tokens_a + end_token
-            token_type_ids = [0] * len(tokens)
-            if tokens_b:
-                tokens += end_token + tokens_b + end_token
-                token_type_ids += [1] * (len(tokens) - len(token_type_ids))
-        else:
-            raise KeyError("pattern is not a valid EncodePattern")
-
-        input_ids = tokenizer.convert_tokens_to_ids(tokens)
+        encoded = encoder(example)
+        input_ids = encoded["input_ids"]
+        token_type_ids = encoded["token_type_ids"]
         attention_mask = [1] * len(input_ids)
 
         padding_length = max_length - len(input_ids)
@@ -90,12 +57,7 @@ def glue_convert_examples_to_features(
         attention_mask = attention_mask + ([0] * padding_length)
         token_type_ids = token_type_ids + ([0] * padding_length)
 
-        label = None
-        if example.label is not None:
-            if output_mode == "classification":
-                label = label_map[example.label]
-            elif output_mode == "regression":
-                label = float(example.label)
+        label = encoded["labels"]
 
         if ex_index < 5:
             logger.info("*** Example ***")
@@ -117,17 +79,6 @@ def glue_convert_examples_to_features(
     return features
 
 
-def _truncate_seq_pair(tokens_a, tokens_b, max_length):
-    while True:
-        total_length = len(tokens_a) + len(tokens_b)
-        if total_length <= max_length:
-            break
-        if len(tokens_a) > len(tokens_b):
-            tokens_a.pop()
-        else:
-            tokens_b.pop()
-
-
 class MrpcProcessor(DataProcessor):
     """Processor for the MRPC data set (GLUE version).
     Sentence pair classification task.
@@ -0,0 +1,97 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+from oneflow.utils.data.dataset import ConcatDataset
+
+from libai.config import LazyCall
+from libai.data.build import BatchFetchDataset, build_nlp_test_loader, trivial_batch_collator
+from libai.data.samplers import SingleRoundSampler
+from libai.data.structures import DistTensorData, Instance
+
+
+class ToyDataset(flow.utils.data.Dataset):
+    """Sample ``idx`` is ``offset + idx`` repeated, built one by one or a batch at once."""
+
+    def __init__(self, size, offset=0):
+        self.size = size
+        self.offset = offset
+        self.num_batch_calls = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        return Instance(
+            input_ids=DistTensorData(flow.full((4,), self.offset + idx, dtype=flow.long)),
+            labels=DistTensorData(flow.tensor(self.offset + idx), placement_idx=-1),
+        )
+
+    def get_batch(self, indices):
+        self.num_batch_calls += 1
+        ids = self.offset + np.asarray(indices, dtype=np.int64)
+        return Instance(
+            input_ids=DistTensorData(flow.from_numpy(np.repeat(ids[:, None], 4, axis=1))),
+            labels=DistTensorData(flow.from_numpy(ids), placement_idx=-1),
+        )
+
+
+def build_loader(dataset, collate_fn=None):
+    return build_nlp_test_loader(
+        dataset,
+        test_batch_size=4,
+        sampler=LazyCall(SingleRoundSampler)(shuffle=False, drop_last=False),
+        num_workers=0,
+        collate_fn=collate_fn,
+    )
+
+
+class TestBatchFetch(unittest.TestCase):
+    def check_batches(self, batches, expected_ids):
+        self.assertEqual(len(batches), len(expected_ids))
+        for batch, ids in zip(batches, expected_ids):
+            self.assertEqual(batch.get("labels").tensor.tolist(), ids)
+            self.assertEqual(batch.get("input_ids").tensor.tolist(), [[i] * 4 for i in ids])
+
+    def test_loader_uses_get_batch(self):
+        dataset = ToyDataset(10)
+        batches = list(build_loader(dataset))
+        self.check_batches(batches, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(dataset.num_batch_calls, 3)
+
+        # a custom collate_fn still gets the samples of `__getitem__`
+        dataset = ToyDataset(10)
+        batches = list(build_loader(dataset, collate_fn=trivial_batch_collator))
+        self.check_batches(batches, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(dataset.num_batch_calls, 0)
+
+    def test_concat_dataset(self):
+        datasets = [ToyDataset(4), ToyDataset(6, offset=100)]
+        dataset = ConcatDataset(datasets)
+        self.assertTrue(BatchFetchDataset.supported(dataset))
+        batches = list(build_loader(dataset))
+        self.check_batches(batches, [[0, 1, 2, 3], [100, 101, 102, 103], [104, 105]])
+        self.assertEqual([d.num_batch_calls for d in datasets], [1, 2])
+
+        # a batch across datasets is stacked from the samples
+        batch = BatchFetchDataset(dataset)[[2, 3, 4]]
+        self.assertEqual(batch.get("labels").tensor.tolist(), [2, 3, 100])
+
+
+if __name__ == "__main__":
+    unittest.main()
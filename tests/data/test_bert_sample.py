@@ -0,0 +1,85 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from libai.data.datasets.bert_dataset import (
+    create_tokens_and_tokentypes,
+    pad_and_convert_to_numpy,
+    truncate_segments,
+)
+
+
+def _truncate_by_loop(tokens_a, tokens_b, max_num_tokens, np_rng):
+    # The per-token truncation loop used before the offsets were computed at once.
+    tokens_a, tokens_b = list(tokens_a), list(tokens_b)
+    while len(tokens_a) + len(tokens_b) > max_num_tokens:
+        tokens = tokens_a if len(tokens_a) > len(tokens_b) else tokens_b
+        if np_rng.random() < 0.5:
+            del tokens[0]
+        else:
+            tokens.pop()
+    return tokens_a, tokens_b
+
+
+class TestBertSample(unittest.TestCase):
+    def test_truncate_segments(self):
+        rng = np.random.RandomState(0)
+        for seed in range(200):
+            tokens_a = np.arange(rng.randint(1, 40))
+            tokens_b = np.arange(100, 100 + rng.randint(0, 40))
+            max_num_tokens = rng.randint(1, 60)
+            expected_a, expected_b = _truncate_by_loop(
+                tokens_a, tokens_b, max_num_tokens, np.random.RandomState(seed)
+            )
+            np_rng = np.random.RandomState(seed)
+            (front_a, back_a), (front_b, back_b) = truncate_segments(
+                len(tokens_a), len(tokens_b), max_num_tokens, np_rng
+            )
+            self.assertEqual(tokens_a[front_a : len(tokens_a) - back_a].tolist(), expected_a)
+            self.assertEqual(tokens_b[front_b : len(tokens_b) - back_b].tolist(), expected_b)
+            # Both ways consume the random generator the same.
+            ref_rng = np.random.RandomState(seed)
+            _truncate_by_loop(tokens_a, tokens_b, max_num_tokens, ref_rng)
+            self.assertEqual(np_rng.randint(1 << 30), ref_rng.randint(1 << 30))
+
+    def test_tokens_and_padding(self):
+        tokens, tokentypes = create_tokens_and_tokentypes(
+            np.array([5, 6]), np.array([7]), cls_id=1, sep_id=2
+        )
+        self.assertEqual(tokens.tolist(), [1, 5, 6, 2, 7, 2])
+        self.assertEqual(tokentypes.tolist(), [0, 0, 0, 0, 1, 1])
+
+        # Stale values in the preallocated buffers are all overwritten.
+        out = (
+            np.full(8, 9, dtype=np.int64),
+            np.full(8, 9, dtype=np.int64),
+            np.full(8, 9, dtype=np.int64),
+            np.ones(8, dtype=bool),
+            np.ones(8, dtype=bool),
+        )
+        outputs = pad_and_convert_to_numpy(tokens, tokentypes, [2], [6], 0, 8, out=out)
+        tokens_np, tokentypes_np, labels_np, padding_mask_np, loss_mask_np = outputs
+        self.assertEqual(tokens_np.tolist(), [1, 5, 6, 2, 7, 2, 0, 0])
+        self.assertEqual(tokentypes_np.tolist(), [0, 0, 0, 0, 1, 1, 0, 0])
+        self.assertEqual(labels_np.tolist(), [-1, -1, 6, -1, -1, -1, -1, -1])
+        self.assertEqual(padding_mask_np.tolist(), [True] * 6 + [False] * 2)
+        self.assertEqual(loss_mask_np.tolist(), [False, False, True] + [False] * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import unittest
+
+import numpy as np
+import oneflow as flow
+
+from libai.data.build import BucketPaddingCollator, build_nlp_train_loader
+from libai.data.samplers import LengthBucketSampler
+from libai.data.samplers.samplers import get_bucket_index
+from libai.data.structures import DistTensorData, Instance
+
+BOUNDARIES = (8, 16, 32)
+
+
+class ToyDataset(flow.utils.data.Dataset):
+    def __init__(self, lengths, padded_length=64):
+        self.lengths = lengths
+        self.padded_length = padded_length
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, idx):
+        length = self.lengths[idx]
+        mask = [1] * length + [0] * (self.padded_length - length)
+        return Instance(
+            input_ids=DistTensorData(flow.full((self.padded_length,), idx, dtype=flow.long)),
+            attention_mask=DistTensorData(flow.tensor(mask, dtype=flow.bool)),
+        )
+
+
+def build_sampler(lengths, **kwargs):
+    return LengthBucketSampler(
+        list(range(len(lengths))),
+        micro_batch_size=4,
+        seed=123,
+        bucket_boundaries=BOUNDARIES,
+        lengths=lengths,
+        **kwargs,
+    )
+
+
+class TestLengthBucketSampler(unittest.TestCase):
+    def setUp(self):
+        self.lengths = np.random.RandomState(0).randint(1, 64, size=200).tolist()
+
+    def test_single_bucket_batches(self):
+        sampler = build_sampler(self.lengths)
+        for batch in itertools.islice(sampler, 100):
+            buckets = {get_bucket_index(self.lengths[idx], BOUNDARIES) for idx in batch}
+            self.assertEqual(len(buckets), 1)
+
+    def test_seed(self):
+        data = list(itertools.islice(build_sampler(self.lengths), 65))
+        data2 = list(itertools.islice(build_sampler(self.lengths), 65))
+        self.assertEqual(data, data2)
+
+    def test_resume_multi_rank(self):
+        samplers = [
+            build_sampler(self.lengths, data_parallel_rank=rank, data_parallel_size=2)
+            for rank in range(2)
+        ]
+        all_outputs = [list(itertools.islice(sampler, 50)) for sampler in samplers]
+
+        for step in range(50):
+            batch0, batch1 = all_outputs[0][step], all_outputs[1][step]
+            self.assertFalse(set(batch0) & set(batch1))
+            buckets = {get_bucket_index(self.lengths[idx], BOUNDARIES) for idx in batch0 + batch1}
+            self.assertEqual(len(buckets), 1)
+
+        for rank in range(2):
+            sampler = build_sampler(
+                self.lengths,
+                data_parallel_rank=rank,
+                data_parallel_size=2,
+                consumed_samples=8 * 31,  # consumed 31 iters
+            )
+            self.assertEqual(list(itertools.islice(sampler, 19)), all_outputs[rank][31:])
+
+    def test_collator(self):
+        lengths = [3, 10, 12]
+        samples = []
+        for length in lengths:
+            mask = flow.tensor([1] * length + [0] * (64 - length), dtype=flow.bool)
+            samples.append(
+                Instance(
+                    input_ids=DistTensorData(flow.ones(64, dtype=flow.long)),
+                    attention_mask=DistTensorData(mask),
+                    pair_mask=DistTensorData(flow.ones(64, 64, dtype=flow.long)),
+                    labels=DistTensorData(flow.tensor(1), placement_idx=-1),
+                )
+            )
+        trim_fields = {"input_ids": [1], "attention_mask": [1], "pair_mask": [1, 2]}
+        batch = BucketPaddingCollator(trim_fields, BOUNDARIES)(samples)
+        self.assertEqual(tuple(batch.get("input_ids").tensor.shape), (3, 16))
+        self.assertEqual(tuple(batch.get("attention_mask").tensor.shape), (3, 16))
+        self.assertEqual(tuple(batch.get("pair_mask").tensor.shape), (3, 16, 16))
+        self.assertEqual(tuple(batch.get("labels").tensor.shape), (3,))
+
+    def test_collator_padded_lengths(self):
+        # encoder and decoder inputs padded to different lengths, and a field whose
+        # size equals the padded length by chance is left as is
+        samples = []
+        for src_length, tgt_length in [(5, 3), (12, 9)]:
+            src_mask = [1] * src_length + [0] * (64 - src_length)
+            tgt_mask = [1] * tgt_length + [0] * (24 - tgt_length)
+            samples.append(
+                Instance(
+                    encoder_mask=DistTensorData(flow.tensor(src_mask, dtype=flow.long)),
+                    decoder_mask=DistTensorData(flow.tensor(tgt_mask, dtype=flow.long)),
+                    cross_mask=DistTensorData(flow.ones(24, 64, dtype=flow.long)),
+                    features=DistTensorData(flow.ones(64, dtype=flow.float)),
+                )
+            )
+        collator = BucketPaddingCollator(
+            {"encoder_mask": [1], "decoder_mask": [1], "cross_mask": [1, 2]},
+            BOUNDARIES,
+            length_keys=["encoder_mask", "decoder_mask"],
+        )
+        batch = collator(samples)
+        self.assertEqual(tuple(batch.get("encoder_mask").tensor.shape), (2, 16))
+        self.assertEqual(tuple(batch.get("decoder_mask").tensor.shape), (2, 16))
+        self.assertEqual(tuple(batch.get("cross_mask").tensor.shape), (2, 16, 16))
+        self.assertEqual(tuple(batch.get("features").tensor.shape), (2, 64))
+
+    def test_loader_option(self):
+        bucketing = dict(
+            enabled=True,
+            bucket_boundaries=list(BOUNDARIES),
+            trim_fields={"input_ids": [1], "attention_mask": [1]},
+        )
+        loader, _, _ = build_nlp_train_loader(
+            ToyDataset(self.lengths), 4, num_workers=0, length_bucketing=bucketing
+        )
+        for batch in itertools.islice(loader, 20):
+            ids = batch.get("input_ids").tensor
+            max_length = max(self.lengths[idx] for idx in ids[:, 0].tolist())
+            bucket = get_bucket_index(max_length, BOUNDARIES)
+            length = BOUNDARIES[bucket] if bucket < len(BOUNDARIES) else 64
+            self.assertEqual(tuple(ids.shape), (4, length))
+            self.assertEqual(tuple(batch.get("attention_mask").tensor.shape), (4, length))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from libai.data.data_utils import build_start_piece_array, create_masked_lm_predictions
+
+VOCAB = ["[PAD]", "[CLS]", "[SEP]", "[MASK]", "the", "qu", "##ick", "bro", "##wn", "fox", "##es"]
+PAD_ID, CLS_ID, SEP_ID, MASK_ID = 0, 1, 2, 3
+
+
+class TestMaskedLmPredictions(unittest.TestCase):
+    def setUp(self):
+        self.vocab_id_list = list(range(len(VOCAB)))
+        self.vocab_id_to_token_dict = dict(enumerate(VOCAB))
+        self.start_piece_array = build_start_piece_array(self.vocab_id_to_token_dict)
+        rng = np.random.RandomState(0)
+        words = rng.randint(4, len(VOCAB), size=120).tolist()
+        self.tokens = [CLS_ID, 4] + words + [SEP_ID]
+
+    def _mask(self, seed, **kwargs):
+        return create_masked_lm_predictions(
+            None,
+            self.tokens,
+            self.vocab_id_list,
+            self.vocab_id_to_token_dict,
+            0.15,
+            CLS_ID,
+            SEP_ID,
+            MASK_ID,
+            20,
+            np.random.RandomState(seed),
+            **kwargs,
+        )
+
+    def test_start_piece_array(self):
+        self.assertEqual(
+            self.start_piece_array.tolist(),
+            [not token.startswith("##") for token in VOCAB],
+        )
+
+    def test_legacy_lookup_table(self):
+        # the lookup table must not change the legacy results
+        for seed in range(5):
+            self.assertEqual(
+                self._mask(seed, legacy_masking=True),
+                self._mask(seed, legacy_masking=True, start_piece_array=self.start_piece_array),
+            )
+
+    def test_vectorized_masking(self):
+        for seed in range(20):
+            tokens, positions, labels, boundary, spans = self._mask(
+                seed, start_piece_array=self.start_piece_array
+            )
+            legacy_boundary = self._mask(seed, legacy_masking=True)[3]
+            self.assertEqual(boundary, legacy_boundary)
+            self.assertEqual(positions, sorted(positions))
+            self.assertLessEqual(len(positions), 20)
+            self.assertEqual(labels, [self.tokens[p] for p in positions])
+            self.assertEqual(sorted(sum([span.index for span in spans], [])), positions)
+            for p in positions:
+                self.assertNotIn(self.tokens[p], (CLS_ID, SEP_ID))
+            # whole words are masked
+            for span in spans:
+                self.assertEqual(boundary[span.index[0]], 1)
+                end = span.index[-1] + 1
+                self.assertTrue(end == len(self.tokens) or boundary[end] == 1)
+            unmasked = set(range(len(self.tokens))) - set(positions)
+            for i in unmasked:
+                self.assertEqual(tokens[i], self.tokens[i])
+
+        self.assertEqual(
+            self._mask(3, start_piece_array=self.start_piece_array),
+            self._mask(3, start_piece_array=self.start_piece_array),
+        )
+
+    def test_t5_masking(self):
+        tokens, positions, _, _, _ = self._mask(
+            0,
+            start_piece_array=self.start_piece_array,
+            max_ngrams=10,
+            geometric_dist=True,
+            masking_style="t5",
+        )
+        self.assertTrue(all(tokens[p] == MASK_ID for p in positions))
+
+
+if __name__ == "__main__":
+    unittest.main()
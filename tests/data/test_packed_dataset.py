@@ -0,0 +1,114 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+
+from libai.data.build import build_nlp_train_loader
+from libai.data.datasets.packed_dataset import PackedDataset, pack_by_length
+from libai.data.structures import DistTensorData, Instance
+
+
+class ToyDataset(flow.utils.data.Dataset):
+    def __init__(self, lengths, padded_length=None):
+        self.lengths = lengths
+        self.padded_length = padded_length
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, idx):
+        length = self.lengths[idx]
+        input_ids = flow.full((length,), idx + 1, dtype=flow.long)
+        labels = input_ids
+        if self.padded_length is not None:
+            num_pad = self.padded_length - length
+            input_ids = flow.cat([input_ids, flow.zeros(num_pad, dtype=flow.long)])
+            labels = flow.cat([labels, flow.full((num_pad,), -1, dtype=flow.long)])
+        return Instance(
+            input_ids=DistTensorData(input_ids),
+            labels=DistTensorData(labels, placement_idx=-1),
+        )
+
+
+class TestPackedDataset(unittest.TestCase):
+    def test_pack_by_length(self):
+        rng = np.random.RandomState(0)
+        lengths = rng.randint(1, 64, size=500)
+        rows = pack_by_length(lengths, 64)
+
+        indices = sorted(idx for row in rows for idx in row)
+        self.assertEqual(indices, list(range(len(lengths))))
+        for row in rows:
+            self.assertLessEqual(lengths[row].sum(), 64)
+        self.assertGreater(lengths.sum() / (len(rows) * 64), 0.95)
+
+    def test_packed_sample(self):
+        lengths = [3, 2, 4]
+        dataset = PackedDataset(ToyDataset(lengths), 8, {"input_ids": 0, "labels": -1})
+        self.assertEqual(len(dataset), 2)
+
+        for sample in dataset:
+            input_ids = sample.get("input_ids").tensor.numpy()
+            labels = sample.get("labels").tensor.numpy()
+            position_ids = sample.get("position_ids").tensor.numpy()
+            mask = sample.get("attention_mask").tensor.numpy()
+            self.assertEqual(input_ids.shape, (8,))
+            self.assertEqual(mask.shape, (8, 8))
+            self.assertEqual(sample.get("labels").placement_idx, -1)
+
+            for i in range(8):
+                for j in range(8):
+                    self.assertEqual(mask[i, j], input_ids[i] == input_ids[j])
+            for doc in set(input_ids[labels != -1]):
+                doc_positions = position_ids[input_ids == doc].tolist()
+                self.assertEqual(doc_positions, list(range(lengths[doc - 1])))
+
+    def test_strip_padding(self):
+        lengths = [3, 2, 4]
+        dataset = PackedDataset(
+            ToyDataset(lengths, padded_length=8),
+            8,
+            {"input_ids": 0, "labels": -1},
+            strip_padding=True,
+        )
+        self.assertEqual(dataset.lengths.tolist(), lengths)
+        self.assertEqual(len(dataset), 2)
+        for sample in dataset:
+            input_ids = sample.get("input_ids").tensor.numpy()
+            for doc in set(input_ids[input_ids > 0]):
+                self.assertEqual((input_ids == doc).sum(), lengths[doc - 1])
+
+    def test_loader_option(self):
+        packing = dict(enabled=True, max_seq_length=8, pad_values={"input_ids": 0, "labels": -1})
+        loader, _, _ = build_nlp_train_loader(
+            ToyDataset([3, 2, 4, 5, 1, 6]), 2, num_workers=0, sequence_packing=packing
+        )
+        self.assertEqual(len(loader.dataset), 3)
+        batch = next(iter(loader))
+        self.assertEqual(tuple(batch.get("input_ids").tensor.shape), (2, 8))
+        self.assertEqual(tuple(batch.get("attention_mask").tensor.shape), (2, 8, 8))
+
+        packing["enabled"] = False
+        loader, _, _ = build_nlp_train_loader(
+            ToyDataset([3, 2, 4]), 1, num_workers=0, sequence_packing=packing
+        )
+        self.assertNotIsInstance(loader.dataset, PackedDataset)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import unittest
+
+import numpy as np
+
+from libai.data.build import build_nlp_train_loader
+from libai.data.samplers import CyclicSampler
+from projects.T5.datasets.dataset import collate_fn
+
+BATCH_SIZE = 16
+
+
+class EpochDataset:
+    supports_epoch_index = True
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, index):
+        return index
+
+
+class TestSpanCorruption(unittest.TestCase):
+    def setUp(self):
+        self.collator = collate_fn(
+            vocab_size=1000,
+            max_seq_length=128,
+            noise_density=0.15,
+            mean_noise_span_length=3,
+            seed=1234,
+        )
+        self.length = self.collator.expanded_inputs_length
+        self.epochs = np.zeros(BATCH_SIZE, dtype=np.int64)
+        self.indices = np.arange(BATCH_SIZE)
+
+    def test_noise_masks(self):
+        masks = self.collator.random_spans_noise_masks(self.length, self.epochs, self.indices)
+        reference = self.collator.random_spans_noise_mask(self.length)
+        span_starts = masks & ~np.pad(masks[:, :-1], [[0, 0], [1, 0]])
+        reference_starts = reference & ~np.pad(reference[:-1], [1, 0])
+
+        self.assertEqual(masks.shape, (BATCH_SIZE, self.length))
+        self.assertTrue((masks.sum(-1) == reference.sum()).all())
+        self.assertTrue((span_starts.sum(-1) == reference_starts.sum()).all())
+        self.assertFalse(masks[:, 0].any())
+        self.assertTrue(masks[:, -1].all())
+        # no two rows share their noise
+        self.assertEqual(len({row.tobytes() for row in masks}), BATCH_SIZE)
+
+    def test_seed(self):
+        masks = self.collator.random_spans_noise_masks(self.length, self.epochs, self.indices)
+        same = self.collator.random_spans_noise_masks(self.length, self.epochs, self.indices)
+        self.assertTrue(np.array_equal(masks, same))
+        # the noise of an example depends on its own epoch and index only
+        reversed_masks = self.collator.random_spans_noise_masks(
+            self.length, self.epochs, self.indices[::-1]
+        )
+        self.assertTrue(np.array_equal(masks, reversed_masks[::-1]))
+        next_epoch = self.collator.random_spans_noise_masks(
+            self.length, self.epochs + 1, self.indices
+        )
+        self.assertTrue((masks != next_epoch).any(-1).all())
+
+    def test_corrupt_spans(self):
+        rng = np.random.RandomState(0)
+        input_ids = rng.randint(0, 900, size=(BATCH_SIZE, self.length))
+        masks = self.collator.random_spans_noise_masks(self.length, self.epochs, self.indices)
+        for mask in [masks, ~masks]:
+            sentinel_ids = self.collator.create_sentinel_ids(mask.astype(np.int8))
+            expected = self.collator.filter_input_ids(input_ids, sentinel_ids)
+            self.assertTrue(np.array_equal(self.collator.corrupt_spans(input_ids, mask), expected))
+
+    def test_collate(self):
+        rng = np.random.RandomState(0)
+        examples = [
+            dict(input_ids=rng.randint(0, 900, size=self.length), epoch=0, index=i)
+            for i in range(BATCH_SIZE)
+        ]
+        batch = self.collator(examples)
+        self.assertEqual(
+            tuple(batch.get("encoder_input_ids").tensor.shape),
+            (BATCH_SIZE, self.collator.max_seq_length),
+        )
+        self.assertEqual(
+            tuple(batch.get("lm_labels").tensor.shape),
+            (BATCH_SIZE, self.collator.targets_length),
+        )
+
+    def test_sampler_epoch(self):
+        sampler = CyclicSampler(EpochDataset(), micro_batch_size=4, shuffle=True, seed=0)
+        samples = [sample for batch in itertools.islice(sampler, 4) for sample in batch]
+        self.assertEqual([epoch for epoch, _ in samples], [0] * 8 + [1] * 8)
+        self.assertEqual(sorted(index for _, index in samples[8:]), list(range(8)))
+
+    def test_loader_seed(self):
+        # the noise follows the training seed the loader is built with
+        build_nlp_train_loader(
+            EpochDataset(), train_batch_size=4, num_workers=0, seed=42, collate_fn=self.collator
+        )
+        self.assertEqual(self.collator.seed, 42)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from libai.data.datasets.tokenized_dataset import (
+    TokenizedDataset,
+    build_tokenized_dataset,
+    tokenizer_fingerprint,
+)
+from libai.utils.file_io import fingerprint
+
+FIELDS = {"input_ids": np.int32, "labels": np.int64}
+
+
+class ToyEncoder:
+    """Character codes of a text and the length of the text as its label."""
+
+    def __call__(self, example):
+        return {"input_ids": [ord(c) for c in example], "labels": [len(example)]}
+
+
+class ToyBasicTokenizer:
+    def __init__(self, do_lower_case):
+        self.do_lower_case = do_lower_case
+        self.never_split = {"[CLS]", "[SEP]"}
+
+
+class ToyTokenizer:
+    def __init__(self, vocab, do_lower_case=True, cls_token="[CLS]"):
+        self.vocab = vocab
+        self.basic_tokenizer = ToyBasicTokenizer(do_lower_case)
+        self._cls_token = cls_token
+
+    def get_vocab(self):
+        return dict(self.vocab)
+
+
+class TestTokenizedDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.examples = ["".join(chr(97 + j % 26) for j in range(i % 7 + 1)) for i in range(50)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_dataset(self, dataset):
+        self.assertEqual(len(dataset), len(self.examples))
+        for i, example in enumerate(self.examples):
+            self.assertEqual(dataset[i]["input_ids"].tolist(), ToyEncoder()(example)["input_ids"])
+            self.assertEqual(dataset.get("labels", i).tolist(), [len(example)])
+        self.assertEqual(dataset.sizes("input_ids").tolist(), [len(e) for e in self.examples])
+
+    def test_build(self):
+        for num_workers in [1, 2]:
+            prefix = os.path.join(self.tmp_dir, f"toy_{num_workers}")
+            TokenizedDataset.build(prefix, self.examples, ToyEncoder(), FIELDS, num_workers, 8)
+            self.assertTrue(TokenizedDataset.exists(prefix, FIELDS))
+            dataset = TokenizedDataset(prefix, FIELDS)
+            self.check_dataset(dataset)
+            # workers of a data loader map the files again instead of copying the items
+            self.check_dataset(pickle.loads(pickle.dumps(dataset)))
+
+    def test_cache(self):
+        prefix = os.path.join(self.tmp_dir, "toy")
+        build_tokenized_dataset(prefix, FIELDS, lambda: self.examples, ToyEncoder(), 1)
+
+        def read_examples():
+            raise AssertionError("the examples must be read from the cache")
+
+        self.check_dataset(build_tokenized_dataset(prefix, FIELDS, read_examples, ToyEncoder()))
+
+    def test_fingerprint(self):
+        path = os.path.join(self.tmp_dir, "data.txt")
+        with open(path, "w") as f:
+            f.write("abc\n")
+        key = fingerprint([path], 128)
+        self.assertEqual(key, fingerprint([path], 128))
+        self.assertNotEqual(key, fingerprint([path], 64))
+        with open(path, "a") as f:
+            f.write("def\n")
+        self.assertNotEqual(key, fingerprint([path], 128))
+
+    def test_tokenizer_fingerprint(self):
+        vocab = {"[CLS]": 0, "[SEP]": 1, "a": 2, "b": 3}
+        key = tokenizer_fingerprint(ToyTokenizer(vocab))
+        self.assertEqual(key, tokenizer_fingerprint(ToyTokenizer(dict(vocab))))
+        # same vocabulary size, different tokens
+        self.assertNotEqual(key, tokenizer_fingerprint(ToyTokenizer({**vocab, "b": 4})))
+        self.assertNotEqual(key, tokenizer_fingerprint(ToyTokenizer(vocab, do_lower_case=False)))
+        self.assertNotEqual(key, tokenizer_fingerprint(ToyTokenizer(vocab, cls_token="<s>")))
+
+
+if __name__ == "__main__":
+    unittest.main()
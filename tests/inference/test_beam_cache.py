@@ -0,0 +1,94 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+from omegaconf import DictConfig
+
+from libai.inference.generator.generation_beam_cache import BeamIndex
+from libai.utils import distributed as dist
+
+BATCH_SIZE = 2
+NUM_BEAMS = 3
+NUM_HEADS = 2
+HEAD_SIZE = 4
+
+
+def to_global(array):
+    return flow.tensor(
+        array,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+
+
+class TestBeamIndex(unittest.TestCase):
+    def setUp(self):
+        dist.setup_dist_util(
+            DictConfig(
+                dict(
+                    data_parallel_size=1,
+                    tensor_parallel_size=1,
+                    pipeline_parallel_size=1,
+                    device_type="cpu",
+                )
+            )
+        )
+        self.rng = np.random.RandomState(0)
+
+    def randn(self, length):
+        shape = (BATCH_SIZE * NUM_BEAMS, NUM_HEADS, length, HEAD_SIZE)
+        return to_global(self.rng.randn(*shape).astype(np.float32))
+
+    def assert_close(self, actual, expected):
+        self.assertTrue(np.allclose(dist.tton(actual), dist.tton(expected), atol=1e-5))
+
+    def test_beam_major(self):
+        beam_index = BeamIndex(NUM_BEAMS)
+        x = self.randn(2)
+        rows = [beam * BATCH_SIZE + i for i in range(BATCH_SIZE) for beam in range(NUM_BEAMS)]
+        self.assert_close(beam_index.to_beam_major(x).index_select(0, to_global(rows)), x)
+        self.assert_close(beam_index.from_beam_major(beam_index.to_beam_major(x)), x)
+
+    def test_attention(self):
+        # the reference cache is reordered at every step, the one of BeamIndex never is
+        beam_index = BeamIndex(NUM_BEAMS)
+        key, value = self.randn(3), self.randn(3)
+        past = ((key, value),)
+        for query_length in [1, 1, 2, 1]:
+            beam_idx = self.rng.randint(NUM_BEAMS, size=(BATCH_SIZE, NUM_BEAMS))
+            beam_idx = to_global((beam_idx + np.arange(BATCH_SIZE)[:, None] * NUM_BEAMS).flatten())
+            key, value = key.index_select(0, beam_idx), value.index_select(0, beam_idx)
+            past = beam_index.reorder(past, beam_idx)
+
+            new_key, new_value = self.randn(query_length), self.randn(query_length)
+            key, value = flow.cat([key, new_key], dim=2), flow.cat([value, new_value], dim=2)
+            past_key, past_value = past[0]
+            past_key = flow.cat([past_key, beam_index.to_beam_major(new_key)], dim=2)
+            past_value = flow.cat([past_value, beam_index.to_beam_major(new_value)], dim=2)
+            past = ((past_key, past_value),)
+
+            query = self.randn(query_length)
+            scores = flow.matmul(query, key, transpose_b=True, alpha=0.5)
+            self.assert_close(beam_index.attention_scores(query, past_key, alpha=0.5), scores)
+
+            weights = flow.softmax(scores, dim=-1)
+            self.assert_close(beam_index.context(weights, past_value), flow.matmul(weights, value))
+
+
+if __name__ == "__main__":
+    unittest.main()
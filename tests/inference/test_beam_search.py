@@ -0,0 +1,184 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+from omegaconf import DictConfig
+
+from libai.inference.generator.generation_beam_search import BeamSearchScorer
+from libai.utils import distributed as dist
+
+VOCAB_SIZE = 8
+PAD_TOKEN_ID = 0
+EOS_TOKEN_ID = 1
+
+
+class ReferenceScorer:
+    """Per-candidate beam scorer with python lists, the reference BeamSearchScorer is checked
+    with.
+    """
+
+    def __init__(self, batch_size, num_beams, length_penalty, early_stopping, num_keep):
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+        self.early_stopping = early_stopping
+        self.num_keep = num_keep
+        self.hyps = [[] for _ in range(batch_size)]
+        self.done = [False] * batch_size
+
+    def add(self, i, hyp, sum_logprobs):
+        beams = self.hyps[i]
+        score = sum_logprobs / (len(hyp) ** self.length_penalty)
+        if len(beams) < self.num_beams or score > min(s for s, _ in beams):
+            beams.append((score, hyp))
+            if len(beams) > self.num_beams:
+                beams.remove(min(beams, key=lambda beam: beam[0]))
+
+    def process(self, input_ids, next_scores, next_tokens, next_indices):
+        num_beams, cur_len = self.num_beams, input_ids.shape[-1]
+        outputs = np.zeros((3,) + next_scores.shape[:1] + (num_beams,))
+        for i in range(len(self.hyps)):
+            if self.done[i]:
+                outputs[:, i] = np.array([[0], [PAD_TOKEN_ID], [0]])
+                continue
+            beam_idx = 0
+            for rank in range(next_scores.shape[-1]):
+                token, score = next_tokens[i, rank], next_scores[i, rank]
+                row = i * num_beams + next_indices[i, rank]
+                if token == EOS_TOKEN_ID:
+                    if rank < num_beams:
+                        self.add(i, input_ids[row].tolist(), float(score))
+                else:
+                    outputs[:, i, beam_idx] = [score, token, row]
+                    beam_idx += 1
+                if beam_idx == num_beams:
+                    break
+            if len(self.hyps[i]) == num_beams:
+                best = float(next_scores[i].max()) / cur_len ** self.length_penalty
+                worst = min(s for s, _ in self.hyps[i])
+                self.done[i] = self.early_stopping or worst >= best
+        scores, tokens, indices = outputs.reshape(3, -1)
+        return scores.astype(np.float32), tokens.astype(np.int64), indices.astype(np.int64)
+
+    def finalize(self, input_ids, final_beam_scores, max_length):
+        for i in range(len(self.hyps)):
+            if not self.done[i]:
+                for beam_id in range(self.num_beams):
+                    row = i * self.num_beams + beam_id
+                    self.add(i, input_ids[row].tolist(), float(final_beam_scores[row]))
+        best = []
+        for beams in self.hyps:
+            best.extend(sorted(beams, key=lambda beam: -beam[0])[: self.num_keep])
+        lengths = [len(hyp) for _, hyp in best]
+        width = min(max(lengths) + 1, max_length)
+        fill = PAD_TOKEN_ID if min(lengths) != max(lengths) else 0
+        decoded = np.full((len(best), width), fill, dtype=np.int64)
+        for i, (_, hyp) in enumerate(best):
+            decoded[i, : len(hyp)] = hyp
+            if len(hyp) < width:
+                decoded[i, len(hyp)] = EOS_TOKEN_ID
+        return decoded, np.array([score for score, _ in best], dtype=np.float32)
+
+
+def to_global(array):
+    return flow.tensor(
+        array,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+
+
+class TestBeamSearchScorer(unittest.TestCase):
+    def setUp(self):
+        dist.setup_dist_util(
+            DictConfig(
+                dict(
+                    data_parallel_size=1,
+                    tensor_parallel_size=1,
+                    pipeline_parallel_size=1,
+                    device_type="cpu",
+                )
+            )
+        )
+        self.rng = np.random.RandomState(0)
+
+    def random_candidates(self, batch_size, num_beams):
+        num_candidates = 2 * num_beams
+        scores = -np.sort(self.rng.rand(batch_size, num_candidates) * 4, axis=-1)
+        tokens = self.rng.randint(2, VOCAB_SIZE, size=(batch_size, num_candidates))
+        for i in range(batch_size):
+            # at most num_beams candidates end with eos, one per beam in beam search
+            num_eos = self.rng.randint(0, num_beams + 1)
+            tokens[i, self.rng.choice(num_candidates, num_eos, replace=False)] = EOS_TOKEN_ID
+        indices = self.rng.randint(0, num_beams, size=(batch_size, num_candidates))
+        return scores.astype(np.float32), tokens, indices
+
+    def check_search(self, length_penalty, early_stopping, num_keep, max_length=12):
+        batch_size, num_beams = 3, 4
+        scorer = BeamSearchScorer(
+            batch_size,
+            num_beams,
+            length_penalty=length_penalty,
+            do_early_stopping=early_stopping,
+            num_beam_hyps_to_keep=num_keep,
+            device_type="cpu",
+        )
+        reference = ReferenceScorer(batch_size, num_beams, length_penalty, early_stopping, num_keep)
+        input_ids = self.rng.randint(2, VOCAB_SIZE, size=(batch_size * num_beams, 3))
+        beam_scores = np.zeros(batch_size * num_beams, dtype=np.float32)
+
+        while input_ids.shape[-1] < max_length and not all(reference.done):
+            candidates = self.random_candidates(batch_size, num_beams)
+            outputs = scorer.process(
+                to_global(input_ids),
+                *[to_global(t) for t in candidates],
+                pad_token_id=PAD_TOKEN_ID,
+                eos_token_id=EOS_TOKEN_ID,
+            )
+            beam_scores, beam_tokens, beam_indices = reference.process(input_ids, *candidates)
+            self.assertTrue(np.array_equal(dist.tton(outputs["next_beam_scores"]), beam_scores))
+            self.assertTrue(np.array_equal(dist.tton(outputs["next_beam_tokens"]), beam_tokens))
+            self.assertTrue(np.array_equal(dist.tton(outputs["next_beam_indices"]), beam_indices))
+            self.assertEqual(bool(scorer.is_done), all(reference.done))
+            input_ids = np.concatenate([input_ids[beam_indices], beam_tokens[:, None]], axis=-1)
+
+        outputs = scorer.finalize(
+            to_global(input_ids),
+            to_global(beam_scores),
+            None,
+            None,
+            max_length=max_length,
+            pad_token_id=PAD_TOKEN_ID,
+            eos_token_id=EOS_TOKEN_ID,
+        )
+        sequences, sequence_scores = reference.finalize(input_ids, beam_scores, max_length)
+        self.assertTrue(np.array_equal(dist.tton(outputs["sequences"]), sequences))
+        self.assertTrue(np.array_equal(dist.tton(outputs["sequence_scores"]), sequence_scores))
+
+    def test_beam_search(self):
+        for length_penalty in [1.0, 0.7]:
+            for early_stopping in [False, True]:
+                for _ in range(3):
+                    self.check_search(length_penalty, early_stopping, num_keep=1)
+
+    def test_num_beam_hyps_to_keep(self):
+        self.check_search(1.0, False, num_keep=2)
+        self.check_search(1.0, False, num_keep=4, max_length=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
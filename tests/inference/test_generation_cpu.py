@@ -0,0 +1,301 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Greedy search, sampling and beam search of tiny GPT/T5/Llama/Couplets models on CPU.
+
+The golden outputs are computed by naive decoders in this file, which rerun the full
+sequence through the model at every step without any cache.
+"""
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+from omegaconf import DictConfig
+
+from libai.inference.generator.generation_beam_search import BeamSearchScorer
+from libai.utils import distributed as dist
+from projects.Couplets.modeling.model import Seq2Seq
+from projects.Llama.llama import LlamaForCausalLM
+from projects.MagicPrompt.gpt2 import GPTModel
+from projects.MT5.mt5_model import MT5Model
+
+VOCAB_SIZE = 32
+MAX_LENGTH = 10
+
+GENERATION_CFG = dict(
+    max_length=MAX_LENGTH,
+    min_length=0,
+    do_sample=False,
+    early_stopping=False,
+    num_beams=1,
+    num_beam_groups=1,
+    diversity_penalty=0.0,
+    temperature=1.0,
+    top_k=50,
+    top_p=1.0,
+    typical_p=1.0,
+    repetition_penalty=1.0,
+    length_penalty=1.0,
+    no_repeat_ngram_size=0,
+    encoder_no_repeat_ngram_size=0,
+    num_return_sequences=1,
+    output_scores=False,
+    forced_bos_token_id=None,
+    forced_eos_token_id=None,
+    remove_invalid_values=False,
+    exponential_decay_length_penalty=None,
+    use_cache=True,
+    pad_token_id=0,
+    eos_token_id=None,
+    bos_token_id=1,
+    decoder_start_token_id=0,
+)
+
+
+def log_softmax(logits):
+    logits = logits.astype(np.float64)
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def reference_greedy_search(next_log_probs, start_ids, max_length):
+    sequences = []
+    for row, ids in enumerate(start_ids):
+        while len(ids) < max_length:
+            ids = ids + [int(np.argmax(next_log_probs(row, [ids])[0]))]
+        sequences.append(ids)
+    return np.array(sequences)
+
+
+def reference_beam_search(next_log_probs, start_ids, num_beams, max_length):
+    sequences = []
+    for row, ids in enumerate(start_ids):
+        beams = [(ids, 0.0)]
+        while len(beams[0][0]) < max_length:
+            log_probs = next_log_probs(row, [seq for seq, _ in beams])
+            candidates = [
+                (score + log_probs[i, token], i, token)
+                for i, (_, score) in enumerate(beams)
+                for token in range(log_probs.shape[-1])
+            ]
+            candidates.sort(key=lambda candidate: -candidate[0])
+            beams = [(beams[i][0] + [token], score) for score, i, token in candidates[:num_beams]]
+        sequences.append(max(beams, key=lambda beam: beam[1])[0])
+    return np.array(sequences)
+
+
+def to_global(ids):
+    return flow.tensor(
+        ids,
+        dtype=flow.long,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+
+
+class _GenerationTestMixin:
+    def setUp(self):
+        dist.setup_dist_util(
+            DictConfig(
+                dict(
+                    data_parallel_size=1,
+                    tensor_parallel_size=1,
+                    pipeline_parallel_size=1,
+                    device_type="cpu",
+                )
+            )
+        )
+        flow.manual_seed(0)
+        self.model = self.build_model().eval()
+        self.inputs = np.random.RandomState(0).randint(2, VOCAB_SIZE, size=(2, 4)).tolist()
+
+    def build_model(self):
+        raise NotImplementedError
+
+    def next_log_probs(self, row, sequences):
+        raise NotImplementedError
+
+    def start_ids(self):
+        return self.inputs
+
+    def generate(self, **kwargs):
+        return dist.tton(self.model.generate(to_global(self.inputs), **kwargs))
+
+    def test_device_type(self):
+        self.assertEqual(self.model.generation_device_type, "cpu")
+        scorer = BeamSearchScorer(batch_size=2, num_beams=2, device_type="cpu")
+        self.assertEqual(scorer.placement.type, "cpu")
+
+    def test_greedy_search(self):
+        expected = reference_greedy_search(self.next_log_probs, self.start_ids(), MAX_LENGTH)
+        self.assertTrue(np.array_equal(self.generate(), expected))
+
+    def test_sample(self):
+        flow.manual_seed(1)
+        outputs = self.generate(do_sample=True, top_k=0)
+        flow.manual_seed(1)
+        self.assertTrue(np.array_equal(self.generate(do_sample=True, top_k=0), outputs))
+
+        # sampling from the top-1 token is greedy search
+        expected = reference_greedy_search(self.next_log_probs, self.start_ids(), MAX_LENGTH)
+        self.assertTrue(np.array_equal(self.generate(do_sample=True, top_k=1), expected))
+
+    def test_beam_search(self):
+        expected = reference_beam_search(self.next_log_probs, self.start_ids(), 3, MAX_LENGTH)
+        self.assertTrue(np.array_equal(self.generate(num_beams=3), expected))
+
+
+class TestGPTGeneration(_GenerationTestMixin, unittest.TestCase):
+    def build_model(self):
+        cfg = DictConfig(
+            dict(
+                GENERATION_CFG,
+                hidden_layers=2,
+                vocab_size=VOCAB_SIZE,
+                hidden_size=16,
+                ffn_hidden_size=32,
+                num_attention_heads=2,
+                max_seq_length=32,
+                embedding_dropout_prob=0.0,
+                attention_dropout_prob=0.0,
+                output_dropout_prob=0.0,
+                layernorm_epsilon=1e-5,
+                initializer_range=1.0,
+                use_scaled_init_for_output_weights=True,
+                bias_gelu_fusion=False,
+                bias_dropout_fusion=False,
+                scale_mask_softmax_fusion=False,
+                apply_query_key_layer_scaling=False,
+                apply_residual_post_layernorm=False,
+                amp_enabled=False,
+                is_encoder_decoder=False,
+            )
+        )
+        return GPTModel(cfg=cfg)
+
+    def next_log_probs(self, row, sequences):
+        logits = self.model(to_global(sequences), use_cache=False)["logits"][:, -1]
+        return log_softmax(dist.tton(logits))
+
+
+class TestLlamaGeneration(_GenerationTestMixin, unittest.TestCase):
+    def build_model(self):
+        cfg = DictConfig(
+            dict(
+                GENERATION_CFG,
+                hidden_layers=2,
+                vocab_size=VOCAB_SIZE,
+                hidden_size=16,
+                intermediate_size=32,
+                num_attention_heads=2,
+                max_position_embeddings=32,
+                rms_norm_eps=1e-5,
+                initializer_range=1.0,
+                use_scaled_init_for_output_weights=False,
+                scale_mask_softmax_fusion=False,
+                amp_enabled=False,
+                is_encoder_decoder=False,
+            )
+        )
+        return LlamaForCausalLM(cfg=cfg)
+
+    def next_log_probs(self, row, sequences):
+        logits = self.model(to_global(sequences))["logits"][:, -1]
+        return log_softmax(dist.tton(logits))
+
+
+class TestT5Generation(_GenerationTestMixin, unittest.TestCase):
+    def build_model(self):
+        cfg = DictConfig(
+            dict(
+                GENERATION_CFG,
+                vocab_size=VOCAB_SIZE,
+                hidden_size=16,
+                hidden_layers=2,
+                num_attention_heads=2,
+                head_size=8,
+                intermediate_size=32,
+                hidden_dropout_prob=0.0,
+                attention_probs_dropout_prob=0.0,
+                embedding_dropout_prob=0.0,
+                relative_attention_num_buckets=8,
+                padding_idx=0,
+                initializer_range=1.0,
+                layernorm_eps=1e-6,
+                amp_enabled=False,
+                model_type="t5",
+                is_encoder_decoder=True,
+                tie_word_embeddings=True,
+            )
+        )
+        return MT5Model(cfg=cfg)
+
+    def start_ids(self):
+        return [[GENERATION_CFG["decoder_start_token_id"]] for _ in self.inputs]
+
+    def next_log_probs(self, row, sequences):
+        encoder_ids = to_global([self.inputs[row]] * len(sequences))
+        decoder_ids = to_global(sequences)
+        encoder_mask = flow.ones_like(encoder_ids).to(flow.bool)
+        logits = self.model(
+            encoder_input_ids=encoder_ids,
+            decoder_input_ids=decoder_ids,
+            encoder_attn_mask=encoder_mask,
+            decoder_attn_mask=flow.ones_like(decoder_ids).to(flow.bool),
+            encoder_decoder_attn_mask=encoder_mask,
+            use_cache=False,
+        )["logits"][:, -1]
+        return log_softmax(dist.tton(logits))
+
+
+class TestCoupletsGeneration(_GenerationTestMixin, unittest.TestCase):
+    def build_model(self):
+        cfg = DictConfig(
+            dict(
+                GENERATION_CFG,
+                vocab_size=VOCAB_SIZE,
+                max_position_embeddings=32,
+                hidden_size=16,
+                intermediate_size=32,
+                hidden_layers=2,
+                num_attention_heads=2,
+                embedding_dropout_prob=0.0,
+                hidden_dropout_prob=0.0,
+                attention_dropout_prob=0.0,
+                initializer_range=1.0,
+                layernorm_epsilon=1e-5,
+                bias_gelu_fusion=False,
+                bias_dropout_fusion=False,
+                scale_mask_softmax_fusion=False,
+                apply_query_key_layer_scaling=True,
+                is_encoder_decoder=True,
+            )
+        )
+        return Seq2Seq(cfg)
+
+    def start_ids(self):
+        return [[GENERATION_CFG["decoder_start_token_id"]] for _ in self.inputs]
+
+    def next_log_probs(self, row, sequences):
+        encoder_states = self.model.encode(to_global([self.inputs[row]] * len(sequences)), None)
+        length = len(sequences[0])
+        causal_mask = to_global(np.tril(np.ones((len(sequences), length, length))))
+        logits = self.model.decode(to_global(sequences), causal_mask, encoder_states, None)
+        return log_softmax(dist.tton(logits[:, -1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
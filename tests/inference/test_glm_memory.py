@@ -0,0 +1,128 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The masks GLM builds from sep and its memory buffers, checked on a tiny model on CPU against
+the dense masks and a full forward of the whole sequence."""
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+from omegaconf import DictConfig
+
+from libai.utils import distributed as dist
+from projects.GLM.modeling_glm import GLMForConditionalGeneration, GLMMemory
+
+VOCAB_SIZE = 32
+PROMPT_LENGTH = 5
+SEQ_LENGTH = 10
+
+
+def to_global(array, dtype=None):
+    return flow.tensor(
+        array,
+        dtype=dtype,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+
+
+def dense_mask(seps, seq_length):
+    """The mask of `GLMModel.build_mask_matrix`, the tokens before sep are seen by all tokens."""
+    mask = np.tril(np.ones((len(seps), seq_length, seq_length), dtype=np.float32))
+    for i, sep in enumerate(seps):
+        mask[i, :, :sep] = 1
+    return mask[:, None]
+
+
+class TestGLMMemory(unittest.TestCase):
+    def setUp(self):
+        dist.setup_dist_util(
+            DictConfig(
+                dict(
+                    data_parallel_size=1,
+                    tensor_parallel_size=1,
+                    pipeline_parallel_size=1,
+                    device_type="cpu",
+                )
+            )
+        )
+        flow.manual_seed(0)
+        cfg = DictConfig(
+            dict(
+                num_layers=2,
+                vocab_size=VOCAB_SIZE,
+                hidden_size=16,
+                num_attention_heads=2,
+                max_sequence_length=32,
+                embedding_dropout_prob=0.0,
+                attention_dropout_prob=0.0,
+                output_dropout_prob=0.0,
+                layernorm_epsilon=1e-5,
+                initializer_range=0.5,
+                use_scaled_init_for_output_weights=True,
+                bias_gelu_fusion=False,
+                bias_dropout_fusion=False,
+                scale_mask_softmax_fusion=False,
+                apply_query_key_layer_scaling=False,
+                amp_enabled=False,
+                block_position_encoding=True,
+                attention_scale=1.0,
+                padding_idx=None,
+                is_encoder_decoder=False,
+            )
+        )
+        self.model = GLMForConditionalGeneration(cfg=cfg).eval()
+
+        rng = np.random.RandomState(0)
+        self.input_ids = to_global(rng.randint(0, VOCAB_SIZE, size=(2, SEQ_LENGTH)), flow.long)
+        # the positions of blank filling, the generated tokens are all at the position of the blank
+        positions = list(range(PROMPT_LENGTH)) + [PROMPT_LENGTH - 1] * (SEQ_LENGTH - PROMPT_LENGTH)
+        block_positions = [0] * PROMPT_LENGTH + list(range(1, SEQ_LENGTH - PROMPT_LENGTH + 1))
+        self.position_ids = to_global([[positions, block_positions]] * 2, flow.long)
+
+    def forward(self, start, end, attention_mask, memory_states=None):
+        return self.model(
+            input_ids=self.input_ids[:, start:end],
+            position_ids=self.position_ids[:, :, start:end],
+            attention_mask=attention_mask,
+            memory_states=memory_states,
+        )
+
+    def assert_close(self, actual, expected):
+        self.assertTrue(np.allclose(dist.tton(actual), dist.tton(expected), atol=1e-4))
+
+    def test_sep_mask(self):
+        for seps in [[3, 3], [1, 6]]:
+            expected = self.forward(0, SEQ_LENGTH, to_global(dense_mask(seps, SEQ_LENGTH)))
+            sep = seps[0] if seps[0] == seps[1] else to_global(seps, flow.long)
+            self.assert_close(self.forward(0, SEQ_LENGTH, sep)["logits"], expected["logits"])
+
+    def test_incremental_decoding(self):
+        expected = self.forward(0, SEQ_LENGTH, PROMPT_LENGTH)["logits"]
+
+        # the prompt and its first generated token, then one token at a time over the memory
+        outputs = self.forward(0, PROMPT_LENGTH + 1, PROMPT_LENGTH, GLMMemory(capacity=2))
+        logits = [outputs["logits"]]
+        for i in range(PROMPT_LENGTH + 1, SEQ_LENGTH):
+            outputs = self.forward(i, i + 1, 0, outputs["mems"])
+            logits.append(outputs["logits"])
+
+        self.assertEqual(outputs["mems"].length, SEQ_LENGTH)
+        self.assert_close(flow.cat(logits, dim=1), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
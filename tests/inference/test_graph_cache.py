@@ -0,0 +1,76 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import oneflow as flow
+
+from libai.inference.utils.graph_cache import GraphCache, checkpoint_fingerprint, get_bucket
+
+
+class TestGraphCache(unittest.TestCase):
+    def test_get_bucket(self):
+        buckets = (1, 2, 4, 8)
+        self.assertEqual(get_bucket(1, buckets), 1)
+        self.assertEqual(get_bucket(3, buckets), 4)
+        self.assertEqual(get_bucket(8, buckets), 8)
+        self.assertEqual(get_bucket(9, buckets), 16)
+        self.assertEqual(get_bucket(17, buckets), 24)
+
+    def test_checkpoint_fingerprint(self):
+        with tempfile.TemporaryDirectory() as model_path:
+            weight = os.path.join(model_path, "model", "weight")
+            os.makedirs(os.path.dirname(weight))
+            with open(weight, "wb") as f:
+                f.write(b"0" * 16)
+            key = checkpoint_fingerprint(model_path)
+            self.assertEqual(key, checkpoint_fingerprint(model_path))
+            # new weights saved at the same path
+            with open(weight, "wb") as f:
+                f.write(b"0" * 32)
+            self.assertNotEqual(key, checkpoint_fingerprint(model_path))
+
+    def test_pad_inputs(self):
+        cache = GraphCache(
+            model=None,
+            batch_buckets=(1, 4),
+            seq_buckets=(8, 16),
+            seq_pad_values={"input_ids": 5, "attention_mask": 0},
+        )
+        input_ids = flow.tensor(np.random.randint(0, 5, (3, 10)))
+        attention_mask = flow.ones(3, 10, dtype=flow.bool)
+        images = flow.randn(3, 2, 10)
+
+        padded, (batch_size, seq_len) = cache.pad_inputs(
+            dict(input_ids=input_ids, attention_mask=attention_mask, images=images)
+        )
+        self.assertEqual((batch_size, seq_len), (3, 10))
+        self.assertEqual(tuple(padded["input_ids"].shape), (4, 16))
+        self.assertEqual(padded["attention_mask"].dtype, flow.bool)
+        self.assertEqual(tuple(padded["images"].shape), (4, 2, 10))
+
+        self.assertTrue(np.array_equal(padded["input_ids"][:3, :10].numpy(), input_ids.numpy()))
+        self.assertTrue((padded["input_ids"][:3, 10:].numpy() == 5).all())
+        self.assertFalse(padded["attention_mask"][:, 10:].numpy().any())
+        self.assertFalse(padded["attention_mask"][3:].numpy().any())
+        self.assertTrue(np.array_equal(padded["images"][:3].numpy(), images.numpy()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+
+from libai.inference.generator.generation_logits_processor import (
+    EncoderNoRepeatNGramLogitsProcessor,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+)
+
+VOCAB_SIZE = 8
+
+
+def get_ngrams(ngram_size, rows):
+    """n-gram tables built with python dicts, the reference the processors are checked with."""
+    tables = []
+    for tokens in rows:
+        table = {}
+        for ngram in zip(*[tokens[i:] for i in range(ngram_size)]):
+            table.setdefault(tuple(ngram[:-1]), []).append(ngram[-1])
+        tables.append(table)
+    return tables
+
+
+def reference_ban(scores, tables, rows, ngram_size):
+    scores = scores.copy()
+    for i, tokens in enumerate(rows):
+        start = len(tokens) + 1 - ngram_size
+        if start < 0:
+            continue
+        banned = tables[i].get(tuple(tokens[start:]), [])
+        scores[i, banned] = -float("inf")
+    return scores
+
+
+class TestLogitsProcessor(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def test_no_repeat_ngram(self):
+        for ngram_size in [1, 2, 3, 4]:
+            for cur_len in [1, 3, 4, 20]:
+                input_ids = self.rng.randint(0, VOCAB_SIZE, size=(6, cur_len))
+                scores = self.rng.randn(6, VOCAB_SIZE).astype(np.float32)
+                rows = input_ids.tolist()
+                expected = scores.copy()
+                if cur_len >= ngram_size:
+                    expected = reference_ban(scores, get_ngrams(ngram_size, rows), rows, ngram_size)
+
+                processor = NoRepeatNGramLogitsProcessor(ngram_size)
+                output = processor(flow.tensor(input_ids), flow.tensor(scores)).numpy()
+                self.assertTrue(np.array_equal(output, expected))
+
+    def test_encoder_no_repeat_ngram(self):
+        num_beams = 3
+        for ngram_size in [1, 2, 3]:
+            encoder_ids = self.rng.randint(0, VOCAB_SIZE, size=(2, 12))
+            tables = get_ngrams(ngram_size, encoder_ids.tolist())
+            processor = EncoderNoRepeatNGramLogitsProcessor(ngram_size, flow.tensor(encoder_ids))
+            for cur_len in [1, 2, 5]:
+                input_ids = self.rng.randint(0, VOCAB_SIZE, size=(2 * num_beams, cur_len))
+                scores = self.rng.randn(2 * num_beams, VOCAB_SIZE).astype(np.float32)
+                rows = input_ids.tolist()
+                hypo_tables = [tables[i // num_beams] for i in range(len(rows))]
+                expected = reference_ban(scores, hypo_tables, rows, ngram_size)
+
+                output = processor(flow.tensor(input_ids), flow.tensor(scores)).numpy()
+                self.assertTrue(np.array_equal(output, expected))
+
+    def test_repetition_penalty(self):
+        input_ids = self.rng.randint(0, VOCAB_SIZE, size=(4, 10))
+        scores = self.rng.randn(4, VOCAB_SIZE).astype(np.float32)
+        expected = scores.copy()
+        for i, tokens in enumerate(input_ids.tolist()):
+            for token in set(tokens):
+                score = scores[i, token]
+                expected[i, token] = score * 1.3 if score < 0 else score / np.float32(1.3)
+
+        processor = RepetitionPenaltyLogitsProcessor(1.3)
+        output = processor(flow.tensor(input_ids), flow.tensor(scores)).numpy()
+        self.assertTrue(np.allclose(output, expected, rtol=0, atol=1e-6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+import oneflow.nn as nn
+from omegaconf import DictConfig
+
+from libai.layers import ContrastiveQueue, info_nce_loss
+from libai.utils import distributed as dist
+
+
+class TestInfoNCELoss(unittest.TestCase):
+    def setUp(self):
+        dist.setup_dist_util(
+            DictConfig(
+                dict(
+                    data_parallel_size=1,
+                    tensor_parallel_size=1,
+                    pipeline_parallel_size=1,
+                    device_type="cpu",
+                )
+            )
+        )
+        self.placement = dist.get_layer_placement(0)
+        self.sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+
+    def _randn(self, *shape):
+        x = flow.randn(*shape, sbp=self.sbp, placement=self.placement)
+        return nn.functional.normalize(x, dim=-1)
+
+    def _check(self, query, keys, labels, queue=None, query_index=None):
+        outputs = []
+        for blockwise in [False, True]:
+            q = query.clone().requires_grad_()
+            k = keys.clone().requires_grad_()
+            if blockwise:
+                loss = info_nce_loss(
+                    q,
+                    k,
+                    labels,
+                    queue=queue,
+                    temperature=0.1,
+                    block_size=3,
+                    query_index=query_index,
+                )
+            else:
+                candidates = k if queue is None else flow.cat([k, queue.queue[0]], dim=0)
+                logits = flow.matmul(q, candidates, transpose_b=True) / 0.1
+                if query_index is not None:
+                    self_mask = np.zeros(logits.shape, dtype=np.float32)
+                    self_mask[np.arange(logits.shape[0]), dist.tton(query_index)] = 1e12
+                    self_mask = flow.tensor(self_mask, sbp=self.sbp, placement=self.placement)
+                    logits = logits - self_mask
+                loss = nn.CrossEntropyLoss()(logits, labels)
+            loss.backward()
+            outputs.append([dist.tton(t) for t in (loss, q.grad, k.grad)])
+
+        for expected, actual in zip(*outputs):
+            self.assertTrue(np.allclose(expected, actual, rtol=1e-4, atol=1e-5))
+
+    def test_moco(self):
+        query, keys = self._randn(6, 8), self._randn(6, 8)
+        labels = flow.arange(6, sbp=self.sbp, placement=self.placement)
+        self._check(query, keys, labels)
+
+        queue = ContrastiveQueue(10, 8, layer_idx=0)
+        self._check(query, keys, labels, queue=queue)
+
+    def test_simcse(self):
+        out = self._randn(8, 8)
+        index = flow.arange(8, sbp=self.sbp, placement=self.placement)
+        labels = (index - index % 2 * 2) + 1
+        self._check(out, out.clone(), labels, query_index=index)
+
+    def test_enqueue(self):
+        queue = ContrastiveQueue(6, 4, layer_idx=0)
+        for _ in range(4):
+            keys = self._randn(2, 4)
+            queue.enqueue(keys)
+        # the queue holds the last three batches, the fourth one overwrote the first
+        self.assertEqual(queue.ptr, 2)
+        self.assertTrue(np.allclose(dist.tton(queue.queue[0, :2]), dist.tton(keys)))
+
+
+if __name__ == "__main__":
+    unittest.main()
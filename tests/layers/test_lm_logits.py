@@ -0,0 +1,73 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+import oneflow.unittest
+from omegaconf import DictConfig
+
+from libai.layers import LMLogits, ParallelCrossEntropyLoss
+from libai.utils import distributed as dist
+
+
+class TestLMLogits(flow.unittest.TestCase):
+    def _test_chunked_loss(self, tensor_parallel_size):
+        dist.setup_dist_util(
+            DictConfig(
+                dict(
+                    data_parallel_size=1,
+                    tensor_parallel_size=tensor_parallel_size,
+                    pipeline_parallel_size=1,
+                )
+            )
+        )
+        placement = dist.get_layer_placement(0)
+        data_sbp = dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast])
+        vocab_sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.split(0)])
+        hidden = flow.randn(2, 10, 8, sbp=data_sbp, placement=placement)
+        weight = flow.randn(32, 8, sbp=vocab_sbp, placement=placement)
+        target = flow.randint(-1, 32, (2, 10), sbp=data_sbp, placement=placement)
+        lm_head = LMLogits(32, bias=True)
+        lm_head.bias.data.copy_(flow.randn(32, sbp=lm_head.bias.sbp, placement=placement))
+
+        outputs = []
+        for chunk_size in [None, 4]:
+            x = hidden.clone().requires_grad_()
+            w = weight.clone().requires_grad_()
+            if chunk_size is None:
+                loss = ParallelCrossEntropyLoss()(lm_head(x, w), target)
+            else:
+                loss = lm_head.chunked_loss(x, w, target, chunk_size)
+            loss.mean().backward()
+            outputs.append([dist.tton(t) for t in (loss, x.grad, w.grad)])
+
+        for expected, actual in zip(*outputs):
+            self.assertTrue(np.allclose(expected, actual, rtol=1e-4, atol=1e-5))
+
+    @unittest.skipIf(not flow.cuda.is_available(), "only test gpu cases")
+    @flow.unittest.skip_unless_1n1d()
+    def test_chunked_loss(self):
+        self._test_chunked_loss(1)
+
+    @unittest.skipIf(not flow.cuda.is_available(), "only test gpu cases")
+    @flow.unittest.skip_unless_1n2d()
+    def test_chunked_loss_with_tensor_parallel(self):
+        self._test_chunked_loss(2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import oneflow as flow
+import oneflow.nn as nn
+
+from libai.engine.hooks import ModelEMA
+from libai.layers import Linear
+from libai.utils.checkpoint import Checkpointer
+from libai.utils.ema import MultiTensorEMA, cosine_momentum, warmup_momentum
+
+
+class TestMultiTensorEMA(unittest.TestCase):
+    def test_update(self):
+        source = nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Linear(16, 4))
+        target = nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Linear(16, 4))
+        expected = [p.numpy().copy() for p in target.parameters()]
+        # small buckets to cover several buckets per group
+        ema = MultiTensorEMA(target.parameters(), source.parameters(), bucket_size=100)
+        self.assertGreater(len(ema.buckets), 1)
+        # the update goes through the flat buffers, not the one by one fallback
+        self.assertTrue(all(bucket.flat is not None for bucket in ema.buckets))
+
+        for momentum in [0.9, 0.99, 0.5]:
+            with flow.no_grad():
+                for p in source.parameters():
+                    p.add_(flow.randn(*p.shape))
+            ema.update(momentum)
+            for i, p in enumerate(source.parameters()):
+                expected[i] = momentum * expected[i] + (1 - momentum) * p.numpy()
+
+        for p, value in zip(target.parameters(), expected):
+            self.assertTrue(np.allclose(p.numpy(), value, atol=1e-6))
+
+        # the module still computes with the averaged parameters
+        x = flow.randn(2, 8)
+        out = target(x).numpy()
+        ref = np.maximum(x.numpy() @ expected[0].T + expected[1], 0) @ expected[2].T + expected[3]
+        self.assertTrue(np.allclose(out, ref, atol=1e-5))
+
+    def test_swap(self):
+        source, target = nn.Linear(4, 4), nn.Linear(4, 4)
+        source_weight, target_weight = source.weight.numpy(), target.weight.numpy()
+        ema = MultiTensorEMA(target.parameters(), source.parameters())
+        ema.swap()
+        self.assertTrue(np.array_equal(source.weight.numpy(), target_weight))
+        self.assertTrue(np.array_equal(target.weight.numpy(), source_weight))
+        ema.swap()
+        self.assertTrue(np.array_equal(source.weight.numpy(), source_weight))
+
+    def test_schedules(self):
+        self.assertAlmostEqual(cosine_momentum(0, 0.99, max_step=100), 0.99)
+        self.assertAlmostEqual(cosine_momentum(100, 0.99, max_step=100), 1.0)
+        moco = 1.0 - 0.5 * (1.0 + math.cos(math.pi * 30 / 100)) * (1.0 - 0.99)
+        self.assertAlmostEqual(cosine_momentum(30, 0.99, max_step=100), moco)
+        self.assertAlmostEqual(warmup_momentum(0, 0.9999), 0.0)
+        self.assertLess(warmup_momentum(100, 0.9999), warmup_momentum(1000, 0.9999))
+
+
+class TestModelEMA(unittest.TestCase):
+    def build_hook(self, save_dir, start_iter):
+        model = Linear(4, 4)
+        checkpointer = Checkpointer(model, save_dir)
+        hook = ModelEMA(momentum=0.5, schedule="constant")
+        hook.trainer = SimpleNamespace(
+            model=model, checkpointer=checkpointer, start_iter=start_iter, iter=0, max_iter=10
+        )
+        hook.before_train()
+        return hook, model, checkpointer
+
+    def test_checkpoint(self):
+        save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_dir)
+
+        hook, model, checkpointer = self.build_hook(save_dir, start_iter=0)
+        self.assertIs(checkpointer.checkpointables["model_ema"], hook)
+        with flow.no_grad():
+            model.weight.add_(flow.ones_like(model.weight))
+        hook.after_step()
+        average = {name: value.numpy() for name, value in hook.state_dict().items()}
+        self.assertFalse(np.allclose(average["weight"], model.weight.numpy()))
+        checkpointer.save("model_0000000")
+
+        # a resumed run loads the average saved with the checkpoint
+        hook, model, _ = self.build_hook(save_dir, start_iter=1)
+        for name, value in hook.state_dict().items():
+            self.assertTrue(np.allclose(value.numpy(), average[name]))
+        self.assertFalse(np.allclose(average["weight"], model.weight.numpy()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Import-time benchmark of the libai package. Every statement runs in a fresh interpreter,
+run this file directly to print the timings.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def import_stats(statement, repeat=1):
+    """Returns the fastest import time of ``statement`` and the modules it loaded."""
+    times, modules = [], None
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _SCRIPT.format(statement=statement)],
+            cwd=ROOT,
+            env=dict(os.environ, PYTHONPATH=ROOT),
+        )
+        stats = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(stats["time"])
+        modules = set(stats["modules"])
+    return min(times), modules
+
+
+class TestImportTime(unittest.TestCase):
+    def test_config_does_not_import_models(self):
+        _, modules = import_stats("from libai.config import LazyConfig")
+        for heavy in ["libai.models", "libai.layers", "libai.data", "libai.tokenizer"]:
+            self.assertNotIn(heavy, modules)
+        self.assertNotIn("flowvision", modules)
+
+    def test_lazy_submodules(self):
+        _, modules = import_stats("import libai; libai.utils")
+        self.assertIn("libai.utils", modules)
+        self.assertNotIn("libai.models", modules)
+
+        _, modules = import_stats("from libai.models import SwinTransformer")
+        self.assertIn("libai.models.swin_transformer", modules)
+        self.assertNotIn("libai.models.bert_model", modules)
+        self.assertNotIn("libai.models.swin_transformer_v2", modules)
+
+        _, modules = import_stats("from libai.data.datasets import BertDataset")
+        self.assertNotIn("libai.data.datasets.imagenet", modules)
+        self.assertNotIn("flowvision", modules)
+
+
+if __name__ == "__main__":
+    for statement in [
+        "from libai.config import LazyConfig",
+        "from libai.tokenizer import build_tokenizer",
+        "from libai.models import SwinTransformer",
+        "import libai.models",
+        "import libai.data",
+    ]:
+        elapsed, _ = import_stats(statement, repeat=5)
+        print(f"{elapsed * 1000:8.1f} ms  {statement}")